@@ -10,6 +10,7 @@ from tqdm import tqdm
 from src.utils import load_config, setup_logging, validate_config
 from src.preprocessing_strategies import get_strategy
 from src.data_handler import DataHandler # استيراد لاستخدام وظائف استخراج المسارات
+from src.roi import crop_to_roi
 
 def _bytes_feature(value):
     if isinstance(value, type(tf.constant(0))): value = value.numpy()
@@ -52,12 +53,16 @@ def main(config_path: str):
             logging.warning(f"لا توجد بيانات لمجموعة '{split_name}'.")
             continue
 
+        # صناديق القرص محفوظة بجانب الصور، فلا يُعاد الكشف في كل تجربة
+        boxes = data_handler.get_roi_boxes(paths) if data_handler.crop_roi else {}
+
         output_filename = os.path.join(output_dir, f"{split_name}.tfrecord")
         with tf.io.TFRecordWriter(output_filename) as writer:
             for path, label in tqdm(zip(paths, labels), total=len(paths), desc=f"Processing {split_name}"):
                 try:
                     image_np = cv2.imread(path)
                     if image_np is None: continue
+                    if path in boxes: image_np = crop_to_roi(image_np, boxes[path])
                     
                     processed_np = strategy.apply(image_np)
                     
@@ -6,6 +6,7 @@ import pandas as pd
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
 from src.preprocessing_strategies import get_strategy
+from src.roi import load_roi_boxes
 
 class DataHandler:
     def __init__(self, config: dict):
@@ -19,6 +20,12 @@ class DataHandler:
         self.df.columns = self.df.columns.str.strip()
         self.img_size = self.prep_conf['image_size']
         self.strategy = get_strategy(self.prep_conf['preprocessing_strategy'])
+        # قص الحواف السوداء: يُفك ترميز منطقة القرص فقط (نفس القص الذي يطبقه الخادم على نسخة الاستدلال).
+        # معطل افتراضيًا: فعّله مع DIAGNOSIS_CROP_ROI في الخادم، لأن النموذج يجب أن يرى نفس القص في الحالتين
+        self.crop_roi = self.prep_conf.get('crop_roi', False)
+        self.roi_cache_path = self.data_conf.get(
+            'roi_cache_path', os.path.join(self.data_conf['images_dir'], 'roi_boxes.json')
+        )
 
     def _get_patient_level_splits(self):
         patient_ids = self.df['Patient ID'].unique()
@@ -84,6 +91,50 @@ class DataHandler:
         processed_image.set_shape([self.img_size, self.img_size, 3])
         return processed_image, label
 
+    def _process_cropped_image(self, path, crop_window, label):
+        image_data = tf.io.read_file(path)
+
+        def decode_full():
+            return tf.io.decode_image(image_data, channels=3, expand_animations=False)
+
+        def decode_window():
+            # JPEG: فك ترميز نافذة القرص فقط [top, left, height, width] بدل الإطار كاملًا؛ غيره يُفك ثم يُقص
+            return tf.cond(
+                tf.io.is_jpeg(image_data),
+                lambda: tf.image.decode_and_crop_jpeg(image_data, crop_window, channels=3),
+                lambda: tf.image.crop_to_bounding_box(decode_full(), *tf.unstack(crop_window)),
+            )
+
+        # نافذة فارغة: تعذر كشف القرص، فيُستخدم الإطار كاملًا
+        image = tf.cond(crop_window[2] > 0, decode_window, decode_full)
+        processed_image = tf.py_function(
+            func=self.strategy.apply, inp=[image], Tout=tf.float32
+        )
+        processed_image.set_shape([self.img_size, self.img_size, 3])
+        return processed_image, label
+
+    def get_roi_boxes(self, paths):
+        """صناديق القرص للمسارات (من الذاكرة المحفوظة أو تُكشف الآن). الصور التي تعذر كشفها ليست في النتيجة."""
+        return load_roi_boxes(paths, self.roi_cache_path)
+
+    def get_crop_windows(self, paths):
+        """
+        نوافذ القص [top, left, height, width] لكل مسار بنفس الترتيب. الصور التي تعذر كشف قرصها
+        تبقى في البيانات بنافذة فارغة (الإطار كاملًا) بدل استبعادها.
+        """
+        boxes = self.get_roi_boxes(paths)
+        windows, fallback = [], 0
+        for path in paths:
+            if path in boxes:
+                left, top, right, bottom = boxes[path]
+                windows.append([top, left, bottom - top, right - left])
+            else:
+                windows.append([0, 0, 0, 0])
+                fallback += 1
+        if fallback:
+            logging.warning(f"تعذر كشف منطقة القرص في {fallback} من {len(paths)} صورة؛ تُستخدم بالإطار كاملًا.")
+        return windows
+
     def get_datasets(self):
         patient_splits = self._get_patient_level_splits()
         datasets = {}
@@ -94,10 +145,16 @@ class DataHandler:
                 datasets[name] = tf.data.Dataset.from_tensor_slices(([], []))
                 continue
             
-            ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+            if self.crop_roi:
+                windows = self.get_crop_windows(paths)
+                ds = tf.data.Dataset.from_tensor_slices((paths, windows, labels))
+                process = self._process_cropped_image
+            else:
+                ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+                process = self._process_image
             if name == 'train': ds = ds.shuffle(len(paths))
             
-            ds = ds.map(self._process_image, num_parallel_calls=AUTOTUNE)
+            ds = ds.map(process, num_parallel_calls=AUTOTUNE)
             if self.pipeline_conf.get('use_cache'): ds = ds.cache()
             
             ds = ds.batch(self.config['training']['batch_size'])
@@ -0,0 +1,92 @@
+# FILE: src/roi.py
+
+import os
+import json
+import logging
+import cv2
+import numpy as np
+import tensorflow as tf
+from typing import Dict, List, Tuple
+
+# (left, top, right, bottom) بإحداثيات البكسل في الصورة الأصلية، بنفس ترتيب PIL.Image.crop
+Box = Tuple[int, int, int, int]
+
+ROI_THRESHOLD = 15       # أقصى سطوع (0-255) يُعد خلفية سوداء
+ROI_MIN_FRACTION = 0.02  # نسبة بكسلات الصف/العمود المضيئة ليُحسب ضمن القرص (تتجاهل النصوص والضجيج)
+ROI_MARGIN = 0.01        # هامش حول القرص كنسبة من ضلعه الأطول
+ROI_MIN_AREA = 0.25      # قرص أصغر من هذه النسبة من الإطار يعني فشل الكشف: تُستخدم الصورة كاملة
+ROI_SAMPLE_SIDE = 512    # الكشف يعمل على عينة (كل step بكسل) بهذا الضلع تقريبًا
+ROI_READ_REDUCTION = 4   # بناء ذاكرة الصناديق يفك ترميز الصورة بربع الدقة (تحجيم DCT في JPEG)
+
+def detect_roi(image: np.ndarray) -> Box:
+    """
+    يكشف قرص قاع العين (المنطقة غير السوداء) ويعيد صندوقه المحيط. العملية مُتجهة بالكامل:
+    عتبة على أقصى قناة لكل بكسل، ثم إسقاط القناع على الصفوف والأعمدة. القرص المقصوص بحافة
+    الإطار (شائع في ODIR) يعطي تقاطعه مع الإطار. عند فشل الكشف يُعاد الإطار كاملًا.
+    """
+    height, width = image.shape[:2]
+    full_frame = (0, 0, width, height)
+    step = max(1, max(height, width) // ROI_SAMPLE_SIDE)
+    sample = image[::step, ::step]
+    brightness = sample.max(axis=2) if sample.ndim == 3 else sample
+    mask = brightness > ROI_THRESHOLD
+
+    rows = np.flatnonzero(mask.mean(axis=1) > ROI_MIN_FRACTION)
+    cols = np.flatnonzero(mask.mean(axis=0) > ROI_MIN_FRACTION)
+    if rows.size == 0 or cols.size == 0:
+        return full_frame
+
+    top, bottom = int(rows[0]) * step, min(height, (int(rows[-1]) + 1) * step)
+    left, right = int(cols[0]) * step, min(width, (int(cols[-1]) + 1) * step)
+    pad = round(ROI_MARGIN * max(right - left, bottom - top))
+    box = (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+    if (box[2] - box[0]) * (box[3] - box[1]) < ROI_MIN_AREA * width * height:
+        return full_frame
+    return box
+
+def crop_to_roi(image: np.ndarray, box: Box) -> np.ndarray:
+    """يقص الصورة إلى الصندوق (عرض view دون نسخ)."""
+    left, top, right, bottom = box
+    return image[top:bottom, left:right]
+
+def _detect_from_file(path: str) -> Box:
+    """يكشف الصندوق من ملف بفك ترميز مخفّض ثم يحوّله إلى إحداثيات الدقة الكاملة."""
+    reduced = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+    if reduced is None:
+        raise ValueError(f"تعذر قراءة الصورة: {path}")
+    # أبعاد الدقة الكاملة من الترويسة فقط، حتى لا يخرج الصندوق المكبّر عن حدود الصورة
+    height, width = _image_size(path)
+    left, top, right, bottom = (v * ROI_READ_REDUCTION for v in detect_roi(reduced))
+    return (min(left, width), min(top, height), min(right, width), min(bottom, height))
+
+def _image_size(path: str) -> Tuple[int, int]:
+    data = tf.io.read_file(path)
+    if tf.io.is_jpeg(data):
+        shape = tf.io.extract_jpeg_shape(data).numpy()
+    else:
+        # PNG وغيرها: لا دالة للترويسة فقط في TF، فتُفك مرة واحدة (النتيجة محفوظة في ذاكرة الصناديق)
+        shape = tf.shape(tf.io.decode_image(data, channels=3, expand_animations=False)).numpy()
+    return int(shape[0]), int(shape[1])
+
+def load_roi_boxes(paths: List[str], cache_path: str) -> Dict[str, Box]:
+    """
+    يعيد صندوق القرص لكل مسار. الصناديق تُحفظ في cache_path (JSON بجانب الصور، مفتاحه اسم الملف)،
+    فالكشف يعمل مرة واحدة لكل عين عبر كل التجارب وخطوات المعالجة.
+    """
+    cache: Dict[str, List[int]] = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    missing = [p for p in paths if os.path.basename(p) not in cache]
+    for path in missing:
+        try:
+            cache[os.path.basename(path)] = list(_detect_from_file(path))
+        except Exception as e:
+            logging.warning(f"فشل كشف منطقة القرص في {path}: {e}")
+    if missing:
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+        logging.info(f"تم كشف منطقة القرص لـ {len(missing)} صورة وحفظها في: {cache_path}")
+
+    return {p: tuple(cache[os.path.basename(p)]) for p in paths if os.path.basename(p) in cache}
@@ -0,0 +1,49 @@
+# FILE: tests/test_roi.py
+import cv2
+import numpy as np
+
+from src.roi import crop_to_roi, detect_roi, load_roi_boxes
+
+
+def _fundus(width=1200, height=800, radius=380):
+    """صورة اصطناعية: قرص مضيء على خلفية سوداء مع ضجيج خفيف."""
+    image = np.random.default_rng(0).integers(0, 8, (height, width, 3), dtype=np.uint8)
+    cv2.circle(image, (width // 2, height // 2), radius, (40, 90, 160), -1)
+    return image
+
+
+def test_detect_roi_crops_black_borders():
+    """الصندوق يحيط بالقرص فقط (مع هامش صغير) لا بالإطار كاملًا."""
+    left, top, right, bottom = detect_roi(_fundus())
+    assert abs(left - 220) <= 12 and abs(right - 980) <= 12
+    assert abs(top - 20) <= 12 and abs(bottom - 780) <= 12
+
+
+def test_detect_roi_falls_back_to_full_frame():
+    """صورة سوداء بالكامل لا تُقص."""
+    image = np.zeros((300, 400, 3), dtype=np.uint8)
+    assert detect_roi(image) == (0, 0, 400, 300)
+    assert crop_to_roi(image, detect_roi(image)).shape == image.shape
+
+
+def test_load_roi_boxes_caches_detection(tmp_path):
+    """الكشف يعمل مرة واحدة: الاستدعاء الثاني يقرأ الصناديق من الملف المحفوظ."""
+    path = str(tmp_path / "1_left.jpg")
+    cv2.imwrite(path, _fundus())
+    cache_path = str(tmp_path / "roi_boxes.json")
+
+    boxes = load_roi_boxes([path], cache_path)
+    cv2.imwrite(path, np.zeros((800, 1200, 3), dtype=np.uint8))
+
+    assert load_roi_boxes([path], cache_path) == boxes
+    left, top, right, bottom = boxes[path]
+    assert right <= 1200 and bottom <= 800 and right - left < 800
+
+
+def test_load_roi_boxes_reads_png(tmp_path):
+    """الكشف لا يقتصر على JPEG: أبعاد PNG تُقرأ ويبقى الصندوق داخل الإطار."""
+    path = str(tmp_path / "1_left.png")
+    cv2.imwrite(path, _fundus())
+
+    left, top, right, bottom = load_roi_boxes([path], str(tmp_path / "roi_boxes.json"))[path]
+    assert abs(left - 220) <= 12 and right <= 1200 and bottom <= 800
@@ -40,3 +40,29 @@ def test_multi_class_model_build(multi_class_config):
 # ملاحظة:
 # اختبار DataHandler يتطلب وجود بيانات TFRecord،
 # لذا يجب تشغيله بعد خطوة المعالجة المسبقة.
+
+
+def test_crop_windows_keep_undetected_images_at_full_frame(tmp_path):
+    """صورة تعذر كشف قرصها تبقى في البيانات بالإطار كاملًا (نافذة فارغة)، ونافذة PNG تُقص بعد فك الترميز."""
+    import cv2
+    import numpy as np
+
+    png, broken = str(tmp_path / "1_left.png"), str(tmp_path / "2_left.png")
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    cv2.circle(image, (150, 100), 95, (40, 90, 160), -1)
+    cv2.imwrite(png, image)
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+
+    handler = DataHandler.__new__(DataHandler)
+    handler.roi_cache_path = str(tmp_path / "roi_boxes.json")
+    handler.img_size = 8
+    handler.strategy = type("Resize", (), {"apply": staticmethod(lambda img: tf.image.resize(img, (8, 8)))})()
+
+    windows = handler.get_crop_windows([png, broken])
+    assert windows[1] == [0, 0, 0, 0]
+    assert windows[0][3] < 300
+
+    for window in (windows[0], [0, 0, 0, 0]):
+        processed, _ = handler._process_cropped_image(tf.constant(png), tf.constant(window), 0.0)
+        assert processed.shape == (8, 8, 3)
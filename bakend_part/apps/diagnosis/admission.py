@@ -0,0 +1,141 @@
+# apps/diagnosis/admission.py
+"""
+التحكم في القبول (Admission Control) لطلبات التشخيص الجديدة.
+يقدّر زمن الانتظار المتوقع من عمق طوابير Celery وعدد التشخيصات المعلقة/الجارية
+ومتوسط زمن الخدمة الأخير، ليقرر الواجهة قبول الطلب أو رفضه (429) أو خفض أولويته.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+from apps.users.models import User
+
+from .models import Diagnosis
+
+logger = logging.getLogger(__name__)
+
+_CACHE_KEY = "diagnosis:backlog-estimate"
+_URGENT, _SAME_DAY, _BULK = "URGENT", "SAME_DAY", "BULK"
+
+BACKLOG_REJECTION_MESSAGE = "Diagnosis backlog exceeds the service-level objective; please retry later."
+
+
+@dataclass
+class BacklogEstimate:
+    queue_depth: int
+    pending: int
+    running: int
+    service_time_seconds: float
+    projected_wait_seconds: float
+
+    @property
+    def estimated_completion_at(self):
+        """وقت الانتهاء المتوقع لطلب يُقبل الآن: الانتظار ثم زمن خدمته هو."""
+        return timezone.now() + timedelta(seconds=self.projected_wait_seconds + self.service_time_seconds)
+
+
+class BacklogEstimator:
+    """يحسب تقدير الطابور الحالي، مع تخزين مؤقت قصير حتى لا يكلف كل طلب رفع استعلامات إضافية."""
+
+    def __init__(self, redis_client=None):
+        self.config = settings.DIAGNOSIS_ADMISSION
+        self._redis = redis_client
+
+    def estimate(self) -> BacklogEstimate:
+        estimate = cache.get(_CACHE_KEY)
+        if estimate is None:
+            estimate = self._compute()
+            cache.set(_CACHE_KEY, estimate, self.config["CACHE_SECONDS"])
+        return estimate
+
+    def _compute(self) -> BacklogEstimate:
+        counts = Diagnosis.objects.aggregate(
+            pending=Count("id", filter=Q(status__in=[Diagnosis.Status.PENDING, Diagnosis.Status.RETRY])),
+            running=Count("id", filter=Q(status=Diagnosis.Status.RUNNING)),
+        )
+        queue_depth = self.queue_depth()
+        service_time = self.service_time()
+
+        # كل تشخيص معلق له رسالة في الطابور عادةً؛ نأخذ الأكبر لتغطية الرسائل اليتيمة أو العكس
+        backlog = max(queue_depth, counts["pending"]) + counts["running"]
+        projected_wait = backlog * service_time / max(self.config["WORKER_CONCURRENCY"], 1)
+
+        return BacklogEstimate(
+            queue_depth=queue_depth,
+            pending=counts["pending"],
+            running=counts["running"],
+            service_time_seconds=service_time,
+            projected_wait_seconds=projected_wait,
+        )
+
+    def queue_depth(self) -> int:
+        """مجموع أطوال طوابير التشخيص في وسيط Redis؛ صفر إن تعذر الاتصال."""
+        try:
+            client = self._redis or self._get_redis()
+            return sum(client.llen(queue) for queue in set(settings.DIAGNOSIS_PRIORITY_QUEUES.values()))
+        except Exception as e:
+            logger.warning(f"Could not read Celery queue depth, assuming 0: {e}")
+            return 0
+
+    def service_time(self) -> float:
+        """متوسط (finished_at - started_at) للتشخيصات الناجحة ضمن النافذة الأخيرة، أو القيمة الافتراضية."""
+        since = timezone.now() - timedelta(minutes=self.config["SERVICE_TIME_WINDOW_MINUTES"])
+        average: Optional[timedelta] = Diagnosis.objects.filter(
+            status=Diagnosis.Status.SUCCESS, finished_at__gte=since, started_at__isnull=False
+        ).aggregate(
+            average=Avg(ExpressionWrapper(F("finished_at") - F("started_at"), output_field=DurationField()))
+        )["average"]
+        if average is None:
+            return float(self.config["DEFAULT_SERVICE_TIME_SECONDS"])
+        return average.total_seconds()
+
+    def _get_redis(self):
+        from redis import Redis
+        self._redis = Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._redis
+
+
+@dataclass
+class Admission:
+    """نتيجة قرار القبول. retry_after ليس None عندما يجب رفض الطلب."""
+    priority: str
+    estimate: BacklogEstimate
+    retry_after: Optional[int] = None
+
+    @property
+    def admitted(self) -> bool:
+        return self.retry_after is None
+
+
+def may_request_urgent(user) -> bool:
+    """URGENT يتجاوز التحكم في القبول ويأخذ أكبر حصة في الجدولة، لذا يطلبه المسؤولون فقط."""
+    return getattr(user, "role", None) == User.Roles.ADMIN
+
+
+def admit(priority: str, user, estimator: Optional[BacklogEstimator] = None) -> Admission:
+    """
+    إذا تجاوز الانتظار المتوقع SLO يُرفض الطلب (مع مدة Retry-After) أو تُخفض أولويته إلى BULK
+    حسب DIAGNOSIS_ADMISSION['MODE']. الطلبات العاجلة تُقبل دائمًا، لكن URGENT من غير المسؤولين
+    يُعامل كـ SAME_DAY (انظر may_request_urgent).
+    """
+    if priority == _URGENT and not may_request_urgent(user):
+        priority = _SAME_DAY
+    config = settings.DIAGNOSIS_ADMISSION
+    estimate = (estimator or BacklogEstimator()).estimate()
+
+    overloaded = estimate.projected_wait_seconds > config["SLO_SECONDS"]
+    if not config["ENABLED"] or not overloaded or priority == _URGENT:
+        return Admission(priority=priority, estimate=estimate)
+
+    if config["MODE"] == "downgrade":
+        return Admission(priority=_BULK, estimate=estimate)
+
+    # الوقت اللازم حتى ينخفض الانتظار المتوقع إلى ما دون SLO
+    retry_after = max(1, int(estimate.projected_wait_seconds - config["SLO_SECONDS"]) + 1)
+    return Admission(priority=priority, estimate=estimate, retry_after=retry_after)
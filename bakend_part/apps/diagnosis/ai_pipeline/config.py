@@ -44,6 +44,34 @@ EXPERT_MODELS_CONFIG = [
 
 
 
+def model_paths(base_dir=None) -> dict:
+    """
+    مسارات ملفات النماذج: {"multi_class", "tabular", "experts": [بترتيب DISEASE_CLASSES]}.
+    base_dir: مجلد إصدار (ModelVersion.file_path) يحوي الملفات بنفس أسمائها في الإعدادات؛
+    دونه تُستخدم مسارات الإعدادات كما هي.
+    """
+    def resolve(path):
+        if base_dir is None or path is None:
+            return path
+        return os.path.join(str(base_dir), os.path.basename(str(path)))
+
+    return {
+        "multi_class": resolve(MULTI_CLASS_MODEL_PATH),
+        "tabular": resolve(TABULAR_MODEL_PATH),
+        "experts": [resolve(expert["path"]) for expert in EXPERT_MODELS_CONFIG],
+    }
+
+# تحميل النماذج عند بدء العامل: عدد خيوط التحميل المتوازي، وفك أرشيفات .keras بجانبها (مجلد .unpacked)
+# حتى تُقرأ الأوزان مباشرة من القرص في التحميلات التالية
+MODEL_LOAD_WORKERS = getattr(settings, 'AI_MODEL_LOAD_WORKERS', 4)
+UNPACK_MODELS = getattr(settings, 'AI_UNPACK_MODELS', False)
+
+# أبعاد الصورة الاصطناعية لتسخين النماذج قبل تبديل إصدار (مدخل النماذج بعد المعالجة المسبقة)
+WARM_UP_IMAGE_SIZE = 224
+
+# تجميع لقطات العين الواحدة قبل دمج الميزات: "mean" أو "max" أو "quality"
+EYE_AGGREGATION = getattr(settings, 'AI_EYE_AGGREGATION', 'mean')
+
 # ترتيب الفئات في مخرجات النموذج متعدد الفئات (8 فئات)
 # هذا الترتيب حاسم لدالة دمج السمات
 MULTI_CLASS_OUTPUT_MAPPING = {
@@ -1,6 +1,9 @@
 # FILE: backend_logic/ai_pipeline/feature_extractor.py
 
 import numpy as np
+from typing import Optional, Sequence
+
+AGGREGATION_METHODS = ("mean", "max", "quality")
 
 def _calculate_f1_score(p_multi: float, p_expert: float, epsilon: float = 1e-8) -> float:
     """
@@ -9,6 +12,27 @@ def _calculate_f1_score(p_multi: float, p_expert: float, epsilon: float = 1e-8)
     """
     return (2 * p_multi * p_expert) / (p_multi + p_expert + epsilon)
 
+def aggregate_eye_predictions(
+    predictions: np.ndarray,
+    method: str = "mean",
+    weights: Optional[Sequence[float]] = None
+) -> np.ndarray:
+    """
+    يجمع تنبؤات عدة لقطات لنفس العين (مصفوفة (k, C)) في متجه واحد (C,) قبل دمج الميزات.
+    - mean: متوسط اللقطات.
+    - max: أعلى احتمال لكل فئة (أكثر حساسية للآفة الظاهرة في لقطة واحدة فقط).
+    - quality: متوسط موزون بدرجات جودة اللقطات (weights)؛ يعود إلى mean دون أوزان.
+    مع لقطة واحدة تعيد الدوال الثلاث نفس التنبؤ، فالنتيجة مطابقة للمسار القديم.
+    """
+    predictions = np.asarray(predictions, dtype=np.float32)
+    if method not in AGGREGATION_METHODS:
+        raise ValueError(f"طريقة تجميع غير معروفة: {method}")
+    if method == "max":
+        return predictions.max(axis=0)
+    if method == "quality" and weights is not None and np.sum(weights) > 0:
+        return np.average(predictions, axis=0, weights=np.asarray(weights, dtype=np.float32))
+    return predictions.mean(axis=0)
+
 def create_fused_feature_vector(
     multi_class_probs_left: np.ndarray,
     multi_class_probs_right: np.ndarray,
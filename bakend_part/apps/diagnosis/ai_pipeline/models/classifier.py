@@ -3,23 +3,136 @@
 
 import tensorflow as tf
 import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
 import threading
+import time
+import zipfile
 import logging
-from typing import List, Tuple, Dict, Callable
+from typing import Iterable, List, Optional, Tuple, Dict, Callable
 
 # Local imports from other parts of the project
-from apps.diagnosis.ai_pipeline.models.singleton import Singleton
 from apps.diagnosis.ai_pipeline.models.preprocessing import PreprocessingStrategy
+from apps.diagnosis.timings import stage
 
 logger = logging.getLogger(__name__)
 
+# Written into the unpacked directory: "<archive size> <archive sha256>" of the archive it was extracted from.
+UNPACKED_STAMP = "archive.sha256"
+_READ_SIZE = 1024 * 1024
+
+
+def unpacked_path(model_path: str) -> str:
+    """Directory next to a `.keras` archive holding its extracted contents (config.json, model.weights.h5)."""
+    return f"{str(model_path)[:-len('.keras')]}.unpacked"
+
+
+def _archive_stamp(archive) -> str:
+    """Size and sha256 of an open archive file, rewound afterwards."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: archive.read(_READ_SIZE), b""):
+        digest.update(chunk)
+    size = archive.tell()
+    archive.seek(0)
+    return f"{size} {digest.hexdigest()}"
+
+
+def _is_unpacked(model_path: str) -> bool:
+    """
+    True when unpacked_path() was extracted from this exact archive. Keyed on the archive's content rather than
+    mtimes, which a copy, a restore or a clock skew between nodes can reorder. The size is compared first, so a
+    replaced archive of another size is detected without hashing it.
+    """
+    try:
+        with open(os.path.join(unpacked_path(model_path), UNPACKED_STAMP)) as f:
+            stamp = f.read().strip()
+        if stamp.split(" ")[0] != str(os.path.getsize(model_path)):
+            return False
+        with open(model_path, "rb") as archive:
+            return _archive_stamp(archive) == stamp
+    except OSError:
+        return False
+
+
+def load_keras_model(model_path: str) -> object:
+    """
+    Loads a `.keras` model, preferring its unpacked directory when it was extracted from this archive:
+    h5py then reads the weights straight from disk instead of Keras copying them out of the zip into memory.
+    """
+    if _is_unpacked(model_path):
+        return tf.keras.models.load_model(unpacked_path(model_path))
+    return tf.keras.models.load_model(model_path)
+
+
+def unpack_model(model_path: str) -> None:
+    """
+    Extracts a `.keras` archive into unpacked_path() for faster later loads, with the archive's size and digest
+    in UNPACKED_STAMP. Extracts into a temporary sibling and renames it into place, so a concurrent loader never
+    sees a half-written directory.
+    """
+    if _is_unpacked(model_path):
+        return
+    target = unpacked_path(model_path)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(str(model_path)), prefix=".unpacking-")
+    try:
+        # One open file for the digest and the extraction: an archive replaced meanwhile cannot mismatch its stamp.
+        with open(model_path, "rb") as f:
+            stamp = _archive_stamp(f)
+            with zipfile.ZipFile(f) as archive:
+                archive.extractall(staging)
+        with open(os.path.join(staging, UNPACKED_STAMP), "w") as f:
+            f.write(stamp)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        logger.info(f"Unpacked {model_path} into {target}.")
+    except OSError as e:
+        # Another worker may have won the rename; the archive still loads either way.
+        logger.warning(f"Could not unpack {model_path}: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class TFLiteModel:
+    """
+    A `.tflite` model (see `manage.py compile_models`) behind the part of the Keras Model API the
+    pipeline uses: predict() and predict_on_batch(). The interpreter is resized to each batch shape.
+    """
+
+    def __init__(self, model_path: str):
+        try:
+            # tf.lite.Interpreter is deprecated in favour of the standalone LiteRT runtime.
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=str(model_path))
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]["index"]
+        self._output = self.interpreter.get_output_details()[0]["index"]
+        self._lock = threading.Lock()  # one interpreter, not safe for concurrent invoke()
+
+    def predict_on_batch(self, inputs) -> np.ndarray:
+        inputs = np.asarray(inputs, dtype=np.float32)
+        with self._lock:
+            if tuple(self.interpreter.get_input_details()[0]["shape"]) != inputs.shape:
+                self.interpreter.resize_tensor_input(self._input, inputs.shape)
+                self.interpreter.allocate_tensors()
+            self.interpreter.set_tensor(self._input, inputs)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+    def predict(self, inputs, batch_size=None, verbose=0) -> np.ndarray:
+        return self.predict_on_batch(inputs)
+
+
 class ModelLoaderFactory:
     """A factory for loading ML models based on their file extension."""
     
     _loaders: Dict[str, Callable[[str], object]] = {
         "h5": lambda path: tf.keras.models.load_model(path),
-        "keras": lambda path: tf.keras.models.load_model(path),
+        "keras": load_keras_model,
         "pb": lambda path: tf.saved_model.load(path),
+        "tflite": TFLiteModel,
     }
 
     @staticmethod
@@ -37,36 +150,71 @@ class EyesModel:
     """
     _model_cache: Dict[str, object] = {}
     _cache_lock = threading.Lock()
+    # One lock per path: different files load concurrently, the same file is loaded only once.
+    _path_locks: Dict[str, threading.Lock] = {}
 
-    def __init__(self, model_path: str, strategy: PreprocessingStrategy):
+    def __init__(self, model_path: str, strategy: PreprocessingStrategy, name: Optional[str] = None):
         self.model_path = model_path
         self.strategy = strategy
+        # Stage names in Diagnosis.stage_timings: model/<name> and preprocessing/<strategy class>.
+        self.name = name or os.path.splitext(os.path.basename(str(model_path)))[0]
         self.model = self._load_model()
 
     def _load_model(self) -> object:
         """Loads a model from the given path, utilizing a thread-safe cache."""
-        with EyesModel._cache_lock:
-            if self.model_path not in EyesModel._model_cache:
-                logger.info(f"Cache miss. Loading expert model from {self.model_path}...")
-                extension = str(self.model_path).split('.')[-1]
-                loader = ModelLoaderFactory.get_loader(extension)
-                EyesModel._model_cache[self.model_path] = loader(self.model_path)
-            else:
-                logger.info(f"Cache hit. Reusing expert model from {self.model_path}.")
-            return EyesModel._model_cache[self.model_path]
+        return EyesModel.load(self.model_path)
+
+    @classmethod
+    def load(cls, model_path: str) -> object:
+        """Returns the cached model for model_path, loading (and timing) it on a cache miss."""
+        with cls._cache_lock:
+            if model_path in cls._model_cache:
+                logger.info(f"Cache hit. Reusing model from {model_path}.")
+                return cls._model_cache[model_path]
+            path_lock = cls._path_locks.setdefault(model_path, threading.Lock())
+
+        with path_lock:
+            with cls._cache_lock:
+                if model_path in cls._model_cache:
+                    return cls._model_cache[model_path]
+            logger.info(f"Cache miss. Loading model from {model_path}...")
+            started = time.perf_counter()
+            extension = str(model_path).split('.')[-1]
+            model = ModelLoaderFactory.get_loader(extension)(model_path)
+            logger.info(f"Loaded model {model_path} in {time.perf_counter() - started:.2f} s.")
+            with cls._cache_lock:
+                cls._model_cache[model_path] = model
+            return model
+
+    @classmethod
+    def evict(cls, model_paths: Iterable[str]) -> None:
+        """
+        Drops cached models that are no longer used (e.g. after a model version swap).
+        Services still holding a model keep working; its memory is freed once they are released.
+        """
+        with cls._cache_lock:
+            for path in model_paths:
+                if cls._model_cache.pop(path, None) is not None:
+                    logger.info(f"Evicted model {path} from the cache.")
         
-    def _prepare_input_tensor(self, image: np.ndarray) -> tf.Tensor:
-        """Applies preprocessing, normalization, and shaping for a single image."""
-        # 1. Apply preprocessing
-        processed_image = self.strategy.apply(image)
+    def _prepare_input_array(self, image: np.ndarray) -> np.ndarray:
+        """Applies preprocessing and normalization for a single image (no batch axis)."""
+        with stage(f"preprocessing/{type(self.strategy).__name__}"):
+            # 1. Apply preprocessing
+            processed_image = self.strategy.apply(image)
 
-        # 2. Ensure correct input shape and data type
-        input_tensor = np.expand_dims(processed_image, axis=0).astype(np.float32)
+            # 2. Ensure correct data type
+            input_array = np.asarray(processed_image, dtype=np.float32)
 
-        # 3. Normalize if needed (safety check)
-        if np.max(input_tensor) > 1.0:
-            input_tensor /= 255.0
-        
+            # 3. Normalize if needed (safety check, applied per image)
+            if np.max(input_array) > 1.0:
+                input_array = input_array / 255.0
+
+        return input_array
+
+    def _prepare_input_tensor(self, image: np.ndarray) -> tf.Tensor:
+        """Applies preprocessing, normalization, and shaping for a single image."""
+        input_tensor = np.expand_dims(self._prepare_input_array(image), axis=0)
         return tf.convert_to_tensor(input_tensor)
 
     def predict_single(self, image: np.ndarray) -> np.ndarray:
@@ -75,7 +223,8 @@ class EyesModel:
         """
         input_tensor = self._prepare_input_tensor(image)
         # The result of .predict() is a numpy array
-        result = self.model.predict(input_tensor)
+        with stage(f"model/{self.name}"):
+            result = self.model.predict(input_tensor)
         return result
     
     def diagnose(self, left_image: np.ndarray, right_image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
@@ -86,15 +235,27 @@ class EyesModel:
         right_tensor = self._prepare_input_tensor(right_image)
 
         # Run prediction
-        left_result = self.model.predict(left_tensor)[0]
-        right_result = self.model.predict(right_tensor)[0]
+        with stage(f"model/{self.name}"):
+            left_result = self.model.predict(left_tensor)[0]
+            right_result = self.model.predict(right_tensor)[0]
         
         return left_result, right_result
 
+    def predict_batch(self, images: List[np.ndarray]) -> np.ndarray:
+        """
+        Prepares all images and runs them through the model in a single forward pass.
+        Returns one row of predictions per input image, in input order.
+        """
+        batch = np.stack([self._prepare_input_array(image) for image in images])
+        with stage(f"model/{self.name}"):
+            return self.model.predict(tf.convert_to_tensor(batch), batch_size=len(images), verbose=0)
+
 
-class Diagnoser(metaclass=Singleton):
+class Diagnoser:
     """
-    A Singleton service that manages and runs all specialized EyesModel instances.
+    Manages and runs all specialized EyesModel instances of one DiagnosisService.
+    Not a singleton: a hot model reload builds a second service (and Diagnoser) next to
+    the one serving in-flight tasks.
     """
     def __init__(self):
         self.models: List[EyesModel] = []
@@ -121,6 +282,29 @@ class Diagnoser(metaclass=Singleton):
         
         logger.info("All expert models have completed prediction.")
         return results
+
+    def predict_batch(
+        self, left_images: List[np.ndarray], right_images: List[np.ndarray]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Runs every expert model once over all left and right images stacked together
+        (batch size 2N). Returns, per model, a (left_results, right_results) tuple
+        where each element holds N rows in input order.
+        """
+        if not self.models:
+            logger.warning("Diagnoser.predict_batch called with no models registered.")
+            return []
+
+        n = len(left_images)
+        images = list(left_images) + list(right_images)
+        logger.info(f"Running {len(self.models)} expert models on a batch of {len(images)} images...")
+        results = []
+        for model in self.models:
+            predictions = model.predict_batch(images)
+            results.append((predictions[:n], predictions[n:]))
+
+        logger.info("All expert models have completed batched prediction.")
+        return results
     
 # import tensorflow as tf
 # import numpy as np
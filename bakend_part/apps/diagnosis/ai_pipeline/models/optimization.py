@@ -0,0 +1,149 @@
+# ocular_diagnosis_system/models/optimization.py
+# FILE: apps/diagnosis/ai_pipeline/models/optimization.py
+"""
+Graph rewrites and conversions that produce serving artifacts from trained Keras models
+(used by `manage.py compile_models`):
+- strip_and_fold: drops training-only layers (Dropout, noise, ...) and folds every BatchNormalization
+  that directly follows a linear Conv/Dense into that layer's kernel and bias.
+- to_tflite: converts with a fixed input signature (any batch size), optionally quantized.
+All rewrites are exact up to float rounding except quantization; callers verify outputs numerically.
+"""
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+keras = tf.keras
+layers = keras.layers
+
+# Layers that are identities at inference time.
+TRAINING_ONLY_LAYERS = (
+    layers.Dropout, layers.GaussianNoise, layers.GaussianDropout, layers.AlphaDropout, layers.ActivityRegularization,
+)
+_FOLDABLE_PRODUCERS = (layers.Conv1D, layers.Conv2D, layers.Conv3D, layers.Dense)
+_UNFOLDABLE_PRODUCERS = (layers.DepthwiseConv2D, layers.Conv2DTranspose, layers.Conv1DTranspose, layers.Conv3DTranspose)
+
+# None: float32 conversion; "float16": float16 weights; "dynamic_int8": int8 weights with dynamic-range kernels.
+TFLITE_QUANTIZATION = {"tflite": None, "tflite_fp16": "float16", "tflite_int8": "dynamic_int8"}
+# Written next to the compiled models by compile_models, read back by parity_check.
+COMPILE_MANIFEST = "compile_manifest.json"
+# Maximum absolute output difference of each variant against the source model (probability units).
+VARIANT_TOLERANCES = {"keras": 1e-4, "xla": 1e-4, "tflite": 1e-4, "tflite_fp16": 5e-3, "tflite_int8": 2e-2}
+
+
+def walk(model) -> Iterator[layers.Layer]:
+    """Leaf layers of a model in definition order, descending into nested models (input layers skipped)."""
+    for layer in model.layers:
+        if isinstance(layer, keras.Model):
+            yield from walk(layer)
+        elif not isinstance(layer, layers.InputLayer):
+            yield layer
+
+
+def _foldable_pairs(model) -> Dict[int, layers.BatchNormalization]:
+    """Maps id(producer) -> the BatchNormalization it alone feeds, for every pair that can be folded."""
+    pairs = {}
+    for layer in walk(model):
+        if not isinstance(layer, layers.BatchNormalization) or len(layer._inbound_nodes) != 1:
+            continue
+        source = layer._inbound_nodes[0].input_tensors[0]
+        if layer.axis not in (-1, len(source.shape) - 1):
+            continue  # only per-output-channel normalisation maps onto the kernel's last axis
+        producer = source._keras_history.operation
+        if (
+            isinstance(producer, _FOLDABLE_PRODUCERS) and not isinstance(producer, _UNFOLDABLE_PRODUCERS)
+            and len(producer._inbound_nodes) == 1 and len(producer._outbound_nodes) == 1
+            and producer.activation is keras.activations.linear
+        ):
+            pairs[id(producer)] = layer
+    return pairs
+
+
+def _clone(model, pairs: dict, removed: set):
+    def clone_layer(layer):
+        if isinstance(layer, keras.Model):
+            return _clone(layer, pairs, removed)
+        if id(layer) in removed:
+            return layers.Identity(name=layer.name)
+        config = layer.get_config()
+        if id(layer) in pairs:
+            config["use_bias"] = True
+        return layer.__class__.from_config(config)
+
+    def call_layer(layer, *args, **kwargs):
+        # Identity does not take the mask/training arguments the replaced layer was called with.
+        return layer(args[0]) if isinstance(layer, layers.Identity) else layer(*args, **kwargs)
+
+    if isinstance(model, keras.Sequential):
+        return keras.Sequential(
+            [keras.Input(model.input_shape[1:]), *[clone_layer(layer) for layer in model.layers]], name=model.name
+        )
+    return keras.models.clone_model(model, clone_function=clone_layer, call_function=call_layer)
+
+
+def strip_and_fold(model) -> Tuple[object, dict]:
+    """Returns an inference-only copy of the model and {"folded_batchnorm", "stripped_layers"} counts."""
+    pairs = _foldable_pairs(model)
+    folded = {id(bn) for bn in pairs.values()}
+    stripped = {id(layer) for layer in walk(model) if isinstance(layer, TRAINING_ONLY_LAYERS)}
+    optimized = _clone(model, pairs, folded | stripped)
+
+    for old, new in zip(walk(model), walk(optimized)):
+        if old.name != new.name:
+            raise ValueError(f"Layer order changed while cloning: {old.name} != {new.name}")
+        if id(old) in pairs:
+            bn = pairs[id(old)]
+            kernel = old.kernel.numpy()
+            bias = old.bias.numpy() if old.use_bias else np.zeros(kernel.shape[-1], kernel.dtype)
+            gamma = bn.gamma.numpy() if bn.scale else 1.0
+            beta = bn.beta.numpy() if bn.center else 0.0
+            scale = gamma / np.sqrt(bn.moving_variance.numpy() + bn.epsilon)
+            new.set_weights([kernel * scale, (bias - bn.moving_mean.numpy()) * scale + beta])
+        elif id(old) not in folded and old.weights:
+            new.set_weights(old.get_weights())
+    return optimized, {"folded_batchnorm": len(pairs), "stripped_layers": len(stripped)}
+
+
+def input_signature(model) -> list:
+    """Fixed serving signature: the model's input shape with a free batch dimension."""
+    return [tf.TensorSpec([None, *model.input_shape[1:]], tf.float32, name="inputs")]
+
+
+def to_tflite(model, quantization: Optional[str] = None) -> bytes:
+    """Converts through a SavedModel export so variables are frozen into the flatbuffer."""
+    with tempfile.TemporaryDirectory() as export_dir:
+        model.export(export_dir, format="tf_saved_model", verbose=False, input_signature=input_signature(model))
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        if quantization:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        return converter.convert()
+
+
+def xla_predict(model) -> Callable[[np.ndarray], np.ndarray]:
+    """The model as an XLA-compiled function (compiled per batch shape on first call)."""
+    function = tf.function(lambda inputs: model(inputs, training=False), jit_compile=True)
+    return lambda inputs: function(tf.convert_to_tensor(inputs)).numpy()
+
+
+def sample_inputs(model, count: int, seed: int = 0) -> np.ndarray:
+    """Deterministic verification inputs: images in [0, 1] (as EyesModel feeds them), features ~ N(0, 1)."""
+    rng = np.random.default_rng(seed)
+    shape = (count, *model.input_shape[1:])
+    if len(shape) == 4:
+        return rng.random(shape, dtype=np.float32)
+    return rng.standard_normal(shape).astype(np.float32)
+
+
+def latency_ms(predict: Callable[[np.ndarray], np.ndarray], inputs: np.ndarray, repeats: int = 5) -> float:
+    """Median wall time of predict(inputs) over `repeats` calls, after one warm-up call."""
+    predict(inputs)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict(inputs)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
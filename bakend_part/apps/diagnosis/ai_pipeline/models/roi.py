@@ -0,0 +1,58 @@
+# ocular_diagnosis_system/models/roi.py
+import numpy as np
+from typing import Tuple
+
+# (left, top, right, bottom) in pixels, the same order as PIL.Image.crop
+Box = Tuple[int, int, int, int]
+
+ROI_THRESHOLD = 15       # brightest channel at or below this (0-255) counts as black border
+ROI_MIN_FRACTION = 0.02  # a row/column is part of the disc when this share of its pixels is bright
+ROI_MARGIN = 0.01        # padding around the disc, as a fraction of its longer side
+ROI_MIN_AREA = 0.25      # a smaller "disc" means detection failed; the full frame is kept
+ROI_SAMPLE_SIDE = 512    # detection runs on a strided sample with roughly this longer side
+
+
+def detect_roi(image: np.ndarray) -> Box:
+    """
+    Finds the bounding box of the fundus disc (the non-black region) in an RGB/BGR or gray image.
+    Fully vectorized: threshold the brightest channel per pixel, then project the mask onto rows
+    and columns. A disc clipped by the frame edge (common in ODIR) yields its intersection with
+    the frame. Falls back to the full frame when no plausible disc is found.
+
+    Kept identical to ai_part's src/roi.py so training and serving crop the same pixels.
+    """
+    height, width = image.shape[:2]
+    full_frame = (0, 0, width, height)
+    step = max(1, max(height, width) // ROI_SAMPLE_SIDE)
+    sample = image[::step, ::step]
+    brightness = sample.max(axis=2) if sample.ndim == 3 else sample
+    mask = brightness > ROI_THRESHOLD
+
+    rows = np.flatnonzero(mask.mean(axis=1) > ROI_MIN_FRACTION)
+    cols = np.flatnonzero(mask.mean(axis=0) > ROI_MIN_FRACTION)
+    if rows.size == 0 or cols.size == 0:
+        return full_frame
+
+    top, bottom = int(rows[0]) * step, min(height, (int(rows[-1]) + 1) * step)
+    left, right = int(cols[0]) * step, min(width, (int(cols[-1]) + 1) * step)
+    pad = round(ROI_MARGIN * max(right - left, bottom - top))
+    box = (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+    if (box[2] - box[0]) * (box[3] - box[1]) < ROI_MIN_AREA * width * height:
+        return full_frame
+    return box
+
+
+def crop_to_roi(image: np.ndarray, box: Box) -> np.ndarray:
+    """Crops an image array to the box (a view, no copy)."""
+    left, top, right, bottom = box
+    return image[top:bottom, left:right]
+
+
+def scale_box(box: Box, from_size: Tuple[int, int], to_size: Tuple[int, int]) -> Box:
+    """Maps a box between two resolutions of the same image; sizes are (width, height)."""
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    left, top, right, bottom = box
+    return (
+        max(0, int(left * sx)), max(0, int(top * sy)),
+        min(to_size[0], round(right * sx)), min(to_size[1], round(bottom * sy)),
+    )
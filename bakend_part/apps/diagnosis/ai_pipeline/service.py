@@ -3,14 +3,18 @@
 
 import numpy as np
 import tensorflow as tf
-# تم إزالة ThreadPoolExecutor
+# ThreadPoolExecutor لتحميل الملفات فقط؛ الاستدلال يبقى تسلسليًا
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from apps.diagnosis.ai_pipeline import config
 from apps.diagnosis.ai_pipeline.production_feature_pipeline import ProductionFeaturePipeline
 from apps.diagnosis.exceptions import ModelInferenceError, ModelLoadingError
-from apps.diagnosis.ai_pipeline.feature_extractor import create_fused_feature_vector
-from apps.diagnosis.ai_pipeline.models.classifier import Diagnoser, EyesModel
+from apps.diagnosis.timings import stage
+from apps.diagnosis.ai_pipeline.feature_extractor import aggregate_eye_predictions, create_fused_feature_vector
+from apps.diagnosis.ai_pipeline.models.classifier import Diagnoser, EyesModel, unpack_model
 from apps.diagnosis.ai_pipeline.models.preprocessing import (
     CataractPreprocessing, DiabetesPreprocessing, GlaucomaPreprocessing,
     HypertensionPreprocessing, PathologicalMyopiaPreprocessing, AgeIssuesPreprocessing, MULTICLASSPreprocessing
@@ -24,20 +28,26 @@ class DiagnosisService:
     تم تعديل هذه النسخة لتشغيل جميع نماذج TensorFlow بشكل تسلسلي
     لضمان الاستقرار وتجنب مشاكل التزامن.
     """
-    def __init__(self):
+    def __init__(self, model_paths: Optional[dict] = None):
+        """model_paths: مسارات config.model_paths() لإصدار معين؛ دونها تُستخدم مسارات الإعدادات."""
+        self.model_paths = model_paths or config.model_paths()
         try:
             logger.info("Initializing Diagnosis Service and loading models...")
+            # 0. تحميل ملفات النماذج الثمانية بالتوازي إلى ذاكرة EyesModel؛ الخطوات التالية تجدها جاهزة
+            self._load_models()
+
             # 1. تحميل النموذج متعدد الفئات
             self.multi_class_model = EyesModel(
-                model_path=config.MULTI_CLASS_MODEL_PATH,
-                strategy=MULTICLASSPreprocessing()
+                model_path=self.model_paths["multi_class"],
+                strategy=MULTICLASSPreprocessing(),
+                name="multi_class"
             )
             
             # 2. إعداد مجمع النماذج المتخصصة
             self._setup_expert_diagnoser()
             
             # 3. تحميل النموذج الجدولي النهائي
-            self.tabular_model = tf.keras.models.load_model(config.TABULAR_MODEL_PATH)
+            self.tabular_model = EyesModel.load(self.model_paths["tabular"])
             
             # 4. إنشاء نسخة من خط أنابيب الميزات للإنتاج
             self.feature_pipeline = ProductionFeaturePipeline()
@@ -47,21 +57,70 @@ class DiagnosisService:
             logger.critical(f"Failed to initialize models or pipeline: {e}", exc_info=True)
             raise ModelLoadingError(f"Failed to initialize models or pipeline: {e}")
         
+    @classmethod
+    def tabular_only(cls, model_paths: Optional[dict] = None) -> 'DiagnosisService':
+        """
+        خدمة بالمرحلة الجدولية فقط (feature_pipeline + tabular_model) لـ rescore_batch، دون تحميل
+        النماذج الصورية السبعة؛ مثلًا لتقييم نموذج جدولي مرشح على مخرجات صورية محفوظة.
+        """
+        service = cls.__new__(cls)
+        service.model_paths = model_paths or config.model_paths()
+        try:
+            service.tabular_model = tf.keras.models.load_model(service.model_paths["tabular"])
+            service.feature_pipeline = ProductionFeaturePipeline()
+        except Exception as e:
+            logger.critical(f"Failed to load the tabular model: {e}", exc_info=True)
+            raise ModelLoadingError(f"Failed to load the tabular model: {e}")
+        return service
+
+    def _load_models(self) -> None:
+        """
+        يحمّل ملفات النماذج المختلفة في مجمع خيوط محدود (config.MODEL_LOAD_WORKERS). جزء كبير من التحميل
+        (إنشاء المتغيرات وقراءة أوزان h5) يجري خارج GIL، فيتداخل تحميل الملفات على عدة أنوية.
+        """
+        paths = list(dict.fromkeys([self.model_paths["multi_class"], *self.model_paths["experts"], self.model_paths["tabular"]]))
+        workers = max(1, min(config.MODEL_LOAD_WORKERS, len(paths)))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-load") as pool:
+            list(pool.map(EyesModel.load, paths))
+        logger.info(f"Loaded {len(paths)} model files in {time.perf_counter() - started:.2f} s with {workers} threads.")
+        if config.UNPACK_MODELS:
+            for path in paths:
+                if str(path).endswith(".keras"):
+                    unpack_model(path)
+
     def _setup_expert_diagnoser(self):
-        """Initializes the Diagnoser singleton with all expert models."""
+        """Initializes this service's Diagnoser with all expert models."""
         self.diagnoser = Diagnoser()
         strategies = [
             CataractPreprocessing(), DiabetesPreprocessing(), GlaucomaPreprocessing(),
             HypertensionPreprocessing(), PathologicalMyopiaPreprocessing(), AgeIssuesPreprocessing()
         ]
+        diseases = [disease for disease, _ in config.DISEASE_CLASSES]
         
-        for i, expert_config in enumerate(config.EXPERT_MODELS_CONFIG):
+        for i, expert_path in enumerate(self.model_paths["experts"]):
             model = EyesModel(
-                model_path=expert_config["path"],
-                strategy=strategies[i]
+                model_path=expert_path,
+                strategy=strategies[i],
+                name=diseases[i]
             )
             self.diagnoser.add_model(model)
 
+    def image_models(self) -> List[tuple]:
+        """(اسم، EyesModel) لكل نموذج صوري: multi_class ثم الخبراء بترتيب DISEASE_CLASSES."""
+        diseases = [disease for disease, _ in config.DISEASE_CLASSES]
+        return [("multi_class", self.multi_class_model), *zip(diseases, self.diagnoser.models)]
+
+    def warm_up(self) -> None:
+        """
+        يمرر حالة اصطناعية واحدة عبر كل النماذج حتى تُبنى الرسوم (tracing) قبل أول طلب حقيقي؛
+        يُستدعى على الخدمة الجديدة قبل تبديلها عند إعادة التحميل الساخن.
+        """
+        image = np.full((config.WARM_UP_IMAGE_SIZE, config.WARM_UP_IMAGE_SIZE, 3), 96, dtype=np.uint8)
+        self.run_diagnosis_batch([
+            {"left_eye_img": image, "right_eye_img": image, "demographics": {"age": 60, "gender": 0}}
+        ])
+
     def run_diagnosis(self, left_eye_img: np.ndarray, right_eye_img: np.ndarray, demographics: dict):
         """
         ينفذ خط أنابيب التشخيص الكامل من طرف إلى طرف بشكل تسلسلي.
@@ -84,29 +143,29 @@ class DiagnosisService:
             
             # --- الخطوة 2: إنشاء متجه الميزات الأولي (18 ميزة) ---
             logger.info("Creating initial feature vector...")
-            initial_feature_vector = create_fused_feature_vector(
-                multi_class_probs_left, multi_class_probs_right,
-                expert_probs_left, expert_probs_right,
-                demographics['age'], demographics['gender']
-            )
+            with stage("fusion"):
+                initial_feature_vector = create_fused_feature_vector(
+                    multi_class_probs_left, multi_class_probs_right,
+                    expert_probs_left, expert_probs_right,
+                    demographics['age'], demographics['gender']
+                )
 
             # --- الخطوة 3: تحويل الميزات الأولية إلى الشكل النهائي (38 ميزة) ---
             logger.info("Transforming features with production pipeline...")
-            final_feature_vector = self.feature_pipeline.transform(initial_feature_vector)
+            with stage("feature_pipeline"):
+                final_feature_vector = self.feature_pipeline.transform(initial_feature_vector)
 
             # --- الخطوة 4: الحصول على التنبؤ النهائي من النموذج الجدولي ---
             logger.info("Getting final prediction from tabular model...")
-            final_probabilities = self.tabular_model.predict(final_feature_vector)[0]
+            with stage("tabular"):
+                final_probabilities = self.tabular_model.predict(final_feature_vector)[0]
             
             # --- الخطوة 5: تنسيق المخرجات النهائية ---
             logger.info("Formatting final diagnosis report...")
-            diagnosis_report = {
-                "final_diagnosis": {},
-                "evidence_vector": initial_feature_vector.tolist()
-            }
-            for i, prob in enumerate(final_probabilities):
-                disease_name = config.MULTI_CLASS_OUTPUT_MAPPING.get(i, f"Unknown_Class_{i}")
-                diagnosis_report["final_diagnosis"][disease_name] = f"{prob:.4f}"
+            diagnosis_report = self._format_report(
+                initial_feature_vector, final_probabilities,
+                self._image_outputs(multi_class_probs_left, multi_class_probs_right, expert_probs_left, expert_probs_right)
+            )
             
             logger.info("Diagnosis pipeline completed successfully.")
             return diagnosis_report
@@ -114,6 +173,150 @@ class DiagnosisService:
         except Exception as e:
             logger.error(f"Full diagnosis pipeline failed: {e}", exc_info=True)
             raise ModelInferenceError(f"Full diagnosis pipeline failed: {e}")
+
+    def run_diagnosis_batch(self, cases: List[dict]) -> List[dict]:
+        """
+        ينفذ خط الأنابيب الكامل لعدة تشخيصات دفعة واحدة.
+        كل عنصر في cases قاموس يحوي left_eye_img و right_eye_img و demographics، أو قوائم لقطات
+        left_eye_imgs و right_eye_imgs (مع left_weights و right_weights اختياريًا للتجميع بالجودة).
+        يُشغَّل كل نموذج صوري مرة واحدة فقط على كل اللقطات (كل العيون اليسرى ثم اليمنى)، ثم تُجمع
+        تنبؤات لقطات كل عين (config.EYE_AGGREGATION) قبل دمج الميزات. النموذج الجدولي يعمل مرة واحدة
+        على N متجهًا. تُعاد التقارير بنفس ترتيب المدخلات.
+        """
+        if not cases:
+            return []
+        try:
+            n = len(cases)
+            left_images, left_spans = self._flatten_eye_images(cases, "left")
+            right_images, right_spans = self._flatten_eye_images(cases, "right")
+            n_left = len(left_images)
+            logger.info(
+                f"Starting batched diagnosis pipeline for {n} cases "
+                f"({n_left + len(right_images)} images)..."
+            )
+
+            # --- الخطوة 1: النموذج متعدد الفئات والنماذج المتخصصة على كل اللقطات دفعة واحدة ---
+            multi_class_probs = self.multi_class_model.predict_batch(left_images + right_images)
+            expert_results = self.diagnoser.predict_batch(left_images, right_images)
+
+            # expert_results: لكل نموذج (نتائج اللقطات اليسرى, نتائج اللقطات اليمنى) -> مصفوفات (لقطات, 6)
+            expert_probs_left = np.stack([res[0][:, 0] for res in expert_results], axis=1)
+            expert_probs_right = np.stack([res[1][:, 0] for res in expert_results], axis=1)
+
+            # --- الخطوة 2 و 3: تجميع لقطات كل عين، متجه الميزات لكل حالة ثم التحويل إلى 38 ميزة ---
+            initial_vectors, final_vectors, image_outputs = [], [], []
+            for i, case in enumerate(cases):
+                left, right = left_spans[i], right_spans[i]
+                left_weights, right_weights = case.get("left_weights"), case.get("right_weights")
+                with stage("fusion"):
+                    eye_probs = (
+                        aggregate_eye_predictions(multi_class_probs[left], config.EYE_AGGREGATION, left_weights),
+                        aggregate_eye_predictions(
+                            multi_class_probs[n_left + right.start:n_left + right.stop], config.EYE_AGGREGATION, right_weights
+                        ),
+                        aggregate_eye_predictions(expert_probs_left[left], config.EYE_AGGREGATION, left_weights),
+                        aggregate_eye_predictions(expert_probs_right[right], config.EYE_AGGREGATION, right_weights),
+                    )
+                    initial_feature_vector = create_fused_feature_vector(
+                        *eye_probs, case["demographics"]['age'], case["demographics"]['gender']
+                    )
+                initial_vectors.append(initial_feature_vector)
+                with stage("feature_pipeline"):
+                    final_vectors.append(self.feature_pipeline.transform(initial_feature_vector))
+                image_outputs.append(self._image_outputs(*eye_probs))
+
+            # --- الخطوة 4: تنبؤ جدولي واحد للدفعة كاملة ---
+            with stage("tabular"):
+                final_probabilities = self.tabular_model.predict(
+                    np.concatenate(final_vectors, axis=0), batch_size=n, verbose=0
+                )
+
+            # --- الخطوة 5: تنسيق المخرجات ---
+            reports = [
+                self._format_report(initial_vectors[i], final_probabilities[i], image_outputs[i]) for i in range(n)
+            ]
+            logger.info(f"Batched diagnosis pipeline completed successfully for {n} cases.")
+            return reports
+
+        except Exception as e:
+            logger.error(f"Batched diagnosis pipeline failed: {e}", exc_info=True)
+            raise ModelInferenceError(f"Batched diagnosis pipeline failed: {e}")
+
+    def rescore_batch(self, cases: List[dict]) -> List[dict]:
+        """
+        يعيد حساب المرحلة الجدولية فقط (feature_pipeline.transform + tabular_model) لنتائج سابقة
+        بعد تغير البيانات الديموغرافية، دون تشغيل النماذج الصورية.
+        كل عنصر في cases قاموس يحوي result (تقرير سابق من هذه الخدمة) و demographics الجديدة.
+        مخرجات النماذج الصورية تؤخذ من result["image_outputs"]، أو من أول 16 ميزة في evidence_vector
+        للتقارير الأقدم. تُعاد التقارير بنفس ترتيب المدخلات.
+        """
+        if not cases:
+            return []
+        try:
+            n = len(cases)
+            initial_vectors = [
+                self._rescored_feature_vector(case["result"], case["demographics"]) for case in cases
+            ]
+            final_vectors = [self.feature_pipeline.transform(vector) for vector in initial_vectors]
+            # predict_on_batch: استدعاء واحد دون حلقة predict وإعداداتها (~1 ms بدل ~70 ms لدفعة صغيرة)
+            final_probabilities = np.asarray(self.tabular_model.predict_on_batch(np.concatenate(final_vectors, axis=0)))
+            return [
+                self._format_report(initial_vectors[i], final_probabilities[i], cases[i]["result"].get("image_outputs"))
+                for i in range(n)
+            ]
+        except Exception as e:
+            logger.error(f"Re-scoring failed: {e}", exc_info=True)
+            raise ModelInferenceError(f"Re-scoring failed: {e}")
+
+    @staticmethod
+    def _rescored_feature_vector(result: dict, demographics: dict) -> np.ndarray:
+        """متجه الميزات الأولي (18) من مخرجات النماذج الصورية المحفوظة مع البيانات الديموغرافية الجديدة."""
+        image_outputs = result.get("image_outputs")
+        if image_outputs:
+            return create_fused_feature_vector(
+                np.asarray(image_outputs["left"]["multi_class"], dtype=np.float32),
+                np.asarray(image_outputs["right"]["multi_class"], dtype=np.float32),
+                np.asarray(image_outputs["left"]["expert"], dtype=np.float32),
+                np.asarray(image_outputs["right"]["expert"], dtype=np.float32),
+                demographics['age'], demographics['gender']
+            )
+        # تقارير أقدم: الميزات المدمجة للعينين (16) لا تعتمد على البيانات الديموغرافية
+        fused = np.asarray(result["evidence_vector"][:16], dtype=np.float32)
+        return np.concatenate([fused, [demographics['age'], demographics['gender']]]).astype(np.float32)
+
+    @staticmethod
+    def _image_outputs(multi_class_left, multi_class_right, expert_left, expert_right) -> dict:
+        """مخرجات النماذج الصورية لكل عين (بعد تجميع اللقطات)، تُحفظ في التقرير لإعادة التقييم دون الصور."""
+        return {
+            "left": {"multi_class": np.asarray(multi_class_left).tolist(), "expert": np.asarray(expert_left).tolist()},
+            "right": {"multi_class": np.asarray(multi_class_right).tolist(), "expert": np.asarray(expert_right).tolist()},
+        }
+
+    @staticmethod
+    def _flatten_eye_images(cases: List[dict], side: str):
+        """يسطّح لقطات العين side لكل الحالات في قائمة واحدة، مع نطاق (slice) لقطات كل حالة فيها."""
+        images, spans = [], []
+        for case in cases:
+            shots = case.get(f"{side}_eye_imgs") or [case[f"{side}_eye_img"]]
+            spans.append(slice(len(images), len(images) + len(shots)))
+            images.extend(shots)
+        return images, spans
+
+    @staticmethod
+    def _format_report(
+        initial_feature_vector: np.ndarray, final_probabilities: np.ndarray, image_outputs: Optional[dict] = None
+    ) -> dict:
+        """يبني قاموس التقرير النهائي المتوافق مع JSON."""
+        diagnosis_report = {
+            "final_diagnosis": {},
+            "evidence_vector": initial_feature_vector.tolist()
+        }
+        if image_outputs is not None:
+            diagnosis_report["image_outputs"] = image_outputs
+        for i, prob in enumerate(final_probabilities):
+            disease_name = config.MULTI_CLASS_OUTPUT_MAPPING.get(i, f"Unknown_Class_{i}")
+            diagnosis_report["final_diagnosis"][disease_name] = f"{prob:.4f}"
+        return diagnosis_report
         
 # FILE: apps/diagnosis/ai_pipeline/service.py
 
@@ -0,0 +1,190 @@
+# apps/diagnosis/artifacts.py
+"""
+توزيع ملفات النماذج على العقد بدل تضمينها في صورة الحاوية:
+- مخزن الملفات (DIAGNOSIS_MODEL_ARTIFACTS["BACKEND"]): "filesystem" (مجلد مشترك، أو محاكٍ محلي للاختبار)
+  أو "s3". كل إصدار بادئة مفاتيح فيه (ModelVersion.file_path) تحوي الملفات و manifest.json ببصماتها.
+- العامل يسحب ملفات الإصدار إلى ذاكرة محلية على العقدة (CACHE_DIR): blobs/<sha256> بعنوان المحتوى،
+  ومجلد لكل إصدار يربط (hard link) أسماء الملفات بها. الملف المتطابق بين إصدارين يُسحب مرة واحدة.
+- كل ملف يُتحقق من بصمته أثناء السحب قبل وضعه في مكانه، وقفل ملف لكل بصمة يجعل العمال المتزامنين
+  على نفس العقدة يتشاركون تنزيلًا واحدًا.
+دون BACKEND يبقى file_path مجلدًا محليًا كما كان.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.files import File, locks
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+
+from .exceptions import ModelArtifactError
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+_READ_SIZE = 1024 * 1024
+
+
+def enabled() -> bool:
+    return bool(settings.DIAGNOSIS_MODEL_ARTIFACTS["BACKEND"])
+
+
+def artifact_storage() -> Storage:
+    config = settings.DIAGNOSIS_MODEL_ARTIFACTS
+    if config["BACKEND"] == "s3":
+        from storages.backends.s3 import S3Storage
+
+        return S3Storage(bucket_name=config["LOCATION"], file_overwrite=True)
+    return FileSystemStorage(location=config["LOCATION"])
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def publish(source_dir: str, prefix: str, filenames) -> Dict[str, dict]:
+    """
+    يرفع ملفات النماذج من source_dir إلى البادئة prefix في المخزن، ثم manifest.json أخيرًا:
+    وجود manifest يعني أن الإصدار مكتمل. يعيد مدخلات manifest.
+    """
+    storage = artifact_storage()
+    files = {}
+    for filename in filenames:
+        path = os.path.join(source_dir, filename)
+        files[filename] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+        key = f"{prefix}/{filename}"
+        if storage.exists(key):
+            storage.delete(key)
+        with open(path, "rb") as f:
+            storage.save(key, File(f))
+        logger.info(f"Published {key} ({files[filename]['size']} bytes).")
+
+    manifest_key = f"{prefix}/{MANIFEST}"
+    if storage.exists(manifest_key):
+        storage.delete(manifest_key)
+    storage.save(manifest_key, ContentFile(json.dumps({"files": files}, indent=2).encode()))
+    return files
+
+
+def model_filenames(source_dir: str) -> List[str]:
+    """أسماء ملفات النماذج المختلفة لإصدار (كما في config.model_paths)، مرتبة."""
+    from .ai_pipeline import config
+
+    paths = config.model_paths(source_dir)
+    return sorted({os.path.basename(path) for path in [paths["multi_class"], paths["tabular"], *paths["experts"]]})
+
+
+def publish_version(source_dir: str, name: str, label: str, activate: bool = False):
+    """ينشر ملفات النماذج في source_dir تحت models/<name>/<label> وينشئ ModelVersion يشير إليها."""
+    from .models import ModelVersion
+
+    if ModelVersion.objects.filter(name=name, version=label).exists():
+        raise ModelArtifactError(f"{name} v{label} already exists; publish under a new version.")
+    filenames = model_filenames(source_dir)
+    missing = [f for f in filenames if not os.path.isfile(os.path.join(source_dir, f))]
+    if missing:
+        raise ModelArtifactError(f"Missing model files in {source_dir}: {', '.join(missing)}")
+    prefix = f"models/{name}/{label}"
+    files = publish(source_dir, prefix, filenames)
+    model_version = ModelVersion.objects.create(name=name, version=label, file_path=prefix, is_active=activate)
+    logger.info(f"Published {model_version}: {len(files)} files at {prefix}.")
+    return model_version
+
+
+def read_manifest(prefix: str) -> Dict[str, dict]:
+    try:
+        with artifact_storage().open(f"{prefix}/{MANIFEST}", "rb") as f:
+            return json.loads(f.read())["files"]
+    except Exception as e:  # FileNotFoundError على نظام الملفات، ClientError (404) على S3
+        raise ModelArtifactError(f"No model manifest at {prefix}/{MANIFEST}: {e}")
+
+
+def _cache_dir(*parts) -> str:
+    path = os.path.join(settings.DIAGNOSIS_MODEL_ARTIFACTS["CACHE_DIR"], *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _cached(blob: str, entry: dict) -> bool:
+    # الملف الموجود باسم بصمته تحقق منه عند وضعه؛ الحجم يكشف النسخ المبتورة دون إعادة قراءة الملف
+    return os.path.isfile(blob) and os.path.getsize(blob) == entry["size"]
+
+
+def _download(storage: Storage, key: str, blob: str, entry: dict) -> None:
+    """ينزّل key إلى ملف مؤقت بجانب blob، ويتحقق من البصمة والحجم، ثم ينقله إلى مكانه."""
+    digest, size = hashlib.sha256(), 0
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(blob), prefix=".download-")
+    try:
+        with os.fdopen(fd, "wb") as out, storage.open(key, "rb") as source:
+            for block in iter(lambda: source.read(_READ_SIZE), b""):
+                digest.update(block)
+                size += len(block)
+                out.write(block)
+        if digest.hexdigest() != entry["sha256"] or size != entry["size"]:
+            raise ModelArtifactError(
+                f"Checksum mismatch for {key}: expected {entry['sha256']} ({entry['size']} bytes), "
+                f"got {digest.hexdigest()} ({size} bytes)."
+            )
+        os.replace(partial, blob)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def _fetch_blob(storage: Storage, key: str, entry: dict) -> str:
+    blob = os.path.join(_cache_dir("blobs"), entry["sha256"])
+    if _cached(blob, entry):
+        return blob
+    with open(f"{blob}.lock", "wb") as lock_file:
+        locks.lock(lock_file, locks.LOCK_EX)
+        try:
+            # عامل آخر على العقدة ربما أنهى التنزيل أثناء انتظار القفل
+            if not _cached(blob, entry):
+                logger.info(f"Fetching model artifact {key} ({entry['size']} bytes)...")
+                _download(storage, key, blob, entry)
+        finally:
+            locks.unlock(lock_file)
+    return blob
+
+
+def fetch(prefix: str) -> str:
+    """يسحب ملفات الإصدار prefix إلى الذاكرة المحلية ويعيد مجلدًا بأسماء ملفاتها (لـ config.model_paths)."""
+    storage = artifact_storage()
+    version_dir = _cache_dir("versions", hashlib.sha256(prefix.encode()).hexdigest()[:16])
+    for filename, entry in read_manifest(prefix).items():
+        blob = _fetch_blob(storage, f"{prefix}/{filename}", entry)
+        target = os.path.join(version_dir, filename)
+        if os.path.exists(target) and os.path.samefile(target, blob):
+            continue
+        staging = f"{target}.{uuid.uuid4().hex}.link"
+        os.link(blob, staging)
+        os.replace(staging, target)
+    return version_dir
+
+
+def local_dir(model_version) -> Optional[str]:
+    """
+    مجلد ملفات الإصدار على هذه العقدة: يُسحب من المخزن عند تفعيل BACKEND، وإلا file_path نفسه.
+    الصفوف القديمة كان file_path فيها ملف نموذج واحد؛ تُرفض بخطأ واضح بدل فشل التحميل لاحقًا.
+    """
+    if model_version is None:
+        return None
+    if not enabled():
+        if not os.path.isdir(model_version.file_path):
+            raise ModelArtifactError(
+                f"{model_version}: file_path {model_version.file_path!r} is not a directory. A ModelVersion "
+                f"points at the directory that holds its model files; rows created before that stored a single "
+                f"model file. Update file_path to the version's directory, or set DIAGNOSIS_MODEL_ARTIFACTS_BACKEND "
+                f"and publish the directory with `manage.py model_artifacts --publish`."
+            )
+        return model_version.file_path
+    return fetch(model_version.file_path)
@@ -0,0 +1,132 @@
+# apps/diagnosis/async_views.py
+"""
+نسخ غير متزامنة (ASGI) من نقطتي إنشاء التشخيص واسترجاع حالته.
+تحت عمال uvicorn لا يحجز رفع بطيء عاملًا كاملًا: جسم الطلب يُقرأ بشكل غير متزامن،
+والصور تُكتب إلى ملفات مؤقتة على القرص ثم تُنقل إلى التخزين دون تحميلها كاملة في الذاكرة.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.authentication import CSRFCheck
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from apps.users.models import Patient
+from .admission import BACKLOG_REJECTION_MESSAGE, admit
+from .models import Diagnosis
+from .scheduling import schedule_diagnosis_processing
+from .serializers import DiagnosisCreateSerializer, DiagnosisDetailSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def _response(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _error(status, detail):
+    return _response({"detail": detail}, status=status)
+
+
+def _csrf_rejection(request):
+    """
+    نفس فحص CSRF الذي تطبقه SessionAuthentication في DRF على الطلبات المعتمدة على الجلسة.
+    قد يقرأ request.POST (رمز csrfmiddlewaretoken في النموذج)، لذا يُستدعى داخل خيط
+    وبعد تعيين upload_handlers.
+    """
+    check = CSRFCheck(lambda req: None)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    return _error(403, f"CSRF Failed: {reason}") if reason else None
+
+
+async def _authenticate(request):
+    """
+    يصادق بنفس ترتيب DEFAULT_AUTHENTICATION_CLASSES: الجلسة (مع CSRF) ثم JWT.
+    يعيد (user, None) عند النجاح أو (None, response) عند الفشل.
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        rejection = await sync_to_async(_csrf_rejection)(request)
+        return (None, rejection) if rejection else (user, None)
+
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return None, _error(401, e.detail)
+    if result is None:
+        return None, _error(401, "Authentication credentials were not provided.")
+    return result[0], None
+
+
+def _validate_upload(request):
+    """
+    يحلل جسم multipart ويتحقق منه. يُستدعى داخل خيط (sync_to_async) لأن التحليل والتحقق من الصور
+    عمليات إدخال/إخراج متزامنة. الملفات تذهب إلى القرص مباشرة (TemporaryFileUploadHandler
+    المعيّن في diagnosis_create قبل المصادقة).
+    """
+    data = request.POST.copy()
+    data.update(request.FILES)
+    serializer = DiagnosisCreateSerializer(data=data, context={"request": request})
+    serializer.is_valid()
+    return serializer
+
+
+@csrf_exempt
+@require_POST
+async def diagnosis_create(request):
+    """POST: نسخة غير متزامنة من DiagnosisViewSet.create بنفس المدخلات والاستجابة."""
+    # قبل المصادقة: فحص CSRF للجلسة قد يحلل الجسم، ولا يمكن تغيير المعالجات بعد ذلك
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    user, error = await _authenticate(request)
+    if error:
+        return error
+
+    serializer = await sync_to_async(_validate_upload)(request)
+    if serializer.errors:
+        return _response(serializer.errors, status=400)
+    validated = serializer.validated_data
+
+    admission = await sync_to_async(admit)(validated.get("priority", Diagnosis.Priority.SAME_DAY), user)
+    if not admission.admitted:
+        response = _error(429, BACKLOG_REJECTION_MESSAGE)
+        response["Retry-After"] = str(admission.retry_after)
+        return response
+
+    try:
+        patient = await user.patients.aget(id=validated.pop("patient_id"))
+    except Patient.DoesNotExist:
+        return _response(["You do not have permission for this patient."], status=400)
+
+    # نفس مسار الحفظ في DiagnosisViewSet: التشخيص ولقطاته الإضافية في معاملة واحدة (serializer.create)،
+    # والمعاملة ملتزمة عند عودة save، فتُجدول المهمة بعدها مباشرة
+    validated["priority"] = admission.priority
+    diagnosis = await sync_to_async(serializer.save)(patient=patient, physician=user)
+    await sync_to_async(schedule_diagnosis_processing)(str(diagnosis.id), diagnosis.priority)
+
+    data = dict(DiagnosisCreateSerializer(diagnosis, context={"request": request}).data)
+    data["estimated_completion_at"] = admission.estimate.estimated_completion_at
+    return _response(data, status=201)
+
+
+@csrf_exempt
+@require_GET
+async def diagnosis_detail(request, pk):
+    """GET: حالة ونتيجة تشخيص، للمالك أو المسؤول فقط (مثل IsOwnerOrAdmin)."""
+    user, error = await _authenticate(request)
+    if error:
+        return error
+
+    try:
+        diagnosis = await Diagnosis.objects.select_related("patient", "physician").prefetch_related("extra_images").aget(pk=pk)
+    except Diagnosis.DoesNotExist:
+        return _error(404, "Not found.")
+    if not (user.is_staff or diagnosis.physician_id == user.id):
+        return _error(403, "You do not have permission to perform this action.")
+
+    return _response(DiagnosisDetailSerializer(diagnosis, context={"request": request}).data)
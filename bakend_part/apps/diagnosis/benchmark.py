@@ -0,0 +1,192 @@
+# apps/diagnosis/benchmark.py
+"""
+قياس أداء DiagnosisService دون الأوزان الحقيقية (python manage.py benchmark_pipeline):
+- stand_in_models: نماذج بمعمارية التدريب نفسها وأوزان عشوائية، تبنيها بناة ai_part من ملفات تكوينها
+  (ModelBuilder: ResNet50 + Dense(512) للنموذج متعدد الفئات والخبراء الستة، TabularModelBuilder:
+  TabularResNet على متجه الميزات النهائي). الملفات بأسماء الإعدادات، فالمجلد يصلح لـ config.model_paths.
+- stage_timings: زمن كل مرحلة منفردة بنفس استدعاءات run_diagnosis: فك الترميز، كل استراتيجية معالجة،
+  كل نموذج، دمج الميزات، ProductionFeaturePipeline، والنموذج الجدولي.
+- end_to_end: زمن التشخيص الكامل (p50/p95/p99) والإنتاجية عند تزامنات مختلفة، بخيوط متوازية على
+  run_diagnosis أو بدفعات run_diagnosis_batch.
+الأزمنة بالميلي ثانية. النماذج العشوائية تكلف نفس الحساب، لكن مخرجاتها بلا معنى.
+"""
+import contextlib
+import io
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from . import derivatives
+from .ai_pipeline import config
+from .ai_pipeline.feature_extractor import create_fused_feature_vector
+from .ai_pipeline.production_feature_pipeline import ProductionFeaturePipeline
+from .parity import IMAGE_PROJECT, TABULAR_PROJECT, training_module
+
+MODES = ("threads", "batch")
+DEMOGRAPHICS = {"age": 62, "gender": 1}
+
+
+def _training_config(project: str, *parts: str) -> dict:
+    from django.conf import settings
+
+    with open(os.path.join(settings.AI_TRAINING_DIR, project, "configs", *parts)) as f:
+        return yaml.safe_load(f)
+
+
+def stand_in_models(directory: str, backbone: str = "ResNet50", seed: int = 0) -> dict:
+    """
+    يبني الملفات الناقصة في directory ويعيد config.model_paths(directory). الملفات الموجودة لا تُمس،
+    فالبناء (دقائق مع ResNet50) يحدث مرة واحدة. backbone يستبدل base_model في التكوين (لاختبار أسرع).
+    """
+    import tensorflow as tf
+
+    paths = config.model_paths(directory)
+    os.makedirs(directory, exist_ok=True)
+    tf.keras.utils.set_random_seed(seed)
+    model_builder = training_module("model_builder").ModelBuilder
+
+    for path in dict.fromkeys([paths["multi_class"], *paths["experts"]]):
+        if os.path.exists(path):
+            continue
+        parts = ("multi_class_config.yaml",) if path == paths["multi_class"] else ("binary", "base_binary_config.yaml")
+        model_config = _training_config(IMAGE_PROJECT, *parts)
+        model_config["model"].update(base_model=backbone, weights=None)
+        with contextlib.redirect_stdout(io.StringIO()):  # ModelBuilder.build يطبع model.summary()
+            model_builder(model_config).build().save(path)
+
+    if not os.path.exists(paths["tabular"]):
+        tabular_config = _training_config(TABULAR_PROJECT, "2_tabular_training_config.yaml")
+        features = ProductionFeaturePipeline().transform(np.zeros(18, dtype=np.float32)).shape[1]
+        builder = training_module("tabular_model_builder", TABULAR_PROJECT).TabularModelBuilder(tabular_config)
+        builder.build((features,)).save(paths["tabular"])
+    return paths
+
+
+def summarize(samples_ms: List[float]) -> dict:
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": int(samples.size),
+        "mean": round(float(samples.mean()), 3),
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p95": round(float(np.percentile(samples, 95)), 3),
+        "p99": round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+def time_calls(function: Callable[[], object], repeats: int) -> List[float]:
+    """أزمنة repeats استدعاءً بعد استدعاء تسخين واحد (بناء الرسم عند أول predict)."""
+    function()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _inference_png(image_path: str) -> bytes:
+    with Image.open(image_path) as image:
+        rendered, _ = derivatives.render(image)
+    buffer = io.BytesIO()
+    rendered[derivatives.INFERENCE].save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def inference_array(image_path: str) -> np.ndarray:
+    """مدخل run_diagnosis لعين: نسخة الاستدلال كما يقرؤها العامل."""
+    return np.array(Image.open(io.BytesIO(_inference_png(image_path))))
+
+
+def stage_timings(service, image_path: str, repeats: int) -> Dict[str, dict]:
+    """
+    زمن كل مرحلة لعين واحدة كما في run_diagnosis: decode/render (نسخة الاستدلال من الأصل عند الرفع)،
+    decode/inference_png (قراءة العامل لها)، ثم لكل نموذج preprocessing/<استراتيجية> و model/<نموذج>
+    (model.predict على دفعة من صورة كما في predict_single)، ثم fusion و feature_pipeline و tabular.
+    """
+    def render():
+        with Image.open(image_path) as image:
+            derivatives.render(image)
+
+    png = _inference_png(image_path)
+    stages = {
+        "decode/render": time_calls(render, repeats),
+        "decode/inference_png": time_calls(lambda: np.array(Image.open(io.BytesIO(png))), repeats),
+    }
+    image = np.array(Image.open(io.BytesIO(png)))
+
+    outputs = {}
+    for name, model in service.image_models():
+        strategy = type(model.strategy).__name__
+        if f"preprocessing/{strategy}" not in stages:
+            stages[f"preprocessing/{strategy}"] = time_calls(lambda: model._prepare_input_array(image), repeats)
+        tensor = model._prepare_input_tensor(image)
+        stages[f"model/{name}"] = time_calls(lambda: model.model.predict(tensor, verbose=0), repeats)
+        outputs[name] = model.model.predict(tensor, verbose=0)[0]
+
+    multi_class = outputs.pop("multi_class")
+    experts = np.array([output[0] for output in outputs.values()])
+
+    def fuse():
+        return create_fused_feature_vector(
+            multi_class, multi_class, experts, experts, DEMOGRAPHICS["age"], DEMOGRAPHICS["gender"]
+        )
+
+    vector = fuse()
+    final = service.feature_pipeline.transform(vector)
+    stages["fusion"] = time_calls(fuse, repeats)
+    stages["feature_pipeline"] = time_calls(lambda: service.feature_pipeline.transform(vector), repeats)
+    stages["tabular"] = time_calls(lambda: service.tabular_model.predict(final, verbose=0), repeats)
+    return {stage: summarize(samples) for stage, samples in stages.items()}
+
+
+def end_to_end(service, image: np.ndarray, mode: str, concurrency: int, requests: int) -> dict:
+    """
+    threads: concurrency خيطًا تستدعي run_diagnosis على نفس الخدمة (كعامل Celery بعدة خيوط).
+    batch: run_diagnosis_batch على concurrency حالة في كل استدعاء؛ زمن الحالة هو زمن دفعتها.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}: use one of {', '.join(MODES)}.")
+    case = {"left_eye_img": image, "right_eye_img": image, "demographics": DEMOGRAPHICS}
+    latencies = []
+
+    def diagnose():
+        started = time.perf_counter()
+        service.run_diagnosis(image, image, DEMOGRAPHICS)
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    if mode == "threads":
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="benchmark") as pool:
+            latencies = list(pool.map(lambda _: diagnose(), range(requests)))
+    else:
+        for batch_start in range(0, requests, concurrency):
+            size = min(concurrency, requests - batch_start)
+            batch_started = time.perf_counter()
+            service.run_diagnosis_batch([case] * size)
+            latencies += [(time.perf_counter() - batch_started) * 1000] * size
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput_per_second": round(requests / elapsed, 3),
+        "latency_ms": summarize(latencies),
+    }
+
+
+def environment() -> dict:
+    import tensorflow as tf
+
+    return {
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
@@ -0,0 +1,189 @@
+# apps/diagnosis/content_store.py
+"""
+تخزين صور قاع العين بعنوان المحتوى (content-addressed): مفتاح كل ملف مشتق من SHA-256 لمحتواه،
+فالصورة المكررة (إعادة إرسال أو إعادة استيراد جماعي) تُخزن مرة واحدة فقط ولا تُكتب مرة ثانية.
+- ContentAddressedStorage يغلّف default_storage (نظام الملفات أو S3) ويستخدمه حقلا صور Diagnosis.
+- StoredImage يعدّ المراجع لكل ملف؛ حذف آخر تشخيص يشير إلى الملف يحذفه من التخزين.
+- البصمة نفسها (image_digest) تصلح مفتاحًا لذاكرات التخزين المؤقت لنتائج الاستدلال.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Iterable, Optional
+
+from django.core.files import File
+from django.core.files.storage import Storage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+CAS_PREFIX = "diagnoses/images/sha256/"
+_CAS_KEY = re.compile(r"^" + re.escape(CAS_PREFIX) + r"[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(\.\w+)?$")
+_READ_SIZE = 64 * 1024
+
+
+def cas_key(digest: str, extension: str = "") -> str:
+    return f"{CAS_PREFIX}{digest[:2]}/{digest}{extension.lower()}"
+
+
+def image_digest(name: Optional[str]) -> Optional[str]:
+    """SHA-256 للصورة من مفتاحها، أو None للملفات المخزنة بالتخطيط القديم (بالتاريخ)."""
+    match = _CAS_KEY.match(name or "")
+    return match.group("digest") if match else None
+
+
+def _hash_content(content):
+    """
+    يحسب البصمة والحجم تدفقيًا. يعيد (digest, size, readable) حيث readable ملف في أوله جاهز للكتابة؛
+    المحتوى غير القابل للإرجاع (seek) يُنسخ إلى ملف مؤقت أثناء القراءة.
+    """
+    digest, size = hashlib.sha256(), 0
+    seekable = getattr(content, "seekable", lambda: False)()
+    spool = None if seekable else tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    if seekable:
+        content.seek(0)
+    while True:
+        block = content.read(_READ_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+        if spool is not None:
+            spool.write(block)
+    readable = spool if spool is not None else content
+    readable.seek(0)
+    return digest.hexdigest(), size, readable
+
+
+class ContentAddressedStorage(Storage):
+    """
+    Storage يحفظ كل ملف تحت cas_key(sha256) في default_storage ويزيد عدّاد مراجعه.
+    إن كان المحتوى مخزنًا من قبل لا يُكتب شيء ويُعاد المفتاح الموجود.
+    بقية العمليات (فتح، حجم، رابط...) تُمرر إلى default_storage كما هي، فالملفات القديمة تبقى مقروءة.
+    """
+
+    @property
+    def backend(self):
+        return default_storage
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        digest, size, readable = _hash_content(content)
+        return store(digest, size, readable, os.path.splitext(name or "")[1])
+
+    def _open(self, name, mode="rb"):
+        return self.backend.open(name, mode)
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+_fundus_image_storage = ContentAddressedStorage()
+
+
+def fundus_image_storage():
+    """يُمرر كـ storage لحقول الصور (callable حتى لا تتغير الهجرات مع إعدادات التخزين)."""
+    return _fundus_image_storage
+
+
+def store(digest: str, size: int, readable, extension: str = "") -> str:
+    """
+    يسجل مرجعًا جديدًا للمحتوى ذي البصمة digest ويعيد مفتاحه. يكتب readable إلى التخزين فقط
+    إن لم يكن المحتوى موجودًا. الزيادة تسبق أي حفظ للتشخيص: فشل الحفظ بعدها يترك عدًّا زائدًا
+    (ملف لا يُحذف أبدًا) بدل عدّ ناقص قد يحذف صورة ما زالت مستخدمة.
+    """
+    from .models import StoredImage
+
+    if StoredImage.objects.filter(digest=digest).update(ref_count=F("ref_count") + 1):
+        return StoredImage.objects.values_list("key", flat=True).get(digest=digest)
+
+    key = cas_key(digest, extension)
+    # نفس المفتاح يعني نفس المحتوى: ملف باقٍ من سجل محذوف لا داعي لإعادة كتابته
+    if not default_storage.exists(key):
+        key = default_storage.save(key, File(readable, name=key))
+    try:
+        with transaction.atomic():
+            StoredImage.objects.create(digest=digest, key=key, size=size, ref_count=1)
+    except IntegrityError:
+        # طلب متزامن بنفس المحتوى سبقنا إلى إنشاء السجل
+        StoredImage.objects.filter(digest=digest).update(ref_count=F("ref_count") + 1)
+    return key
+
+
+def adopt(key: str) -> str:
+    """
+    ينقل ملفًا رُفع إلى مفتاح عادي (رفع مباشر) إلى التخزين بعنوان المحتوى ويعيد المفتاح الجديد.
+    إن كان المحتوى مكررًا يُستخدم الموجود. الملف المرفوع يُحذف بعد COMMIT فقط: داخل معاملة تفشل
+    تُلغى زيادة عدّاد المراجع ويبقى الملف المرفوع، فيمكن إعادة التأكيد.
+    """
+    if image_digest(key):
+        return key
+    with default_storage.open(key, "rb") as uploaded:
+        digest, size, readable = _hash_content(uploaded)
+        new_key = store(digest, size, readable, os.path.splitext(key)[1])
+    transaction.on_commit(lambda: default_storage.delete(key))
+    return new_key
+
+
+def release(keys: Iterable[str]) -> None:
+    """
+    ينقص عدّاد المراجع للمفاتيح المعطاة. عند الوصول إلى الصفر يُحذف السجل، ويُحذف الملف من التخزين
+    بعد COMMIT فقط. المفاتيح القديمة غير المسجلة تُتجاهل.
+    """
+    from .models import StoredImage
+
+    keys = [key for key in keys if image_digest(key)]
+    if not keys:
+        return
+    with transaction.atomic():
+        for key in keys:
+            # القفل يمنع store من زيادة سجل نحذفه الآن
+            image = StoredImage.objects.select_for_update().filter(key=key).first()
+            if image is None:
+                continue
+            if image.ref_count > 1:
+                StoredImage.objects.filter(pk=image.pk).update(ref_count=F("ref_count") - 1)
+                continue
+            image.delete()
+            transaction.on_commit(lambda key=key: _delete_unreferenced(key))
+
+
+def _delete_unreferenced(key: str) -> None:
+    from .derivatives import delete_for
+    from .models import StoredImage
+    from .tiles import delete_tiles
+
+    # مرجع جديد للمحتوى نفسه أُنشئ بعد الحذف: الملف مستخدم من جديد
+    if not StoredImage.objects.filter(key=key).exists():
+        default_storage.delete(key)
+        delete_for(key)
+        delete_tiles(key)
+        logger.info(f"Deleted unreferenced image {key} and its derivatives.")
@@ -0,0 +1,228 @@
+# apps/diagnosis/derivatives.py
+"""
+النسخ المشتقة من صور قاع العين، تُكتب مرة واحدة وتُسجل على Diagnosis:
+- inference: نسخة PNG (بلا فقد) أقصر ضلع فيها INFERENCE_SIZE. النماذج تصغّر المدخل إلى 224x224،
+  فخط الأنابيب يقرأ هذه النسخة بدل فك ترميز الأصل بدقته الكاملة في كل تشغيل (إعادة المحاولة، إعادة التقييم).
+  مع CROP_ROI تُقص الحواف السوداء حول قرص قاع العين قبل التصغير، فمدخل النموذج كله بكسلات مفيدة؛
+  صندوق القص يُحفظ على StoredImage بإحداثيات الأصل.
+- thumbnail: صورة WebP صغيرة تعرضها القوائم بدل الأصل.
+المفاتيح مشتقة من بصمة الأصل (content_store)، فالصور المكررة تتشارك نفس النسخ.
+النسخة المفقودة (سجل قديم أو ملف محذوف) تُولد عند أول حاجة إليها.
+"""
+import hashlib
+import io
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from .ai_pipeline.models.roi import Box, detect_roi, scale_box
+from .content_store import image_digest
+from .timings import stage
+
+logger = logging.getLogger(__name__)
+
+SIDES = ("left", "right")
+INFERENCE = "inference"
+THUMBNAIL = "thumbnail"
+
+
+def derivative_field(side: str, kind: str) -> str:
+    return f"{side}_inference_image" if kind == INFERENCE else f"{side}_thumbnail"
+
+
+def source_id(source_name: str) -> str:
+    """معرّف الأصل في مفاتيح النسخ المشتقة: بصمة المحتوى، أو بصمة الاسم للصور القديمة (بلا بصمة في المفتاح)."""
+    return image_digest(source_name) or hashlib.sha256(source_name.encode()).hexdigest()
+
+
+def derivative_keys(source_name: str) -> Dict[str, str]:
+    """مفاتيح النسخ المشتقة من الأصل."""
+    config = settings.DIAGNOSIS_DERIVATIVES
+    base = source_id(source_name)
+    prefix = f"diagnoses/derivatives/{base[:2]}/{base}{'-roi' if config['CROP_ROI'] else ''}"
+    return {
+        INFERENCE: f"{prefix}-{config['INFERENCE_SIZE']}.png",
+        THUMBNAIL: f"{prefix}-thumb{config['THUMBNAIL_SIZE']}.webp",
+    }
+
+
+def _shrink(image: Image.Image, size: int) -> Tuple[int, int]:
+    """أبعاد الصورة بعد تصغيرها (دون تكبير) حتى يصبح أقصر ضلع size."""
+    scale = min(1, size / min(image.size))
+    return max(1, round(image.width * scale)), max(1, round(image.height * scale))
+
+
+def render(image: Image.Image, roi_box: Optional[Box] = None) -> Tuple[Dict[str, Image.Image], Optional[Box]]:
+    """
+    يصغّر الصورة (دون تكبير) إلى نسخة الاستدلال، ثم الصورة المصغرة من نسخة الاستدلال.
+    مع CROP_ROI يُقص قرص قاع العين أولًا: بالصندوق المحفوظ roi_box إن وُجد، وإلا يُكشف على الصورة
+    المفكوكة بالدقة المخفضة (رخيص). يعيد النسختين وصندوق القص بإحداثيات الأصل (None دون قص).
+    """
+    config = settings.DIAGNOSIS_DERIVATIVES
+    size = config["INFERENCE_SIZE"]
+    full_size = image.size
+    # JPEG: فك الترميز مباشرة بدقة مخفضة (تحجيم DCT) بدل فك الأصل كاملًا ثم تصغيره
+    image.draft("RGB", _shrink(image, size))
+    decoded = image.convert("RGB")
+
+    if config["CROP_ROI"]:
+        if roi_box is None:
+            roi_box = scale_box(detect_roi(np.asarray(decoded)), decoded.size, full_size)
+        decoded = decoded.crop(scale_box(roi_box, full_size, decoded.size))
+
+    target = _shrink(decoded, size)
+    inference = decoded.resize(target, Image.Resampling.LANCZOS) if target != decoded.size else decoded
+
+    thumbnail = inference.copy()
+    thumbnail.thumbnail((config["THUMBNAIL_SIZE"], config["THUMBNAIL_SIZE"]), Image.Resampling.LANCZOS)
+    return {INFERENCE: inference, THUMBNAIL: thumbnail}, roi_box
+
+
+def is_stored(key: str) -> bool:
+    # size بدل exists: S3Storage.exists يعيد False دائمًا عند تفعيل AWS_S3_FILE_OVERWRITE
+    try:
+        default_storage.size(key)
+        return True
+    except Exception:
+        return False
+
+
+def overwriting_storage():
+    """
+    نسخة من مخزن default تكتب فوق المفتاح الموجود (allow_overwrite لنظام الملفات، file_overwrite لـ S3)،
+    فكتابة نسخة مشتقة أو بلاطة طلب واحد بدل exists ثم delete ثم save. محتوى هذه المفاتيح ثابت.
+    """
+    backend = settings.STORAGES["default"]
+    storage_class = import_string(backend["BACKEND"])
+    options = dict(backend.get("OPTIONS", {}))
+    options["allow_overwrite" if issubclass(storage_class, FileSystemStorage) else "file_overwrite"] = True
+    return storage_class(**options)
+
+
+def _write(key: str, image: Image.Image, kind: str) -> None:
+    buffer = io.BytesIO()
+    if kind == THUMBNAIL:
+        image.save(buffer, format="WEBP", quality=settings.DIAGNOSIS_DERIVATIVES["THUMBNAIL_QUALITY"], method=4)
+    else:
+        image.save(buffer, format="PNG", compress_level=1)
+    overwriting_storage().save(key, ContentFile(buffer.getvalue()))
+
+
+def _render_source(source) -> Dict[str, Image.Image]:
+    """يفك ترميز الأصل ويصغّره، مع صندوق القص المحفوظ على StoredImage (أو يحفظ الصندوق المكتشف)."""
+    from .models import StoredImage
+
+    digest = image_digest(source.name)
+    cached_box = StoredImage.objects.filter(digest=digest).values_list("roi_box", flat=True).first()
+    with stage("image_read"), source.open("rb"):
+        data = source.read()
+    with stage("decode"):
+        rendered, roi_box = render(Image.open(io.BytesIO(data)), tuple(cached_box) if cached_box else None)
+    if roi_box and not cached_box and digest:
+        StoredImage.objects.filter(digest=digest).update(roi_box=list(roi_box))
+    return rendered
+
+
+def _load(field) -> Optional[Image.Image]:
+    """يقرأ نسخة مشتقة مسجلة، أو None إن كانت مفقودة من التخزين."""
+    try:
+        with stage("image_read"), field.open("rb"):
+            data = field.read()
+        with stage("decode"):
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        return image
+    except Exception:  # FileNotFoundError على نظام الملفات، ClientError (404) على S3
+        logger.warning(f"Derivative {field.name} is missing; regenerating from the original.")
+        return None
+
+
+def generate(diagnosis, sides: Iterable[str] = SIDES) -> Dict[str, Image.Image]:
+    """
+    يولد النسخ المشتقة للجهات المطلوبة ويسجلها على diagnosis. يعيد نسخة الاستدلال لكل جهة
+    حتى يستخدمها المستدعي مباشرة دون قراءتها من التخزين مرة أخرى.
+    """
+    from .models import Diagnosis
+
+    updates, inference_images = {}, {}
+    for side in sides:
+        source = getattr(diagnosis, f"{side}_fundus_image")
+        keys = derivative_keys(source.name)
+        rendered = _render_source(source)
+        for kind, key in keys.items():
+            with stage("derivative_write"):
+                _write(key, rendered[kind], kind)
+            updates[derivative_field(side, kind)] = key
+        inference_images[side] = rendered[INFERENCE]
+
+    Diagnosis.objects.filter(pk=diagnosis.pk).update(**updates)
+    for field, key in updates.items():
+        setattr(diagnosis, field, key)
+    logger.info(f"Generated image derivatives for diagnosis {diagnosis.pk} ({', '.join(sides)}).")
+    return inference_images
+
+
+def _record_stored(diagnosis, sides: Iterable[str]) -> None:
+    """يسجل النسخ الموجودة أصلًا في التخزين (صورة مكررة) دون فك ترميز الأصل."""
+    from .models import Diagnosis
+
+    updates = {}
+    for side in sides:
+        keys = derivative_keys(getattr(diagnosis, f"{side}_fundus_image").name)
+        if all(is_stored(key) for key in keys.values()):
+            updates.update({derivative_field(side, kind): key for kind, key in keys.items()})
+    if updates:
+        Diagnosis.objects.filter(pk=diagnosis.pk).update(**updates)
+        for field, key in updates.items():
+            setattr(diagnosis, field, key)
+
+
+def ensure_thumbnails(diagnosis) -> None:
+    """يكمل الصور المصغرة الناقصة (للسجلات التي لم يعالجها عامل بعد أو السجلات القديمة)."""
+    missing = [side for side in SIDES if not getattr(diagnosis, derivative_field(side, THUMBNAIL))]
+    _record_stored(diagnosis, missing)
+    missing = [side for side in missing if not getattr(diagnosis, derivative_field(side, THUMBNAIL))]
+    if missing:
+        generate(diagnosis, missing)
+
+
+def inference_image(diagnosis, side: str) -> Image.Image:
+    """نسخة الاستدلال المسجلة، أو تُولد الآن (مع الصورة المصغرة) إن كانت ناقصة أو مفقودة من التخزين."""
+    if not getattr(diagnosis, derivative_field(side, INFERENCE)):
+        _record_stored(diagnosis, [side])
+    field = getattr(diagnosis, derivative_field(side, INFERENCE))
+    image = _load(field) if field else None
+    return image if image is not None else generate(diagnosis, [side])[side]
+
+
+def extra_inference_image(extra) -> Image.Image:
+    """
+    نسخة الاستدلال للقطة إضافية (DiagnosisImage): نفس المفتاح والقص المستخدمين للصورة الأساسية،
+    دون صورة مصغرة. تُولد عند أول حاجة وتُسجل على اللقطة.
+    """
+    from .models import DiagnosisImage
+
+    image = _load(extra.inference_image) if extra.inference_image else None
+    if image is not None:
+        return image
+    key = derivative_keys(extra.image.name)[INFERENCE]
+    image = _load(default_storage.open(key)) if is_stored(key) else None
+    if image is None:
+        image = _render_source(extra.image)[INFERENCE]
+        with stage("derivative_write"):
+            _write(key, image, INFERENCE)
+    DiagnosisImage.objects.filter(pk=extra.pk).update(inference_image=key)
+    extra.inference_image = key
+    return image
+
+
+def delete_for(source_name: str) -> None:
+    """يحذف النسخ المشتقة من أصل حُذف من التخزين."""
+    for key in derivative_keys(source_name).values():
+        default_storage.delete(key)
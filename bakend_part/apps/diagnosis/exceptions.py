@@ -13,3 +13,11 @@ class ModelInferenceError(DiagnosisError):
 class ModelLoadingError(DiagnosisError):
     """يحدث عند فشل تحميل النموذج (خطأ غير قابل للاسترداد)."""
     pass
+
+class ModelArtifactError(ModelLoadingError):
+    """يحدث عند تعذر سحب ملفات إصدار نماذج من المخزن أو عند اختلاف بصمة ملف عن manifest."""
+    pass
+
+class ImageQualityError(DiagnosisError):
+    """يحدث عند رفض صورة في فحص الجودة قبل الاستدلال (ضبابية، تعريض سيئ، ليست صورة قاع عين)."""
+    pass
@@ -0,0 +1,77 @@
+# apps/diagnosis/loadtest.py
+"""
+اختبار حمل لمسار التشخيص كاملًا عبر الواجهة والعمال (python manage.py load_test_diagnoses):
+الطلبات تصل بمعدل ثابت (حمل مفتوح: لا ينتظر الطلب انتهاء ما قبله)، ولكل طلب تُقاس أربع فترات:
+- enqueue: من إرسال POST حتى استلام 201 (الرفع، القبول، الحفظ، نشر المهمة في on_commit).
+- queue_wait: started_at - created_at على الخادم (الوسيط ثم انتظار عامل متاح).
+- processing: finished_at - started_at على الخادم.
+- total: من الإرسال حتى أول استعلام يرى حالة نهائية (دقته بحدود --poll-interval).
+تكرار ذلك على معدلات متزايدة يعطي منحنى الإنتاجية مقابل زمن الاستجابة لتحديد حجم مجموعات العمال.
+الأزمنة بالميلي ثانية.
+"""
+import random
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .benchmark import summarize
+
+ARRIVALS = ("poisson", "fixed")
+FINAL_STATUSES = ("SUCCESS", "FAILURE")
+METRICS = ("enqueue_ms", "queue_wait_ms", "processing_ms", "total_ms")
+
+
+def arrival_offsets(rate: float, count: int, process: str = "poisson", seed: int = 0) -> List[float]:
+    """
+    أوقات وصول count طلبًا بالثواني من بداية المستوى. poisson: فواصل أسية بمتوسط 1/rate (وصول مستقل
+    كعيادات كثيرة)، fixed: فاصل ثابت. البذرة تجعل الجدول نفسه قابلًا للتكرار بين التشغيلات.
+    """
+    if rate <= 0:
+        raise ValueError(f"Arrival rate must be positive, got {rate}.")
+    if process not in ARRIVALS:
+        raise ValueError(f"Unknown arrival process {process!r}: use one of {', '.join(ARRIVALS)}.")
+    generator = random.Random(seed)
+    offsets, now = [], 0.0
+    for _ in range(count):
+        offsets.append(now)
+        now += generator.expovariate(rate) if process == "poisson" else 1 / rate
+    return offsets
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+def _between_ms(start: Optional[datetime], end: Optional[datetime]) -> Optional[float]:
+    return (end - start).total_seconds() * 1000 if start and end else None
+
+
+def server_timings(detail: dict) -> dict:
+    """queue_wait_ms و processing_ms من طوابع السجل في استجابة GET /api/diagnoses/<id>/ (None إن لم تُسجل)."""
+    created, started, finished = (_timestamp(detail.get(key)) for key in ("created_at", "started_at", "finished_at"))
+    return {
+        "queue_wait_ms": _between_ms(created, started),
+        "processing_ms": _between_ms(started, finished),
+    }
+
+
+def summarize_level(rate: float, records: List[dict], seconds: float) -> dict:
+    """
+    يلخص مستوى واحدًا. records: لكل طلب {"outcome", والفترات المقاسة}؛ outcome هو حالة التشخيص النهائية،
+    أو رمز HTTP لطلب لم يُقبل (429 من التحكم في القبول)، أو "timeout". seconds: من أول إرسال حتى آخر نتيجة.
+    """
+    outcomes: Dict[str, int] = {}
+    for record in records:
+        outcomes[str(record["outcome"])] = outcomes.get(str(record["outcome"]), 0) + 1
+    completed = outcomes.get("SUCCESS", 0)
+    latencies = {}
+    for metric in METRICS:
+        samples = [record[metric] for record in records if record.get(metric) is not None]
+        latencies[metric] = summarize(samples) if samples else None
+    return {
+        "offered_per_second": rate,
+        "requests": len(records),
+        "outcomes": outcomes,
+        "seconds": round(seconds, 3),
+        "throughput_per_second": round(completed / seconds, 3) if seconds else 0.0,
+        "latency": latencies,
+    }
@@ -0,0 +1,169 @@
+# apps/diagnosis/management/commands/benchmark_claims.py
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from apps.diagnosis.models import Diagnosis
+from apps.diagnosis.repositories import DiagnosisRepository
+from apps.users.models import Patient
+
+
+class Command(BaseCommand):
+    """
+    يقيس معدل حجز التشخيصات (claims/second) لكل آلية حجز:
+    - redis: قفل Redis + معاملة select_for_update + فحص الحالة + حفظ (مسار process_diagnosis الحالي)
+    - skip_locked_single: UPDATE شرطي واحد لكل تشخيص
+    - skip_locked_batch: UPDATE ... FOR UPDATE SKIP LOCKED لدفعة من N تشخيص
+    ينشئ سجلات مؤقتة ويحذفها في النهاية. النتائج ذات معنى على PostgreSQL؛ SQLite لا يدعم
+    القفل على مستوى الصف ويتسلسل مع أكثر من عامل واحد.
+    """
+    help = "Benchmark diagnosis work-claiming throughput (Redis lock vs. SKIP LOCKED)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=500, help="Number of PENDING rows to claim per run.")
+        parser.add_argument("--workers", type=int, default=1, help="Concurrent claiming threads.")
+        parser.add_argument("--batch-size", type=int, default=8, help="Batch size for skip_locked_batch.")
+        parser.add_argument(
+            "--paths", nargs="+", default=["redis", "skip_locked_single", "skip_locked_batch"],
+            choices=["redis", "skip_locked_single", "skip_locked_batch"],
+        )
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        rows, workers = options["rows"], options["workers"]
+        physician = get_user_model().objects.create_user(username=f"bench-{uuid.uuid4().hex[:12]}")
+        patient = Patient.objects.create(full_name="Claim Benchmark", gender=Patient.Gender.OTHER)
+        diagnosis_ids = self._create_rows(patient, physician, rows)
+
+        results = []
+        try:
+            for path in options["paths"]:
+                self._reset_rows(diagnosis_ids)
+                claim = self._make_claimer(path, options["batch_size"])
+                if claim is None:
+                    self.stderr.write(f"Skipping '{path}': Redis at {settings.CELERY_BROKER_URL} is unreachable.")
+                    continue
+                elapsed, claimed = self._run(claim, diagnosis_ids, workers)
+                results.append({
+                    "path": path,
+                    "workers": workers,
+                    "rows": rows,
+                    "claimed": claimed,
+                    "seconds": round(elapsed, 4),
+                    "claims_per_second": round(claimed / elapsed, 1) if elapsed else None,
+                })
+        finally:
+            Diagnosis.objects.filter(id__in=diagnosis_ids).delete()
+            patient.delete()
+            physician.delete()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'path':<20}{'workers':>8}{'claimed':>9}{'seconds':>10}{'claims/s':>11}")
+        for r in results:
+            self.stdout.write(
+                f"{r['path']:<20}{r['workers']:>8}{r['claimed']:>9}{r['seconds']:>10}{r['claims_per_second']:>11}"
+            )
+
+    def _create_rows(self, patient, physician, rows):
+        diagnoses = [
+            Diagnosis(patient=patient, physician=physician,
+                      left_fundus_image="benchmark/left.png", right_fundus_image="benchmark/right.png")
+            for _ in range(rows)
+        ]
+        Diagnosis.objects.bulk_create(diagnoses)
+        return [d.id for d in diagnoses]
+
+    def _reset_rows(self, diagnosis_ids):
+        Diagnosis.objects.filter(id__in=diagnosis_ids).update(
+            status=Diagnosis.Status.PENDING, worker_id=None, started_at=None
+        )
+
+    def _make_claimer(self, path, batch_size):
+        """
+        يعيد دالة claim(pending_ids, worker_id) تعيد عدد السجلات المحجوزة، أو None عند نفاد العمل.
+        يعيد None بدل الدالة إن تعذر تشغيل المسار (Redis غير متاح).
+        """
+        repo = DiagnosisRepository()
+
+        if path == "skip_locked_batch":
+            # يحجز من الجدول مباشرة دون الحاجة إلى معرفات مسبقة
+            def claim(pending_ids, worker_id):
+                return len(repo.claim_pending(batch_size, worker_id)) or None
+            return claim
+
+        if path == "skip_locked_single":
+            def claim(pending_ids, worker_id):
+                diagnosis_id = _pop(pending_ids)
+                if diagnosis_id is None:
+                    return None
+                return 1 if repo.claim_one(diagnosis_id, worker_id) else 0
+            return claim
+
+        from redis import Redis
+        from redis.exceptions import ConnectionError as RedisConnectionError
+        redis_client = Redis.from_url(settings.CELERY_BROKER_URL)
+        try:
+            redis_client.ping()
+        except RedisConnectionError:
+            return None
+
+        def claim(pending_ids, worker_id):
+            diagnosis_id = _pop(pending_ids)
+            if diagnosis_id is None:
+                return None
+            lock = redis_client.lock(f"lock:diagnosis:{diagnosis_id}", timeout=660)
+            if not lock.acquire(blocking=False):
+                return 0
+            try:
+                with transaction.atomic():
+                    diagnosis = Diagnosis.objects.select_for_update().get(id=diagnosis_id)
+                    if diagnosis.status in [Diagnosis.Status.SUCCESS, Diagnosis.Status.FAILURE, Diagnosis.Status.RUNNING]:
+                        return 0
+                    diagnosis.status = Diagnosis.Status.RUNNING
+                    diagnosis.worker_id = worker_id
+                    diagnosis.started_at = timezone.now()
+                    diagnosis.save()
+                return 1
+            finally:
+                lock.release()
+        return claim
+
+    def _run(self, claim, diagnosis_ids, workers):
+        pending_ids = list(diagnosis_ids)
+        counts = [0] * workers
+
+        def worker(index):
+            worker_id = f"benchmark-{index}"
+            try:
+                while True:
+                    claimed = claim(pending_ids, worker_id)
+                    if claimed is None:
+                        break
+                    counts[index] += claimed
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start, sum(counts)
+
+
+def _pop(pending_ids):
+    """list.pop ذري في CPython، لذا يكفي لتوزيع المعرفات بين الخيوط."""
+    try:
+        return pending_ids.pop()
+    except IndexError:
+        return None
@@ -0,0 +1,101 @@
+# apps/diagnosis/management/commands/benchmark_pipeline.py
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis import benchmark, parity
+from apps.diagnosis.exceptions import ModelLoadingError
+
+
+class Command(BaseCommand):
+    """
+    يقيس أداء DiagnosisService على نماذج بديلة بمعمارية التدريب وأوزان عشوائية (apps.diagnosis.benchmark):
+    زمن كل مرحلة، ثم زمن التشخيص الكامل والإنتاجية عند كل تزامن. النتائج تُكتب JSON، و --compare يطبع
+    الفرق عن تشغيل سابق؛ قارن فقط نتائج نفس الجهاز ونفس --backbone.
+    """
+    help = "Benchmark DiagnosisService per stage and end to end on stand-in models with random weights."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", default=str(settings.AI_MODELS_BASE_DIR / "stand_ins"),
+                            help="Model directory; missing files are built as stand-ins (default: ai_models/stand_ins).")
+        parser.add_argument("--backbone", default="ResNet50", help="tf.keras.applications backbone for the stand-ins.")
+        parser.add_argument("--image", help="Fundus JPEG to run (default: a synthetic 1600x1200 image).")
+        parser.add_argument("--repeats", type=int, default=20, help="Timed calls per stage.")
+        parser.add_argument("--requests", type=int, default=16, help="Diagnoses per end-to-end measurement.")
+        parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4], help="Concurrency levels.")
+        parser.add_argument("--modes", nargs="*", default=list(benchmark.MODES), choices=benchmark.MODES)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="Earlier --output file to compare against.")
+
+    def handle(self, *args, **options):
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)
+
+        with tempfile.TemporaryDirectory() as scratch:
+            image_path = options["image"] or parity.golden_images(scratch, 1)[0]
+            results = self._measure(image_path, options)
+
+        self._print(results, previous)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}.")
+
+    def _measure(self, image_path: str, options: dict) -> dict:
+        from apps.diagnosis.ai_pipeline.service import DiagnosisService
+
+        existing = os.path.isdir(options["models"]) and os.listdir(options["models"])
+        self.stdout.write(f"{'Using' if existing else 'Building'} stand-in models in {options['models']}...")
+        try:
+            paths = benchmark.stand_in_models(options["models"], options["backbone"])
+            service = DiagnosisService(paths)
+        except (FileNotFoundError, ModelLoadingError) as e:
+            raise CommandError(str(e))
+
+        results = {
+            "created_at": timezone.now().isoformat(),
+            "environment": benchmark.environment(),
+            "backbone": options["backbone"],
+            "image": os.path.basename(image_path),
+        }
+        # Keras يطبع شريط تقدم لكل predict في run_diagnosis
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["stages"] = benchmark.stage_timings(service, image_path, options["repeats"])
+            image = benchmark.inference_array(image_path)
+            service.warm_up()
+            service.run_diagnosis(image, image, benchmark.DEMOGRAPHICS)
+            results["end_to_end"] = [
+                benchmark.end_to_end(service, image, mode, concurrency, options["requests"])
+                for mode in options["modes"] for concurrency in options["concurrency"]
+            ]
+        return results
+
+    def _print(self, results: dict, previous=None) -> None:
+        old_stages = (previous or {}).get("stages", {})
+        self.stdout.write(f"{'stage':<48}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'vs p50':>10}")
+        for stage, timing in results["stages"].items():
+            change = self._change(timing["p50"], old_stages.get(stage, {}).get("p50"))
+            self.stdout.write(f"{stage:<48}{timing['p50']:>10.2f}{timing['p95']:>10.2f}{timing['p99']:>10.2f}{change:>10}")
+
+        old_runs = {(r["mode"], r["concurrency"]): r for r in (previous or {}).get("end_to_end", [])}
+        self.stdout.write(f"{'mode':<10}{'conc':>6}{'per s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'vs per s':>10}")
+        for run in results["end_to_end"]:
+            old = old_runs.get((run["mode"], run["concurrency"]), {}).get("throughput_per_second")
+            latency = run["latency_ms"]
+            self.stdout.write(
+                f"{run['mode']:<10}{run['concurrency']:>6}{run['throughput_per_second']:>9.2f}"
+                f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+                f"{self._change(run['throughput_per_second'], old):>10}"
+            )
+
+    @staticmethod
+    def _change(value, old) -> str:
+        return f"{(value - old) / old:+.0%}" if old else ""
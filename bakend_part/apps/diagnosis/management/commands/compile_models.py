@@ -0,0 +1,168 @@
+# apps/diagnosis/management/commands/compile_models.py
+import json
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis import artifacts
+from apps.diagnosis.ai_pipeline import config
+from apps.diagnosis.exceptions import ModelArtifactError
+
+VARIANTS = ("tflite", "tflite_fp16", "tflite_int8")
+
+
+class Command(BaseCommand):
+    """
+    يمرر كل نماذج الخدمة (متعدد الفئات، الخبراء الستة، الجدولي) عبر خط تجميع: حذف طبقات التدريب فقط،
+    دمج BatchNormalization في الطبقة السابقة، توقيع إدخال ثابت، ونسخ اختيارية (XLA، TFLite، مكممة).
+    كل نسخة تُقاس (الحجم، زمن التحميل، زمن الاستدلال) وتُقارن مخرجاتها بالنموذج المصدر على مدخلات ثابتة،
+    وتُكتب النتائج في compile_manifest.json. ملفات .keras المجمعة تحمل نفس الأسماء فتصلح إصدارًا مباشرة،
+    و --publish ينشرها ModelVersion جديدًا فقط إذا اجتازت كل النسخ التحقق.
+    """
+    help = "Compile the serving models (strip, fold BatchNorm, optional XLA/TFLite), verify them and write a manifest."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", help="Directory with the trained models (default: the paths in settings).")
+        parser.add_argument("--output", required=True, help="Directory for the compiled models and compile_manifest.json.")
+        parser.add_argument("--variants", nargs="*", default=[], choices=VARIANTS, help="TFLite variants to build.")
+        parser.add_argument("--xla", action="store_true", help="Also verify and benchmark the XLA-compiled model.")
+        parser.add_argument("--samples", type=int, default=8, help="Verification inputs per model (also the batch size timed).")
+        parser.add_argument("--repeats", type=int, default=5, help="Timed calls per latency measurement.")
+        parser.add_argument("--tolerance", nargs="*", default=[], metavar="VARIANT=ATOL", help="Override a variant's tolerance.")
+        parser.add_argument("--publish", action="store_true", help="Publish the compiled models as a new ModelVersion.")
+        parser.add_argument("--name", default="pipeline", help="ModelVersion name for --publish.")
+        parser.add_argument("--label", help="ModelVersion version for --publish.")
+        parser.add_argument("--activate", action="store_true", help="Mark the published version active.")
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        from apps.diagnosis.ai_pipeline.models.optimization import COMPILE_MANIFEST
+
+        tolerances = self._tolerances(options["tolerance"])
+        if options["publish"] and not (options["label"] and artifacts.enabled()):
+            raise CommandError("--publish needs --label and DIAGNOSIS_MODEL_ARTIFACTS_BACKEND.")
+        os.makedirs(os.path.join(options["output"], "variants"), exist_ok=True)
+
+        manifest = {
+            "created_at": timezone.now().isoformat(),
+            "tensorflow": tf.__version__,
+            "source": options["source"] or "settings",
+            "samples": options["samples"],
+            "models": {},
+        }
+        for filename, path in self._sources(options["source"]):
+            self.stdout.write(f"{filename} ({path})")
+            manifest["models"][filename] = self._compile(path, filename, options, tolerances)
+            tf.keras.backend.clear_session()
+
+        failures = [
+            f"{filename}:{variant}"
+            for filename, entry in manifest["models"].items()
+            for variant, result in entry["variants"].items() if not result["verified"]
+        ]
+        manifest["verified"] = not failures
+        manifest_path = os.path.join(options["output"], COMPILE_MANIFEST)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        self.stdout.write(f"Wrote {manifest_path}.")
+
+        if failures:
+            raise CommandError(f"Verification failed for {', '.join(failures)}; nothing was published.")
+        if options["publish"]:
+            try:
+                model_version = artifacts.publish_version(
+                    options["output"], options["name"], options["label"], options["activate"]
+                )
+            except ModelArtifactError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Published {model_version} (id {model_version.pk})."))
+
+    @staticmethod
+    def _tolerances(overrides) -> dict:
+        from apps.diagnosis.ai_pipeline.models.optimization import VARIANT_TOLERANCES
+
+        tolerances = dict(VARIANT_TOLERANCES)
+        for item in overrides:
+            variant, _, value = item.partition("=")
+            if variant not in tolerances or not value:
+                raise CommandError(f"Bad --tolerance {item!r}: use one of {', '.join(tolerances)}=ATOL.")
+            tolerances[variant] = float(value)
+        return tolerances
+
+    @staticmethod
+    def _sources(source_dir):
+        """(اسم الملف في الإصدار، مسار المصدر) لكل نموذج مختلف؛ يقبل نسخة .h5 قديمة بنفس الاسم في --source."""
+        paths = config.model_paths(source_dir)
+        seen = {}
+        for path in [paths["multi_class"], *paths["experts"], paths["tabular"]]:
+            filename = os.path.basename(str(path))
+            legacy = os.path.splitext(str(path))[0] + ".h5"
+            if filename not in seen:
+                seen[filename] = legacy if not os.path.exists(path) and os.path.exists(legacy) else str(path)
+        if missing := [path for path in seen.values() if not os.path.exists(path)]:
+            raise CommandError(f"Missing source models: {', '.join(missing)}")
+        return list(seen.items())
+
+    def _compile(self, path: str, filename: str, options: dict, tolerances: dict) -> dict:
+        import tensorflow as tf
+
+        from apps.diagnosis.ai_pipeline.models import optimization
+        from apps.diagnosis.ai_pipeline.models.classifier import ModelLoaderFactory, TFLiteModel
+
+        started = time.perf_counter()
+        source = ModelLoaderFactory.get_loader(path.split(".")[-1])(path)
+        entry = {"source": {"file": path, "bytes": os.path.getsize(path), "load_seconds": round(time.perf_counter() - started, 3)}}
+        inputs = optimization.sample_inputs(source, options["samples"])
+        expected = source.predict_on_batch(inputs)
+        entry["source"]["latency_ms"] = self._latency(source.predict_on_batch, inputs, options["repeats"])
+
+        optimized, counts = optimization.strip_and_fold(source)
+        entry.update(counts)
+        target = os.path.join(options["output"], filename)
+        optimized.save(target)
+        stem = os.path.splitext(filename)[0]
+
+        builders = {"keras": (target, lambda: tf.keras.models.load_model(target))}
+        if options["xla"]:
+            builders["xla"] = (None, lambda: optimization.xla_predict(tf.keras.models.load_model(target)))
+        for variant in options["variants"]:
+            variant_path = os.path.join(options["output"], "variants", f"{stem}.{variant}.tflite")
+            with open(variant_path, "wb") as f:
+                f.write(optimization.to_tflite(optimized, optimization.TFLITE_QUANTIZATION[variant]))
+            builders[variant] = (variant_path, lambda p=variant_path: TFLiteModel(p))
+
+        entry["variants"] = {}
+        for variant, (variant_path, build) in builders.items():
+            started = time.perf_counter()
+            model = build()
+            load_seconds = time.perf_counter() - started
+            predict = model if callable(model) and not hasattr(model, "predict_on_batch") else model.predict_on_batch
+            diff = float(np.max(np.abs(np.asarray(predict(inputs)) - expected)))
+            result = {
+                "file": os.path.relpath(variant_path, options["output"]) if variant_path else None,
+                "bytes": os.path.getsize(variant_path) if variant_path else None,
+                "load_seconds": round(load_seconds, 3),
+                "latency_ms": self._latency(predict, inputs, options["repeats"]),
+                "max_abs_diff": diff,
+                "tolerance": tolerances[variant],
+                "verified": diff <= tolerances[variant],
+            }
+            entry["variants"][variant] = result
+            self.stdout.write(
+                f"  {variant:<12} max|diff| {diff:.2e} (<= {tolerances[variant]:g}: {'ok' if result['verified'] else 'FAIL'}), "
+                f"{result['latency_ms']['batch_1']:.1f} ms/batch of 1 vs {entry['source']['latency_ms']['batch_1']:.1f} ms source"
+            )
+        return entry
+
+    @staticmethod
+    def _latency(predict, inputs, repeats: int) -> dict:
+        from apps.diagnosis.ai_pipeline.models.optimization import latency_ms
+
+        return {
+            "batch_1": round(latency_ms(predict, inputs[:1], repeats), 3),
+            f"batch_{len(inputs)}": round(latency_ms(predict, inputs, repeats), 3),
+        }
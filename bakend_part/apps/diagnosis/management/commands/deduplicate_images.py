@@ -0,0 +1,49 @@
+# apps/diagnosis/management/commands/deduplicate_images.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apps.diagnosis.content_store import CAS_PREFIX, adopt
+from apps.diagnosis.models import Diagnosis, StoredImage
+
+
+class Command(BaseCommand):
+    """
+    ينقل صور التشخيصات المخزنة بالتخطيط القديم (diagnoses/images/%Y/%m/%d/) إلى التخزين بعنوان المحتوى.
+    الصور المكررة تُحذف ويشير التشخيص إلى النسخة الوحيدة. آمن لإعادة التشغيل: الصور المنقولة تُتخطى.
+    """
+    help = "Move legacy diagnosis images into content-addressed storage, removing duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Maximum number of diagnoses to process.")
+
+    def handle(self, *args, **options):
+        legacy = Diagnosis.objects.filter(
+            ~Q(left_fundus_image__startswith=CAS_PREFIX) | ~Q(right_fundus_image__startswith=CAS_PREFIX)
+        ).only("id", "left_fundus_image", "right_fundus_image").order_by("created_at")
+        if options["limit"]:
+            legacy = legacy[:options["limit"]]
+
+        moved = missing = 0
+        for diagnosis in legacy.iterator():
+            updates = {}
+            # المراجع الجديدة وتحديث التشخيص معًا؛ الملفات القديمة تُحذف بعد COMMIT
+            with transaction.atomic():
+                for field in ("left_fundus_image", "right_fundus_image"):
+                    name = getattr(diagnosis, field).name
+                    if name.startswith(CAS_PREFIX):
+                        continue
+                    try:
+                        updates[field] = adopt(name)
+                    except FileNotFoundError:
+                        missing += 1
+                        self.stderr.write(f"Diagnosis {diagnosis.id}: '{name}' is missing from storage.")
+                if updates:
+                    Diagnosis.objects.filter(id=diagnosis.id).update(**updates)
+                    moved += len(updates)
+
+        bytes_stored = sum(StoredImage.objects.values_list("size", flat=True))
+        self.stdout.write(
+            f"Moved {moved} images ({missing} missing). "
+            f"{StoredImage.objects.count()} unique images, {bytes_stored} bytes stored."
+        )
@@ -0,0 +1,219 @@
+# apps/diagnosis/management/commands/load_test_diagnoses.py
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis import loadtest, parity
+
+
+class Command(BaseCommand):
+    """
+    اختبار حمل لمسار التشخيص كاملًا (الواجهة، الوسيط، عمال Celery) ضد خادم يعمل فعليًا (apps.diagnosis.loadtest).
+    ينشئ مرضى عبر الواجهة، ثم يرسل لكل معدل في --rates عدد --requests زوج صور بوصول Poisson (أو ثابت)،
+    ويستعلم عن كل تشخيص حتى ينتهي. الناتج منحنى الإنتاجية مقابل زمن الانتظار والمعالجة لكل معدل.
+
+    مكدس محلي دون Redis ولا أوزان حقيقية (انظر eye2_project/settings/loadtest.py و README):
+      DJANGO_SETTINGS_MODULE=eye2_project.settings.loadtest python manage.py runserver --noreload
+      DJANGO_SETTINGS_MODULE=eye2_project.settings.loadtest celery -A eye2_project worker -Q diagnosis_interactive -c 2
+    --prepare ينشئ مجلدات هذا المكدس (LOAD_TEST_DIR ومجلدات وسيط filesystem) قبل migrate وتشغيله.
+    """
+    help = "Load-test diagnosis creation through to completion against a running server and its workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--path", default="/api/diagnoses/", help="Create endpoint; <path><id>/ is polled.")
+        parser.add_argument("--token", default=os.environ.get("LOAD_TEST_TOKEN"), help="JWT access token.")
+        parser.add_argument("--username", help="Obtain the token with these credentials instead of --token.")
+        parser.add_argument("--password", default=os.environ.get("LOAD_TEST_PASSWORD"))
+        parser.add_argument("--patients", type=int, default=4, help="Patients to create; requests cycle through them.")
+        parser.add_argument("--clinic-id", help="Clinic for the new patients (default: create one).")
+        parser.add_argument("--image", help="Fundus image sent for both eyes (default: a synthetic 1600x1200 JPEG).")
+        parser.add_argument("--rates", type=float, nargs="+", default=[0.1, 0.2, 0.4],
+                            help="Arrival rates to measure, in diagnoses per second.")
+        parser.add_argument("--requests", type=int, default=20, help="Diagnoses sent per rate.")
+        parser.add_argument("--arrivals", default="poisson", choices=loadtest.ARRIVALS)
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the arrival schedule.")
+        parser.add_argument("--priority", default="SAME_DAY")
+        parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between status polls.")
+        parser.add_argument("--timeout", type=float, default=600.0, help="Seconds before a diagnosis counts as timed out.")
+        parser.add_argument("--no-warm-up", action="store_true",
+                            help="Skip the uncounted first diagnosis (it includes the workers' model loading).")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--prepare", action="store_true",
+                            help="Create the local stack's folders (settings.loadtest: LOAD_TEST_DIR, broker) and exit.")
+
+    def handle(self, *args, **options):
+        if options["prepare"]:
+            self._prepare()
+            return
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError("httpx is required for the load test (pip install httpx).")
+        if not options["token"] and not (options["username"] and options["password"]):
+            raise CommandError("Provide --token (or LOAD_TEST_TOKEN), or --username and --password.")
+        self.httpx = httpx
+
+        with tempfile.TemporaryDirectory() as scratch:
+            image_path = options["image"] or parity.golden_images(scratch, 1)[0]
+            with open(image_path, "rb") as f:
+                image = (os.path.basename(image_path), f.read())
+
+        try:
+            results = asyncio.run(self._run(httpx, image, options))
+        except httpx.HTTPError as e:
+            raise CommandError(f"Load test setup failed: {e}")
+
+        self._print(results)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}.")
+
+    def _prepare(self) -> None:
+        if not getattr(settings, "LOAD_TEST_DIR", None):
+            raise CommandError("--prepare needs DJANGO_SETTINGS_MODULE=eye2_project.settings.loadtest.")
+        transport = getattr(settings, "CELERY_BROKER_TRANSPORT_OPTIONS", {})
+        folders = [settings.LOAD_TEST_DIR, settings.MEDIA_ROOT]
+        folders += [transport[key] for key in ("data_folder_in", "data_folder_out", "processed_folder") if key in transport]
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+        self.stdout.write(f"Prepared {settings.LOAD_TEST_DIR}; run migrate next.")
+
+    async def _run(self, httpx, image, options) -> dict:
+        base_url = options["base_url"].rstrip("/")
+        async with httpx.AsyncClient(base_url=base_url, timeout=options["timeout"]) as client:
+            self._auth_lock = asyncio.Lock()
+            if options["token"]:
+                client.headers["Authorization"] = f"Bearer {options['token']}"
+            else:
+                await self._authenticate(client, options)
+            patients = await self._create_patients(client, options)
+            if not options["no_warm_up"]:
+                warm_up = await self._diagnose(client, time.perf_counter(), patients[0], image, options)
+                self.stdout.write(f"Warm-up diagnosis: {warm_up['outcome']}.")
+
+            levels = []
+            for index, rate in enumerate(options["rates"]):
+                self.stdout.write(f"Sending {options['requests']} diagnoses at {rate:g}/s...")
+                levels.append(await self._level(client, rate, options["seed"] + index, patients, image, options))
+
+        return {
+            "created_at": timezone.now().isoformat(),
+            "base_url": base_url,
+            "path": options["path"],
+            "arrivals": options["arrivals"],
+            "priority": options["priority"],
+            "poll_interval": options["poll_interval"],
+            "levels": levels,
+        }
+
+    @staticmethod
+    async def _authenticate(client, options) -> None:
+        response = await client.post(
+            "/api/users/auth/token/", json={"username": options["username"], "password": options["password"]}
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access']}"
+
+    async def _send(self, client, method, url, options, **kwargs):
+        """
+        طلب يعيد تسجيل الدخول مرة عند 401/403 إن أُعطيت بيانات الدخول: توكن الوصول ينتهي (5 دقائق افتراضيًا
+        في simplejwt) قبل أن ينتهي تشغيل طويل. أول طلب يفشل يجدد التوكن، والبقية يعيدون الإرسال به.
+        """
+        used = client.headers.get("Authorization")
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in (401, 403) or not options["username"]:
+            return response
+        async with self._auth_lock:
+            if client.headers.get("Authorization") == used:
+                await self._authenticate(client, options)
+        return await client.request(method, url, **kwargs)
+
+    @staticmethod
+    async def _create_patients(client, options) -> list:
+        clinic_id = options["clinic_id"]
+        if not clinic_id:
+            response = await client.post("/api/users/users/clinics/", json={"name": "Load test clinic"})
+            response.raise_for_status()
+            clinic_id = response.json()["id"]
+        patients = []
+        for number in range(options["patients"]):
+            response = await client.post("/api/users/users/patients/", json={
+                "full_name": f"Load test patient {number + 1}",
+                "date_of_birth": "1964-01-01",
+                "gender": "FEMALE" if number % 2 else "MALE",
+                "clinic_id": clinic_id,
+            })
+            response.raise_for_status()
+            patients.append(response.json()["id"])
+        return patients
+
+    async def _level(self, client, rate, seed, patients, image, options) -> dict:
+        offsets = loadtest.arrival_offsets(rate, options["requests"], options["arrivals"], seed)
+        started = time.perf_counter()
+        records = await asyncio.gather(*(
+            self._diagnose(client, started + offset, patients[number % len(patients)], image, options)
+            for number, offset in enumerate(offsets)
+        ))
+        return loadtest.summarize_level(rate, records, max(record["ended"] for record in records) - started)
+
+    async def _diagnose(self, client, send_at, patient_id, image, options) -> dict:
+        """يرسل تشخيصًا في موعده (حمل مفتوح: لا ينتظر ما قبله)، ثم يستعلم عنه حتى حالة نهائية أو المهلة."""
+        await asyncio.sleep(max(0.0, send_at - time.perf_counter()))
+        sent = time.perf_counter()
+        files = {side: image for side in ("left_fundus_image", "right_fundus_image")}
+        data = {"patient_id": patient_id, "priority": options["priority"]}
+        try:
+            response = await self._send(client, "POST", options["path"], options, data=data, files=files)
+        except self.httpx.HTTPError as e:  # خطأ اتصال أو مهلة يُسجل نتيجةً ولا يوقف بقية الطلبات
+            return {"outcome": type(e).__name__, "ended": time.perf_counter()}
+        record = {"enqueue_ms": (time.perf_counter() - sent) * 1000}
+        if response.status_code != 201:
+            return {**record, "outcome": response.status_code, "ended": time.perf_counter()}
+
+        detail_url = f"{options['path']}{response.json()['id']}/"
+        while time.perf_counter() - sent < options["timeout"]:
+            await asyncio.sleep(options["poll_interval"])
+            try:
+                response = await self._send(client, "GET", detail_url, options)
+                detail = response.json()
+            except (self.httpx.HTTPError, ValueError):
+                continue
+            if 400 <= response.status_code < 500:
+                return {**record, "outcome": response.status_code, "ended": time.perf_counter()}
+            if detail.get("status") in loadtest.FINAL_STATUSES:
+                ended = time.perf_counter()
+                return {
+                    **record,
+                    **loadtest.server_timings(detail),
+                    "total_ms": (ended - sent) * 1000,
+                    "outcome": detail["status"],
+                    "ended": ended,
+                }
+        return {**record, "outcome": "timeout", "ended": time.perf_counter()}
+
+    def _print(self, results: dict) -> None:
+        self.stdout.write(
+            f"{'offered/s':>10}{'done/s':>9}{'outcomes':>24}{'enqueue p50':>13}{'wait p50':>10}{'wait p95':>10}"
+            f"{'proc p50':>10}{'total p50':>11}{'total p95':>11}{'total p99':>11}"
+        )
+        for level in results["levels"]:
+            latency = level["latency"]
+
+            def seconds(metric, pct):
+                return f"{latency[metric][pct] / 1000:.2f}s" if latency[metric] else "-"
+
+            outcomes = " ".join(f"{outcome}={count}" for outcome, count in sorted(level["outcomes"].items()))
+            self.stdout.write(
+                f"{level['offered_per_second']:>10g}{level['throughput_per_second']:>9.3f}{outcomes:>24}"
+                f"{seconds('enqueue_ms', 'p50'):>13}{seconds('queue_wait_ms', 'p50'):>10}{seconds('queue_wait_ms', 'p95'):>10}"
+                f"{seconds('processing_ms', 'p50'):>10}{seconds('total_ms', 'p50'):>11}{seconds('total_ms', 'p95'):>11}"
+                f"{seconds('total_ms', 'p99'):>11}"
+            )
@@ -0,0 +1,157 @@
+# apps/diagnosis/management/commands/load_test_uploads.py
+import asyncio
+import io
+import json
+import os
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+
+class Command(BaseCommand):
+    """
+    اختبار حمل لرفع التشخيصات المتزامن ضد خادم يعمل فعليًا.
+    يحاكي اتصالات الهاتف البطيئة بتقييد سرعة إرسال جسم الطلب لكل اتصال، ويقيس أثناء ذلك
+    زمن استجابة نقطة الفحص الصحي لمعرفة هل ما زال الخادم يخدم بقية الطلبات.
+
+    للمقارنة شغّل الخادم بالطريقتين ووجّه الاختبار إلى المسار المناسب:
+      gunicorn eye2_project.wsgi:application -w 4                                 --path /api/diagnoses/
+      gunicorn eye2_project.asgi:application -w 4 -k uvicorn.workers.UvicornWorker --path /api/async/diagnoses/
+    """
+    help = "Load-test concurrent slow diagnosis uploads against a running server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--path", default="/api/async/diagnoses/", help="Create endpoint to exercise.")
+        parser.add_argument("--token", default=os.environ.get("LOAD_TEST_TOKEN"), help="JWT access token.")
+        parser.add_argument("--patient-id", required=True, help="Patient the test user is assigned to.")
+        parser.add_argument("--concurrency", type=int, default=32, help="Simultaneous uploads in flight.")
+        parser.add_argument("--uploads", type=int, default=64, help="Total uploads to send.")
+        parser.add_argument("--image-kb", type=int, default=1024, help="Approximate size of each fundus image.")
+        parser.add_argument("--upload-kbps", type=int, default=512, help="Per-connection upload rate (0 = unthrottled).")
+        parser.add_argument("--priority", default="BULK")
+        parser.add_argument("--health-path", default="/api/health/")
+        parser.add_argument("--timeout", type=float, default=300.0)
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError("httpx is required for the load test (pip install httpx).")
+        if not options["token"]:
+            raise CommandError("Provide a JWT access token with --token or LOAD_TEST_TOKEN.")
+
+        image = _noise_png(options["image_kb"])
+        results = asyncio.run(self._run(httpx, image, options))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for key, value in results.items():
+            self.stdout.write(f"{key:<28}{value}")
+
+    async def _run(self, httpx, image, options):
+        url = options["base_url"].rstrip("/") + options["path"]
+        headers = {"Authorization": f"Bearer {options['token']}"}
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        limits = httpx.Limits(max_connections=options["concurrency"] + 1)
+        latencies, statuses, probes = [], {}, []
+        done = asyncio.Event()
+
+        async with httpx.AsyncClient(timeout=options["timeout"], limits=limits) as client:
+            async def upload():
+                async with semaphore:
+                    boundary = uuid.uuid4().hex
+                    body = _multipart(boundary, options["patient_id"], options["priority"], image)
+                    # Content-Length صريح كما يرسله تطبيق الهاتف؛ بدونه يرسل httpx الجسم مجزأً (chunked)
+                    request_headers = {
+                        **headers,
+                        "Content-Type": f"multipart/form-data; boundary={boundary}",
+                        "Content-Length": str(len(body)),
+                    }
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post(
+                            url, headers=request_headers, content=_throttled(body, options["upload_kbps"]),
+                        )
+                        status = response.status_code
+                    except httpx.HTTPError as e:
+                        status = type(e).__name__
+                    latencies.append(time.perf_counter() - start)
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+            async def probe():
+                # طلب خفيف كل 250ms: زمنه يكشف هل الرفع البطيء يحجز عمال الخادم
+                health_url = options["base_url"].rstrip("/") + options["health_path"]
+                while not done.is_set():
+                    start = time.perf_counter()
+                    try:
+                        await client.get(health_url)
+                        probes.append(time.perf_counter() - start)
+                    except httpx.HTTPError:
+                        probes.append(float("inf"))
+                    await asyncio.sleep(0.25)
+
+            probe_task = asyncio.create_task(probe())
+            start = time.perf_counter()
+            await asyncio.gather(*(upload() for _ in range(options["uploads"])))
+            elapsed = time.perf_counter() - start
+            done.set()
+            await probe_task
+
+        return {
+            "endpoint": url,
+            "uploads": options["uploads"],
+            "concurrency": options["concurrency"],
+            "upload_kbps": options["upload_kbps"],
+            "statuses": statuses,
+            "wall_seconds": round(elapsed, 2),
+            "uploads_per_second": round(options["uploads"] / elapsed, 2),
+            "upload_p50_seconds": _percentile(latencies, 50),
+            "upload_p95_seconds": _percentile(latencies, 95),
+            "health_p50_seconds": _percentile(probes, 50),
+            "health_p95_seconds": _percentile(probes, 95),
+        }
+
+
+def _noise_png(size_kb):
+    """صورة PNG عشوائية (غير قابلة للضغط) بحجم تقريبي size_kb."""
+    side = max(8, int((size_kb * 1024 / 3) ** 0.5))
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(buffer, format="PNG", compress_level=0)
+    return buffer.getvalue()
+
+
+def _multipart(boundary, patient_id, priority, image):
+    parts = []
+    for name, value in (("patient_id", patient_id), ("priority", priority)):
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name in ("left_fundus_image", "right_fundus_image"):
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.png"\r\n'
+            f'Content-Type: image/png\r\n\r\n'.encode() + image + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts)
+
+
+async def _throttled(body, kbps, chunk_size=16 * 1024):
+    """يرسل الجسم على دفعات بسرعة لا تتجاوز kbps كيلوبايت/ثانية."""
+    delay = chunk_size / (kbps * 1024) if kbps else 0
+    for offset in range(0, len(body), chunk_size):
+        yield body[offset:offset + chunk_size]
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _percentile(values, pct):
+    values = sorted(v for v in values if v != float("inf"))
+    if not values:
+        return None
+    if len(values) == 1:
+        return round(values[0], 3)
+    return round(statistics.quantiles(values, n=100, method="inclusive")[pct - 1], 3)
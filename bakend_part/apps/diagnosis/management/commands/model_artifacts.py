@@ -0,0 +1,58 @@
+# apps/diagnosis/management/commands/model_artifacts.py
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.diagnosis import artifacts
+from apps.diagnosis.exceptions import ModelArtifactError
+from apps.diagnosis.models import ModelVersion
+from apps.diagnosis.rescoring import current_model_version
+
+
+class Command(BaseCommand):
+    """
+    ينشر ملفات إصدار نماذج في مخزن DIAGNOSIS_MODEL_ARTIFACTS وينشئ له ModelVersion، أو يسحب ملفات
+    إصدار إلى ذاكرة العقدة مسبقًا (مثلًا عند إقلاع حاوية العامل قبل أول مهمة).
+    """
+    help = "Publish model files to the artifact store, or pre-fetch a ModelVersion into this node's cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--publish", metavar="DIR", help="Directory holding the model files (same names as ai_models/).")
+        parser.add_argument("--name", default="pipeline", help="ModelVersion name for --publish.")
+        parser.add_argument("--label", help="ModelVersion version for --publish (e.g. 2 or 2024.06).")
+        parser.add_argument("--activate", action="store_true", help="Mark the published version active.")
+        parser.add_argument("--fetch", action="store_true", help="Pull a version's files into the node-local cache.")
+        parser.add_argument("--model-version", type=int, help="ModelVersion id for --fetch (default: the active one).")
+
+    def handle(self, *args, **options):
+        if not artifacts.enabled():
+            raise CommandError("Set DIAGNOSIS_MODEL_ARTIFACTS_BACKEND to 'filesystem' or 's3' first.")
+        try:
+            if options["publish"]:
+                self._publish(options)
+            elif options["fetch"]:
+                self._fetch(options)
+            else:
+                raise CommandError("Pass --publish DIR --label V, or --fetch.")
+        except ModelArtifactError as e:
+            raise CommandError(str(e))
+
+    def _publish(self, options):
+        if not options["label"]:
+            raise CommandError("--publish needs --label.")
+        model_version = artifacts.publish_version(
+            options["publish"], options["name"], options["label"], options["activate"]
+        )
+        files = artifacts.read_manifest(model_version.file_path)
+        total = sum(entry["size"] for entry in files.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Published {model_version} (id {model_version.pk}): {len(files)} files, "
+            f"{total / 1e6:.1f} MB at {model_version.file_path}."
+        ))
+
+    def _fetch(self, options):
+        if options["model_version"]:
+            model_version = ModelVersion.objects.filter(pk=options["model_version"]).first()
+        else:
+            model_version = current_model_version()
+        if model_version is None:
+            raise CommandError("No ModelVersion to fetch: activate one or pass --model-version.")
+        self.stdout.write(f"{model_version} is available at {artifacts.local_dir(model_version)}.")
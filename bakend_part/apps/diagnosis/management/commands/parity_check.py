@@ -0,0 +1,95 @@
+# apps/diagnosis/management/commands/parity_check.py
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.diagnosis import parity
+from apps.diagnosis.exceptions import ModelLoadingError
+
+
+class Command(BaseCommand):
+    """
+    يشغل فحص التطابق العددي (apps.diagnosis.parity) على مجموعة صور ثابتة: المعالجة المسبقة للتدريب مقابل
+    الخدمة، ثم النماذج والخط الكامل والنسخ المجمعة، ويفشل (رمز خروج غير صفري) عند تجاوز أي تسامح.
+    يُشغَّل قبل دمج أي تحسين أداء في المعالجة أو الاستدلال، وقبل نشر نسخ compile_models.
+    """
+    help = "Compare training vs serving preprocessing and every serving backend on a fixed image set."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", help="Directory of fundus JPEGs (default: synthetic golden images).")
+        parser.add_argument("--count", type=int, default=4, help="Number of synthetic images without --images.")
+        parser.add_argument("--decode", default="tf", choices=parity.DECODES,
+                            help="Training decode to compare: tf (data_handler, RGB) or cv2 (preprocess_to_tfrecord, BGR).")
+        parser.add_argument("--models", help="Directory with the model files (default: the paths in settings).")
+        parser.add_argument("--preprocessing-only", action="store_true", help="Skip the model, pipeline and compiled stages.")
+        parser.add_argument("--compiled", help="compile_models --output directory whose variants to check.")
+        parser.add_argument("--golden", help=".npz file of recorded serving outputs to compare against.")
+        parser.add_argument("--update-golden", action="store_true", help="Record --golden from this run if it passes.")
+        parser.add_argument("--tolerance", nargs="*", default=[], metavar="STAGE=ATOL",
+                            help="Override a tolerance by stage kind (e.g. batched) or full stage name.")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options["update_golden"] and not options["golden"]:
+            raise CommandError("--update-golden needs --golden FILE.")
+        if options["golden"] and not options["update_golden"] and not os.path.exists(options["golden"]):
+            raise CommandError(f"No golden file at {options['golden']}; record one with --update-golden.")
+        if options["compiled"] and options["preprocessing_only"]:
+            raise CommandError("--compiled needs the models: drop --preprocessing-only.")
+
+        with tempfile.TemporaryDirectory() as scratch:
+            if options["images"]:
+                paths = parity.image_paths(options["images"])
+            else:
+                paths = parity.golden_images(scratch, options["count"])
+            try:
+                check = parity.ParityCheck(paths, options["decode"], self._tolerances(options["tolerance"]))
+                self._run(check, options)
+            except (ValueError, FileNotFoundError, ModelLoadingError) as e:
+                raise CommandError(str(e))
+
+        for result in check.results:
+            self.stdout.write(
+                f"  {'ok  ' if result['passed'] else 'FAIL'} {result['stage']:<48} "
+                f"max {result['max_abs_diff']:.2e}  mean {result['mean_abs_diff']:.2e}  "
+                f"({result['metric']} <= {result['tolerance']:g})"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(check.report(), f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}.")
+
+        failures = [result["stage"] for result in check.results if not result["passed"]]
+        if failures:
+            raise CommandError(f"Parity check failed for {', '.join(failures)}.")
+        if options["update_golden"]:
+            check.save_golden(options["golden"])
+            self.stdout.write(f"Recorded golden outputs in {options['golden']}.")
+        self.stdout.write(self.style.SUCCESS(f"{len(check.results)} parity checks passed on {len(paths)} images."))
+
+    @staticmethod
+    def _tolerances(overrides) -> dict:
+        tolerances = {}
+        for item in overrides:
+            stage, _, value = item.partition("=")
+            if not stage or not value:
+                raise CommandError(f"Bad --tolerance {item!r}: use STAGE=ATOL.")
+            tolerances[stage] = float(value)
+        return tolerances
+
+    def _run(self, check, options) -> None:
+        from apps.diagnosis.ai_pipeline import config
+        from apps.diagnosis.ai_pipeline.service import DiagnosisService
+
+        self.stdout.write(f"Checking {len(check.paths)} images (training decode: {check.decode})...")
+        check.check_preprocessing()
+        if not options["preprocessing_only"]:
+            service = DiagnosisService(config.model_paths(options["models"]))
+            check.check_models(service)
+            check.check_pipeline(service)
+            if options["compiled"]:
+                check.check_compiled(service, options["compiled"])
+        if options["golden"] and not options["update_golden"]:
+            check.check_golden(options["golden"])
@@ -0,0 +1,85 @@
+# apps/diagnosis/management/commands/rescore_diagnoses.py
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.diagnosis.models import ModelVersion, RescoreRun
+from apps.diagnosis.rescoring import current_model_version, describe, run_chunks, serving_model_version, start_run
+from apps.diagnosis.scheduling import schedule_rescore_run
+
+
+class Command(BaseCommand):
+    """
+    يعيد استدلال التشخيصات المخزنة بالإصدار المفعّل (أو --model-version) على دفعات، مع نقطة استئناف
+    بعد كل دفعة. افتراضيًا يُجدول التشغيل على طابور DIAGNOSIS_RESCORE["QUEUE"]؛ --inline يشغله هنا
+    ويطبع التقدم والإنتاجية والزمن المتبقي بعد كل دفعة.
+    """
+    help = "Re-run inference for stored diagnoses after a new ModelVersion is activated (resumable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-version", type=int, help="Target ModelVersion id (default: the latest active one).")
+        parser.add_argument("--chunk-size", type=int, help="Diagnoses per inference batch.")
+        parser.add_argument("--resume", type=int, metavar="RUN_ID", help="Resume a paused or interrupted run.")
+        parser.add_argument("--pause", type=int, metavar="RUN_ID", help="Pause a run after its current chunk.")
+        parser.add_argument("--status", action="store_true", help="Show progress, throughput and ETA of recent runs.")
+        parser.add_argument("--inline", action="store_true", help="Process in this process instead of the Celery queue.")
+
+    def handle(self, *args, **options):
+        if options["status"]:
+            for run in RescoreRun.objects.select_related("model_version").order_by("-created_at")[:10]:
+                self.stdout.write(describe(run))
+            return
+        if options["pause"]:
+            if not RescoreRun.objects.filter(pk=options["pause"], status=RescoreRun.Status.RUNNING).update(
+                status=RescoreRun.Status.PAUSED
+            ):
+                raise CommandError(f"Run {options['pause']} is not running.")
+            self.stdout.write(f"Run {options['pause']} will pause after its current chunk.")
+            return
+
+        run = self._resume(options["resume"]) if options["resume"] else self._start(options)
+        if not options["inline"]:
+            schedule_rescore_run(run.pk)
+            self.stdout.write(f"Queued run {run.pk}: {run.total} diagnoses. Follow it with --status.")
+            return
+
+        from apps.diagnosis.services import get_orchestrator
+
+        orchestrator = get_orchestrator()
+        if orchestrator.model_version != run.model_version:
+            raise CommandError(
+                f"This process loaded {orchestrator.model_version}, not {run.model_version}: activate the "
+                f"target version or pin it with DIAGNOSIS_MODEL_VERSION, or drop --inline."
+            )
+        run_chunks(run, orchestrator, on_chunk=lambda current: self.stdout.write(describe(current)))
+        self.stdout.write(self.style.SUCCESS(describe(run)))
+
+    def _start(self, options) -> RescoreRun:
+        if options["model_version"]:
+            model_version = ModelVersion.objects.filter(pk=options["model_version"]).first()
+        else:
+            model_version = current_model_version()
+        if model_version is None:
+            raise CommandError("No target ModelVersion: activate one or pass --model-version.")
+        self._check_served(model_version)
+        running = RescoreRun.objects.filter(model_version=model_version, status=RescoreRun.Status.RUNNING).first()
+        if running:
+            raise CommandError(f"Run {running.pk} is already running for {model_version}; use --status or --pause.")
+        return start_run(model_version, options["chunk_size"])
+
+    def _resume(self, run_id: int) -> RescoreRun:
+        run = RescoreRun.objects.select_related("model_version").filter(pk=run_id).first()
+        if run is None or run.status == RescoreRun.Status.COMPLETED:
+            raise CommandError(f"Run {run_id} does not exist or is already completed.")
+        self._check_served(run.model_version)
+        run.status = RescoreRun.Status.RUNNING
+        run.save(update_fields=["status", "updated_at"])
+        return run
+
+    @staticmethod
+    def _check_served(model_version) -> None:
+        """العمال لا يحمّلون إلا الإصدار المثبت أو آخر إصدار مفعّل؛ أي هدف آخر ينتظر بلا نهاية."""
+        serving = serving_model_version()
+        if serving is None or serving.pk != model_version.pk:
+            raise CommandError(
+                f"Workers serve {serving}, not {model_version}: activate the target version or pin it with "
+                f"DIAGNOSIS_MODEL_VERSION before re-scoring with it."
+            )
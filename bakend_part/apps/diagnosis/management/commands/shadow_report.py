@@ -0,0 +1,56 @@
+# apps/diagnosis/management/commands/shadow_report.py
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+
+from apps.diagnosis.models import ModelVersion, ShadowResult
+
+
+class Command(BaseCommand):
+    """
+    يلخص التقييم الظلي لإصدار مرشح: نسبة الاتفاق على الفئة الأعلى، متوسط وأقصى فرق في الاحتمالات،
+    وعدد الفئات التي عبرت حد 0.5 في أحد الاتجاهين. يساعد على قرار تفعيل الإصدار قبل أن يراه المرضى.
+    """
+    help = "Summarise disagreement between production results and the shadow (candidate) ModelVersion."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-version", type=int, help="Candidate ModelVersion id (default: DIAGNOSIS_SHADOW_VERSION).")
+        parser.add_argument("--days", type=int, default=7, help="Only include shadow results from the last N days.")
+
+    def handle(self, *args, **options):
+        version_id = options["model_version"] or settings.DIAGNOSIS_SHADOW["VERSION"]
+        candidate = ModelVersion.objects.filter(pk=version_id).first() if version_id else None
+        if candidate is None:
+            raise CommandError("No candidate ModelVersion: pass --model-version or set DIAGNOSIS_SHADOW_VERSION.")
+
+        results = ShadowResult.objects.filter(
+            model_version=candidate, created_at__gte=timezone.now() - timedelta(days=options["days"])
+        )
+        summary = results.aggregate(
+            total=Count("id"),
+            agreed=Count("id", filter=Q(agrees=True)),
+            reused=Count("id", filter=Q(reused_image_outputs=True)),
+            mean_diff=Avg("mean_abs_diff"),
+            max_diff=Max("max_abs_diff"),
+            elapsed_ms=Avg("elapsed_ms"),
+        )
+        if not summary["total"]:
+            self.stdout.write(f"No shadow results for {candidate} in the last {options['days']} days.")
+            return
+
+        total = summary["total"]
+        self.stdout.write(f"Shadow evaluation of {candidate}, last {options['days']} days: {total} diagnoses")
+        self.stdout.write(f"  top-class agreement: {summary['agreed'] / total:.1%} ({total - summary['agreed']} disagree)")
+        self.stdout.write(f"  probability diff:    mean {summary['mean_diff']:.4f}, max {summary['max_diff']:.4f}")
+        self.stdout.write(
+            f"  cost:                {summary['elapsed_ms']:.1f} ms mean, "
+            f"{summary['reused'] / total:.0%} from stored image outputs"
+        )
+
+        flips = Counter(label for flipped in results.values_list("flipped", flat=True) for label in flipped)
+        for label, count in flips.most_common():
+            self.stdout.write(f"  flipped {label}: {count} ({count / total:.1%})")
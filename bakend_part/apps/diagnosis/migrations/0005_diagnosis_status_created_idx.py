@@ -0,0 +1,20 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0004_diagnosis_finished_at_diagnosis_started_at_and_more'),
+        ('users', '0010_rename_personal_patient_image_patient_personal_photo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['status', 'created_at'], name='diagnosis_status_created_idx'),
+        ),
+    ]
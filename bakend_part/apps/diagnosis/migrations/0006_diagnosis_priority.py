@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0005_diagnosis_status_created_idx'),
+        ('users', '0010_rename_personal_patient_image_patient_personal_photo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosis',
+            name='priority',
+            field=models.CharField(choices=[('URGENT', 'Urgent'), ('SAME_DAY', 'Same-day appointment'), ('BULK', 'Bulk')], default='SAME_DAY', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='diagnosis_claim_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:40
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0006_diagnosis_priority'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('content_type', models.CharField(max_length=20)),
+                ('length', models.BigIntegerField(help_text='Total size in bytes (Upload-Length)')),
+                ('offset', models.BigIntegerField(default=0, help_text='Bytes received so far (Upload-Offset)')),
+                ('parts', models.JSONField(default=list, help_text='Offsets of the stored chunks, in order')),
+                ('key', models.CharField(blank=True, help_text='Storage key of the assembled file', max_length=255)),
+                ('status', models.CharField(choices=[('IN_PROGRESS', 'In progress'), ('COMPLETED', 'Completed'), ('CONSUMED', 'Consumed')], default='IN_PROGRESS', max_length=12)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
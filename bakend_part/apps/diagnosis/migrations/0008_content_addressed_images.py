@@ -0,0 +1,34 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:45
+
+import apps.diagnosis.content_store
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0007_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('digest', models.CharField(help_text='SHA-256 of the file content', max_length=64, primary_key=True, serialize=False)),
+                ('key', models.CharField(help_text='Storage key of the file', max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='diagnosis',
+            name='left_fundus_image',
+            field=models.ImageField(storage=apps.diagnosis.content_store.fundus_image_storage, upload_to='diagnoses/images/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='diagnosis',
+            name='right_fundus_image',
+            field=models.ImageField(storage=apps.diagnosis.content_store.fundus_image_storage, upload_to='diagnoses/images/%Y/%m/%d/'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0008_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosis',
+            name='left_inference_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='diagnoses/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='left_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='diagnoses/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='right_inference_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='diagnoses/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='right_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='diagnoses/derivatives/'),
+        ),
+    ]
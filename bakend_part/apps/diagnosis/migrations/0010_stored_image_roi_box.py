@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0009_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedimage',
+            name='roi_box',
+            field=models.JSONField(blank=True, help_text='[left, top, right, bottom] of the fundus disc in original pixels', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0010_stored_image_roi_box'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosis',
+            name='quality',
+            field=models.JSONField(blank=True, help_text='Per-eye image quality report', null=True),
+        ),
+    ]
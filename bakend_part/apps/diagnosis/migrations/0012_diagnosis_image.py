@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-19 06:07
+
+import apps.diagnosis.content_store
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0011_diagnosis_quality'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('left', 'Left'), ('right', 'Right')], max_length=5)),
+                ('image', models.ImageField(storage=apps.diagnosis.content_store.fundus_image_storage, upload_to='diagnoses/images/%Y/%m/%d/')),
+                ('inference_image', models.ImageField(blank=True, editable=False, upload_to='diagnoses/derivatives/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('diagnosis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extra_images', to='diagnosis.diagnosis')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-19 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0012_diagnosis_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RescoreRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('PAUSED', 'Paused'), ('COMPLETED', 'Completed')], default='RUNNING', max_length=10)),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('snapshot_at', models.DateTimeField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('cursor_created_at', models.DateTimeField(blank=True, null=True)),
+                ('cursor_id', models.UUIDField(blank=True, null=True)),
+                ('elapsed_seconds', models.FloatField(default=0.0, help_text='Time spent processing chunks')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('model_version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rescore_runs', to='diagnosis.modelversion')),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-19 06:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0013_rescore_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.JSONField(help_text="The candidate's full report")),
+                ('production_top', models.CharField(max_length=50)),
+                ('candidate_top', models.CharField(max_length=50)),
+                ('agrees', models.BooleanField(help_text='Both versions give the same top class')),
+                ('max_abs_diff', models.FloatField()),
+                ('mean_abs_diff', models.FloatField()),
+                ('flipped', models.JSONField(default=list, help_text='Classes that crossed the 0.5 threshold')),
+                ('reused_image_outputs', models.BooleanField(default=False, help_text='Only the tabular stage ran, on the stored image-model outputs')),
+                ('elapsed_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('diagnosis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shadow_results', to='diagnosis.diagnosis')),
+                ('model_version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shadow_results', to='diagnosis.modelversion')),
+                ('production_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='diagnosis.modelversion')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('diagnosis', 'model_version'), name='shadow_result_unique_version')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0014_shadow_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, help_text='Per-stage processing times in milliseconds', null=True),
+        ),
+    ]
@@ -3,6 +3,7 @@ import uuid
 from django.db import models
 from django.conf import settings
 from apps.users.models import Patient, Appointment 
+from .content_store import fundus_image_storage, image_digest
 
 
 
@@ -28,15 +29,26 @@ class Diagnosis(models.Model):
         SUCCESS = "SUCCESS", "Success"
         FAILURE = "FAILURE", "Failure"
 
+    class Priority(models.TextChoices):
+        URGENT = "URGENT", "Urgent"          # حالة طارئة / مريض حاضر الآن
+        SAME_DAY = "SAME_DAY", "Same-day appointment"
+        BULK = "BULK", "Bulk"                # رفع جماعي أو إعادة استيراد
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="diagnoses")
     physician = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name="diagnoses")
     appointment = models.OneToOneField(Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name="diagnosis")
 
-    # مُدخلات
-    left_fundus_image = models.ImageField(upload_to='diagnoses/images/%Y/%m/%d/')
-    right_fundus_image = models.ImageField(upload_to='diagnoses/images/%Y/%m/%d/')
+    # مُدخلات - تُخزن بعنوان المحتوى (SHA-256)، فالصورة المكررة تُحفظ مرة واحدة
+    left_fundus_image = models.ImageField(upload_to='diagnoses/images/%Y/%m/%d/', storage=fundus_image_storage)
+    right_fundus_image = models.ImageField(upload_to='diagnoses/images/%Y/%m/%d/', storage=fundus_image_storage)
+    # نسخ مشتقة تُولد بعد الرفع (انظر apps.diagnosis.derivatives): يقرأ خط الأنابيب نسخة الاستدلال،
+    # وتعرض القوائم الصور المصغرة بدل الأصل
+    left_inference_image = models.ImageField(upload_to='diagnoses/derivatives/', blank=True, editable=False)
+    right_inference_image = models.ImageField(upload_to='diagnoses/derivatives/', blank=True, editable=False)
+    left_thumbnail = models.ImageField(upload_to='diagnoses/derivatives/', blank=True, editable=False)
+    right_thumbnail = models.ImageField(upload_to='diagnoses/derivatives/', blank=True, editable=False)
 
     # تتبع الحالة - تمت إضافة db_index
     status = models.CharField(
@@ -45,10 +57,16 @@ class Diagnosis(models.Model):
         default=Status.PENDING, 
         db_index=True  # مهم لتسريع البحث عن الحالات
     )
+    # تحدد طابور Celery ونصيب التشخيص من مقاعد الحجز بالدفعات
+    priority = models.CharField(max_length=10, choices=Priority.choices, default=Priority.SAME_DAY)
     
     # النتائج
     result = models.JSONField(null=True, blank=True, help_text="Stores the final JSON output from the AI pipeline")
     error_message = models.TextField(null=True, blank=True)
+    # تقرير فحص الجودة قبل الاستدلال لكل عين (انظر apps.diagnosis.quality)
+    quality = models.JSONField(null=True, blank=True, help_text="Per-eye image quality report")
+    # أزمنة مراحل المعالجة (انظر apps.diagnosis.timings)
+    stage_timings = models.JSONField(null=True, blank=True, help_text="Per-stage processing times in milliseconds")
     medical_notes = models.TextField(blank=True) 
 
     # معلومات التدقيق - تمت إضافة حقول جديدة
@@ -59,12 +77,163 @@ class Diagnosis(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # يخدم استعلام الحجز: الحالات القابلة للمعالجة مرتبة بالأقدم
+            models.Index(fields=['status', 'created_at'], name='diagnosis_status_created_idx'),
+            models.Index(fields=['status', 'priority', 'created_at'], name='diagnosis_claim_priority_idx'),
+        ]
+
     def __str__(self):
         return f"Diagnosis {self.id} - {self.status}"
     
     def get_clinic(self):
         return self.patient.clinic if self.patient else None
 
+    @property
+    def image_digests(self):
+        """(left, right) SHA-256 للصورتين؛ مفتاح مناسب لذاكرات الاستدلال المؤقتة. None للملفات القديمة."""
+        return image_digest(self.left_fundus_image.name), image_digest(self.right_fundus_image.name)
+
+
+class DiagnosisImage(models.Model):
+    """
+    لقطة إضافية لإحدى العينين (العيادات تلتقط عادة 2-4 صور لكل عين). الصورة الأساسية تبقى في
+    left_fundus_image / right_fundus_image، ويجمع خط الأنابيب تنبؤات كل لقطات العين قبل دمج الميزات.
+    """
+    class Side(models.TextChoices):
+        LEFT = "left", "Left"
+        RIGHT = "right", "Right"
+
+    diagnosis = models.ForeignKey(Diagnosis, on_delete=models.CASCADE, related_name="extra_images")
+    side = models.CharField(max_length=5, choices=Side.choices)
+    image = models.ImageField(upload_to='diagnoses/images/%Y/%m/%d/', storage=fundus_image_storage)
+    inference_image = models.ImageField(upload_to='diagnoses/derivatives/', blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    def __str__(self):
+        return f"{self.side} image of diagnosis {self.diagnosis_id}"
+
+
+class StoredImage(models.Model):
+    """ملف صورة فريد في التخزين بعنوان المحتوى، مع عدد التشخيصات وجلسات الرفع التي تشير إليه."""
+    digest = models.CharField(max_length=64, primary_key=True, help_text="SHA-256 of the file content")
+    key = models.CharField(max_length=255, unique=True, help_text="Storage key of the file")
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    roi_box = models.JSONField(
+        null=True, blank=True, help_text="[left, top, right, bottom] of the fundus disc in original pixels"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.ref_count} refs)"
+
+
+class UploadSession(models.Model):
+    """
+    جلسة رفع قابلة للاستئناف (على نمط tus) لصورة قاع عين واحدة.
+    كل جزء يُخزن ككائن مستقل في التخزين، وتُجمع الأجزاء تدفقيًا في الملف النهائي عند الاكتمال.
+    """
+    class Status(models.TextChoices):
+        IN_PROGRESS = "IN_PROGRESS", "In progress"
+        COMPLETED = "COMPLETED", "Completed"    # الملف النهائي جاهز في التخزين
+        CONSUMED = "CONSUMED", "Consumed"       # استُخدم لإنشاء تشخيص
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="upload_sessions")
+    content_type = models.CharField(max_length=20)
+    length = models.BigIntegerField(help_text="Total size in bytes (Upload-Length)")
+    offset = models.BigIntegerField(default=0, help_text="Bytes received so far (Upload-Offset)")
+    parts = models.JSONField(default=list, help_text="Offsets of the stored chunks, in order")
+    key = models.CharField(max_length=255, blank=True, help_text="Storage key of the assembled file")
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.IN_PROGRESS)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"UploadSession {self.id} - {self.offset}/{self.length}"
+
+
+class ShadowResult(models.Model):
+    """
+    نتيجة إصدار مرشح (التقييم الظلي) لتشخيص اكتمل بالإصدار الجاري، مع إحصاءات الاختلاف بينهما.
+    لا تظهر للطبيب ولا تغير Diagnosis.result (انظر apps.diagnosis.shadow).
+    """
+    diagnosis = models.ForeignKey(Diagnosis, on_delete=models.CASCADE, related_name="shadow_results")
+    model_version = models.ForeignKey(ModelVersion, on_delete=models.CASCADE, related_name="shadow_results")
+    production_version = models.ForeignKey(
+        ModelVersion, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    result = models.JSONField(help_text="The candidate's full report")
+    production_top = models.CharField(max_length=50)
+    candidate_top = models.CharField(max_length=50)
+    agrees = models.BooleanField(help_text="Both versions give the same top class")
+    max_abs_diff = models.FloatField()
+    mean_abs_diff = models.FloatField()
+    flipped = models.JSONField(default=list, help_text="Classes that crossed the 0.5 threshold")
+    reused_image_outputs = models.BooleanField(
+        default=False, help_text="Only the tabular stage ran, on the stored image-model outputs"
+    )
+    elapsed_ms = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["diagnosis", "model_version"], name="shadow_result_unique_version"),
+        ]
+
+    def __str__(self):
+        return f"Shadow {self.model_version} on {self.diagnosis_id} ({'agrees' if self.agrees else 'disagrees'})"
+
+
+class RescoreRun(models.Model):
+    """
+    تشغيل لإعادة استدلال التشخيصات المخزنة بعد تفعيل ModelVersion جديد (انظر apps.diagnosis.rescoring).
+    نقطة الاستئناف (cursor_created_at, cursor_id) تُحفظ بعد كل دفعة مع نتائجها، فالتشغيل المتوقف
+    يستأنف من آخر دفعة مكتملة.
+    """
+    class Status(models.TextChoices):
+        RUNNING = "RUNNING", "Running"
+        PAUSED = "PAUSED", "Paused"
+        COMPLETED = "COMPLETED", "Completed"
+
+    model_version = models.ForeignKey(ModelVersion, on_delete=models.CASCADE, related_name="rescore_runs")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING)
+    chunk_size = models.PositiveIntegerField()
+    # التشخيصات الناجحة التي أنشئت حتى snapshot_at ولم تُقيَّم بهذا الإصدار
+    snapshot_at = models.DateTimeField()
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    cursor_created_at = models.DateTimeField(null=True, blank=True)
+    cursor_id = models.UUIDField(null=True, blank=True)
+    elapsed_seconds = models.FloatField(default=0.0, help_text="Time spent processing chunks")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.processed - self.failed)
+
+    @property
+    def throughput(self) -> float:
+        """تشخيصات في الثانية خلال زمن المعالجة الفعلي (دون فترات الإيقاف)."""
+        done = self.processed + self.failed
+        return done / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def eta_seconds(self):
+        return self.remaining / self.throughput if self.throughput else None
+
+    def __str__(self):
+        return f"RescoreRun {self.pk} ({self.model_version}) - {self.processed + self.failed}/{self.total}"
+
         
 # class Diagnosis(models.Model):
 #     """يسجل طلب تشخيص كامل، من الإدخال إلى النتيجة."""
@@ -0,0 +1,308 @@
+# apps/diagnosis/parity.py
+"""
+فحص التطابق العددي بين خط التدريب (ai_part) وخط الخدمة على مجموعة صور ثابتة، حتى لا يمر تحسين أداء
+يغير المخرجات بصمت (python manage.py parity_check). كل مرحلة تُقارن بمرجعها ويُسجل أقصى ومتوسط فرق مطلق:
+- preprocessing/<استراتيجية>: استراتيجية التدريب على فك ترميز التدريب (cv2.imread بترتيب BGR كما في
+  preprocess_to_tfrecord، أو tf.image بترتيب RGB كما في data_handler) مقابل استراتيجية الخدمة على نسخة
+  الاستدلال (PIL، RGB، مقصوصة ومصغرة). تُحكم بمتوسط الفرق: اختلاف إعادة التحجيم يزيح الحواف بكسلًا،
+  فأقصى الفرق كبير دائمًا.
+- training_inputs/<نموذج>: مخرجات النموذج على مدخلات التدريب مقابل مدخلات الخدمة.
+- batched/<نموذج>: predict_batch مقابل predict_single لكل صورة.
+- pipeline/batched و pipeline/rescore: run_diagnosis_batch مقابل run_diagnosis، و rescore_batch مقابلهما.
+- <نسخة>/<نموذج>: نسخ compile_models (keras، xla، tflite...) مقابل النموذج المصدر على نفس المدخلات.
+- golden/<مفتاح>: مخرجات الخدمة مقابل تسجيل سابق معتمد، فيُكشف أي تغير منذ آخر تشغيل ناجح.
+كل المراحل عدا preprocessing تُحكم بأقصى فرق مطلق.
+"""
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from . import derivatives
+from .ai_pipeline.models import preprocessing as serving_preprocessing
+from .ai_pipeline.models.optimization import COMPILE_MANIFEST, VARIANT_TOLERANCES
+
+logger = logging.getLogger(__name__)
+
+DECODES = ("tf", "cv2")
+IMAGE_PROJECT = "ocular_diagnosis_image_ai_system"
+TABULAR_PROJECT = "ocular_diagnosis_tabular_ai_system"
+
+# التسامح لكل مرحلة: يُبحث عن اسمها الكامل أولًا ثم عن نوعها (ما قبل "/")
+DEFAULT_TOLERANCES = {
+    **VARIANT_TOLERANCES,
+    "preprocessing": 0.02,  # متوسط الفرق في البكسلات بمقياس [0, 1]
+    # حواف Canny ثنائية (0 أو 1) وتنزاح بكسلًا مع اختلاف إعادة التحجيم بين الخطين؛
+    # بالإطار كاملًا (دون CROP_ROI) يُصغَّر القرص أكثر فيصل متوسط الفرق إلى نحو 0.13
+    "preprocessing/HypertensionPreprocessing": 0.15,
+    "training_inputs": 0.05,
+    "batched": 1e-5,
+    "pipeline": 2e-4,  # final_diagnosis محفوظ بأربع منازل عشرية
+    "golden": 1e-5,
+}
+
+_TRAINING_MODULES: Dict[str, object] = {}
+
+
+def training_module(name: str, project: str = IMAGE_PROJECT):
+    """وحدة src/<name>.py من مشروع تدريب في AI_TRAINING_DIR، تُحمّل بمسارها باسم لا يتعارض مع وحدات الخدمة."""
+    path = os.path.join(settings.AI_TRAINING_DIR, project, "src", f"{name}.py")
+    if path not in _TRAINING_MODULES:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Training module not found: {path} (set AI_TRAINING_DIR).")
+        spec = importlib.util.spec_from_file_location(f"training_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _TRAINING_MODULES[path] = module
+    return _TRAINING_MODULES[path]
+
+
+def golden_images(directory: str, count: int = 4) -> List[str]:
+    """صور قاع عين اصطناعية ثابتة (JPEG) بأحجام ونسب مختلفة، حين لا تتوفر صور حقيقية."""
+    sizes = [(1600, 1200), (1200, 1200), (2000, 1300), (900, 700)]
+    paths = []
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        rng = np.random.default_rng(i)
+        image = rng.integers(0, 8, (height, width, 3), dtype=np.uint8)
+        center, radius = (width // 2, height // 2), int(min(width, height) * 0.45)
+        cv2.circle(image, center, radius, (170, 80, 40), -1)
+        for _ in range(12):
+            start, end = rng.integers(
+                [center[0] - radius // 2, center[1] - radius // 2], [center[0] + radius // 2, center[1] + radius // 2], (2, 2)
+            )
+            cv2.line(image, tuple(map(int, start)), tuple(map(int, end)), (110, 30, 20), 3)
+        cv2.circle(image, (center[0] + radius // 3, center[1]), radius // 6, (240, 210, 150), -1)
+        path = os.path.join(directory, f"golden_{i}.jpg")
+        Image.fromarray(cv2.GaussianBlur(image, (5, 5), 0)).save(path, quality=95)
+        paths.append(path)
+    return paths
+
+
+def image_paths(directory: str) -> List[str]:
+    """صور JPEG في المجلد مرتبة بالاسم (فك ترميز tf في التدريب يقبل JPEG فقط)."""
+    return sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.JPG", "*.JPEG") for path in glob.glob(os.path.join(directory, pattern))
+    )
+
+
+def training_image(path: str, decode: str) -> np.ndarray:
+    """
+    الصورة كما يراها التدريب. مع DIAGNOSIS_DERIVATIVES["CROP_ROI"] (النموذج دُرب بـ crop_roi) تُقص إلى
+    صندوق القرص المكشوف من الملف كما في load_roi_boxes، وإلا يُستخدم الإطار كاملًا.
+    """
+    crop = settings.DIAGNOSIS_DERIVATIVES["CROP_ROI"]
+    roi = training_module("roi")
+    if decode == "cv2":
+        # preprocess_to_tfrecord: cv2.imread (BGR) ثم crop_to_roi
+        image = cv2.imread(path)
+        return roi.crop_to_roi(image, roi._detect_from_file(path)) if crop else image
+    import tensorflow as tf
+
+    if not crop:
+        # data_handler._process_image: decode_jpeg للإطار كاملًا (RGB)
+        return tf.image.decode_jpeg(tf.io.read_file(path), channels=3).numpy()
+    # data_handler._process_cropped_image: decode_and_crop_jpeg بنافذة [top, left, height, width] (RGB)
+    left, top, right, bottom = roi._detect_from_file(path)
+    window = [top, left, bottom - top, right - left]
+    return tf.image.decode_and_crop_jpeg(tf.io.read_file(path), window, channels=3).numpy()
+
+
+def serving_image(path: str) -> np.ndarray:
+    """الصورة كما تراها الخدمة: نسخة الاستدلال من derivatives.render (تُحفظ PNG بلا فقد، فلا حاجة لكتابتها)."""
+    with Image.open(path) as image:
+        rendered, _ = derivatives.render(image)
+    return np.array(rendered[derivatives.INFERENCE])
+
+
+def _scaled(processed: np.ndarray) -> np.ndarray:
+    """مخرج الاستراتيجية بمقياس مدخل النموذج، كما يطبعه EyesModel._prepare_input_array."""
+    array = np.asarray(processed, dtype=np.float32)
+    return array / 255.0 if np.max(array) > 1.0 else array
+
+
+def _report_values(reports: List[dict]) -> np.ndarray:
+    """كل القيم العددية في التقارير: الاحتمالات النهائية، متجه الأدلة، ومخرجات النماذج الصورية."""
+    values = []
+    for report in reports:
+        values += [float(p) for p in report["final_diagnosis"].values()]
+        values += report["evidence_vector"]
+        for side in ("left", "right"):
+            values += report["image_outputs"][side]["multi_class"] + report["image_outputs"][side]["expert"]
+    return np.asarray(values, dtype=np.float64)
+
+
+def _digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ParityCheck:
+    """
+    يمرر مجموعة الصور عبر المراحل ويجمع نتيجة لكل مقارنة في results. المراحل مستقلة: check_preprocessing
+    أولًا (تفك ترميز الصور بالطريقتين)، ثم ما يلزم من check_models و check_pipeline و check_compiled،
+    وأخيرًا check_golden أو save_golden على مخرجات الخدمة المجمعة في outputs.
+    """
+
+    def __init__(self, paths: List[str], decode: str = "tf", tolerances: Optional[Dict[str, float]] = None):
+        if decode not in DECODES:
+            raise ValueError(f"Unknown training decode {decode!r}: use one of {', '.join(DECODES)}.")
+        if not paths:
+            raise ValueError("The parity check needs at least one image.")
+        self.paths = list(paths)
+        self.digests = [_digest(path) for path in self.paths]
+        self.decode = decode
+        self.tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+        self.results: List[dict] = []
+        self.outputs: Dict[str, np.ndarray] = {}
+        self.training_images: List[np.ndarray] = []
+        self.serving_images: List[np.ndarray] = []
+        self.feature_vectors: Optional[np.ndarray] = None
+
+    @property
+    def passed(self) -> bool:
+        return all(result["passed"] for result in self.results)
+
+    def tolerance(self, stage: str) -> float:
+        kind = stage.split("/")[0]
+        if stage in self.tolerances:
+            return self.tolerances[stage]
+        if kind in self.tolerances:
+            return self.tolerances[kind]
+        raise KeyError(f"No tolerance for stage {stage!r}.")
+
+    def record(self, stage: str, expected, actual, metric: str = "max") -> dict:
+        expected, actual = np.asarray(expected, dtype=np.float64), np.asarray(actual, dtype=np.float64)
+        if expected.shape != actual.shape:
+            max_diff = mean_diff = float("inf")
+            logger.warning(f"Parity stage {stage}: shape {actual.shape} != expected {expected.shape}.")
+        else:
+            diff = np.abs(expected - actual)
+            max_diff, mean_diff = float(diff.max()), float(diff.mean())
+        tolerance = self.tolerance(stage)
+        result = {
+            "stage": stage,
+            "max_abs_diff": max_diff,
+            "mean_abs_diff": mean_diff,
+            "metric": metric,
+            "tolerance": tolerance,
+            "passed": (max_diff if metric == "max" else mean_diff) <= tolerance,
+        }
+        self.results.append(result)
+        return result
+
+    def check_preprocessing(self) -> None:
+        """كل استراتيجية تدريب مقابل نظيرتها في الخدمة، على فك ترميز كل خط للصورة نفسها."""
+        self.training_images = [training_image(path, self.decode) for path in self.paths]
+        self.serving_images = [serving_image(path) for path in self.paths]
+        for name, training_class in training_module("preprocessing_strategies").STRATEGY_REGISTRY.items():
+            serving_class = getattr(serving_preprocessing, name, None)
+            if serving_class is None:
+                raise ValueError(f"Training strategy {name} has no serving counterpart.")
+            training = np.stack([_scaled(training_class().apply(image)) for image in self.training_images])
+            serving = np.stack([_scaled(serving_class().apply(image)) for image in self.serving_images])
+            self.record(f"preprocessing/{name}", training, serving, metric="mean")
+            self.outputs[f"serving/{name}"] = serving
+
+    def check_models(self, service) -> None:
+        """المسار الدفعي مقابل صورة بصورة، ومدخلات التدريب مقابل مدخلات الخدمة، لكل نموذج صوري."""
+        from .ai_pipeline.models.classifier import EyesModel
+
+        training_strategies = training_module("preprocessing_strategies").STRATEGY_REGISTRY
+        for name, model in service.image_models():
+            batched = model.predict_batch(self.serving_images)
+            single = np.concatenate([model.predict_single(image) for image in self.serving_images])
+            self.record(f"batched/{name}", single, batched)
+            training_model = EyesModel(model.model_path, training_strategies[type(model.strategy).__name__]())
+            self.record(f"training_inputs/{name}", batched, training_model.predict_batch(self.training_images))
+            self.outputs[f"outputs/{name}"] = batched
+
+    def cases(self) -> List[dict]:
+        """حالة لكل صورة: هي العين اليسرى والصورة التالية اليمنى، بعمر وجنس مختلفين."""
+        n = len(self.serving_images)
+        return [
+            {
+                "left_eye_img": self.serving_images[i],
+                "right_eye_img": self.serving_images[(i + 1) % n],
+                "demographics": {"age": 40 + 7 * i, "gender": i % 2},
+            }
+            for i in range(n)
+        ]
+
+    def check_pipeline(self, service) -> None:
+        """الخط الكامل: الدفعي وإعادة التقييم (predict_on_batch للجدولي) مقابل التشغيل التسلسلي."""
+        cases = self.cases()
+        sequential = [service.run_diagnosis(c["left_eye_img"], c["right_eye_img"], c["demographics"]) for c in cases]
+        batched = service.run_diagnosis_batch(cases)
+        rescored = service.rescore_batch([{"result": r, "demographics": c["demographics"]} for r, c in zip(batched, cases)])
+        self.record("pipeline/batched", _report_values(sequential), _report_values(batched))
+        self.record("pipeline/rescore", _report_values(sequential), _report_values(rescored))
+        self.outputs["outputs/final"] = _report_values(batched)
+        self.feature_vectors = np.concatenate([
+            service.feature_pipeline.transform(np.asarray(report["evidence_vector"], dtype=np.float32))
+            for report in batched
+        ])
+
+    def check_compiled(self, service, compiled_dir: str) -> None:
+        """
+        كل نسخة في compile_manifest.json مقابل النموذج المصدر في الخدمة، على مدخلات الخدمة الحقيقية
+        (الصور بعد المعالجة، ومتجهات الميزات من check_pipeline للنموذج الجدولي).
+        """
+        from .ai_pipeline.models.classifier import ModelLoaderFactory
+        from .ai_pipeline.models.optimization import xla_predict
+
+        with open(os.path.join(compiled_dir, COMPILE_MANIFEST)) as f:
+            manifest = json.load(f)["models"]
+        sources = [
+            (name, model.model_path, model.model, np.stack([model._prepare_input_array(i) for i in self.serving_images]))
+            for name, model in service.image_models()
+        ]
+        if self.feature_vectors is not None:
+            sources.append(("tabular", service.model_paths["tabular"], service.tabular_model, self.feature_vectors))
+
+        loaded = {}
+        for name, path, source, inputs in sources:
+            filename = os.path.basename(str(path))
+            if filename not in manifest:
+                logger.warning(f"{filename} is not in {COMPILE_MANIFEST}; skipping its compiled variants.")
+                continue
+            expected = np.asarray(source.predict_on_batch(inputs))
+            for variant, entry in manifest[filename]["variants"].items():
+                key = (filename, variant)
+                if key not in loaded:
+                    if variant == "xla":
+                        keras_path = os.path.join(compiled_dir, filename)
+                        loaded[key] = xla_predict(ModelLoaderFactory.get_loader("keras")(keras_path))
+                    else:
+                        variant_path = os.path.join(compiled_dir, entry["file"])
+                        loaded[key] = ModelLoaderFactory.get_loader(variant_path.split(".")[-1])(variant_path).predict_on_batch
+                self.record(f"{variant}/{name}", expected, np.asarray(loaded[key](inputs)))
+
+    def check_golden(self, path: str) -> None:
+        """مخرجات الخدمة مقابل تسجيل سابق لنفس الصور (save_golden)."""
+        with np.load(path) as golden:
+            if list(golden["images"]) != self.digests:
+                raise ValueError(f"{path} was recorded on a different image set.")
+            for key in golden.files:
+                if key in self.outputs:
+                    self.record(f"golden/{key}", golden[key], self.outputs[key])
+
+    def save_golden(self, path: str) -> None:
+        np.savez_compressed(path, images=np.array(self.digests), **self.outputs)
+        logger.info(f"Recorded {len(self.outputs)} golden outputs for {len(self.paths)} images in {path}.")
+
+    def report(self) -> dict:
+        return {
+            "decode": self.decode,
+            "images": [os.path.basename(path) for path in self.paths],
+            "passed": self.passed,
+            "results": self.results,
+        }
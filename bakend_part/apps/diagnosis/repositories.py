@@ -1,7 +1,18 @@
 # apps/diagnosis/repositories.py
 # apps/diagnosis/repositories.py
-from typing import Optional
+from collections import defaultdict
+from typing import List, Optional
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from apps.users.models import Patient
 from .models import Diagnosis
+from .scheduling import fair_share_order
+
+# الحالات التي يمكن حجزها للمعالجة (معلقة أو بانتظار إعادة المحاولة)
+CLAIMABLE_STATUSES = [Diagnosis.Status.PENDING, Diagnosis.Status.RETRY]
 
 class DiagnosisRepository:
     """
@@ -15,10 +26,135 @@ class DiagnosisRepository:
         يستخدم select_related لتحسين الأداء عن طريق جلب بيانات المريض المرتبطة في استعلام واحد.
         """
         try:
-            return Diagnosis.objects.select_related("patient").get(id=diagnosis_id)
+            return Diagnosis.objects.select_related("patient").prefetch_related("extra_images").get(id=diagnosis_id)
         except Diagnosis.DoesNotExist:
             return None
 
+    def save_quality(self, diagnosis_id, quality: dict) -> None:
+        """يحفظ تقرير فحص الجودة دون المساس ببقية الحقول (السجل قيد التشغيل)."""
+        Diagnosis.objects.filter(id=diagnosis_id).update(quality=quality)
+
+    def claim_one(self, diagnosis_id: str, worker_id: str) -> bool:
+        """
+        يحجز تشخيصًا واحدًا بعبارة UPDATE شرطية واحدة (انتقال PENDING/RETRY -> RUNNING).
+        يعيد True إذا نجح الحجز، و False إذا كان السجل غير موجود أو محجوزًا أو منتهيًا.
+        بديل عن (قفل Redis + معاملة select_for_update) برحلة واحدة إلى قاعدة البيانات.
+        """
+        claimed = Diagnosis.objects.filter(id=diagnosis_id, status__in=CLAIMABLE_STATUSES).update(
+            status=Diagnosis.Status.RUNNING,
+            worker_id=worker_id,
+            started_at=timezone.now()
+        )
+        return claimed == 1
+
+    def claim_pending(self, limit: int, worker_id: str) -> List[Diagnosis]:
+        """
+        يحجز حتى limit تشخيصًا قابلًا للمعالجة وينقلها إلى RUNNING، ثم يعيدها مع بيانات المريض واللقطات الإضافية محمّلة.
+        ترتيب الاختيار هو التقاسم العادل (أوزان الأولويات + التناوب بين العيادات) على نافذة من المرشحين،
+        والقفل يتم بهذا الترتيب مع SKIP LOCKED حتى limit: العمال المتزامنون يتخطون ما حجزه غيرهم
+        ويأخذون التالي في النافذة بدل أن يتصادموا على نفس المعرفات.
+        - PostgreSQL: عبارة واحدة WITH ... SELECT ... FOR UPDATE SKIP LOCKED LIMIT n ... UPDATE ... RETURNING.
+        - غير ذلك: استعلام المرشحين ثم معاملة select_for_update(skip_locked=True) مرتبة ثم bulk_update.
+        """
+        weights = {p: w for p, w in settings.DIAGNOSIS_PRIORITY_WEIGHTS.items() if w > 0}
+        if not weights:
+            return []
+        if connection.vendor == 'postgresql':
+            claimed = self._claim_skip_locked(limit, worker_id, weights)
+        else:
+            claimed = self._claim_orm(limit, worker_id, weights)
+        prefetch_related_objects(claimed, 'extra_images')
+        return claimed
+
+    def _claim_skip_locked(self, limit: int, worker_id: str, weights: dict) -> List[Diagnosis]:
+        """
+        نسخة SQL من fair_share_order: داخل كل أولوية تناوب بين العيادات (lane_rank)، وبين الأولويات
+        Weighted Fair Queueing (الترتيب بـ lane_rank / weight)، فالمقاعد غير المستخدمة تذهب للأولويات الأخرى.
+        """
+        window = limit * settings.DIAGNOSIS_FAIR_SHARE_WINDOW
+        qn = connection.ops.quote_name
+        table, patients = qn(Diagnosis._meta.db_table), qn(Patient._meta.db_table)
+        priorities = ', '.join(['%s'] * len(weights))
+        weight_case = 'CASE priority ' + ' '.join(['WHEN %s THEN %s'] * len(weights)) + ' END'
+        sql = (
+            f"WITH candidates AS ("
+            f"  SELECT d.id, d.priority, d.created_at, ROW_NUMBER() OVER ("
+            f"    PARTITION BY d.priority, p.clinic_id ORDER BY d.created_at) AS clinic_rank"
+            f"  FROM {table} d JOIN {patients} p ON p.id = d.patient_id"
+            f"  WHERE d.status IN (%s, %s) AND d.priority IN ({priorities})"
+            f"), lanes AS ("
+            f"  SELECT id, created_at, {weight_case} AS weight, ROW_NUMBER() OVER ("
+            f"    PARTITION BY priority ORDER BY clinic_rank, created_at) AS lane_rank"
+            f"  FROM candidates WHERE clinic_rank <= %s"
+            f"), locked AS ("
+            f"  SELECT d.id, l.lane_rank::float / l.weight AS slot, l.weight, l.created_at"
+            f"  FROM {table} d JOIN lanes l ON l.id = d.id"
+            f"  WHERE l.lane_rank <= %s AND d.status IN (%s, %s)"
+            f"  ORDER BY slot, l.weight DESC, l.created_at LIMIT %s"
+            f"  FOR UPDATE OF d SKIP LOCKED"
+            f") "
+            f"UPDATE {table} SET status = %s, worker_id = %s, started_at = %s "
+            f"FROM locked WHERE {table}.id = locked.id "
+            f"RETURNING {table}.*, locked.slot, locked.weight, locked.created_at AS queued_at"
+        )
+        params = [
+            *CLAIMABLE_STATUSES, *weights,
+            *(value for item in weights.items() for value in item), window,
+            window, *CLAIMABLE_STATUSES, limit,
+            Diagnosis.Status.RUNNING, worker_id, timezone.now(),
+        ]
+        with transaction.atomic():
+            claimed = list(Diagnosis.objects.raw(sql, params))
+        # ترتيب RETURNING غير مضمون
+        claimed.sort(key=lambda d: (d.slot, -d.weight, d.queued_at))
+        prefetch_related_objects(claimed, 'patient')
+        return claimed
+
+    def _claim_orm(self, limit: int, worker_id: str, weights: dict) -> List[Diagnosis]:
+        order = self._select_candidates(limit, weights)
+        if not order:
+            return []
+        position = Case(*[When(id=pk, then=Value(i)) for i, pk in enumerate(order)])
+        with transaction.atomic():
+            claimed = list(
+                Diagnosis.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('patient')
+                .filter(id__in=order, status__in=CLAIMABLE_STATUSES)
+                .order_by(position)[:limit]
+            )
+            started_at = timezone.now()
+            for diagnosis in claimed:
+                diagnosis.status = Diagnosis.Status.RUNNING
+                diagnosis.worker_id = worker_id
+                diagnosis.started_at = started_at
+            Diagnosis.objects.bulk_update(claimed, ['status', 'worker_id', 'started_at'])
+        return claimed
+
+    def _select_candidates(self, limit: int, weights: dict) -> list:
+        """
+        يعيد معرفات نافذة المرشحين (limit * DIAGNOSIS_FAIR_SHARE_WINDOW لكل أولوية) مرتبة بالتقاسم العادل.
+        النافذة تُملأ بالتناوب بين العيادات: أقدم طلب لكل عيادة، ثم ثانيها، وهكذا،
+        فلا يملأ تراكم عيادة واحدة النافذة كلها ويحجب البقية.
+        """
+        window = limit * settings.DIAGNOSIS_FAIR_SHARE_WINDOW
+        clinic_rank = Window(
+            RowNumber(), partition_by=[F('priority'), F('patient__clinic_id')], order_by=F('created_at').asc()
+        )
+        rows = (
+            Diagnosis.objects.filter(status__in=CLAIMABLE_STATUSES, priority__in=list(weights))
+            .annotate(clinic_rank=clinic_rank)
+            .filter(clinic_rank__lte=window)
+            .order_by('clinic_rank', 'created_at')
+            .values('id', 'priority', 'created_at', clinic_id=F('patient__clinic_id'))
+        )
+        lanes = defaultdict(list)
+        for row in rows:
+            if len(lanes[row['priority']]) < window:
+                lanes[row['priority']].append(row)
+        # fair_share_order يتوقع المرشحين مرتبين بالأقدم أولًا
+        candidates = sorted((row for lane in lanes.values() for row in lane), key=lambda row: row['created_at'])
+        return fair_share_order(candidates, weights, len(candidates))
+
     # ملاحظة: تم نقل منطق update_with_success و update_with_failure
     # إلى مهمة Celery مباشرة للتحكم الدقيق في المعاملات وآلة الحالة (FSM).
     
@@ -0,0 +1,131 @@
+# apps/diagnosis/rescoring.py
+"""
+إعادة استدلال التشخيصات المخزنة بعد تفعيل ModelVersion جديد، بدل إعادة إرسالها واحدًا واحدًا:
+- start_run يلتقط لقطة (snapshot) للتشخيصات الناجحة التي لم تُقيَّم بالإصدار الهدف.
+- run_chunks يمرّ عليها بـ iterator() بترتيب (created_at, id)، ويشغّل كل دفعة في تمريرة استدلال
+  واحدة (run_batch_from_django_models)، ويكتب النتائج بـ bulk_update مع نقطة الاستئناف في نفس المعاملة.
+- التشخيص الذي يفشل استدلاله يحتفظ بنتيجته السابقة ويُعد ضمن failed.
+يعمل عادة في مهمة rescore_model_version على طابور منخفض الأولوية (DIAGNOSIS_RESCORE["QUEUE"])،
+فلا يزاحم الطلبات التفاعلية.
+"""
+import logging
+import time
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Diagnosis, ModelVersion, RescoreRun
+
+logger = logging.getLogger(__name__)
+
+
+def current_model_version() -> Optional[ModelVersion]:
+    """آخر إصدار مفعّل؛ يُسجل على كل نتيجة جديدة ويكون الهدف الافتراضي لإعادة التقييم."""
+    return ModelVersion.objects.filter(is_active=True).order_by("-created_at").first()
+
+
+def serving_model_version() -> Optional[ModelVersion]:
+    """الإصدار الذي تحمّله العمال: المثبت بـ DIAGNOSIS_MODEL_RELOAD["PINNED_VERSION"]، وإلا آخر إصدار مفعّل."""
+    pinned = settings.DIAGNOSIS_MODEL_RELOAD["PINNED_VERSION"]
+    if pinned:
+        return ModelVersion.objects.filter(pk=pinned).first()
+    return current_model_version()
+
+
+def stale_diagnoses(model_version: ModelVersion, snapshot_at):
+    """التشخيصات الناجحة حتى snapshot_at التي لم تُقيَّم بالإصدار model_version."""
+    return (
+        Diagnosis.objects.filter(status=Diagnosis.Status.SUCCESS, created_at__lte=snapshot_at)
+        .exclude(model_version=model_version)
+    )
+
+
+def start_run(model_version: ModelVersion, chunk_size: Optional[int] = None) -> RescoreRun:
+    snapshot_at = timezone.now()
+    return RescoreRun.objects.create(
+        model_version=model_version,
+        chunk_size=chunk_size or settings.DIAGNOSIS_RESCORE["CHUNK_SIZE"],
+        snapshot_at=snapshot_at,
+        total=stale_diagnoses(model_version, snapshot_at).count(),
+    )
+
+
+def _remaining(run: RescoreRun):
+    queryset = stale_diagnoses(run.model_version, run.snapshot_at)
+    if run.cursor_created_at is not None:
+        queryset = queryset.filter(
+            Q(created_at__gt=run.cursor_created_at) | Q(created_at=run.cursor_created_at, id__gt=run.cursor_id)
+        )
+    return queryset.select_related("patient").prefetch_related("extra_images").order_by("created_at", "id")
+
+
+def _chunks(records: Iterable, size: int) -> Iterator[List]:
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+
+def _apply_chunk(run: RescoreRun, chunk: List[Diagnosis], orchestrator) -> None:
+    started = time.perf_counter()
+    # نفس الصور: تقرير الجودة المحفوظ لا يتغير، فلا كتابة لكل تشخيص في الدفعة
+    results, failures = orchestrator.run_batch_from_django_models(chunk, save_quality=False)
+    updated = [diagnosis for diagnosis in chunk if str(diagnosis.id) in results]
+    for diagnosis in updated:
+        diagnosis.result = results[str(diagnosis.id)]
+        diagnosis.model_version = run.model_version
+    for diagnosis_id, error in failures.items():
+        logger.warning(f"Re-scoring diagnosis {diagnosis_id} failed; keeping its previous result: {error}")
+
+    run.processed += len(updated)
+    run.failed += len(chunk) - len(updated)
+    run.cursor_created_at, run.cursor_id = chunk[-1].created_at, chunk[-1].id
+    run.elapsed_seconds += time.perf_counter() - started
+    with transaction.atomic():
+        Diagnosis.objects.bulk_update(updated, ["result", "model_version"])
+        run.save(update_fields=[
+            "processed", "failed", "cursor_created_at", "cursor_id", "elapsed_seconds", "updated_at",
+        ])
+
+
+def run_chunks(
+    run: RescoreRun, orchestrator, deadline: Optional[float] = None,
+    on_chunk: Optional[Callable[[RescoreRun], None]] = None,
+) -> bool:
+    """
+    يعالج الدفعات المتبقية حتى الانتهاء، أو حتى تجاوز deadline (time.monotonic)، أو إيقاف التشغيل
+    (status = PAUSED من أمر الإدارة). يعيد True عند اكتمال التشغيل.
+    """
+    chunks = _chunks(_remaining(run).iterator(chunk_size=run.chunk_size), run.chunk_size)
+    for index, chunk in enumerate(chunks):
+        # المهلة تُفحص بعد جلب الدفعة التالية: التوقف يعني وجود عمل متبقٍ فعلًا
+        if index and deadline is not None and time.monotonic() >= deadline:
+            return False
+        _apply_chunk(run, chunk, orchestrator)
+        if on_chunk:
+            on_chunk(run)
+        status = RescoreRun.objects.values_list("status", flat=True).get(pk=run.pk)
+        if status != RescoreRun.Status.RUNNING:
+            logger.info(f"Rescore run {run.pk} is {status}; stopping after chunk.")
+            return False
+
+    run.status, run.finished_at = RescoreRun.Status.COMPLETED, timezone.now()
+    run.save(update_fields=["status", "finished_at", "updated_at"])
+    logger.info(
+        f"Rescore run {run.pk} completed: {run.processed} re-scored, {run.failed} failed "
+        f"in {run.elapsed_seconds:.0f} s."
+    )
+    return True
+
+
+def describe(run: RescoreRun) -> str:
+    """سطر حالة يعرض التقدم والإنتاجية والزمن المتبقي المقدر."""
+    eta = run.eta_seconds
+    return (
+        f"Run {run.pk} [{run.status}] {run.model_version}: "
+        f"{run.processed + run.failed}/{run.total} ({run.failed} failed), "
+        f"{run.throughput:.2f} diagnoses/s, ETA {f'{eta:.0f} s' if eta is not None else 'n/a'}"
+    )
@@ -0,0 +1,193 @@
+# apps/diagnosis/resumable.py
+"""
+بروتوكول رفع قابل للاستئناف على نمط tus (Creation + Checksum + Termination) لصور قاع العين.
+- POST ينشئ جلسة بطول معلوم (Upload-Length).
+- HEAD يعيد Upload-Offset الحالي ليستأنف العميل من حيث توقف.
+- PATCH يرسل جزءًا عند Upload-Offset مع Upload-Checksum (sha256). الجزء يُكتب إلى ملف مؤقت
+  مع حساب البصمة أثناء القراءة، ثم يُحفظ ككائن مستقل في التخزين (يعمل على نظام الملفات وS3).
+- عند اكتمال الطول تُجمع الأجزاء تدفقيًا في الملف النهائي دون تحميله كاملًا في الذاكرة،
+  ويُحفظ في التخزين بعنوان المحتوى (الجلسة المكتملة تملك مرجعًا واحدًا ينتقل إلى التشخيص).
+"""
+import base64
+import hashlib
+import io
+import logging
+import tempfile
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .content_store import fundus_image_storage, release
+from .models import UploadSession
+from .uploads import ALLOWED_CONTENT_TYPES, new_upload_key, verify_uploaded
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+_READ_SIZE = 64 * 1024
+
+
+class UploadProtocolError(Exception):
+    """رفض طلب في البروتوكول؛ status هو رمز HTTP المقابل في tus."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def _part_key(session: UploadSession, offset: int) -> str:
+    return f"uploads/parts/{session.id}/{offset:012d}"
+
+
+def create_session(owner, length: int, content_type: str) -> UploadSession:
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise UploadProtocolError(415, f"Unsupported content type '{content_type}'.")
+    if not 0 < length <= settings.DIAGNOSIS_UPLOAD["MAX_BYTES"]:
+        raise UploadProtocolError(413, "Upload-Length is missing or exceeds the upload limit.")
+    return UploadSession.objects.create(
+        owner=owner,
+        content_type=content_type,
+        length=length,
+        expires_at=timezone.now() + timedelta(hours=settings.DIAGNOSIS_RESUMABLE["EXPIRES_HOURS"]),
+    )
+
+
+def parse_checksum(header: Optional[str]) -> bytes:
+    """يحلل ترويسة Upload-Checksum بصيغة tus: 'sha256 <base64>'."""
+    try:
+        algorithm, encoded = (header or "").split(" ", 1)
+        digest = base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise UploadProtocolError(400, "Upload-Checksum must be 'sha256 <base64 digest>'.")
+    if algorithm.lower() != "sha256":
+        raise UploadProtocolError(400, "Only sha256 checksums are supported.")
+    return digest
+
+
+def append_chunk(session: UploadSession, offset: int, stream, content_length: int, checksum: bytes) -> UploadSession:
+    """
+    يضيف جزءًا إلى الجلسة. يتحقق من التسلسل والحجم والبصمة، ثم يقدّم الإزاحة بتحديث شرطي
+    (offset القديم) حتى لا يتقدم طلبان متزامنان على نفس الإزاحة.
+    """
+    if session.status != UploadSession.Status.IN_PROGRESS:
+        raise UploadProtocolError(403, "Upload is already complete.")
+    if session.expires_at <= timezone.now():
+        raise UploadProtocolError(410, "Upload has expired.")
+    if offset != session.offset:
+        raise UploadProtocolError(409, f"Upload-Offset mismatch; server offset is {session.offset}.")
+    if not 0 < content_length <= settings.DIAGNOSIS_RESUMABLE["MAX_CHUNK_BYTES"]:
+        raise UploadProtocolError(413, "Chunk is empty or exceeds the maximum chunk size.")
+    if offset + content_length > session.length:
+        raise UploadProtocolError(413, "Chunk extends past Upload-Length.")
+
+    part_key = _part_key(session, offset)
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        digest, received = hashlib.sha256(), 0
+        while received < content_length:
+            block = stream.read(min(_READ_SIZE, content_length - received))
+            if not block:
+                break
+            digest.update(block)
+            spool.write(block)
+            received += len(block)
+
+        if received != content_length:
+            raise UploadProtocolError(400, "Request body is shorter than Content-Length.")
+        if digest.digest() != checksum:
+            raise UploadProtocolError(460, "Checksum mismatch.")
+
+        spool.seek(0)
+        if default_storage.exists(part_key):
+            default_storage.delete(part_key)
+        default_storage.save(part_key, File(spool, name=part_key))
+
+    new_offset = offset + content_length
+    advanced = UploadSession.objects.filter(id=session.id, offset=offset).update(
+        offset=new_offset, parts=session.parts + [offset], updated_at=timezone.now()
+    )
+    if not advanced:
+        default_storage.delete(part_key)
+        session.refresh_from_db()
+        raise UploadProtocolError(409, f"Upload-Offset mismatch; server offset is {session.offset}.")
+
+    session.refresh_from_db()
+    if session.offset == session.length:
+        _complete(session)
+    return session
+
+
+def _complete(session: UploadSession) -> None:
+    """يجمع الأجزاء في الملف النهائي ويتحقق منه، ثم يحذف الأجزاء."""
+    part_keys = [_part_key(session, offset) for offset in session.parts]
+    key = fundus_image_storage().save(
+        new_upload_key(session.content_type),
+        File(io.BufferedReader(_PartsReader(part_keys)), name="assembled"),
+    )
+    error = verify_uploaded(key)
+    if error:
+        release([key])
+        discard(session)
+        raise UploadProtocolError(422, f"Assembled file is invalid: {error}")
+
+    for part_key in part_keys:
+        default_storage.delete(part_key)
+    session.key = key
+    session.status = UploadSession.Status.COMPLETED
+    session.save(update_fields=["key", "status", "updated_at"])
+    logger.info(f"Resumable upload {session.id} assembled into {key} ({session.length} bytes).")
+
+
+def discard(session: UploadSession) -> None:
+    """إنهاء الجلسة (tus Termination): يحذف الأجزاء المخزنة والملف المجمّع غير المستخدم والسجل."""
+    if session.status == UploadSession.Status.IN_PROGRESS:
+        for offset in session.parts:
+            default_storage.delete(_part_key(session, offset))
+    elif session.status == UploadSession.Status.COMPLETED and session.key:
+        release([session.key])
+    session.delete()
+
+
+def purge_expired_sessions() -> int:
+    """يحذف الجلسات المنتهية التي لم تُستهلك بعد. الجلسات المستهلكة انتقل مرجع ملفها إلى التشخيص."""
+    expired = UploadSession.objects.filter(expires_at__lte=timezone.now()).exclude(
+        status=UploadSession.Status.CONSUMED
+    )
+    count = 0
+    for session in expired.iterator():
+        discard(session)
+        count += 1
+    return count
+
+
+class _PartsReader(io.RawIOBase):
+    """ملف للقراءة فقط يسلسل الأجزاء المخزنة واحدًا تلو الآخر، فلا يوجد في الذاكرة إلا مقطع صغير."""
+
+    def __init__(self, part_keys: List[str]):
+        self._pending = list(part_keys)
+        self._current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                if not self._pending:
+                    return 0
+                self._current = default_storage.open(self._pending.pop(0), "rb")
+            data = self._current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self._current.close()
+            self._current = None
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+        super().close()
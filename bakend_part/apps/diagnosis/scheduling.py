@@ -0,0 +1,151 @@
+# apps/diagnosis/scheduling.py
+"""
+منطق جدولة التشخيصات: توجيه كل أولوية إلى طابور Celery خاص بها،
+وترتيب الحجز بالدفعات بحسب أوزان الأولويات مع تقاسم عادل بين العيادات.
+"""
+import hashlib
+import logging
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from celery import current_app
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# أسماء المهام المسجلة في العامل. الويب يرسل المهام بالاسم حتى لا يستورد apps.diagnosis.tasks
+# (التي تجر خط أنابيب الذكاء الاصطناعي) في عمليات gunicorn.
+PROCESS_DIAGNOSIS_TASK = "apps.diagnosis.tasks.process_diagnosis"
+PROCESS_DIAGNOSIS_BATCH_TASK = "apps.diagnosis.tasks.process_diagnosis_batch"
+GENERATE_TILES_TASK = "apps.diagnosis.tasks.generate_diagnosis_tiles"
+RESCORE_PATIENT_TASK = "apps.diagnosis.tasks.rescore_patient_diagnoses"
+RESCORE_MODEL_VERSION_TASK = "apps.diagnosis.tasks.rescore_model_version"
+SHADOW_EVALUATE_TASK = "apps.diagnosis.tasks.shadow_evaluate"
+
+
+def queue_for_priority(priority: str) -> str:
+    """يعيد اسم طابور Celery المخصص لأولوية التشخيص."""
+    queues = settings.DIAGNOSIS_PRIORITY_QUEUES
+    return queues.get(priority, settings.CELERY_TASK_DEFAULT_QUEUE)
+
+
+def enqueue_task(task_name: str, kwargs: Optional[dict] = None, queue: Optional[str] = None):
+    """
+    يرسل مهمة إلى الوسيط باسمها دون استيراد وحدتها.
+    في وضع CELERY_TASK_ALWAYS_EAGER (التطوير) يتجاهل send_task هذا الإعداد، لذا ننفذ المهمة محليًا.
+    """
+    if current_app.conf.task_always_eager:
+        return current_app.tasks[task_name].apply_async(kwargs=kwargs, queue=queue)
+    return current_app.send_task(task_name, kwargs=kwargs, queue=queue)
+
+
+def schedule_diagnosis_processing(diagnosis_id: str, priority: str = "SAME_DAY"):
+    """
+    يجدول معالجة التشخيص على طابور أولويته حسب وضع العامل:
+    مهمة لكل تشخيص، أو مهمة دفعات تحجز كل ما هو معلق (DIAGNOSIS_BATCH_MODE).
+    ثم يجدول بناء بلاطات التكبير على طابور البلاطات منخفض الأولوية؛ لا تنتظر المعالجة ولا تنتظرها المعالجة.
+    """
+    queue = queue_for_priority(priority)
+    if settings.DIAGNOSIS_BATCH_MODE:
+        result = enqueue_task(PROCESS_DIAGNOSIS_BATCH_TASK, queue=queue)
+    else:
+        result = enqueue_task(PROCESS_DIAGNOSIS_TASK, kwargs={"diagnosis_id": diagnosis_id}, queue=queue)
+    enqueue_task(GENERATE_TILES_TASK, kwargs={"diagnosis_id": diagnosis_id}, queue=settings.DIAGNOSIS_TILES["QUEUE"])
+    return result
+
+
+def schedule_patient_rescoring(patient_id: str):
+    """
+    يجدول إعادة تقييم تشخيصات المريض بعد تعديل بياناته الديموغرافية. المهمة قصيرة (المرحلة الجدولية فقط)
+    والطبيب ينتظر نتيجتها، فتذهب إلى طابور المواعيد اليومية.
+    """
+    return enqueue_task(
+        RESCORE_PATIENT_TASK, kwargs={"patient_id": patient_id}, queue=queue_for_priority("SAME_DAY")
+    )
+
+
+def schedule_rescore_run(run_id: int):
+    """يجدول (أو يستأنف) تشغيل إعادة استدلال على طابوره منخفض الأولوية."""
+    return enqueue_task(
+        RESCORE_MODEL_VERSION_TASK, kwargs={"run_id": run_id}, queue=settings.DIAGNOSIS_RESCORE["QUEUE"]
+    )
+
+
+def shadow_sampled(diagnosis_id, rate: float) -> bool:
+    """عينة حتمية بحسب المعرف: نفس التشخيص يُختار أو لا في كل مرة (إعادة المحاولة لا تكرر العينة)."""
+    bucket = int(hashlib.sha256(str(diagnosis_id).encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < rate
+
+
+def schedule_shadow_evaluations(diagnosis_ids: Iterable) -> int:
+    """
+    يجدول التقييم الظلي لعينة DIAGNOSIS_SHADOW["SAMPLE_RATE"] من تشخيصات ناجحة على طابور الظل.
+    يُستدعى بعد حفظ النتائج؛ فشل الإرسال إلى الوسيط يُسجل فقط ولا يمس مهمة التشخيص. يعيد عدد المجدول.
+    """
+    config = settings.DIAGNOSIS_SHADOW
+    if not config["VERSION"] or config["SAMPLE_RATE"] <= 0:
+        return 0
+    scheduled = 0
+    for diagnosis_id in diagnosis_ids:
+        if not shadow_sampled(diagnosis_id, config["SAMPLE_RATE"]):
+            continue
+        try:
+            enqueue_task(SHADOW_EVALUATE_TASK, kwargs={"diagnosis_id": str(diagnosis_id)}, queue=config["QUEUE"])
+            scheduled += 1
+        except Exception:
+            logger.warning(f"Could not schedule shadow evaluation for {diagnosis_id}.", exc_info=True)
+    return scheduled
+
+
+def _clinic_round_robin(candidates: List[dict]) -> List[dict]:
+    """
+    يرتب مرشحي أولوية واحدة بالتناوب بين العيادات: دورة لكل عيادة في كل جولة،
+    والعيادة ذات أقدم طلب تبدأ الجولة. هكذا لا يحجب رفع جماعي من عيادة واحدة بقية العيادات.
+    المرشحون يجب أن يكونوا مرتبين بالأقدم أولًا.
+    """
+    per_clinic: "OrderedDict[object, List[dict]]" = OrderedDict()
+    for candidate in candidates:
+        per_clinic.setdefault(candidate["clinic_id"], []).append(candidate)
+
+    ordered = []
+    queues = list(per_clinic.values())
+    depth = 0
+    while queues:
+        queues = [q for q in queues if len(q) > depth]
+        ordered.extend(q[depth] for q in queues)
+        depth += 1
+    return ordered
+
+
+def fair_share_order(candidates: Iterable[dict], weights: Dict[str, int], limit: int) -> List:
+    """
+    يختار حتى limit معرّفًا من المرشحين (قواميس فيها id و priority و clinic_id، مرتبة بالأقدم أولًا).
+    - بين الأولويات: Smooth Weighted Round Robin بحسب weights، والمقاعد غير المستخدمة
+      لأولوية فارغة تذهب للأولويات الأخرى (لا تجويع للطلبات الجماعية ولا حجز للعاجلة).
+    - داخل كل أولوية: تناوب عادل بين العيادات.
+    """
+    by_priority = defaultdict(list)
+    for candidate in candidates:
+        by_priority[candidate["priority"]].append(candidate)
+
+    lanes = {
+        priority: _clinic_round_robin(items)
+        for priority, items in by_priority.items()
+        if weights.get(priority, 0) > 0
+    }
+    current = {priority: 0 for priority in lanes}
+    selected = []
+
+    while lanes and len(selected) < limit:
+        total = sum(weights[p] for p in lanes)
+        for priority in lanes:
+            current[priority] += weights[priority]
+        chosen = max(lanes, key=lambda p: current[p])
+        current[chosen] -= total
+
+        selected.append(lanes[chosen].pop(0)["id"])
+        if not lanes[chosen]:
+            del lanes[chosen]
+            del current[chosen]
+
+    return selected
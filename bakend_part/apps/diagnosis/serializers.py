@@ -1,18 +1,72 @@
 # apps/diagnosis/serializers.py
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from .models import Diagnosis
+from .models import Diagnosis, DiagnosisImage
+from .uploads import ALLOWED_CONTENT_TYPES
+
+def _extra_images_field():
+    # الصورة الأساسية تُحسب ضمن الحد الأقصى للقطات كل عين
+    return serializers.ListField(
+        child=serializers.ImageField(), write_only=True, required=False,
+        max_length=settings.DIAGNOSIS_MAX_IMAGES_PER_EYE - 1,
+    )
 
 class DiagnosisCreateSerializer(serializers.ModelSerializer):
-    """Serializer لإنشاء طلب تشخيص جديد، الآن يتطلب patient_id."""
+    """
+    Serializer لإنشاء طلب تشخيص جديد، الآن يتطلب patient_id.
+    left_extra_images / right_extra_images: لقطات إضافية اختيارية لكل عين (حقل مكرر في multipart).
+    """
     patient_id = serializers.UUIDField(write_only=True)
+    left_extra_images = _extra_images_field()
+    right_extra_images = _extra_images_field()
     
     class Meta:
         model = Diagnosis
-        fields = ('id', 'patient_id', 'left_fundus_image', 'right_fundus_image')
+        fields = (
+            'id', 'patient_id', 'left_fundus_image', 'right_fundus_image',
+            'left_extra_images', 'right_extra_images', 'priority',
+        )
         read_only_fields = ('id',)
 
+    def create(self, validated_data):
+        extras = [
+            (side, image) for side in DiagnosisImage.Side.values
+            for image in validated_data.pop(f'{side}_extra_images', [])
+        ]
+        with transaction.atomic():
+            diagnosis = super().create(validated_data)
+            for side, image in extras:
+                DiagnosisImage.objects.create(diagnosis=diagnosis, side=side, image=image)
+        return diagnosis
+
+class DiagnosisImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DiagnosisImage
+        fields = ('id', 'side', 'image', 'created_at')
+
+class DiagnosisPresignSerializer(serializers.Serializer):
+    """يطلب روابط رفع مباشر إلى التخزين لصورتي العينين."""
+    left_content_type = serializers.ChoiceField(choices=list(ALLOWED_CONTENT_TYPES), default='image/png')
+    right_content_type = serializers.ChoiceField(choices=list(ALLOWED_CONTENT_TYPES), default='image/png')
+
+class DiagnosisConfirmSerializer(serializers.Serializer):
+    """يؤكد اكتمال الرفع المباشر وينشئ طلب التشخيص من الملفات المرفوعة."""
+    upload_token = serializers.CharField()
+    patient_id = serializers.UUIDField()
+    priority = serializers.ChoiceField(choices=Diagnosis.Priority.choices, default=Diagnosis.Priority.SAME_DAY)
+
+class DiagnosisFromUploadsSerializer(serializers.Serializer):
+    """ينشئ طلب التشخيص من جلستي رفع قابل للاستئناف مكتملتين."""
+    left_upload = serializers.UUIDField()
+    right_upload = serializers.UUIDField()
+    patient_id = serializers.UUIDField()
+    priority = serializers.ChoiceField(choices=Diagnosis.Priority.choices, default=Diagnosis.Priority.SAME_DAY)
+
 class DiagnosisDetailSerializer(serializers.ModelSerializer):
     """Serializer لعرض التفاصيل الكاملة لسجل التشخيص."""
+    extra_images = DiagnosisImageSerializer(many=True, read_only=True)
+
     class Meta:
         model = Diagnosis
         fields = '__all__'
@@ -2,14 +2,21 @@
 # FILE: apps/diagnosis/services.py
 
 import os
+import threading
+import time
 import numpy as np
-from PIL import Image
 import logging
-from typing import Dict
+from typing import Dict, List, Tuple
 
-from apps.diagnosis.ai_pipeline.service import DiagnosisService as AIPipelineService
+from django.conf import settings
+from django.utils import timezone
+
+from .derivatives import SIDES, extra_inference_image, inference_image
+from .quality import assess, rejection_message
 from .repositories import DiagnosisRepository
-from .exceptions import ModelInferenceError, ModelLoadingError
+from .rescoring import serving_model_version
+from .timings import record, stage
+from .exceptions import ImageQualityError, ModelInferenceError, ModelLoadingError
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +34,28 @@ def get_orchestrator() -> 'DjangoDiagnosisOrchestrator':
         logger.info(f"Initializing DjangoDiagnosisOrchestrator for worker process PID: {pid}...")
         _ORCHESTRATOR_CACHE[pid] = DjangoDiagnosisOrchestrator()
         logger.info(f"Orchestrator for PID: {pid} is ready.")
-    return _ORCHESTRATOR_CACHE[pid]
+    orchestrator = _ORCHESTRATOR_CACHE[pid]
+    # كل مهمة تبدأ من هنا: يُطبق تبديل إصدار جاهز بين المهام، فالمهمة الجارية تكمل على الإصدار القديم
+    orchestrator.refresh()
+    return orchestrator
+
+# خدمة جدولية فقط لكل (عملية عامل, إصدار): إعادة التقييم الديموغرافي لتشخيص بإصداره الذي أنتجه
+_TABULAR_SERVICE_CACHE: Dict[tuple, object] = {}
+
+def get_tabular_service(model_version):
+    """
+    خدمة المرحلة الجدولية فقط لإصدار (ملفاته من local_dir)، أو لمسارات الإعدادات دون إصدار.
+    تُحمّل مرة واحدة لكل عامل؛ النماذج الصورية لا تُحمّل.
+    """
+    key = (os.getpid(), model_version.pk if model_version else None)
+    if key not in _TABULAR_SERVICE_CACHE:
+        from apps.diagnosis.ai_pipeline import config
+        from apps.diagnosis.ai_pipeline.service import DiagnosisService as AIPipelineService
+
+        from .artifacts import local_dir
+
+        _TABULAR_SERVICE_CACHE[key] = AIPipelineService.tabular_only(config.model_paths(local_dir(model_version)))
+    return _TABULAR_SERVICE_CACHE[key]
 # -----------------------------------------
 
 class DjangoDiagnosisOrchestrator:
@@ -38,53 +66,190 @@ class DjangoDiagnosisOrchestrator:
     ملاحظة: لا تقم بإنشاء نسخ من هذه الفئة مباشرة، استخدم دالة get_orchestrator()
     للاستفادة من نمط Singleton.
     """
-    def __init__(self):
-        # تهيئة خدمة الذكاء الاصطناعي الأساسية. سيتم استدعاء هذا مرة واحدة فقط لكل عامل.
-        self.ai_service = AIPipelineService()
+    def __init__(self, ai_service=None, model_version=None):
+        # تهيئة خدمة الذكاء الاصطناعي الأساسية بالإصدار المفعّل (أو المثبت). مرة واحدة فقط لكل عامل؛
+        # الإصدارات التالية تُحمّل في الخلفية (refresh). ai_service: خدمة جاهزة (مثل مرشح التقييم الظلي).
+        if ai_service is None:
+            model_version = self._target_version()
+            ai_service = self._load_service(model_version)
+        self.model_version = model_version
+        self.ai_service = ai_service
         self.repo = DiagnosisRepository()
+        self._swap_lock = threading.Lock()
+        self._pending = None  # (خدمة محملة ومسخنة, إصدارها) تنتظر التبديل
+        self._loader = None   # خيط التحميل الجاري
+        self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _target_version():
+        """الإصدار المثبت بالإعداد DIAGNOSIS_MODEL_RELOAD["PINNED_VERSION"]، وإلا آخر إصدار مفعّل."""
+        return serving_model_version()
+
+    @staticmethod
+    def _load_service(model_version):
+        """يحمّل الرسم الكامل لإصدار (ملفاته في ModelVersion.file_path)، أو من مسارات الإعدادات دون إصدار."""
+        # استيراد متأخر: خط أنابيب الذكاء الاصطناعي يستورد tensorflow و cv2، ولا نريد تحميلهما
+        # إلا في العامل الذي يشغل النماذج فعلًا (وليس في عمليات الويب).
+        from apps.diagnosis.ai_pipeline import config
+        from apps.diagnosis.ai_pipeline.service import DiagnosisService as AIPipelineService
+
+        from .artifacts import local_dir
 
-    def _preprocess_image_for_pipeline(self, image_field) -> np.ndarray:
-        """يقرأ ImageField من Django ويحوله إلى مصفوفة NumPy."""
+        return AIPipelineService(config.model_paths(local_dir(model_version)))
+
+    def refresh(self) -> None:
+        """
+        إعادة التحميل الساخن: يطبق تبديلًا جاهزًا، ثم (مرة كل POLL_SECONDS على الأكثر) يقارن الإصدار
+        الجاري بالإصدار الهدف، ويبدأ تحميل الجديد وتسخينه في خيط خلفي عند الاختلاف. التبديل نفسه
+        تبديل مرجعين تحت قفل؛ المهام الجارية تحتفظ بمرجع الخدمة القديمة حتى تنتهي.
+        """
+        self._apply_pending_swap()
+        config = settings.DIAGNOSIS_MODEL_RELOAD
+        if not config["ENABLED"] or time.monotonic() - self._checked_at < config["POLL_SECONDS"]:
+            return
+        self._checked_at = time.monotonic()
+        target = self._target_version()
+        current_id = self.model_version.pk if self.model_version else None
+        if target is None or target.pk == current_id:
+            return
+        with self._swap_lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            if self._pending is not None and self._pending[1].pk == target.pk:
+                return
+            logger.info(f"Model version changed to {target}; loading it in the background.")
+            self._loader = threading.Thread(
+                target=self._load_in_background, args=(target,), name=f"model-loader-{target.pk}", daemon=True
+            )
+            self._loader.start()
+
+    def _load_in_background(self, model_version) -> None:
+        started = time.perf_counter()
         try:
-            image = Image.open(image_field)
-            # قد تحتاج إلى تحويلات إضافية هنا إذا لم تكن جزءًا من خط الأنابيب
-            # مثال: image = image.convert('RGB')
-            return np.array(image)
+            service = self._load_service(model_version)
+            service.warm_up()
+        except Exception as e:
+            # الإصدار الجاري يستمر في الخدمة؛ المحاولة تتكرر في الاستطلاع التالي
+            logger.error(f"Failed to load model version {model_version}: {e}", exc_info=True)
+            return
+        with self._swap_lock:
+            self._pending = (service, model_version)
+        logger.info(f"Model version {model_version} loaded and warmed up in {time.perf_counter() - started:.1f} s.")
+
+    def _apply_pending_swap(self) -> None:
+        with self._swap_lock:
+            if self._pending is None:
+                return
+            old_service = self.ai_service
+            self.ai_service, self.model_version = self._pending
+            self._pending = None
+        logger.info(f"Swapped the diagnosis pipeline to model version {self.model_version}.")
+        # النماذج المخزنة للإصدار القديم تُحرر عند انتهاء آخر مهمة تستخدمه
+        old_paths = getattr(old_service, "model_paths", None)
+        if old_paths:
+            from apps.diagnosis.ai_pipeline.models.classifier import EyesModel
+
+            new_paths = self.ai_service.model_paths
+            EyesModel.evict(
+                {old_paths["multi_class"], old_paths["tabular"], *old_paths["experts"]}
+                - {new_paths["multi_class"], new_paths["tabular"], *new_paths["experts"]}
+            )
+
+    def _preprocess_image_for_pipeline(self, diagnosis_record, side: str) -> np.ndarray:
+        """
+        يقرأ نسخة الاستدلال المصغرة لعين واحدة ويحولها إلى مصفوفة NumPy.
+        أول تشغيل لسجل جديد يولد النسخة من الأصل (مع الصورة المصغرة)؛ التشغيلات التالية لا تفك ترميز الأصل.
+        """
+        image_field = getattr(diagnosis_record, f"{side}_fundus_image")
+        try:
+            return np.array(inference_image(diagnosis_record, side))
         except Exception as e:
             logger.error(f"Failed to preprocess image {image_field.name}: {e}", exc_info=True)
             raise IOError(f"Could not read or process image file: {image_field.name}")
 
-    def run_diagnosis_from_django_model(self, diagnosis_id: str) -> dict:
+    def _load_eye_shots(self, diagnosis_record) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        نسخ الاستدلال لكل لقطات العينين: {side: {label: image}}. الصورة الأساسية بالوسم "left"/"right"،
+        واللقطات الإضافية (DiagnosisImage) بالوسم "left#2" و "left#3" ... بترتيب رفعها.
+        """
+        shots = {side: {side: self._preprocess_image_for_pipeline(diagnosis_record, side)} for side in SIDES}
+        for extra in diagnosis_record.extra_images.all():
+            label = f"{extra.side}#{len(shots[extra.side]) + 1}"
+            try:
+                shots[extra.side][label] = np.array(extra_inference_image(extra))
+            except Exception as e:
+                logger.error(f"Failed to preprocess image {extra.image.name}: {e}", exc_info=True)
+                raise IOError(f"Could not read or process image file: {extra.image.name}")
+        return shots
+
+    def _prepare_eyes(self, diagnosis_record, save_quality: bool = True, bulk: bool = False) -> dict:
+        """
+        يقرأ نسخ الاستدلال لكل لقطات العينين ويفحص جودتها قبل تشغيل النماذج، ويحفظ التقرير على السجل
+        (bulk=True: على السجل في الذاكرة فقط، ويكتبه المستدعي مع النتائج).
+        اللقطات المرفوضة تُستبعد، والعين التي لا تبقى لها لقطة صالحة تثير ImageQualityError، فلا تُستهلك
+        تمريرة استدلال على صور غير صالحة. يعيد مدخلات حالة لـ run_diagnosis_batch: لقطات كل عين
+        وأوزانها (درجة التركيز) للتجميع بالجودة.
+        """
+        shots = self._load_eye_shots(diagnosis_record)
+        case = {}
+        if not settings.DIAGNOSIS_QUALITY["ENABLED"]:
+            for side in SIDES:
+                case[f"{side}_eye_imgs"] = list(shots[side].values())
+            return case
+
+        with stage("quality"):
+            reports = {label: assess(image) for side in SIDES for label, image in shots[side].items()}
+        if save_quality:
+            diagnosis_record.quality = {label: report.as_dict() for label, report in reports.items()}
+            if not bulk:
+                with stage("db_write"):
+                    self.repo.save_quality(diagnosis_record.id, diagnosis_record.quality)
+        rejected = {}
+        for side in SIDES:
+            usable = [label for label in shots[side] if reports[label].passed]
+            if not usable:
+                rejected.update({label: reports[label] for label in shots[side]})
+            case[f"{side}_eye_imgs"] = [shots[side][label] for label in usable]
+            case[f"{side}_weights"] = [reports[label].sharpness for label in usable]
+        if rejected:
+            raise ImageQualityError(rejection_message(rejected))
+        return case
+
+    def run_diagnosis_from_django_model(self, diagnosis_id: str, save_quality: bool = True) -> dict:
         """
         ينفذ التشخيص الكامل باستخدام سجل Diagnosis من قاعدة البيانات.
         يعيد قاموس النتائج عند النجاح، أو يثير استثناءً عند الفشل.
+        save_quality=False لا يكتب على السجل (إعادة تشغيل للمقارنة، مثل التقييم الظلي).
         """
         try:
             diagnosis_record = self.repo.get_by_id(diagnosis_id)
             if not diagnosis_record:
                 # هذا خطأ فادح غير قابل للاسترداد يجب أن يوقف المهمة
                 raise ValueError(f"Diagnosis record with ID {diagnosis_id} not found.")
+            if diagnosis_record.started_at:
+                record("queue_wait", (diagnosis_record.started_at - diagnosis_record.created_at).total_seconds() * 1000)
 
             logger.info(f"Preparing inputs for diagnosis_id={diagnosis_id}")
-            left_eye_img = self._preprocess_image_for_pipeline(diagnosis_record.left_fundus_image)
-            right_eye_img = self._preprocess_image_for_pipeline(diagnosis_record.right_fundus_image)
-            
-            patient = diagnosis_record.patient
-            demographics = {
-                "age": patient.age,
-                "gender": 1 if patient.gender == 'FEMALE' else 0
-            }
+            case = self._prepare_eyes(diagnosis_record, save_quality=save_quality)
+            case["demographics"] = self._build_demographics(diagnosis_record.patient)
 
             logger.info(f"Running AI pipeline for diagnosis_id={diagnosis_id}")
-            result_dict = self.ai_service.run_diagnosis(
-                left_eye_img=left_eye_img,
-                right_eye_img=right_eye_img,
-                demographics=demographics
-            )
+            if len(case["left_eye_imgs"]) == len(case["right_eye_imgs"]) == 1:
+                result_dict = self.ai_service.run_diagnosis(
+                    left_eye_img=case["left_eye_imgs"][0],
+                    right_eye_img=case["right_eye_imgs"][0],
+                    demographics=case["demographics"]
+                )
+            else:
+                # عدة لقطات: تمريرة واحدة لكل نموذج على كل اللقطات ثم التجميع لكل عين
+                result_dict = self.ai_service.run_diagnosis_batch([case])[0]
             
             logger.info(f"AI pipeline completed successfully for diagnosis_id={diagnosis_id}")
             return result_dict
 
+        except ImageQualityError as e:
+            logger.warning(f"Diagnosis {diagnosis_id} rejected before inference: {e}")
+            raise
         except (ModelInferenceError, ModelLoadingError, ValueError, IOError) as e:
             # التقط الأخطاء المتوقعة وسجلها وأثرها مجددًا
             logger.error(f"A predictable error occurred during diagnosis for {diagnosis_id}: {e}", exc_info=True)
@@ -95,6 +260,81 @@ class DjangoDiagnosisOrchestrator:
             # أثر الخطأ مجددًا ليتم التعامل معه كخطأ قابل لإعادة المحاولة في طبقة المهام
             raise
 
+    @staticmethod
+    def _build_demographics(patient, on=None) -> dict:
+        """
+        يحوّل بيانات المريض إلى المدخلات الديموغرافية التي يتوقعها خط الأنابيب.
+        on: تاريخ يُحسب العمر فيه (تاريخ التشخيص عند إعادة التقييم)، وإلا فالعمر اليوم.
+        """
+        return {
+            "age": patient.age_on(on) if on else patient.age,
+            "gender": 1 if patient.gender == 'FEMALE' else 0
+        }
+
+    def rescore_from_django_models(self, diagnosis_records: List, ai_service=None) -> Dict[str, dict]:
+        """
+        يعيد تقييم تشخيصات ناجحة (مع patient محمّل مسبقًا) بالبيانات الديموغرافية الحالية للمريض،
+        بتشغيل المرحلة الجدولية فقط على مخرجات النماذج الصورية المحفوظة في result.
+        العمر يُحسب في تاريخ إنشاء التشخيص. يعيد النتائج الجديدة حسب المعرف؛ السجلات التي لا تحوي
+        evidence_vector تُتخطى. ai_service: خدمة إصدار آخر (get_tabular_service) بدل الخدمة المحمّلة.
+        """
+        records = [record for record in diagnosis_records if (record.result or {}).get("evidence_vector")]
+        if not records:
+            return {}
+        cases = [
+            {
+                "result": record.result,
+                "demographics": self._build_demographics(record.patient, timezone.localdate(record.created_at)),
+            }
+            for record in records
+        ]
+        reports = (ai_service or self.ai_service).rescore_batch(cases)
+        return {str(record.id): report for record, report in zip(records, reports)}
+
+    def run_batch_from_django_models(
+        self, diagnosis_records: List, save_quality: bool = True
+    ) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        """
+        ينفذ التشخيص لمجموعة من سجلات Diagnosis (مع patient محمّل مسبقًا) في تمريرة واحدة.
+        يعيد (results, failures): قاموس النتائج حسب المعرف، وقاموس رسائل الخطأ للسجلات التي فشلت.
+        الصورة التالفة تُفشل سجلها فقط ولا تُسقط بقية الدفعة.
+        تقرير الجودة يوضع على كل سجل في الذاكرة (حقل quality) ويكتبه المستدعي مع النتائج بـ bulk_update؛
+        save_quality=False لا يغيّره (إعادة الاستدلال: الصور نفسها، والتقرير محفوظ).
+        """
+        results: Dict[str, dict] = {}
+        failures: Dict[str, str] = {}
+        cases, case_ids = [], []
+
+        for record in diagnosis_records:
+            record_id = str(record.id)
+            try:
+                case = self._prepare_eyes(record, save_quality=save_quality, bulk=True)
+                case["demographics"] = self._build_demographics(record.patient)
+                cases.append(case)
+                case_ids.append(record_id)
+            except (IOError, ImageQualityError) as e:
+                failures[record_id] = str(e)
+
+        if not cases:
+            return results, failures
+
+        logger.info(f"Running batched AI pipeline for {len(cases)} diagnoses")
+        # مرجع واحد للدفعة ومسار الرجوع معًا: كل السجلات تُقيَّم بنفس الإصدار
+        ai_service = self.ai_service
+        try:
+            reports = ai_service.run_diagnosis_batch(cases)
+            results.update(zip(case_ids, reports))
+        except ModelInferenceError:
+            # فشل الدفعة كاملة (مثلاً صورة بأبعاد غير متوقعة): نعود للمسار الفردي لعزل السجل المسبب
+            logger.warning("Batched inference failed; falling back to per-diagnosis inference.", exc_info=True)
+            for record_id, case in zip(case_ids, cases):
+                try:
+                    results[record_id] = ai_service.run_diagnosis_batch([case])[0]
+                except ModelInferenceError as e:
+                    failures[record_id] = str(e)
+
+        return results, failures
+
         
 # # apps/diagnosis/services.py
 # from apps.diagnosis.exceptions import ModelInferenceError, ModelLoadingError
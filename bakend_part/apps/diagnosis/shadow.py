@@ -0,0 +1,173 @@
+# apps/diagnosis/shadow.py
+"""
+التقييم الظلي (shadow) لإصدار نماذج مرشح قبل ترقيته: نسبة (SAMPLE_RATE) من التشخيصات الناجحة تُعاد
+بالإصدار المرشح DIAGNOSIS_SHADOW["VERSION"] في مهمة على طابور منخفض الأولوية، بعد حفظ نتيجة الطبيب،
+فلا يتأثر زمن الاستجابة. النتيجة وإحصاءات الاختلاف تُحفظ في ShadowResult ولا تغير Diagnosis.result.
+
+إعادة استخدام المخرجات الوسيطة: إن كانت ملفات النماذج الصورية السبعة في المرشح مطابقة بالمحتوى
+(SHA-256) لملفات الإصدار الذي أنتج التشخيص، فمدخلات المرحلة الجدولية لم تتغير؛ تُحمّل المرحلة الجدولية
+للمرشح فقط وتعمل على result["image_outputs"] المحفوظة (ميلي ثوانٍ بدل تمريرة صور كاملة).
+مع مخزن الملفات (DIAGNOSIS_MODEL_ARTIFACTS) تُقارن البصمات من manifest.json للإصدارين، فلا تُسحب ملفات
+إصدار الإنتاج إلى عقدة الظل لمجرد المقارنة.
+"""
+import hashlib
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.utils import timezone
+
+from . import artifacts
+from .exceptions import ModelArtifactError
+from .models import Diagnosis, ModelVersion, ShadowResult
+
+logger = logging.getLogger(__name__)
+
+FLIP_THRESHOLD = 0.5
+
+# مقيّم واحد لكل (عملية عامل, إصدار مرشح)، على نمط _ORCHESTRATOR_CACHE
+_EVALUATOR_CACHE: Dict[tuple, "ShadowEvaluator"] = {}
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path: str, mtime: float) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path) -> Optional[str]:
+    """بصمة ملف نموذج (مخزنة حسب المسار ووقت التعديل)، أو None إن لم يوجد."""
+    path = str(path)
+    try:
+        return _file_digest(path, os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def image_model_digests(model_version: Optional[ModelVersion]) -> List[Optional[str]]:
+    """
+    بصمات النماذج الصورية لإصدار (متعدد الفئات ثم الخبراء): من manifest.json في المخزن عند تفعيله دون سحب
+    الملفات، وإلا من مجلده المحلي (أو مسارات الإعدادات دون إصدار). None لملف غير موجود.
+    """
+    from apps.diagnosis.ai_pipeline import config
+
+    if model_version is not None and artifacts.enabled():
+        manifest = artifacts.read_manifest(model_version.file_path)
+        paths = config.model_paths(model_version.file_path)
+        names = [os.path.basename(path) for path in [paths["multi_class"], *paths["experts"]]]
+        return [manifest.get(name, {}).get("sha256") for name in names]
+    paths = config.model_paths(artifacts.local_dir(model_version))
+    return [file_digest(path) for path in [paths["multi_class"], *paths["experts"]]]
+
+
+def image_models_unchanged(production: List[Optional[str]], candidate: List[Optional[str]]) -> bool:
+    """هل النماذج الصورية متطابقة بالمحتوى بين إصدارين؟ (بصمات image_model_digests)"""
+    return None not in production and production == candidate
+
+
+def compare(production: dict, candidate: dict) -> dict:
+    """إحصاءات الاختلاف بين تقريرين (final_diagnosis: {فئة: احتمال نصي})."""
+    labels = list(production["final_diagnosis"])
+    p = np.array([float(production["final_diagnosis"][label]) for label in labels])
+    c = np.array([float(candidate["final_diagnosis"].get(label, 0.0)) for label in labels])
+    diff = np.abs(p - c)
+    production_top, candidate_top = labels[int(p.argmax())], labels[int(c.argmax())]
+    return {
+        "production_top": production_top,
+        "candidate_top": candidate_top,
+        "agrees": production_top == candidate_top,
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "flipped": [label for label, a, b in zip(labels, p, c) if (a >= FLIP_THRESHOLD) != (b >= FLIP_THRESHOLD)],
+    }
+
+
+class ShadowEvaluator:
+    """
+    يشغل الإصدار المرشح على تشخيصات مكتملة. يُحمّل المرحلة الجدولية دائمًا، والرسم الكامل فقط عند أول
+    تشخيص تختلف نماذجه الصورية عن المرشح.
+    """
+
+    def __init__(self, candidate: ModelVersion):
+        from apps.diagnosis.ai_pipeline import config
+
+        self.candidate = candidate
+        self.paths = config.model_paths(artifacts.local_dir(candidate))
+        # بصمات النماذج الصورية لكل إصدار إنتاج (مفتاحه pk)؛ ملفات الإصدار المنشور لا تتغير
+        self._digests = {candidate.pk: image_model_digests(candidate)}
+        self._tabular_service = None
+        self._orchestrator = None
+
+    def _tabular(self):
+        if self._tabular_service is None:
+            from apps.diagnosis.ai_pipeline.service import DiagnosisService
+
+            self._tabular_service = DiagnosisService.tabular_only(self.paths)
+        return self._tabular_service
+
+    def _full(self):
+        if self._orchestrator is None:
+            from apps.diagnosis.ai_pipeline.service import DiagnosisService
+            from .services import DjangoDiagnosisOrchestrator
+
+            self._orchestrator = DjangoDiagnosisOrchestrator(DiagnosisService(self.paths), self.candidate)
+        return self._orchestrator
+
+    def _image_digests(self, model_version: Optional[ModelVersion]) -> List[Optional[str]]:
+        if model_version is None:
+            return image_model_digests(None)
+        if model_version.pk not in self._digests:
+            self._digests[model_version.pk] = image_model_digests(model_version)
+        return self._digests[model_version.pk]
+
+    def can_reuse(self, diagnosis: Diagnosis) -> bool:
+        if not (diagnosis.result or {}).get("evidence_vector"):
+            return False
+        try:
+            production = self._image_digests(diagnosis.model_version)
+        except ModelArtifactError as e:
+            logger.info(f"Cannot compare image models of {diagnosis.model_version} with {self.candidate}: {e}")
+            return False
+        return image_models_unchanged(production, self._digests[self.candidate.pk])
+
+    def evaluate(self, diagnosis: Diagnosis) -> ShadowResult:
+        from .services import DjangoDiagnosisOrchestrator
+
+        started = time.perf_counter()
+        reused = self.can_reuse(diagnosis)
+        if reused:
+            demographics = DjangoDiagnosisOrchestrator._build_demographics(
+                diagnosis.patient, timezone.localdate(diagnosis.created_at)
+            )
+            candidate = self._tabular().rescore_batch([{"result": diagnosis.result, "demographics": demographics}])[0]
+        else:
+            candidate = self._full().run_diagnosis_from_django_model(str(diagnosis.id), save_quality=False)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        shadow, _ = ShadowResult.objects.update_or_create(
+            diagnosis=diagnosis, model_version=self.candidate,
+            defaults={
+                "production_version": diagnosis.model_version,
+                "result": candidate,
+                "reused_image_outputs": reused,
+                "elapsed_ms": round(elapsed_ms, 3),
+                **compare(diagnosis.result, candidate),
+            },
+        )
+        return shadow
+
+
+def get_evaluator(candidate: ModelVersion) -> ShadowEvaluator:
+    key = (os.getpid(), candidate.pk)
+    if key not in _EVALUATOR_CACHE:
+        # مرشح جديد يحل محل السابق في هذه العملية (ذاكرة رسم واحد فقط)
+        for stale in [k for k in _EVALUATOR_CACHE if k[0] == key[0]]:
+            del _EVALUATOR_CACHE[stale]
+        _EVALUATOR_CACHE[key] = ShadowEvaluator(candidate)
+    return _EVALUATOR_CACHE[key]
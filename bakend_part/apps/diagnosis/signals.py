@@ -0,0 +1,57 @@
+# apps/diagnosis/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from apps.users.models import Patient
+from .content_store import release
+from .models import Diagnosis, DiagnosisImage
+from .scheduling import schedule_patient_rescoring
+
+# حقول المريض التي تدخل خط الأنابيب (العمر والجنس)
+DEMOGRAPHIC_FIELDS = ("date_of_birth", "gender")
+
+
+def _demographics(patient) -> dict:
+    # __dict__ بدل getattr: الحقل المؤجل (only/defer) لا يستدعي استعلامًا، ويبقى None
+    return {field: patient.__dict__.get(field) for field in DEMOGRAPHIC_FIELDS}
+
+
+@receiver(post_delete, sender=Diagnosis)
+def release_diagnosis_images(sender, instance, **kwargs):
+    """يحرر مرجعي الصورتين عند حذف التشخيص (بما في ذلك الحذف المتسلسل مع المريض)."""
+    release([instance.left_fundus_image.name, instance.right_fundus_image.name])
+
+
+@receiver(post_delete, sender=DiagnosisImage)
+def release_extra_image(sender, instance, **kwargs):
+    """يحرر مرجع اللقطة الإضافية (يُستدعى أيضًا لكل لقطة عند حذف تشخيصها)."""
+    release([instance.image.name])
+
+
+@receiver(post_init, sender=Patient)
+def remember_demographics(sender, instance, **kwargs):
+    """يحفظ القيم المحملة من قاعدة البيانات لمقارنتها عند الحفظ (دون استعلام إضافي)."""
+    instance._loaded_demographics = _demographics(instance)
+
+
+@receiver(post_save, sender=Patient)
+def rescore_on_demographics_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    تصحيح تاريخ الميلاد أو الجنس يجدول إعادة تقييم تشخيصات المريض (المرحلة الجدولية فقط) بعد COMMIT.
+    التعديل عبر QuerySet.update لا يرسل إشارات، فيحتاج إلى جدولة rescore_patient_diagnoses يدويًا.
+    """
+    previous, current = instance._loaded_demographics, _demographics(instance)
+    instance._loaded_demographics = current
+    if created or not settings.DIAGNOSIS_RESCORE_ON_DEMOGRAPHICS_CHANGE:
+        return
+    if update_fields is not None and not set(update_fields) & set(DEMOGRAPHIC_FIELDS):
+        return
+    changed = [
+        field for field in DEMOGRAPHIC_FIELDS
+        if previous[field] is not None and current[field] is not None and previous[field] != current[field]
+    ]
+    if changed:
+        patient_id = str(instance.pk)
+        transaction.on_commit(lambda: schedule_patient_rescoring(patient_id))
@@ -6,14 +6,30 @@ from django.utils import timezone
 from django.conf import settings
 from redis import Redis
 import logging
+import time
 
-from .models import Diagnosis
-from .services import DjangoDiagnosisOrchestrator, get_orchestrator
+from .models import Diagnosis, ModelVersion, RescoreRun
+from .rescoring import describe, run_chunks, serving_model_version
+from .scheduling import schedule_rescore_run, schedule_shadow_evaluations
+from .shadow import get_evaluator
+from .services import DjangoDiagnosisOrchestrator, get_orchestrator, get_tabular_service
+from .repositories import DiagnosisRepository
+from .resumable import purge_expired_sessions
+from .tiles import generate_tiles
+from .timings import collect, record, stage
 from .exceptions import DiagnosisError, ModelInferenceError, ModelLoadingError
 
 logger = logging.getLogger(__name__)
-# تهيئة عميل Redis من إعدادات Celery
-redis_client = Redis.from_url(settings.CELERY_BROKER_URL)
+# عميل Redis من إعدادات Celery لقفل الحجز فقط؛ يُنشأ عند أول استخدام (الوسيط قد لا يكون Redis مع skip_locked)
+redis_client = None
+
+
+def get_redis_client() -> Redis:
+    global redis_client
+    if redis_client is None:
+        redis_client = Redis.from_url(settings.CELERY_BROKER_URL)
+    return redis_client
+
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def process_diagnosis(self, diagnosis_id: str):
@@ -23,44 +39,64 @@ def process_diagnosis(self, diagnosis_id: str):
     - Atomic: تستخدم المعاملات لضمان سلامة البيانات.
     - Robust: تتعامل مع الأخطاء القابلة وغير القابلة لإعادة المحاولة.
     """
-    lock_key = f"lock:diagnosis:{diagnosis_id}"
-    # يجب أن يكون timeout أطول بقليل من task_time_limit
-    lock = redis_client.lock(lock_key, timeout=660)
+    # مع DIAGNOSIS_CLAIM_BACKEND = "skip_locked" يكفي UPDATE شرطي واحد بدل قفل Redis + قفل الصف
+    use_redis_lock = settings.DIAGNOSIS_CLAIM_BACKEND == "redis"
+    lock = None
 
-    if not lock.acquire(blocking=False):
-        logger.warning(f"Skipping diagnosis_id={diagnosis_id}. Already locked by another worker.")
-        return {"status": "SKIPPED", "reason": "Already locked"}
+    if use_redis_lock:
+        lock_key = f"lock:diagnosis:{diagnosis_id}"
+        # يجب أن يكون timeout أطول بقليل من task_time_limit
+        lock = get_redis_client().lock(lock_key, timeout=660)
+
+        if not lock.acquire(blocking=False):
+            logger.warning(f"Skipping diagnosis_id={diagnosis_id}. Already locked by another worker.")
+            return {"status": "SKIPPED", "reason": "Already locked"}
 
     try:
-        with transaction.atomic():
-            # 1. قفل الصف لمنع التحديثات المتزامنة وضمان قراءة أحدث حالة
-            diagnosis = Diagnosis.objects.select_for_update().get(id=diagnosis_id)
+        claim_started = time.perf_counter()
+        if use_redis_lock:
+            with transaction.atomic():
+                # 1. قفل الصف لمنع التحديثات المتزامنة وضمان قراءة أحدث حالة
+                diagnosis = Diagnosis.objects.select_for_update().get(id=diagnosis_id)
 
-            # 2. التحقق من Idempotency: هل تمت معالجة هذه المهمة بالفعل أو هي قيد التشغيل؟
-            if diagnosis.status in [Diagnosis.Status.SUCCESS, Diagnosis.Status.FAILURE, Diagnosis.Status.RUNNING]:
-                logger.info(f"Skipping diagnosis_id={diagnosis_id}. Current state is '{diagnosis.status}'.")
-                return {"status": "SKIPPED", "reason": f"Final or running state: {diagnosis.status}"}
+                # 2. التحقق من Idempotency: هل تمت معالجة هذه المهمة بالفعل أو هي قيد التشغيل؟
+                if diagnosis.status in [Diagnosis.Status.SUCCESS, Diagnosis.Status.FAILURE, Diagnosis.Status.RUNNING]:
+                    logger.info(f"Skipping diagnosis_id={diagnosis_id}. Current state is '{diagnosis.status}'.")
+                    return {"status": "SKIPPED", "reason": f"Final or running state: {diagnosis.status}"}
 
-            # 3. تحديث الحالة إلى "قيد التشغيل" لتكون مرئية للأنظمة الأخرى
-            diagnosis.status = Diagnosis.Status.RUNNING
-            diagnosis.worker_id = self.request.id
-            diagnosis.started_at = timezone.now()
-            diagnosis.save()
+                # 3. تحديث الحالة إلى "قيد التشغيل" لتكون مرئية للأنظمة الأخرى
+                diagnosis.status = Diagnosis.Status.RUNNING
+                diagnosis.worker_id = self.request.id
+                diagnosis.started_at = timezone.now()
+                diagnosis.save()
+        elif not DiagnosisRepository().claim_one(diagnosis_id, self.request.id):
+            # 1-3. الحجز الشرطي فشل: السجل غير موجود أو قيد التشغيل أو في حالة نهائية
+            logger.info(f"Skipping diagnosis_id={diagnosis_id}. Not in a claimable state.")
+            return {"status": "SKIPPED", "reason": "Not in a claimable state"}
+        claim_ms = (time.perf_counter() - claim_started) * 1000
 
         # 4. تنفيذ منطق العمل الرئيسي (خارج المعاملة الأولية)
         
         orchestrator = get_orchestrator() # <-- استخدم الدالة للحصول على نسخة Singleton
-        result_data = orchestrator.run_diagnosis_from_django_model(diagnosis_id)
-        #orchestrator = DjangoDiagnosisOrchestrator()
-        #result_data = orchestrator.run_diagnosis_from_django_model(diagnosis_id)
+        model_version = orchestrator.model_version  # الإصدار الذي سيشغل هذه المهمة فعلًا
+        with collect() as timer:
+            record("claim", claim_ms)
+            result_data = orchestrator.run_diagnosis_from_django_model(diagnosis_id)
+            #orchestrator = DjangoDiagnosisOrchestrator()
+            #result_data = orchestrator.run_diagnosis_from_django_model(diagnosis_id)
 
-        # 5. تحديث الحالة النهائية عند النجاح
-        Diagnosis.objects.filter(id=diagnosis_id).update(
-            status=Diagnosis.Status.SUCCESS,
-            result=result_data,
-            finished_at=timezone.now()
-        )
+            # 5. تحديث الحالة النهائية عند النجاح
+            with stage("db_write"):
+                Diagnosis.objects.filter(id=diagnosis_id).update(
+                    status=Diagnosis.Status.SUCCESS,
+                    result=result_data,
+                    model_version=model_version,
+                    finished_at=timezone.now()
+                )
+        # أزمنة المراحل بتحديث ثانٍ رخيص، حتى يشمل db_write الكتابة النهائية نفسها
+        Diagnosis.objects.filter(id=diagnosis_id).update(stage_timings=timer.as_dict())
         logger.info(f"Successfully processed diagnosis_id={diagnosis_id}.")
+        schedule_shadow_evaluations([diagnosis_id])
         return {"status": "SUCCESS", "diagnosis_id": diagnosis_id}
 
     except (ModelInferenceError, ModelLoadingError, DiagnosisError, ValueError) as e:
@@ -90,7 +126,225 @@ def process_diagnosis(self, diagnosis_id: str):
 
     finally:
         # 6. تحرير القفل دائمًا لضمان عدم بقاء النظام محجوزًا
-        lock.release()
+        if lock is not None:
+            lock.release()
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def process_diagnosis_batch(self, batch_size: int = None):
+    """
+    مهمة Celery تحجز حتى N تشخيصًا معلقًا وتعالجها في تمريرة استدلال واحدة.
+    - الحجز: DiagnosisRepository.claim_pending (SKIP LOCKED) ينقل الدفعة إلى RUNNING ذريًا،
+      فلا يمكن لعاملين حجز نفس السجل، و process_diagnosis يتخطى أي سجل في حالة RUNNING.
+    - الكتابة: تُكتب كل النتائج (نجاحًا أو فشلًا) مع تقارير الجودة بعملية bulk_update واحدة.
+    - الأزمنة: لكل سجل حصته من أزمنة مراحل الدفعة (المجموع مقسومًا على عدد السجلات) مع انتظاره في الطابور،
+      وتُكتب بـ bulk_update ثانٍ بعد الكتابة النهائية حتى تشمل db_write زمنها.
+    """
+    batch_size = batch_size or settings.DIAGNOSIS_BATCH_SIZE
+
+    # 1. حجز الدفعة بشكل ذري
+    claim_started = time.perf_counter()
+    claimed = DiagnosisRepository().claim_pending(batch_size, self.request.id)
+    if not claimed:
+        logger.info("No pending diagnoses to claim.")
+        return {"status": "SKIPPED", "reason": "No pending diagnoses"}
+
+    claimed_ids = [diagnosis.id for diagnosis in claimed]
+    logger.info(f"Claimed {len(claimed)} diagnoses for batched processing.")
+
+    try:
+        # 2. تشغيل خط الأنابيب على الدفعة كاملة
+        orchestrator = get_orchestrator()
+        model_version = orchestrator.model_version
+        with collect() as timer:
+            record("claim", (time.perf_counter() - claim_started) * 1000)
+            results, failures = orchestrator.run_batch_from_django_models(claimed)
+
+            # 3. كتابة النتائج دفعة واحدة
+            finished_at = timezone.now()
+            for diagnosis in claimed:
+                key = str(diagnosis.id)
+                diagnosis.finished_at = finished_at
+                if key in results:
+                    diagnosis.status = Diagnosis.Status.SUCCESS
+                    diagnosis.result = results[key]
+                    diagnosis.model_version = model_version
+                    diagnosis.error_message = None
+                else:
+                    diagnosis.status = Diagnosis.Status.FAILURE
+                    diagnosis.result = None
+                    diagnosis.error_message = failures.get(key, "Diagnosis was not processed.")
+            with stage("db_write"):
+                Diagnosis.objects.bulk_update(
+                    claimed, ['status', 'result', 'quality', 'model_version', 'error_message', 'finished_at']
+                )
+
+        # 4. أزمنة المراحل للناجحة بتحديث ثانٍ رخيص، حتى تشمل db_write الكتابة السابقة
+        shares = timer.as_dict(len(claimed))
+        succeeded = [diagnosis for diagnosis in claimed if str(diagnosis.id) in results]
+        for diagnosis in succeeded:
+            queue_wait_ms = (diagnosis.started_at - diagnosis.created_at).total_seconds() * 1000
+            diagnosis.stage_timings = {"queue_wait": round(queue_wait_ms, 2), **shares}
+        Diagnosis.objects.bulk_update(succeeded, ['stage_timings'])
+
+        logger.info(f"Batch finished: {len(results)} succeeded, {len(claimed) - len(results)} failed.")
+        schedule_shadow_evaluations(results)
+        return {"status": "SUCCESS", "succeeded": len(results), "failed": len(claimed) - len(results)}
+
+    except (ModelInferenceError, ModelLoadingError, DiagnosisError, ValueError) as e:
+        logger.error(f"NON-RETRIABLE error for batch {claimed_ids}: {e}", exc_info=True)
+        Diagnosis.objects.filter(id__in=claimed_ids).update(
+            status=Diagnosis.Status.FAILURE,
+            error_message=str(e),
+            finished_at=timezone.now()
+        )
+        return {"status": "FAILURE", "error": str(e)}
+
+    except SoftTimeLimitExceeded:
+        logger.error(f"Soft time limit exceeded for batch {claimed_ids}.")
+        Diagnosis.objects.filter(id__in=claimed_ids).update(
+            status=Diagnosis.Status.FAILURE,
+            error_message="Processing time limit exceeded.",
+            finished_at=timezone.now()
+        )
+        return {"status": "FAILURE", "error": "Time limit exceeded"}
+
+    except Exception as e:
+        # أعد السجلات إلى RETRY لتُحجز من جديد في المحاولة التالية
+        logger.exception(f"RETRIABLE error for batch {claimed_ids}. Retrying...")
+        Diagnosis.objects.filter(id__in=claimed_ids).update(status=Diagnosis.Status.RETRY)
+        self.retry(exc=e)
+
+
+@shared_task
+def generate_diagnosis_tiles(diagnosis_id: str):
+    """يبني هرم بلاطات التكبير لصورتي التشخيص بعد الرفع. يعيد عدد البلاطات المكتوبة (0 إن كانت موجودة)."""
+    diagnosis = Diagnosis.objects.filter(id=diagnosis_id).only("left_fundus_image", "right_fundus_image").first()
+    if diagnosis is None:
+        logger.warning(f"Skipping tiles for diagnosis_id={diagnosis_id}: record not found.")
+        return 0
+    return sum(generate_tiles(image.name) for image in (diagnosis.left_fundus_image, diagnosis.right_fundus_image))
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def rescore_patient_diagnoses(self, patient_id: str):
+    """
+    يعيد تقييم التشخيصات الناجحة لمريض تغيرت بياناته الديموغرافية (تاريخ الميلاد أو الجنس).
+    تعمل المرحلة الجدولية فقط على مخرجات النماذج الصورية المحفوظة، فلا تُقرأ الصور ولا تعمل الشبكات السبع.
+    كل تشخيص يُقيّم بالنموذج الجدولي لإصداره (model_version) لأن مخرجاته الصورية من ذلك الإصدار، فلا يتغير
+    model_version. القراءة والكتابة تحت select_for_update حتى لا تُكتب نتيجة فوق تحديث من عامل آخر،
+    والنماذج تُحمّل قبل القفل. تُكتب النتائج بعملية bulk_update واحدة. يعيد عدد التشخيصات المعاد تقييمها.
+    """
+    candidates = Diagnosis.objects.filter(patient_id=patient_id, status=Diagnosis.Status.SUCCESS, result__isnull=False)
+    version_ids = set(candidates.values_list("model_version_id", flat=True))
+    if not version_ids:
+        return 0
+    services = {}
+
+    def service_for(version_id):
+        if version_id not in services:
+            loaded = orchestrator.model_version.pk if orchestrator.model_version else None
+            services[version_id] = (
+                orchestrator.ai_service if version_id == loaded
+                else get_tabular_service(ModelVersion.objects.filter(pk=version_id).first() if version_id else None)
+            )
+        return services[version_id]
+
+    try:
+        orchestrator = get_orchestrator()
+        for version_id in version_ids:
+            service_for(version_id)
+        with transaction.atomic():
+            diagnoses = list(candidates.select_related("patient").select_for_update(of=("self",)))
+            results = {}
+            for version_id in {diagnosis.model_version_id for diagnosis in diagnoses}:
+                group = [diagnosis for diagnosis in diagnoses if diagnosis.model_version_id == version_id]
+                results.update(orchestrator.rescore_from_django_models(group, ai_service=service_for(version_id)))
+
+            rescored_at = timezone.now().isoformat()
+            rescored = [diagnosis for diagnosis in diagnoses if str(diagnosis.id) in results]
+            for diagnosis in rescored:
+                diagnosis.result = {**results[str(diagnosis.id)], "rescored_at": rescored_at}
+            Diagnosis.objects.bulk_update(rescored, ['result'])
+    except ModelInferenceError as e:
+        logger.error(f"Re-scoring failed for patient_id={patient_id}: {e}", exc_info=True)
+        return 0
+    except Exception as e:
+        logger.exception(f"RETRIABLE error while re-scoring patient_id={patient_id}. Retrying...")
+        raise self.retry(exc=e)
+    logger.info(f"Re-scored {len(rescored)} diagnoses for patient_id={patient_id}.")
+    return len(rescored)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def rescore_model_version(self, run_id: int):
+    """
+    يعالج دفعات تشغيل إعادة استدلال (RescoreRun) لمدة DIAGNOSIS_RESCORE["TASK_SECONDS"] ثم يعيد جدولة
+    نفسه على نفس الطابور، فلا تتجاوز مهمة واحدة حد الزمن ويمكن إيقاف التشغيل أو استئنافه بين الدفعات.
+    """
+    run = RescoreRun.objects.select_related("model_version").filter(pk=run_id).first()
+    if run is None or run.status != RescoreRun.Status.RUNNING:
+        logger.info(f"Skipping rescore run {run_id}: not running.")
+        return {"status": "SKIPPED"}
+    orchestrator = get_orchestrator()
+    if orchestrator.model_version != run.model_version:
+        # الإصدار الهدف لم يُحمّل بعد في هذا العامل (إعادة التحميل الساخن في الخلفية). الانتظار محدود
+        # بـ LOAD_WAIT_SECONDS، وإن لم يعد الهدف هو الإصدار المخدوم فلن يُحمّل أبدًا: يُوقف التشغيل مؤقتًا
+        poll = settings.DIAGNOSIS_MODEL_RELOAD["POLL_SECONDS"]
+        max_waits = max(settings.DIAGNOSIS_RESCORE["LOAD_WAIT_SECONDS"] // poll, 1)
+        serving = serving_model_version()
+        if serving != run.model_version or self.request.retries >= max_waits:
+            RescoreRun.objects.filter(pk=run.pk, status=RescoreRun.Status.RUNNING).update(
+                status=RescoreRun.Status.PAUSED
+            )
+            logger.warning(
+                f"Paused rescore run {run_id}: this worker serves {orchestrator.model_version} and the target "
+                f"{run.model_version} is not loaded (workers serve {serving}). Resume it once the target is active."
+            )
+            return {"status": RescoreRun.Status.PAUSED}
+        logger.info(f"Rescore run {run_id} waits for model version {run.model_version} to load.")
+        raise self.retry(countdown=poll, max_retries=max_waits)
+    try:
+        deadline = time.monotonic() + settings.DIAGNOSIS_RESCORE["TASK_SECONDS"]
+        finished = run_chunks(run, orchestrator, deadline=deadline)
+    except Exception as e:
+        logger.exception(f"RETRIABLE error in rescore run {run_id}. Retrying...")
+        self.retry(exc=e)
+
+    logger.info(describe(run))
+    run.refresh_from_db(fields=["status"])
+    if not finished and run.status == RescoreRun.Status.RUNNING:
+        schedule_rescore_run(run.pk)
+    return {"status": run.status, "processed": run.processed, "failed": run.failed}
+
+
+@shared_task
+def shadow_evaluate(diagnosis_id: str):
+    """
+    يشغل الإصدار المرشح DIAGNOSIS_SHADOW["VERSION"] على تشخيص ناجح ويحفظ ShadowResult. تعمل على طابور
+    الظل بعد حفظ النتيجة، وأي خطأ فيها يُسجل فقط: التقييم الظلي لا يغير التشخيص ولا يعيد المحاولة.
+    """
+    candidate = ModelVersion.objects.filter(pk=settings.DIAGNOSIS_SHADOW["VERSION"]).first()
+    diagnosis = (
+        Diagnosis.objects.select_related("patient", "model_version").prefetch_related("extra_images")
+        .filter(id=diagnosis_id, status=Diagnosis.Status.SUCCESS).first()
+    )
+    if candidate is None or diagnosis is None or diagnosis.model_version_id == candidate.pk:
+        return {"status": "SKIPPED"}
+    try:
+        shadow = get_evaluator(candidate).evaluate(diagnosis)
+    except Exception as e:
+        logger.warning(f"Shadow evaluation of {diagnosis_id} with {candidate} failed: {e}", exc_info=True)
+        return {"status": "FAILURE", "error": str(e)}
+    return {"status": "SUCCESS", "agrees": shadow.agrees, "reused_image_outputs": shadow.reused_image_outputs}
+
+
+@shared_task
+def purge_expired_upload_sessions():
+    """مهمة دورية (عبر Celery beat) تحذف جلسات الرفع المنتهية غير المستخدمة وأجزاءها من التخزين."""
+    purged = purge_expired_sessions()
+    logger.info(f"Purged {purged} expired upload sessions.")
+    return purged
 
         
 # from celery import shared_task
@@ -0,0 +1,55 @@
+# apps/diagnosis/tests/base.py
+"""أدوات مشتركة لاختبارات تطبيق التشخيص: صور مرفوعة صغيرة، وصنف أساس بطبيب ومريض وعميل API."""
+import io
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.diagnosis.models import Diagnosis, Patient
+
+
+def png_upload(name):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def png_bytes():
+    return png_upload('x.png').read()
+
+
+def fundus_upload(name, size=(1024, 768)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=(120, 40, 20)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class DoctorPatientTestCase(TestCase):
+    """
+    طبيب (self.user) ومريض من مرضاه (self.patient) وعميل API موثّق بالطبيب (self.api)، مع ذاكرة مؤقتة
+    نظيفة (حدود المعدل وتقديرات القبول). الأصناف الفرعية تغيّر username وبيانات المريض فقط.
+    """
+    username = 'doctor'
+    patient_name = 'Test Patient'
+    date_of_birth = date(1970, 1, 1)
+    gender = 'MALE'
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username=self.username, password='x')
+        self.patient = Patient.objects.create(
+            full_name=self.patient_name, date_of_birth=self.date_of_birth, gender=self.gender
+        )
+        self.patient.doctors.add(self.user)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def create_diagnosis(self, left='left.png', right='right.png', **fields):
+        return Diagnosis.objects.create(
+            patient=self.patient, physician=self.user, left_fundus_image=left, right_fundus_image=right, **fields
+        )
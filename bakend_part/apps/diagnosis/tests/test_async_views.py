@@ -0,0 +1,119 @@
+# apps/diagnosis/tests/test_async_views.py
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.diagnosis.models import Diagnosis
+
+from .base import DoctorPatientTestCase, png_upload
+
+
+class WebImportGraphTests(TestCase):
+    """يضمن أن عمليات الويب لا تستورد tensorflow أو cv2 (يحمّلهما العامل فقط)."""
+
+    def test_url_conf_does_not_import_ai_stack(self):
+        script = (
+            "import sys, django; django.setup(); "
+            "from django.conf import settings; from importlib import import_module; "
+            "import_module(settings.ROOT_URLCONF); import eye2_project.wsgi; "
+            "print('AI_MODULES=' + ','.join(m for m in ('tensorflow', 'keras', 'cv2') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parents[3], timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        loaded = [line for line in result.stdout.splitlines() if line.startswith('AI_MODULES=')]
+        self.assertEqual(loaded, ['AI_MODULES='], "AI stack imported by the web tier")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncDiagnosisViewTests(DoctorPatientTestCase):
+    """اختبارات نقطتي الإنشاء والاسترجاع غير المتزامنتين."""
+    username = 'async-doc'
+    patient_name = 'Async Patient'
+    gender = 'FEMALE'
+
+    def setUp(self):
+        super().setUp()
+        self.auth = self._bearer(self.user)
+
+    @staticmethod
+    def _bearer(user):
+        return {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    def _payload(self):
+        return {
+            'patient_id': str(self.patient.id),
+            'left_fundus_image': png_upload('left.png'),
+            'right_fundus_image': png_upload('right.png'),
+            'priority': Diagnosis.Priority.BULK,
+        }
+
+    @patch('apps.diagnosis.async_views.schedule_diagnosis_processing')
+    async def test_create_streams_upload_and_schedules(self, mock_schedule):
+        response = await self.async_client.post('/api/async/diagnoses/', self._payload(), headers=self.auth)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertIn('estimated_completion_at', body)
+        diagnosis = await Diagnosis.objects.aget(id=body['id'])
+        self.assertEqual(diagnosis.priority, Diagnosis.Priority.BULK)
+        self.assertTrue(diagnosis.left_fundus_image.name.endswith('.png'))
+        mock_schedule.assert_called_once_with(str(diagnosis.id), Diagnosis.Priority.BULK)
+
+    @patch('apps.diagnosis.async_views.schedule_diagnosis_processing')
+    @patch('apps.diagnosis.serializers.DiagnosisImage.objects.create', side_effect=DatabaseError)
+    async def test_create_rolls_back_when_extra_images_fail(self, mock_create_extra, mock_schedule):
+        payload = {**self._payload(), 'left_extra_images': [png_upload('left2.png')]}
+
+        with self.assertRaises(DatabaseError):
+            await self.async_client.post('/api/async/diagnoses/', payload, headers=self.auth)
+
+        self.assertFalse(await Diagnosis.objects.aexists())
+        mock_schedule.assert_not_called()
+
+    async def test_create_requires_authentication(self):
+        response = await self.async_client.post('/api/async/diagnoses/', self._payload())
+        self.assertEqual(response.status_code, 401)
+
+    async def test_session_auth_enforces_csrf(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        await client.aforce_login(self.user)
+        response = await client.post('/api/async/diagnoses/', self._payload())
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF Failed', response.json()['detail'])
+
+    @patch('apps.diagnosis.async_views.schedule_diagnosis_processing')
+    async def test_session_auth_with_csrf_token_uploads(self, mock_schedule):
+        client = AsyncClient(enforce_csrf_checks=True)
+        await client.aforce_login(self.user)
+        token = 'a' * 32
+        client.cookies[settings.CSRF_COOKIE_NAME] = token
+
+        response = await client.post('/api/async/diagnoses/', self._payload(), headers={'X-CSRFToken': token})
+
+        self.assertEqual(response.status_code, 201, response.content)
+        diagnosis = await Diagnosis.objects.aget(id=response.json()['id'])
+        self.assertEqual(diagnosis.physician_id, self.user.id)
+        mock_schedule.assert_called_once()
+
+    async def test_detail_restricted_to_owner(self):
+        diagnosis = await Diagnosis.objects.acreate(
+            patient=self.patient, physician=self.user, left_fundus_image='l.png', right_fundus_image='r.png'
+        )
+        response = await self.async_client.get(f'/api/async/diagnoses/{diagnosis.id}/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Diagnosis.Status.PENDING)
+
+        other = await get_user_model().objects.acreate_user(username='other-doc', password='x')
+        response = await self.async_client.get(f'/api/async/diagnoses/{diagnosis.id}/', headers=self._bearer(other))
+        self.assertEqual(response.status_code, 403)
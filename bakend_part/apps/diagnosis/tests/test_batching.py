@@ -0,0 +1,95 @@
+# apps/diagnosis/tests/test_batching.py
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.test import TestCase
+
+from apps.diagnosis.ai_pipeline.production_feature_pipeline import ProductionFeaturePipeline
+from apps.diagnosis.ai_pipeline.service import DiagnosisService
+from apps.diagnosis.models import Diagnosis
+from apps.diagnosis.tasks import process_diagnosis_batch
+
+from .base import DoctorPatientTestCase
+
+
+class BatchedPipelineTests(TestCase):
+    """اختبارات مسار الاستدلال بالدفعات داخل DiagnosisService."""
+
+    def _build_service(self, n_cases):
+        service = DiagnosisService.__new__(DiagnosisService)
+        service.multi_class_model = MagicMock()
+        service.multi_class_model.predict_batch.return_value = np.full((2 * n_cases, 8), 0.125, dtype=np.float32)
+        service.diagnoser = MagicMock()
+        service.diagnoser.predict_batch.return_value = [
+            (np.full((n_cases, 1), 0.5, dtype=np.float32), np.full((n_cases, 1), 0.25, dtype=np.float32))
+            for _ in range(6)
+        ]
+        service.feature_pipeline = ProductionFeaturePipeline()
+        service.tabular_model = MagicMock()
+        service.tabular_model.predict.return_value = np.full((n_cases, 8), 0.1, dtype=np.float32)
+        return service
+
+    def test_models_run_once_per_batch(self):
+        """كل نموذج يُستدعى مرة واحدة بدفعة 2N، والنموذج الجدولي مرة واحدة بـ N متجهًا."""
+        n_cases = 3
+        service = self._build_service(n_cases)
+        cases = [
+            {
+                "left_eye_img": np.zeros((32, 32, 3), dtype=np.uint8),
+                "right_eye_img": np.zeros((32, 32, 3), dtype=np.uint8),
+                "demographics": {"age": 50 + i, "gender": i % 2},
+            }
+            for i in range(n_cases)
+        ]
+
+        reports = service.run_diagnosis_batch(cases)
+
+        self.assertEqual(len(reports), n_cases)
+        service.multi_class_model.predict_batch.assert_called_once()
+        self.assertEqual(len(service.multi_class_model.predict_batch.call_args[0][0]), 2 * n_cases)
+        service.diagnoser.predict_batch.assert_called_once()
+        service.tabular_model.predict.assert_called_once()
+        self.assertEqual(service.tabular_model.predict.call_args[0][0].shape, (n_cases, 38))
+        self.assertEqual(reports[1]["evidence_vector"][16], 51.0)
+        self.assertEqual(reports[0]["final_diagnosis"]["Normal"], "0.1000")
+
+
+class ProcessDiagnosisBatchTaskTests(DoctorPatientTestCase):
+    """اختبارات حجز الدفعات وكتابة نتائجها في مهمة process_diagnosis_batch."""
+    username = 'batch_doctor'
+    patient_name = 'Batch Patient'
+
+    def _create(self, status=Diagnosis.Status.PENDING):
+        return self.create_diagnosis(status=status)
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_claims_up_to_batch_size_and_bulk_writes(self, mock_get_orchestrator):
+        pending = [self._create() for _ in range(3)]
+        done = self._create(status=Diagnosis.Status.SUCCESS)
+
+        def fake_run(records):
+            ids = [str(r.id) for r in records]
+            records[0].quality = {'left': {'passed': True}, 'right': {'passed': True}}
+            return {ids[0]: {"final_diagnosis": {}}}, {ids[1]: "Could not read or process image file"}
+
+        mock_get_orchestrator.return_value.run_batch_from_django_models.side_effect = fake_run
+        mock_get_orchestrator.return_value.model_version = None
+
+        outcome = process_diagnosis_batch.apply(kwargs={'batch_size': 2}).get()
+
+        self.assertEqual(outcome, {"status": "SUCCESS", "succeeded": 1, "failed": 1})
+        statuses = [Diagnosis.objects.get(id=d.id).status for d in pending]
+        self.assertEqual(statuses, [Diagnosis.Status.SUCCESS, Diagnosis.Status.FAILURE, Diagnosis.Status.PENDING])
+        self.assertIsNotNone(Diagnosis.objects.get(id=pending[0].id).finished_at)
+        # تقرير الجودة يُكتب في نفس bulk_update
+        self.assertTrue(Diagnosis.objects.get(id=pending[0].id).quality['left']['passed'])
+        self.assertEqual(Diagnosis.objects.get(id=done.id).status, Diagnosis.Status.SUCCESS)
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_no_pending_rows_is_a_noop(self, mock_get_orchestrator):
+        self._create(status=Diagnosis.Status.RUNNING)
+
+        outcome = process_diagnosis_batch.apply().get()
+
+        self.assertEqual(outcome["status"], "SKIPPED")
+        mock_get_orchestrator.assert_not_called()
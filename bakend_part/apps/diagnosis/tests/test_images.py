@@ -0,0 +1,393 @@
+# apps/diagnosis/tests/test_images.py
+import io
+import tempfile
+import xml.etree.ElementTree as ET
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFilter
+
+from apps.diagnosis import derivatives, quality, tiles
+from apps.diagnosis.ai_pipeline.feature_extractor import aggregate_eye_predictions
+from apps.diagnosis.ai_pipeline.models.roi import detect_roi
+from apps.diagnosis.ai_pipeline.production_feature_pipeline import ProductionFeaturePipeline
+from apps.diagnosis.ai_pipeline.service import DiagnosisService
+from apps.diagnosis.models import Diagnosis, StoredImage
+from apps.diagnosis.repositories import DiagnosisRepository
+from apps.diagnosis.services import DjangoDiagnosisOrchestrator
+from apps.diagnosis.tasks import generate_diagnosis_tiles
+from apps.diagnosis.views import schedule_diagnosis_processing
+
+from .base import DoctorPatientTestCase, fundus_upload
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageDerivativeTests(DoctorPatientTestCase):
+    """اختبارات النسخة المصغرة للاستدلال والصور المصغرة WebP."""
+    username = 'thumb-doc'
+    patient_name = 'Thumb Patient'
+    date_of_birth = date(1990, 6, 6)
+    gender = 'FEMALE'
+
+    def _diagnosis(self):
+        return self.create_diagnosis(fundus_upload('left.png'), fundus_upload('right.png', (600, 600)))
+
+    def test_inference_copy_is_generated_once_and_shared_by_duplicates(self):
+        diagnosis = self._diagnosis()
+        image = derivatives.inference_image(diagnosis, 'left')
+        self.assertEqual(image.size, (341, 256))
+
+        diagnosis.refresh_from_db()
+        self.assertTrue(diagnosis.left_inference_image.name.endswith('-256.png'))
+        with diagnosis.left_thumbnail.open('rb') as f:
+            thumbnail = Image.open(f)
+            self.assertEqual((thumbnail.format, max(thumbnail.size)), ('WEBP', 160))
+
+        # التشغيلات التالية والتشخيصات المكررة لا تفك ترميز الأصل
+        duplicate = self._diagnosis()
+        with patch('apps.diagnosis.derivatives.render') as mock_render:
+            self.assertEqual(derivatives.inference_image(diagnosis, 'left').size, (341, 256))
+            self.assertEqual(derivatives.inference_image(duplicate, 'left').size, (341, 256))
+        mock_render.assert_not_called()
+        self.assertEqual(duplicate.left_inference_image.name, diagnosis.left_inference_image.name)
+
+    def test_missing_derivative_is_regenerated(self):
+        diagnosis = self._diagnosis()
+        derivatives.inference_image(diagnosis, 'right')
+        default_storage.delete(diagnosis.right_inference_image.name)
+
+        diagnosis.refresh_from_db()
+        self.assertEqual(derivatives.inference_image(diagnosis, 'right').size, (256, 256))
+        self.assertTrue(default_storage.exists(diagnosis.right_inference_image.name))
+
+    def test_thumbnail_view_generates_lazily_for_allowed_users(self):
+        diagnosis = self._diagnosis()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('diagnosis-thumbnail', args=[diagnosis.id, 'right']))
+        self.assertEqual(response.status_code, 302)
+        diagnosis.refresh_from_db()
+        self.assertEqual(response['Location'], diagnosis.right_thumbnail.url)
+        self.assertEqual(self.client.get(reverse('diagnosis-thumbnail', args=[diagnosis.id, 'middle'])).status_code, 404)
+
+        self.client.force_login(get_user_model().objects.create_user(username='thumb-other', password='x'))
+        self.assertEqual(self.client.get(reverse('diagnosis-thumbnail', args=[diagnosis.id, 'right'])).status_code, 404)
+
+    def test_derivatives_are_deleted_with_the_last_reference(self):
+        diagnosis = self._diagnosis()
+        derivatives.generate(diagnosis)
+        keys = [diagnosis.left_inference_image.name, diagnosis.left_thumbnail.name]
+        with self.captureOnCommitCallbacks(execute=True):
+            diagnosis.delete()
+        self.assertFalse(any(default_storage.exists(key) for key in keys))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DeepZoomTileTests(DoctorPatientTestCase):
+    """اختبارات هرم بلاطات Deep Zoom ونقاط تقديمها."""
+    username = 'tiles-doc'
+    patient_name = 'Tiles Patient'
+    date_of_birth = date(1985, 7, 7)
+
+    def setUp(self):
+        super().setUp()
+        self.diagnosis = self.create_diagnosis(fundus_upload('left.png', (600, 300)), fundus_upload('right.png', (300, 300)))
+        self.client.force_login(self.user)
+
+    def test_pyramid_matches_deep_zoom_layout(self):
+        source = self.diagnosis.left_fundus_image.name
+        self.assertEqual(tiles.max_level(600, 300), 10)
+        # المستوى 10: 600x300 ← 3x2 بلاطات، المستوى 9: 300x150 ← 2x1، ثم بلاطة واحدة لكل مستوى من 8 إلى 0
+        self.assertEqual(tiles.generate_tiles(source), 6 + 2 + 9)
+        self.assertEqual(tiles.generate_tiles(source), 0)
+
+        with default_storage.open(tiles.tile_key(source, 10, 2, 1), 'rb') as f:
+            self.assertEqual(Image.open(f).size, (600 - 507, 300 - 253))
+        with default_storage.open(tiles.dzi_key(source), 'rb') as f:
+            size = ET.fromstring(f.read()).find('{http://schemas.microsoft.com/deepzoom/2008}Size')
+        self.assertEqual((size.get('Width'), size.get('Height')), ('600', '300'))
+
+    def test_interrupted_pyramid_is_overwritten_in_place(self):
+        source = self.diagnosis.right_fundus_image.name
+        leftover = tiles.tile_key(source, 0, 0, 0)
+        default_storage.save(leftover, ContentFile(b'partial'))
+
+        tiles.generate_tiles(source)
+
+        with default_storage.open(leftover, 'rb') as f:
+            self.assertEqual(Image.open(f).size, (1, 1))
+        self.assertEqual(default_storage.listdir(leftover.rsplit('/', 1)[0])[1], ['0_0.jpg'])
+
+    @patch('apps.diagnosis.scheduling.current_app')
+    def test_tiles_are_scheduled_and_served_with_long_cache(self, mock_app):
+        mock_app.conf.task_always_eager = False
+        schedule_diagnosis_processing(str(self.diagnosis.id))
+        mock_app.send_task.assert_called_with(
+            'apps.diagnosis.tasks.generate_diagnosis_tiles', kwargs={'diagnosis_id': str(self.diagnosis.id)},
+            queue='diagnosis_tiles',
+        )
+        source_url = reverse('diagnosis-tile-source', args=[self.diagnosis.id, 'right'])
+        self.assertEqual(self.client.get(source_url).status_code, 404)
+
+        generate_diagnosis_tiles(str(self.diagnosis.id))
+        response = self.client.get(source_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        tile_url = source_url.replace('.dzi', '_files/9/1_0.jpg')
+        response = self.client.get(tile_url)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/jpeg'))
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).format, 'JPEG')
+        self.assertEqual(self.client.get(tile_url.replace('1_0', '5_5')).status_code, 404)
+
+        detail = self.client.get(f'/frontend/diagnoses/{self.diagnosis.id}/')
+        self.assertContains(detail, f'data-tile-source="{source_url}"')
+
+        self.client.force_login(get_user_model().objects.create_user(username='tiles-other', password='x'))
+        self.assertEqual(self.client.get(tile_url).status_code, 404)
+
+    def test_tiles_are_deleted_with_the_last_reference(self):
+        source = self.diagnosis.right_fundus_image.name
+        tiles.generate_tiles(source)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.diagnosis.delete()
+        self.assertFalse(default_storage.exists(tiles.dzi_key(source)))
+        self.assertFalse(default_storage.exists(tiles.tile_key(source, 0, 0, 0)))
+
+
+def _fundus_with_borders(name, size=(1200, 800), radius=380):
+    """قرص مضيء على خلفية سوداء كصور ODIR."""
+    image = Image.new('RGB', size)
+    cx, cy = size[0] // 2, size[1] // 2
+    ImageDraw.Draw(image).ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=(160, 90, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DIAGNOSIS_DERIVATIVES={**settings.DIAGNOSIS_DERIVATIVES, 'CROP_ROI': True})
+class FundusRoiCropTests(DoctorPatientTestCase):
+    """اختبارات قص الحواف السوداء حول قرص قاع العين في نسخة الاستدلال."""
+    username = 'roi-doc'
+    patient_name = 'Roi Patient'
+    date_of_birth = date(1980, 3, 3)
+
+    def _diagnosis(self):
+        return self.create_diagnosis(_fundus_with_borders('left.jpg'), _fundus_with_borders('right.jpg'))
+
+    def test_detect_roi_finds_the_disc_or_keeps_the_full_frame(self):
+        image = np.zeros((800, 1200, 3), dtype=np.uint8)
+        self.assertEqual(detect_roi(image), (0, 0, 1200, 800))
+        image[20:780, 220:980] = 200
+        left, top, right, bottom = detect_roi(image)
+        self.assertTrue(abs(left - 220) <= 12 and abs(right - 980) <= 12, (left, right))
+        self.assertTrue(top <= 20 and bottom >= 780)
+
+    def test_inference_copy_contains_only_the_disc_and_box_is_cached(self):
+        diagnosis = self._diagnosis()
+        image = derivatives.inference_image(diagnosis, 'left')
+        # القرص مربع تقريبًا (760x760) بدل إطار 3:2
+        self.assertEqual(image.size[1], 256)
+        self.assertLess(abs(image.size[0] - 256), 10)
+        self.assertLess(np.asarray(image)[:, :4].max(), 200)
+
+        box = StoredImage.objects.get(key=diagnosis.left_fundus_image.name).roi_box
+        self.assertTrue(abs(box[0] - 220) <= 12 and abs(box[2] - 980) <= 12, box)
+
+        # إعادة التوليد تستخدم الصندوق المحفوظ دون كشف جديد
+        default_storage.delete(diagnosis.left_inference_image.name)
+        with patch('apps.diagnosis.derivatives.detect_roi') as mock_detect:
+            derivatives.inference_image(diagnosis, 'left')
+        mock_detect.assert_not_called()
+
+    def test_crop_can_be_disabled(self):
+        config = {**settings.DIAGNOSIS_DERIVATIVES, 'CROP_ROI': False}
+        with self.settings(DIAGNOSIS_DERIVATIVES=config):
+            diagnosis = self._diagnosis()
+            self.assertEqual(derivatives.inference_image(diagnosis, 'right').size, (384, 256))
+            self.assertNotIn('-roi', diagnosis.right_inference_image.name)
+
+
+def _retina(blur=0, size=512):
+    """قرص قاع عين اصطناعي بأوعية (خطوط) على خلفية سوداء."""
+    image = Image.new('RGB', (size, size))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((8, 8, size - 8, size - 8), fill=(170, 90, 40))
+    for i in range(12):
+        draw.line((60 + 30 * i, 80, 420 - 25 * i, 440), fill=(110, 40, 20), width=3)
+    return image.filter(ImageFilter.GaussianBlur(blur)) if blur else image
+
+
+def _upload(image, name):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageQualityGateTests(DoctorPatientTestCase):
+    """اختبارات فحص الجودة قبل الاستدلال."""
+    username = 'quality-doc'
+    patient_name = 'Quality Patient'
+
+    def setUp(self):
+        super().setUp()
+        self.orchestrator = DjangoDiagnosisOrchestrator.__new__(DjangoDiagnosisOrchestrator)
+        self.orchestrator.ai_service = MagicMock()
+        self.orchestrator.repo = DiagnosisRepository()
+
+    def test_assess_flags_blur_exposure_and_non_fundus_images(self):
+        sharp = quality.assess(np.asarray(_retina().resize((256, 256))))
+        self.assertTrue(sharp.passed, sharp.problems)
+        self.assertLess(sharp.elapsed_ms, 50)
+
+        blurry = quality.assess(np.asarray(_retina(blur=6).resize((256, 256))))
+        self.assertEqual([p.split(':')[0] for p in blurry.problems], ['out of focus'])
+
+        document = quality.assess(np.full((256, 256, 3), 255, dtype=np.uint8))
+        self.assertIn('not a fundus photo', document.problems[0])
+        self.assertTrue(any(p.startswith('over-exposed') for p in document.problems))
+
+        dark = quality.assess((np.asarray(_retina().resize((256, 256))) * 0.15).astype(np.uint8))
+        self.assertTrue(any(p.startswith('under-exposed') for p in dark.problems))
+
+    def test_rejected_images_fail_without_inference(self):
+        good = Diagnosis.objects.create(
+            patient=self.patient, physician=self.user,
+            left_fundus_image=_upload(_retina(), 'l.png'), right_fundus_image=_upload(_retina(), 'r.png'),
+        )
+        blurry = Diagnosis.objects.create(
+            patient=self.patient, physician=self.user,
+            left_fundus_image=_upload(_retina(), 'l.png'), right_fundus_image=_upload(_retina(blur=6), 'rb.png'),
+        )
+        self.orchestrator.ai_service.run_diagnosis_batch.return_value = [{'final_diagnosis': 'N'}]
+
+        # التقرير يوضع على السجلات في الذاكرة ويكتبه process_diagnosis_batch مع النتائج
+        with patch.object(self.orchestrator.repo, 'save_quality') as mock_save:
+            results, failures = self.orchestrator.run_batch_from_django_models([good, blurry])
+        mock_save.assert_not_called()
+
+        self.assertEqual(list(results), [str(good.id)])
+        self.assertTrue(failures[str(blurry.id)].startswith('Image quality check failed: right eye out of focus'))
+        self.assertEqual(len(self.orchestrator.ai_service.run_diagnosis_batch.call_args[0][0]), 1)
+        self.assertTrue(blurry.quality['left']['passed'])
+        self.assertFalse(blurry.quality['right']['passed'])
+
+        # إعادة الاستدلال (save_quality=False) تفحص الجودة دون تغيير التقرير
+        good.quality = None
+        results, _ = self.orchestrator.run_batch_from_django_models([good], save_quality=False)
+        self.assertIsNone(good.quality)
+        self.assertEqual(list(results), [str(good.id)])
+
+    def test_quality_report_counts_saved_inference_time(self):
+        now = timezone.now()
+        passed = {'left': {'passed': True, 'problems': [], 'elapsed_ms': 0.8}, 'right': {'passed': True, 'problems': [], 'elapsed_ms': 0.8}}
+        for _ in range(3):
+            Diagnosis.objects.create(
+                patient=self.patient, left_fundus_image=fundus_upload('a.png'), right_fundus_image=fundus_upload('b.png'),
+                status=Diagnosis.Status.SUCCESS, quality=passed, started_at=now - timedelta(seconds=10), finished_at=now,
+            )
+        Diagnosis.objects.create(
+            patient=self.patient, left_fundus_image=fundus_upload('a.png'), right_fundus_image=fundus_upload('b.png'),
+            status=Diagnosis.Status.FAILURE, error_message='Image quality check failed: left eye out of focus: sharpness 0.4.',
+            quality={**passed, 'left': {'passed': False, 'problems': ['out of focus: sharpness 0.4'], 'elapsed_ms': 0.8}},
+        )
+        out = io.StringIO()
+        call_command('quality_report', stdout=out)
+        self.assertIn('rejected 1 before inference', out.getvalue())
+        self.assertIn('out of focus: 1 eyes', out.getvalue())
+        self.assertIn('Inference time saved: 10 s (25.0% of 40 s)', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MultiShotEyeTests(DoctorPatientTestCase):
+    """اختبارات اللقطات المتعددة لكل عين: الرفع، التجميع، وتمريرة واحدة لكل نموذج."""
+    username = 'shots-doc'
+    patient_name = 'Shots Patient'
+    date_of_birth = date(1975, 5, 5)
+    gender = 'FEMALE'
+
+    def test_aggregation_methods(self):
+        shots = np.array([[0.2, 0.8], [0.6, 0.4]], dtype=np.float32)
+        np.testing.assert_allclose(aggregate_eye_predictions(shots, 'mean'), [0.4, 0.6])
+        np.testing.assert_allclose(aggregate_eye_predictions(shots, 'max'), [0.6, 0.8])
+        np.testing.assert_allclose(aggregate_eye_predictions(shots, 'quality', [3.0, 1.0]), [0.3, 0.7])
+        np.testing.assert_allclose(aggregate_eye_predictions(shots[:1], 'max'), shots[0])
+        with self.assertRaises(ValueError):
+            aggregate_eye_predictions(shots, 'median')
+
+    def test_all_shots_run_in_one_pass_and_are_aggregated_per_eye(self):
+        service = DiagnosisService.__new__(DiagnosisService)
+        # الحالة الأولى: 3 لقطات يسرى و 1 يمنى؛ الثانية: 1 و 2 -> 4 يسرى ثم 3 يمنى
+        left_normal, right_normal = [0.1, 0.3, 0.5, 0.9], [0.2, 0.6, 0.4]
+        multi = np.zeros((7, 8), dtype=np.float32)
+        multi[:, 0] = left_normal + right_normal
+        service.multi_class_model = MagicMock(**{'predict_batch.return_value': multi})
+        service.diagnoser = MagicMock(**{'predict_batch.return_value': [
+            (np.full((4, 1), 0.5, dtype=np.float32), np.full((3, 1), 0.25, dtype=np.float32)) for _ in range(6)
+        ]})
+        service.feature_pipeline = ProductionFeaturePipeline()
+        service.tabular_model = MagicMock(**{'predict.return_value': np.full((2, 8), 0.1, dtype=np.float32)})
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        cases = [
+            {'left_eye_imgs': [image] * 3, 'right_eye_imgs': [image], 'demographics': {'age': 60, 'gender': 1}},
+            {'left_eye_img': image, 'right_eye_imgs': [image] * 2, 'demographics': {'age': 61, 'gender': 0}},
+        ]
+
+        reports = service.run_diagnosis_batch(cases)
+
+        service.multi_class_model.predict_batch.assert_called_once()
+        self.assertEqual(len(service.multi_class_model.predict_batch.call_args[0][0]), 7)
+        service.diagnoser.predict_batch.assert_called_once()
+        self.assertAlmostEqual(reports[0]['evidence_vector'][0], 0.3, places=5)   # متوسط 3 لقطات يسرى
+        self.assertAlmostEqual(reports[0]['evidence_vector'][8], 0.2, places=5)
+        self.assertAlmostEqual(reports[1]['evidence_vector'][0], 0.9, places=5)
+        self.assertAlmostEqual(reports[1]['evidence_vector'][8], 0.5, places=5)   # متوسط لقطتين يمنى
+
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def test_extra_shots_are_uploaded_checked_and_batched(self, mock_schedule):
+        response = self.api.post('/api/diagnoses/', {
+            'patient_id': str(self.patient.id),
+            'left_fundus_image': _upload(_retina(), 'l1.png'),
+            'right_fundus_image': _upload(_retina(), 'r1.png'),
+            'left_extra_images': [_upload(_retina(blur=6), 'l2.png'), _upload(_retina().rotate(90), 'l3.png')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        diagnosis = DiagnosisRepository().get_by_id(response.data['id'])
+        self.assertEqual(list(diagnosis.extra_images.values_list('side', flat=True)), ['left', 'left'])
+
+        orchestrator = DjangoDiagnosisOrchestrator.__new__(DjangoDiagnosisOrchestrator)
+        orchestrator.ai_service = MagicMock(**{'run_diagnosis_batch.return_value': [{'final_diagnosis': 'N'}]})
+        orchestrator.repo = DiagnosisRepository()
+        results, failures = orchestrator.run_batch_from_django_models([diagnosis])
+
+        self.assertEqual(failures, {})
+        case = orchestrator.ai_service.run_diagnosis_batch.call_args[0][0][0]
+        # اللقطة الضبابية استُبعدت، وبقيت لقطتان يسرى بأوزان التركيز
+        self.assertEqual((len(case['left_eye_imgs']), len(case['right_eye_imgs'])), (2, 1))
+        self.assertEqual(len(case['left_weights']), 2)
+        self.assertEqual(set(diagnosis.quality), {'left', 'left#2', 'left#3', 'right'})
+        self.assertFalse(diagnosis.quality['left#2']['passed'])
+
+        response = self.api.get(f"/api/diagnoses/{diagnosis.id}/")
+        self.assertEqual(len(response.data['extra_images']), 2)
+
+    def test_too_many_shots_are_rejected(self):
+        response = self.api.post('/api/diagnoses/', {
+            'patient_id': str(self.patient.id),
+            'left_fundus_image': _upload(_retina(), 'l1.png'),
+            'right_fundus_image': _upload(_retina(), 'r1.png'),
+            'right_extra_images': [_upload(_retina(), f'r{i}.png') for i in range(4)],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('right_extra_images', response.data)
@@ -0,0 +1,244 @@
+# apps/diagnosis/tests/test_model_loading.py
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import tensorflow as tf
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from apps.diagnosis import artifacts, parity
+from apps.diagnosis.ai_pipeline import config as ai_config
+from apps.diagnosis.ai_pipeline.models import optimization
+from apps.diagnosis.ai_pipeline.models.classifier import (
+    UNPACKED_STAMP, EyesModel, TFLiteModel, load_keras_model, unpack_model, unpacked_path,
+)
+from apps.diagnosis.ai_pipeline.models.preprocessing import MULTICLASSPreprocessing
+from apps.diagnosis.ai_pipeline.service import DiagnosisService
+from apps.diagnosis.models import ModelVersion
+
+
+class ParallelModelLoadingTests(TestCase):
+    """اختبارات تحميل ملفات النماذج بالتوازي عند إنشاء DiagnosisService."""
+
+    def setUp(self):
+        cache = patch.dict(EyesModel._model_cache, clear=True)
+        cache.start()
+        self.addCleanup(cache.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_distinct_files_load_concurrently_and_once(self):
+        loaded, active, peak = [], [0], [0]
+        lock = threading.Lock()
+
+        def slow_loader(path):
+            with lock:
+                loaded.append(path)
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return MagicMock(name=os.path.basename(path))
+
+        paths = ai_config.model_paths(self.directory)
+        with patch('apps.diagnosis.ai_pipeline.models.classifier.ModelLoaderFactory.get_loader', return_value=slow_loader), \
+                patch.object(ai_config, 'MODEL_LOAD_WORKERS', 4):
+            service = DiagnosisService(paths)
+
+        distinct = {paths['multi_class'], paths['tabular'], *paths['experts']}
+        self.assertCountEqual(loaded, distinct)
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], 4)
+        self.assertIs(service.tabular_model, EyesModel._model_cache[paths['tabular']])
+        self.assertEqual(len(service.diagnoser.models), 6)
+
+    def test_unpacked_directory_is_preferred_once_fresh(self):
+        path = os.path.join(self.directory, 'tabular_model.keras')
+        model = tf.keras.Sequential([tf.keras.Input((3,)), tf.keras.layers.Dense(2)])
+        model.save(path)
+        sample = np.ones((1, 3), dtype=np.float32)
+
+        unpack_model(path)
+        self.assertTrue(os.path.isfile(os.path.join(unpacked_path(path), 'model.weights.h5')))
+        with patch('tensorflow.keras.models.load_model', wraps=tf.keras.models.load_model) as mock_load:
+            restored = load_keras_model(path)
+            self.assertEqual(mock_load.call_args[0][0], unpacked_path(path))
+            # الحداثة ببصمة الأرشيف لا بالتوقيت: لمس الأرشيف لا يبطل المجلد المفكوك
+            os.utime(path, (time.time() + 60, time.time() + 60))
+            load_keras_model(path)
+            self.assertEqual(mock_load.call_args[0][0], unpacked_path(path))
+
+            # أرشيف استُبدل بمحتوى آخر وتوقيت أقدم (نسخ مع الحفاظ على التوقيت): يُحمّل الأرشيف
+            replacement = tf.keras.Sequential([tf.keras.Input((3,)), tf.keras.layers.Dense(2)])
+            replacement.save(path)
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+            reloaded = load_keras_model(path)
+            self.assertEqual(mock_load.call_args[0][0], path)
+        np.testing.assert_allclose(restored(sample).numpy(), model(sample).numpy())
+        np.testing.assert_allclose(reloaded(sample).numpy(), replacement(sample).numpy())
+
+        unpack_model(path)
+        with open(os.path.join(unpacked_path(path), UNPACKED_STAMP)) as f:
+            size, digest = f.read().split(' ')
+        with open(path, 'rb') as f:
+            self.assertEqual((int(size), digest), (os.path.getsize(path), hashlib.sha256(f.read()).hexdigest()))
+
+
+def _stand_in_model(input_shape, outputs: int):
+    """نموذج صغير بطبقات Conv/Dense + BatchNormalization + Dropout، بإحصاءات BN غير بديهية."""
+    inputs = tf.keras.Input(input_shape)
+    if len(input_shape) == 3:
+        x = tf.keras.layers.Conv2D(4, 3, strides=4)(inputs)
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.ReLU()(x)
+        x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    else:
+        x = tf.keras.layers.Dense(16)(inputs)
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.ReLU()(x)
+    x = tf.keras.layers.Dropout(0.3)(x)
+    model = tf.keras.Sequential([tf.keras.Input(input_shape), tf.keras.Model(inputs, tf.keras.layers.Dense(outputs, activation='sigmoid')(x))])
+    rng = np.random.default_rng(1)
+    for layer in optimization.walk(model):
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([rng.uniform(0.5, 1.5, gamma.shape), rng.normal(0, 0.2, beta.shape),
+                               rng.normal(0, 0.2, mean.shape), rng.uniform(0.5, 1.5, variance.shape)])
+    return model
+
+
+class ModelCompilationTests(TestCase):
+    """اختبارات تجميع النماذج (حذف طبقات التدريب، دمج BatchNorm، TFLite) والتحقق منها قبل النشر."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def test_strip_and_fold_preserves_outputs(self):
+        model = _stand_in_model((32, 32, 3), 2)
+        optimized, counts = optimization.strip_and_fold(model)
+        self.assertEqual(counts, {'folded_batchnorm': 1, 'stripped_layers': 1})
+        self.assertFalse([l for l in optimization.walk(optimized) if isinstance(l, tf.keras.layers.BatchNormalization)])
+        inputs = optimization.sample_inputs(model, 4)
+        np.testing.assert_allclose(optimized.predict_on_batch(inputs), model.predict_on_batch(inputs), atol=1e-5)
+
+    def test_tflite_variant_loads_through_the_model_factory(self):
+        model = _stand_in_model((38,), 8)
+        path = os.path.join(self.root, 'tabular_model.tflite')
+        with open(path, 'wb') as f:
+            f.write(optimization.to_tflite(model, 'dynamic_int8'))
+        with patch.dict(EyesModel._model_cache, clear=True):
+            served = EyesModel.load(path)
+        self.assertIsInstance(served, TFLiteModel)
+        inputs = optimization.sample_inputs(model, 3)
+        self.assertEqual(served.predict(inputs).shape, (3, 8))
+        np.testing.assert_allclose(served.predict_on_batch(inputs[:1]), model.predict_on_batch(inputs[:1]), atol=2e-2)
+
+    def test_command_writes_manifest_and_publishes_only_verified_models(self):
+        source = os.path.join(self.root, 'source')
+        os.makedirs(source)
+        paths = ai_config.model_paths(source)
+        for path in {paths['multi_class'], *paths['experts']}:
+            _stand_in_model((32, 32, 3), 8 if path == paths['multi_class'] else 1).save(path)
+        _stand_in_model((38,), 8).save(paths['tabular'])
+        output = os.path.join(self.root, 'compiled')
+        store = {'BACKEND': 'filesystem', 'LOCATION': os.path.join(self.root, 'store'), 'CACHE_DIR': os.path.join(self.root, 'cache')}
+
+        with self.settings(DIAGNOSIS_MODEL_ARTIFACTS=store):
+            with self.assertRaisesRegex(CommandError, 'Verification failed'):
+                call_command('compile_models', '--source', source, '--output', output, '--samples', '2', '--repeats', '1',
+                             '--tolerance', 'keras=-1', '--publish', '--label', '9', stdout=io.StringIO())
+            self.assertFalse(ModelVersion.objects.filter(version='9').exists())
+
+            call_command('compile_models', '--source', source, '--output', output, '--samples', '2', '--repeats', '1',
+                         '--publish', '--label', '9', stdout=io.StringIO())
+
+        with open(os.path.join(output, 'compile_manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertTrue(manifest['verified'])
+        self.assertEqual(set(manifest['models']), set(artifacts.model_filenames(source)))
+        tabular = manifest['models']['tabular_model.keras']
+        self.assertEqual(tabular['folded_batchnorm'], 1)
+        self.assertLess(tabular['variants']['keras']['max_abs_diff'], 1e-4)
+        self.assertIn('batch_2', tabular['variants']['keras']['latency_ms'])
+        self.assertEqual(ModelVersion.objects.get(version='9').file_path, 'models/pipeline/9')
+
+
+class ParityHarnessTests(TestCase):
+    """اختبارات فحص التطابق العددي بين خطي التدريب والخدمة ونسخ النماذج المحسنة."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.images = os.path.join(cls.root, 'images')
+        os.makedirs(cls.images)
+        cls.paths = parity.golden_images(cls.images, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, True)
+        super().tearDownClass()
+
+    def test_rgb_training_decode_matches_serving_preprocessing(self):
+        check = parity.ParityCheck(self.paths, 'tf')
+        check.check_preprocessing()
+        self.assertEqual(len(check.results), 7)
+        self.assertTrue(check.passed, [r for r in check.results if not r['passed']])
+
+    def test_cropped_training_decode_matches_cropped_serving(self):
+        with self.settings(DIAGNOSIS_DERIVATIVES={**settings.DIAGNOSIS_DERIVATIVES, 'CROP_ROI': True}):
+            check = parity.ParityCheck(self.paths, 'tf')
+            check.check_preprocessing()
+        self.assertTrue(check.passed, [r for r in check.results if not r['passed']])
+
+    def test_bgr_training_decode_is_reported_as_drift(self):
+        check = parity.ParityCheck(self.paths, 'cv2')
+        check.check_preprocessing()
+        failed = {r['stage'] for r in check.results if not r['passed']}
+        self.assertIn('preprocessing/MULTICLASSPreprocessing', failed)
+        # الاستراتيجية تستخدم القناة الخضراء وحدها، فترتيب القنوات لا يغيرها
+        self.assertNotIn('preprocessing/DiabetesPreprocessing', failed)
+
+    def test_command_checks_backends_and_catches_drift_against_golden(self):
+        models = os.path.join(self.root, 'models')
+        os.makedirs(models)
+        paths = ai_config.model_paths(models)
+        for path in {paths['multi_class'], *paths['experts']}:
+            _stand_in_model((224, 224, 3), 8 if path == paths['multi_class'] else 1).save(path)
+        _stand_in_model((38,), 8).save(paths['tabular'])
+        compiled = os.path.join(self.root, 'compiled')
+        golden = os.path.join(self.root, 'golden.npz')
+        report_path = os.path.join(self.root, 'parity.json')
+
+        with patch.dict(EyesModel._model_cache, clear=True):
+            call_command('compile_models', '--source', models, '--output', compiled, '--samples', '1', '--repeats', '1',
+                         stdout=io.StringIO())
+            call_command('parity_check', '--images', self.images, '--models', models, '--compiled', compiled,
+                         '--golden', golden, '--update-golden', '--output', report_path, stdout=io.StringIO())
+            with open(report_path) as f:
+                report = json.load(f)
+            self.assertTrue(report['passed'])
+            stages = {r['stage'] for r in report['results']}
+            self.assertTrue({'batched/multi_class', 'training_inputs/Age Issues', 'pipeline/batched',
+                             'pipeline/rescore', 'keras/Glaucoma', 'keras/tabular'} <= stages)
+
+            # تحسين مزعوم يغير مخرج المعالجة قليلًا: يبقى ضمن تسامح المقارنة مع التدريب، لكن golden يكشفه
+            apply = MULTICLASSPreprocessing.apply
+            with patch.object(MULTICLASSPreprocessing, 'apply', lambda strategy, image: apply(strategy, image) * 0.99):
+                with self.assertRaisesRegex(CommandError, 'golden/serving/MULTICLASSPreprocessing'):
+                    call_command('parity_check', '--images', self.images, '--preprocessing-only', '--golden', golden,
+                                 stdout=io.StringIO())
+            call_command('parity_check', '--images', self.images, '--preprocessing-only', '--golden', golden,
+                         stdout=io.StringIO())
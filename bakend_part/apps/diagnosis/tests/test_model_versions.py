@@ -0,0 +1,261 @@
+# apps/diagnosis/tests/test_model_versions.py
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+
+from apps.diagnosis import artifacts
+from apps.diagnosis.ai_pipeline import config as ai_config
+from apps.diagnosis.ai_pipeline.models.classifier import Diagnoser
+from apps.diagnosis.exceptions import ModelArtifactError
+from apps.diagnosis.models import Diagnosis, ModelVersion, Patient, ShadowResult
+from apps.diagnosis.scheduling import SHADOW_EVALUATE_TASK, schedule_shadow_evaluations
+from apps.diagnosis.services import DjangoDiagnosisOrchestrator
+from apps.diagnosis.shadow import ShadowEvaluator, compare
+from apps.diagnosis.tasks import shadow_evaluate
+
+
+class HotModelReloadTests(TestCase):
+    """اختبارات إعادة التحميل الساخن لرسم النماذج عند تفعيل ModelVersion جديد."""
+
+    def setUp(self):
+        self.v1 = ModelVersion.objects.create(name='pipeline', version='1', file_path='/models/v1', is_active=True)
+        patcher = patch.object(DjangoDiagnosisOrchestrator, '_load_service', side_effect=self._fake_service)
+        self.load_service = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _fake_service(model_version):
+        service = MagicMock(name=f'service-{model_version.version}')
+        service.model_paths = ai_config.model_paths(model_version.file_path)
+        return service
+
+    def _reload_settings(self, **overrides):
+        return self.settings(DIAGNOSIS_MODEL_RELOAD={**settings.DIAGNOSIS_MODEL_RELOAD, 'POLL_SECONDS': 0, **overrides})
+
+    def test_version_paths_and_independent_diagnosers(self):
+        paths = ai_config.model_paths('/models/v2')
+        self.assertEqual(paths['tabular'], os.path.join('/models/v2', 'tabular_model.keras'))
+        self.assertEqual(len(paths['experts']), 6)
+        self.assertIsNot(Diagnoser(), Diagnoser())
+
+    @patch('apps.diagnosis.ai_pipeline.models.classifier.EyesModel.evict')
+    def test_new_version_loads_in_background_and_swaps_between_tasks(self, mock_evict):
+        orchestrator = DjangoDiagnosisOrchestrator()
+        old_service = orchestrator.ai_service
+        self.assertEqual(orchestrator.model_version, self.v1)
+        v2 = ModelVersion.objects.create(name='pipeline', version='2', file_path='/models/v2', is_active=True)
+
+        with self._reload_settings():
+            orchestrator.refresh()
+            orchestrator._loader.join(timeout=5)
+            # المهمة الجارية ما زالت على الإصدار القديم حتى بداية المهمة التالية
+            self.assertIs(orchestrator.ai_service, old_service)
+            orchestrator.refresh()
+
+        self.assertEqual(orchestrator.model_version, v2)
+        self.assertIsNot(orchestrator.ai_service, old_service)
+        orchestrator.ai_service.warm_up.assert_called_once()
+        evicted = mock_evict.call_args[0][0]
+        self.assertIn(os.path.join('/models/v1', 'multi_class_model.keras'), evicted)
+        self.assertNotIn(os.path.join('/models/v2', 'multi_class_model.keras'), evicted)
+
+    def test_pinned_version_and_failed_loads_keep_serving(self):
+        ModelVersion.objects.create(name='pipeline', version='2', file_path='/models/v2', is_active=True)
+        with self._reload_settings(PINNED_VERSION=self.v1.pk):
+            orchestrator = DjangoDiagnosisOrchestrator()
+            orchestrator.refresh()
+        self.assertEqual(orchestrator.model_version, self.v1)
+        self.assertIsNone(orchestrator._loader)
+
+        self.load_service.side_effect = OSError('missing weights')
+        with self._reload_settings():
+            orchestrator.refresh()
+            orchestrator._loader.join(timeout=5)
+            orchestrator.refresh()
+        self.assertEqual(orchestrator.model_version, self.v1)
+
+
+class ShadowEvaluationTests(TestCase):
+    """اختبارات التقييم الظلي لإصدار نماذج مرشح خارج المسار الحرج."""
+
+    def setUp(self):
+        self.patient = Patient.objects.create(full_name='Shadow Patient', date_of_birth=date(1970, 1, 1), gender='MALE')
+        self.production = ModelVersion.objects.create(name='pipeline', version='1', file_path=self._bundle(b'tab-1'))
+        self.candidate = ModelVersion.objects.create(name='pipeline', version='2', file_path=self._bundle(b'tab-2'))
+        self.diagnosis = Diagnosis.objects.create(
+            patient=self.patient, left_fundus_image='l.png', right_fundus_image='r.png',
+            status=Diagnosis.Status.SUCCESS, model_version=self.production,
+            result={'final_diagnosis': {'N': '0.9', 'D': '0.2'}, 'evidence_vector': [0.1] * 38},
+        )
+
+    def _bundle(self, tabular: bytes) -> str:
+        """مجلد إصدار بنماذج صورية متطابقة المحتوى ونموذج جدولي مختلف."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        paths = ai_config.model_paths(directory)
+        for path in [paths['multi_class'], *paths['experts']]:
+            with open(path, 'wb') as f:
+                f.write(b'image-model-' + os.path.basename(path).encode())
+        with open(paths['tabular'], 'wb') as f:
+            f.write(tabular)
+        return directory
+
+    def test_compare_reports_top_class_and_flips(self):
+        stats = compare(
+            {'final_diagnosis': {'N': '0.9', 'D': '0.2', 'G': '0.55'}},
+            {'final_diagnosis': {'N': '0.3', 'D': '0.6', 'G': '0.56'}},
+        )
+        self.assertEqual((stats['production_top'], stats['candidate_top']), ('N', 'D'))
+        self.assertFalse(stats['agrees'])
+        self.assertAlmostEqual(stats['max_abs_diff'], 0.6)
+        self.assertEqual(stats['flipped'], ['N', 'D'])
+
+    @patch('apps.diagnosis.ai_pipeline.service.DiagnosisService.tabular_only')
+    def test_unchanged_image_models_reuse_stored_outputs(self, mock_tabular_only):
+        mock_tabular_only.return_value.rescore_batch.return_value = [
+            {'final_diagnosis': {'N': '0.85', 'D': '0.25'}, 'evidence_vector': [0.2] * 38},
+        ]
+        with self.settings(DIAGNOSIS_SHADOW={**settings.DIAGNOSIS_SHADOW, 'VERSION': self.candidate.pk}):
+            outcome = shadow_evaluate(str(self.diagnosis.id))
+
+        self.assertEqual(outcome['status'], 'SUCCESS')
+        shadow = ShadowResult.objects.get(diagnosis=self.diagnosis, model_version=self.candidate)
+        self.assertTrue(shadow.reused_image_outputs)
+        self.assertTrue(shadow.agrees)
+        self.assertEqual(shadow.production_version, self.production)
+        self.assertEqual(mock_tabular_only.call_args[0][0]['tabular'], ai_config.model_paths(self.candidate.file_path)['tabular'])
+        # نتيجة المريض لا تتغير
+        self.diagnosis.refresh_from_db()
+        self.assertEqual(self.diagnosis.result['final_diagnosis']['N'], '0.9')
+        self.assertEqual(self.diagnosis.model_version, self.production)
+
+        out = io.StringIO()
+        call_command('shadow_report', '--model-version', str(self.candidate.pk), stdout=out)
+        self.assertIn('top-class agreement: 100.0%', out.getvalue())
+
+    def test_reuse_compares_store_manifests_without_fetching_production(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        retrained = self._bundle(b'tab-3')
+        with open(ai_config.model_paths(retrained)['experts'][0], 'wb') as f:
+            f.write(b'retrained-expert')
+        store = {'BACKEND': 'filesystem', 'LOCATION': os.path.join(root, 'store'), 'CACHE_DIR': os.path.join(root, 'cache')}
+        with self.settings(DIAGNOSIS_MODEL_ARTIFACTS=store):
+            production = artifacts.publish_version(self.production.file_path, 'pipeline', '10')
+            candidate = artifacts.publish_version(self.candidate.file_path, 'pipeline', '11')
+            changed = artifacts.publish_version(retrained, 'pipeline', '12')
+            Diagnosis.objects.filter(pk=self.diagnosis.pk).update(model_version=production)
+            self.diagnosis.refresh_from_db()
+
+            with patch('apps.diagnosis.artifacts.fetch', wraps=artifacts.fetch) as mock_fetch:
+                self.assertTrue(ShadowEvaluator(candidate).can_reuse(self.diagnosis))
+                self.assertFalse(ShadowEvaluator(changed).can_reuse(self.diagnosis))
+        # يُسحب المرشح فقط (لتشغيله)، ولا تُسحب ملفات إصدار الإنتاج
+        self.assertEqual([call.args[0] for call in mock_fetch.call_args_list], [candidate.file_path, changed.file_path])
+
+    @patch('apps.diagnosis.scheduling.enqueue_task')
+    def test_sampling_is_deterministic_and_off_by_default(self, mock_enqueue):
+        ids = [str(self.diagnosis.id), 'a', 'b', 'c']
+        with self.settings(DIAGNOSIS_SHADOW={**settings.DIAGNOSIS_SHADOW, 'VERSION': None}):
+            self.assertEqual(schedule_shadow_evaluations(ids), 0)
+        mock_enqueue.assert_not_called()
+
+        shadow_settings = {'VERSION': self.candidate.pk, 'SAMPLE_RATE': 1.0, 'QUEUE': 'diagnosis_shadow'}
+        with self.settings(DIAGNOSIS_SHADOW=shadow_settings):
+            self.assertEqual(schedule_shadow_evaluations(ids), 4)
+            mock_enqueue.assert_called_with(SHADOW_EVALUATE_TASK, kwargs={'diagnosis_id': 'c'}, queue='diagnosis_shadow')
+            # فشل الوسيط لا يصل إلى مهمة التشخيص
+            mock_enqueue.side_effect = ConnectionError('broker down')
+            self.assertEqual(schedule_shadow_evaluations(ids), 0)
+        mock_enqueue.side_effect = None
+        with self.settings(DIAGNOSIS_SHADOW={**shadow_settings, 'SAMPLE_RATE': 0.5}):
+            first = schedule_shadow_evaluations(ids)
+            self.assertEqual(schedule_shadow_evaluations(ids), first)
+
+
+class ModelArtifactTests(TestCase):
+    """اختبارات نشر ملفات النماذج وسحبها إلى ذاكرة العقدة مع التحقق من البصمات."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        override = self.settings(DIAGNOSIS_MODEL_ARTIFACTS={
+            'BACKEND': 'filesystem',
+            'LOCATION': os.path.join(self.root, 'store'),
+            'CACHE_DIR': os.path.join(self.root, 'cache'),
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _source(self, tabular: bytes) -> str:
+        directory = tempfile.mkdtemp(dir=self.root)
+        paths = ai_config.model_paths(directory)
+        for path in [paths['multi_class'], *paths['experts']]:
+            with open(path, 'wb') as f:
+                f.write(b'weights-' + os.path.basename(path).encode())
+        with open(paths['tabular'], 'wb') as f:
+            f.write(tabular)
+        return directory
+
+    def _publish(self, label: str, tabular: bytes) -> ModelVersion:
+        call_command('model_artifacts', '--publish', self._source(tabular), '--label', label, stdout=io.StringIO())
+        return ModelVersion.objects.get(version=label)
+
+    def test_publish_then_fetch_shares_unchanged_files_between_versions(self):
+        v1, v2 = self._publish('1', b'tabular-1'), self._publish('2', b'tabular-2')
+        self.assertEqual(v1.file_path, 'models/pipeline/1')
+
+        with patch('apps.diagnosis.artifacts._download', wraps=artifacts._download) as mock_download:
+            first = artifacts.local_dir(v1)
+            downloads = mock_download.call_count
+            second = artifacts.local_dir(v2)
+            self.assertEqual(mock_download.call_count, downloads + 1)  # النموذج الجدولي فقط
+            artifacts.local_dir(v1)
+            self.assertEqual(mock_download.call_count, downloads + 1)
+
+        first_paths, second_paths = ai_config.model_paths(first), ai_config.model_paths(second)
+        with open(second_paths['tabular'], 'rb') as f:
+            self.assertEqual(f.read(), b'tabular-2')
+        self.assertTrue(os.path.samefile(first_paths['multi_class'], second_paths['multi_class']))
+        self.assertFalse(os.path.samefile(first_paths['tabular'], second_paths['tabular']))
+
+    def test_corrupted_artifact_is_rejected_and_not_cached(self):
+        version = self._publish('1', b'tabular-1')
+        store = os.path.join(self.root, 'store', version.file_path, 'tabular_model.keras')
+        with open(store, 'wb') as f:
+            f.write(b'tampered!')
+
+        with self.assertRaisesRegex(ModelArtifactError, 'Checksum mismatch'):
+            artifacts.local_dir(version)
+        blobs = os.listdir(os.path.join(self.root, 'cache', 'blobs'))
+        self.assertFalse([name for name in blobs if name.startswith('.download-')])
+        self.assertNotIn(hashlib.sha256(b'tabular-1').hexdigest(), blobs)
+        self.assertNotIn(hashlib.sha256(b'tampered!').hexdigest(), blobs)
+
+    def test_concurrent_workers_share_one_download(self):
+        version = self._publish('1', b'tabular-1')
+        with patch('apps.diagnosis.artifacts._download', wraps=artifacts._download) as mock_download, \
+                ThreadPoolExecutor(4) as pool:
+            directories = list(pool.map(lambda _: artifacts.local_dir(version), range(4)))
+        self.assertEqual(len(set(directories)), 1)
+        self.assertEqual(mock_download.call_count, len(artifacts.read_manifest(version.file_path)))
+
+    def test_local_version_holding_a_single_model_file_is_rejected(self):
+        directory = self._source(b'tabular-1')
+        legacy = ModelVersion.objects.create(
+            name='pipeline', version='0', file_path=ai_config.model_paths(directory)['tabular'], is_active=True
+        )
+        current = ModelVersion.objects.create(name='pipeline', version='1', file_path=directory)
+        with self.settings(DIAGNOSIS_MODEL_ARTIFACTS={**settings.DIAGNOSIS_MODEL_ARTIFACTS, 'BACKEND': ''}):
+            with self.assertRaisesRegex(ModelArtifactError, 'is not a directory'):
+                artifacts.local_dir(legacy)
+            self.assertEqual(artifacts.local_dir(current), directory)
@@ -1,13 +1,17 @@
-# apps/diagnosis/tests.py
+# apps/diagnosis/tests/test_orchestrator.py
+import uuid
 from datetime import date
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
-from unittest.mock import patch, MagicMock
-from apps.diagnosis.services import DjangoDiagnosisOrchestrator, AIPipelineService
-from apps.diagnosis.exceptions import ModelInferenceError, ModelLoadingError
+
+from apps.diagnosis.ai_pipeline.service import DiagnosisService as AIPipelineService
+from apps.diagnosis.exceptions import ModelInferenceError
 from apps.diagnosis.models import Diagnosis, Patient
-from django.core.files.uploadedfile import SimpleUploadedFile
-import numpy as np
-import uuid
+from apps.diagnosis.services import DjangoDiagnosisOrchestrator
+
 
 class DiagnosisOrchestratorTests(TestCase):
 
@@ -85,7 +89,6 @@ class DiagnosisOrchestratorTests(TestCase):
         assert 'not found' in args[1]
 
 
-
 """
 from django.test import TestCase
 from unittest.mock import patch
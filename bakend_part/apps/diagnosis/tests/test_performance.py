@@ -0,0 +1,262 @@
+# apps/diagnosis/tests/test_performance.py
+import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, timedelta
+from unittest.mock import patch
+
+import tensorflow as tf
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.diagnosis import derivatives, loadtest, timings
+from apps.diagnosis.ai_pipeline import config as ai_config
+from apps.diagnosis.ai_pipeline.models.classifier import EyesModel
+from apps.diagnosis.models import Diagnosis
+from apps.diagnosis.tasks import process_diagnosis, process_diagnosis_batch
+from apps.users.models import User
+
+from .base import DoctorPatientTestCase, fundus_upload
+
+
+class PipelineBenchmarkTests(TestCase):
+    """اختبارات قياس أداء خط التشخيص على نماذج بديلة بمعمارية التدريب."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def test_command_builds_stand_ins_and_writes_comparable_results(self):
+        models = os.path.join(self.root, 'models')
+        first, second = os.path.join(self.root, 'first.json'), os.path.join(self.root, 'second.json')
+        options = ['--models', models, '--backbone', 'MobileNetV3Small', '--repeats', '2']
+
+        with patch.dict(EyesModel._model_cache, clear=True):
+            call_command('benchmark_pipeline', *options, '--requests', '2', '--concurrency', '2', '--output', first,
+                         stdout=io.StringIO())
+            paths = ai_config.model_paths(models)
+            built_at = os.path.getmtime(paths['multi_class'])
+            out = io.StringIO()
+            call_command('benchmark_pipeline', *options, '--requests', '1', '--concurrency', '1', '--modes', 'batch',
+                         '--output', second, '--compare', first, stdout=out)
+
+        with open(first) as f:
+            results = json.load(f)
+        self.assertTrue({'decode/render', 'preprocessing/HypertensionPreprocessing', 'model/multi_class',
+                         'model/Age Issues', 'fusion', 'feature_pipeline', 'tabular'} <= set(results['stages']))
+        self.assertEqual([(r['mode'], r['concurrency']) for r in results['end_to_end']], [('threads', 2), ('batch', 2)])
+        latency = results['end_to_end'][0]['latency_ms']
+        self.assertLessEqual(latency['p50'], latency['p99'])
+        self.assertIn('%', out.getvalue())
+        self.assertEqual(os.path.getmtime(paths['multi_class']), built_at)
+
+        # بناة ai_part: ثماني فئات softmax، وخبير ثنائي، و TabularResNet على متجه الميزات النهائي (38)
+        self.assertEqual(tf.keras.models.load_model(paths['multi_class']).output_shape, (None, 8))
+        self.assertEqual(tf.keras.models.load_model(paths['experts'][1]).output_shape, (None, 1))
+        self.assertEqual(tf.keras.models.load_model(paths['tabular']).input_shape, (None, 38))
+
+
+class DiagnosisLoadTestTests(TestCase):
+    """منطق load_test_diagnoses دون خادم: جدول الوصول، فترات الخادم، وملخص كل معدل."""
+
+    def test_arrival_schedules_are_reproducible(self):
+        self.assertEqual(loadtest.arrival_offsets(2, 4, 'fixed'), [0.0, 0.5, 1.0, 1.5])
+        offsets = loadtest.arrival_offsets(4, 2000, 'poisson', seed=3)
+        self.assertEqual(offsets, loadtest.arrival_offsets(4, 2000, 'poisson', seed=3))
+        self.assertNotEqual(offsets, loadtest.arrival_offsets(4, 2000, 'poisson', seed=4))
+        self.assertAlmostEqual(offsets[-1] / (len(offsets) - 1), 0.25, delta=0.02)
+        with self.assertRaises(ValueError):
+            loadtest.arrival_offsets(0, 4)
+
+    def test_server_timings_from_the_detail_response(self):
+        timings = loadtest.server_timings({
+            'created_at': '2026-01-01T10:00:00Z',
+            'started_at': '2026-01-01T10:00:02.500000Z',
+            'finished_at': '2026-01-01T10:00:04Z',
+        })
+        self.assertEqual(timings, {'queue_wait_ms': 2500.0, 'processing_ms': 1500.0})
+        self.assertEqual(
+            loadtest.server_timings({'created_at': '2026-01-01T10:00:00Z', 'started_at': None}),
+            {'queue_wait_ms': None, 'processing_ms': None},
+        )
+
+    def test_summary_counts_only_successes_as_throughput(self):
+        records = [
+            {'outcome': 'SUCCESS', 'enqueue_ms': 20.0, 'queue_wait_ms': 100.0, 'processing_ms': 900.0, 'total_ms': 1100.0},
+            {'outcome': 'SUCCESS', 'enqueue_ms': 30.0, 'queue_wait_ms': 300.0, 'processing_ms': 1100.0, 'total_ms': 1500.0},
+            {'outcome': 'FAILURE', 'enqueue_ms': 25.0, 'queue_wait_ms': 50.0, 'processing_ms': 10.0, 'total_ms': 600.0},
+            {'outcome': 429, 'enqueue_ms': 5.0},
+        ]
+        level = loadtest.summarize_level(0.5, records, seconds=4.0)
+
+        self.assertEqual(level['outcomes'], {'SUCCESS': 2, 'FAILURE': 1, '429': 1})
+        self.assertEqual(level['throughput_per_second'], 0.5)
+        self.assertEqual(level['latency']['enqueue_ms']['n'], 4)
+        self.assertEqual(level['latency']['queue_wait_ms']['n'], 3)
+        self.assertEqual(level['latency']['processing_ms']['p50'], 900.0)
+        self.assertIsNone(loadtest.summarize_level(1, [{'outcome': 'timeout'}], 1.0)['latency']['total_ms'])
+
+    def test_command_needs_credentials(self):
+        with self.assertRaisesMessage(CommandError, '--username'):
+            call_command('load_test_diagnoses', '--token', '', stdout=io.StringIO())
+
+    def test_loadtest_settings_create_nothing_and_prepare_creates_the_stack(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        stack = os.path.join(root, 'stack')
+        environ = {name: value for name, value in os.environ.items() if name not in ('DATABASE_URL', 'CELERY_BROKER_URL')}
+        self.addCleanup(sys.modules.pop, 'eye2_project.settings.loadtest', None)
+        sys.modules.pop('eye2_project.settings.loadtest', None)
+        with patch.dict(os.environ, {**environ, 'LOAD_TEST_DIR': stack}, clear=True):
+            loadtest_settings = importlib.import_module('eye2_project.settings.loadtest')
+        self.assertFalse(os.path.exists(stack))
+        self.assertEqual(loadtest_settings.DATABASES['default']['NAME'], os.path.join(stack, 'db.sqlite3'))
+
+        with self.settings(
+            LOAD_TEST_DIR=loadtest_settings.LOAD_TEST_DIR, MEDIA_ROOT=loadtest_settings.MEDIA_ROOT,
+            CELERY_BROKER_TRANSPORT_OPTIONS=loadtest_settings.CELERY_BROKER_TRANSPORT_OPTIONS,
+        ):
+            call_command('load_test_diagnoses', '--prepare', stdout=io.StringIO())
+        for folder in ('media', 'broker', os.path.join('broker', 'processed')):
+            self.assertTrue(os.path.isdir(os.path.join(stack, folder)), folder)
+
+        with self.assertRaisesMessage(CommandError, 'settings.loadtest'):
+            call_command('load_test_diagnoses', '--prepare', stdout=io.StringIO())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DIAGNOSIS_CLAIM_BACKEND='skip_locked')
+class StageTimingTests(DoctorPatientTestCase):
+    """أزمنة المراحل على Diagnosis.stage_timings وتقرير p50/p95/p99 لكل مرحلة."""
+    username = 'timing-doc'
+    patient_name = 'Timing Patient'
+    date_of_birth = date(1975, 3, 3)
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user(username='timing-admin', password='x', role=User.Roles.ADMIN)
+
+    def _finished(self, stage_timings, hours_ago=1, status=Diagnosis.Status.SUCCESS):
+        return self.create_diagnosis(
+            status=status, stage_timings=stage_timings, finished_at=timezone.now() - timedelta(hours=hours_ago)
+        )
+
+    def test_stages_are_summed_only_inside_a_collector(self):
+        with timings.stage('tabular'):
+            pass
+        timings.record('queue_wait', 5.0)
+
+        with timings.collect() as timer:
+            for _ in range(2):
+                with timings.stage('model/multi_class'):
+                    pass
+            timings.record('queue_wait', 5.0)
+            timings.record('queue_wait', 2.5)
+        self.assertEqual(set(timer.stages), {'model/multi_class', 'queue_wait'})
+        self.assertEqual(timer.as_dict()['queue_wait'], 7.5)
+        self.assertEqual(timer.as_dict(divisor=3)['queue_wait'], 2.5)
+
+    def test_derivative_reads_are_split_into_read_and_decode(self):
+        diagnosis = Diagnosis.objects.create(
+            patient=self.patient, left_fundus_image=fundus_upload('left.png'), right_fundus_image=fundus_upload('right.png'),
+        )
+        with timings.collect() as first:
+            derivatives.inference_image(diagnosis, 'left')
+        with timings.collect() as second:
+            derivatives.inference_image(diagnosis, 'left')
+
+        self.assertEqual(set(first.stages), {'image_read', 'decode', 'derivative_write'})
+        self.assertEqual(set(second.stages), {'image_read', 'decode'})
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_process_diagnosis_persists_the_breakdown(self, mock_get_orchestrator):
+        diagnosis = self._finished(None, status=Diagnosis.Status.PENDING)
+
+        def fake_run(diagnosis_id):
+            with timings.stage('tabular'):
+                return {"final_diagnosis": {}}
+
+        mock_get_orchestrator.return_value.run_diagnosis_from_django_model.side_effect = fake_run
+        mock_get_orchestrator.return_value.model_version = None
+        process_diagnosis.apply(kwargs={'diagnosis_id': str(diagnosis.id)}).get()
+
+        stage_timings = Diagnosis.objects.get(id=diagnosis.id).stage_timings
+        self.assertEqual(set(stage_timings), {'claim', 'tabular', 'db_write'})
+        self.assertTrue(all(value >= 0 for value in stage_timings.values()))
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_batch_rows_get_their_share_and_own_queue_wait(self, mock_get_orchestrator):
+        pending = [self._finished(None, status=Diagnosis.Status.PENDING) for _ in range(2)]
+        Diagnosis.objects.filter(id=pending[0].id).update(created_at=timezone.now() - timedelta(seconds=30))
+
+        def fake_run(records):
+            timings.record('tabular', 40.0)
+            return {str(r.id): {"final_diagnosis": {}} for r in records}, {}
+
+        mock_get_orchestrator.return_value.run_batch_from_django_models.side_effect = fake_run
+        mock_get_orchestrator.return_value.model_version = None
+        process_diagnosis_batch.apply(kwargs={'batch_size': 2}).get()
+
+        first, second = (Diagnosis.objects.get(id=d.id).stage_timings for d in pending)
+        self.assertEqual((first['tabular'], second['tabular']), (20.0, 20.0))
+        self.assertEqual(first['db_write'], second['db_write'])
+        self.assertIn('claim', first)
+        self.assertGreater(first['queue_wait'], 29000)
+        self.assertLess(second['queue_wait'], 29000)
+
+    def test_percentiles_per_stage_within_the_window(self):
+        for ms in range(1, 101):
+            self._finished({'model/multi_class': float(ms), 'queue_wait': 1.0})
+        self._finished({'model/multi_class': 5000.0, 'tabular': 3.0}, hours_ago=48)
+        self._finished({'model/multi_class': 5000.0}, status=Diagnosis.Status.FAILURE)
+        self._finished({'tabular': 7.0})
+
+        report = timings.stage_percentiles(timezone.now() - timedelta(hours=24))
+
+        self.assertEqual(report['diagnoses'], 101)
+        self.assertEqual(list(report['stages']), ['queue_wait', 'model/multi_class', 'tabular'])
+        self.assertEqual(
+            report['stages']['model/multi_class'], {'n': 100, 'p50': 50.0, 'p95': 95.0, 'p99': 99.0}
+        )
+        self.assertEqual(report['stages']['tabular'], {'n': 1, 'p50': 7.0, 'p95': 7.0, 'p99': 7.0})
+
+    def test_postgresql_percentiles_are_one_within_group_query(self):
+        self._finished({'queue_wait': 3.0, 'model/multi_class': 40.0})
+        # SQLite لا يعرف PERCENTILE_DISC: يُلتقط الاستعلام المولّد لـ PostgreSQL ويُتوقع فشل تنفيذه هنا
+        with patch.object(connection, 'vendor', 'postgresql'), CaptureQueriesContext(connection) as queries, \
+                self.assertRaises(DatabaseError), transaction.atomic():
+            timings.stage_percentiles(timezone.now() - timedelta(hours=24))
+
+        statements = [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        sql = statements[-1]
+        for i, name in enumerate(['queue_wait', 'model/multi_class']):
+            for pct, fraction in ((50, '0.5'), (95, '0.95'), (99, '0.99')):
+                self.assertIn(
+                    f'PERCENTILE_DISC({fraction}) WITHIN GROUP (ORDER BY '
+                    f'(("diagnosis_diagnosis"."stage_timings" ->> \'{name}\'))::real) AS "p{pct}_{i}"', sql
+                )
+        self.assertEqual(sql.count('PERCENTILE_DISC'), 6)
+        # أسماء المراحل ثم الاستعلام التجميعي فقط، دون استعلامات ORDER BY ... OFFSET لكل نسبة
+        self.assertEqual(len(statements), 2)
+
+    def test_report_endpoint_is_admin_only(self):
+        self._finished({'tabular': 4.0})
+        api = self.api
+        self.assertEqual(api.get('/api/diagnoses/stage-timings/').status_code, 403)
+
+        api.force_authenticate(self.admin)
+        response = api.get('/api/diagnoses/stage-timings/', {'hours': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['stages']['tabular']['p99'], 4.0)
+        until = (timezone.now() - timedelta(hours=3)).isoformat()
+        self.assertEqual(api.get('/api/diagnoses/stage-timings/', {'until': until}).data['diagnoses'], 0)
+        self.assertEqual(api.get('/api/diagnoses/stage-timings/', {'since': 'yesterday'}).status_code, 400)
+        for params in ({'model_version': 'abc'}, {'hours': 'nan'}, {'hours': 'inf'}, {'hours': '-1'}, {'hours': '1e12'}):
+            self.assertEqual(api.get('/api/diagnoses/stage-timings/', params).status_code, 400, params)
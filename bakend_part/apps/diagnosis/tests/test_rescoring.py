@@ -0,0 +1,244 @@
+# apps/diagnosis/tests/test_rescoring.py
+import io
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.diagnosis.ai_pipeline.production_feature_pipeline import ProductionFeaturePipeline
+from apps.diagnosis.ai_pipeline.service import DiagnosisService
+from apps.diagnosis.models import Diagnosis, ModelVersion, Patient, RescoreRun
+from apps.diagnosis.rescoring import run_chunks, start_run
+from apps.diagnosis.services import DjangoDiagnosisOrchestrator
+from apps.diagnosis.tasks import rescore_model_version, rescore_patient_diagnoses
+
+
+class DemographicRescoringTests(TestCase):
+    """اختبارات إعادة التقييم الجدولي بعد تعديل البيانات الديموغرافية للمريض."""
+
+    def setUp(self):
+        self.patient = Patient.objects.create(full_name='Rescore Patient', date_of_birth=date(1970, 1, 1), gender='MALE')
+        self.service = DiagnosisService.__new__(DiagnosisService)
+        multi = np.tile(np.linspace(0.05, 0.4, 8, dtype=np.float32), (2, 1))
+        self.service.multi_class_model = MagicMock(**{'predict_batch.return_value': multi})
+        self.service.diagnoser = MagicMock(**{'predict_batch.return_value': [
+            (np.full((1, 1), 0.5, dtype=np.float32), np.full((1, 1), 0.25, dtype=np.float32)) for _ in range(6)
+        ]})
+        self.service.feature_pipeline = ProductionFeaturePipeline()
+        self.service.tabular_model = MagicMock(**{
+            'predict.return_value': np.full((1, 8), 0.1, dtype=np.float32),
+            'predict_on_batch.return_value': np.full((1, 8), 0.1, dtype=np.float32),
+        })
+        self.image = np.zeros((32, 32, 3), dtype=np.uint8)
+
+    def _full_run(self, demographics):
+        case = {'left_eye_img': self.image, 'right_eye_img': self.image, 'demographics': demographics}
+        return self.service.run_diagnosis_batch([case])[0]
+
+    def test_rescore_matches_full_pipeline_without_image_models(self):
+        original = self._full_run({'age': 40, 'gender': 0})
+        expected = self._full_run({'age': 71, 'gender': 1})
+        self.service.multi_class_model.reset_mock()
+        self.service.diagnoser.reset_mock()
+
+        rescored = self.service.rescore_batch([{'result': original, 'demographics': {'age': 71, 'gender': 1}}])[0]
+
+        self.service.multi_class_model.predict_batch.assert_not_called()
+        self.service.diagnoser.predict_batch.assert_not_called()
+        self.assertEqual(self.service.tabular_model.predict_on_batch.call_args[0][0].shape, (1, 38))
+        np.testing.assert_allclose(rescored['evidence_vector'], expected['evidence_vector'])
+        self.assertEqual(rescored['image_outputs'], original['image_outputs'])
+        # التقارير الأقدم (دون image_outputs) تُعاد تقييمها من الميزات المدمجة في evidence_vector
+        legacy = {key: value for key, value in original.items() if key != 'image_outputs'}
+        rescored = self.service.rescore_batch([{'result': legacy, 'demographics': {'age': 71, 'gender': 1}}])[0]
+        np.testing.assert_allclose(rescored['evidence_vector'], expected['evidence_vector'], rtol=1e-6)
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_changing_date_of_birth_rescores_successful_diagnoses(self, mock_get_orchestrator):
+        orchestrator = DjangoDiagnosisOrchestrator.__new__(DjangoDiagnosisOrchestrator)
+        orchestrator.ai_service, orchestrator.model_version = self.service, None
+        mock_get_orchestrator.return_value = orchestrator
+        done = Diagnosis.objects.create(
+            patient=self.patient, left_fundus_image='l.png', right_fundus_image='r.png',
+            status=Diagnosis.Status.SUCCESS, result=self._full_run({'age': 56, 'gender': 0}),
+        )
+        pending = Diagnosis.objects.create(patient=self.patient, left_fundus_image='l.png', right_fundus_image='r.png')
+        Diagnosis.objects.filter(pk=done.pk).update(created_at=timezone.now().replace(year=2020, month=6, day=1))
+
+        self.patient.date_of_birth = date(1980, 1, 1)
+        with patch('apps.diagnosis.signals.schedule_patient_rescoring') as mock_schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.patient.save()
+        mock_schedule.assert_called_once_with(str(self.patient.id))
+
+        self.assertEqual(rescore_patient_diagnoses(str(self.patient.id)), 1)
+        done.refresh_from_db()
+        pending.refresh_from_db()
+        # العمر في تاريخ التشخيص (2020) وليس اليوم
+        self.assertEqual(done.result['evidence_vector'][16], 40.0)
+        self.assertIn('rescored_at', done.result)
+        self.assertIsNone(pending.result)
+
+    @patch('apps.diagnosis.tasks.get_tabular_service')
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_each_diagnosis_is_rescored_with_its_own_model_version(self, mock_get_orchestrator, mock_tabular_service):
+        old, current = (ModelVersion.objects.create(name='pipeline', version=v, file_path=f'v{v}') for v in '12')
+        orchestrator = DjangoDiagnosisOrchestrator.__new__(DjangoDiagnosisOrchestrator)
+        orchestrator.ai_service, orchestrator.model_version = self.service, current
+        mock_get_orchestrator.return_value = orchestrator
+        old_service = DiagnosisService.__new__(DiagnosisService)
+        old_service.feature_pipeline = ProductionFeaturePipeline()
+        old_service.tabular_model = MagicMock(**{'predict_on_batch.return_value': np.full((1, 8), 0.7, dtype=np.float32)})
+        mock_tabular_service.return_value = old_service
+        result = self._full_run({'age': 56, 'gender': 0})
+        on_old, on_current = (
+            Diagnosis.objects.create(
+                patient=self.patient, left_fundus_image='l.png', right_fundus_image='r.png',
+                status=Diagnosis.Status.SUCCESS, result=result, model_version=version,
+            ) for version in (old, current)
+        )
+
+        self.assertEqual(rescore_patient_diagnoses(str(self.patient.id)), 2)
+
+        mock_tabular_service.assert_called_once_with(old)
+        on_old.refresh_from_db()
+        on_current.refresh_from_db()
+        self.assertEqual(set(on_old.result['final_diagnosis'].values()), {'0.7000'})
+        self.assertEqual(set(on_current.result['final_diagnosis'].values()), {'0.1000'})
+        self.assertEqual((on_old.model_version, on_current.model_version), (old, current))
+
+    def test_other_patient_edits_do_not_rescore(self):
+        self.patient.phone = '0999999999'
+        with patch('apps.diagnosis.signals.schedule_patient_rescoring') as mock_schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.patient.save()
+            Patient.objects.create(full_name='New Patient', gender='FEMALE')
+        mock_schedule.assert_not_called()
+
+
+class BulkRescoringTests(TestCase):
+    """اختبارات إعادة استدلال التشخيصات المخزنة بعد تفعيل ModelVersion جديد."""
+
+    def setUp(self):
+        self.old = ModelVersion.objects.create(name='pipeline', version='1', file_path='v1', is_active=False)
+        self.new = ModelVersion.objects.create(name='pipeline', version='2', file_path='v2', is_active=True)
+        patient = Patient.objects.create(full_name='Bulk Patient', date_of_birth=date(1960, 1, 1), gender='MALE')
+
+        def create(**fields):
+            return Diagnosis.objects.create(
+                patient=patient, left_fundus_image='l.png', right_fundus_image='r.png', **fields
+            )
+
+        self.stale = [
+            create(status=Diagnosis.Status.SUCCESS, result={'final_diagnosis': 'old'}, model_version=self.old)
+            for _ in range(5)
+        ]
+        self.current = create(status=Diagnosis.Status.SUCCESS, result={'final_diagnosis': 'v2'}, model_version=self.new)
+        self.failed = create(status=Diagnosis.Status.FAILURE)
+        self.broken_id = str(self.stale[2].id)
+
+        def fake_run(records, save_quality=True):
+            results = {str(r.id): {'final_diagnosis': 'new'} for r in records if str(r.id) != self.broken_id}
+            failures = {self.broken_id: 'unreadable image'} if any(str(r.id) == self.broken_id for r in records) else {}
+            return results, failures
+
+        self.orchestrator = MagicMock(**{'run_batch_from_django_models.side_effect': fake_run})
+        self.orchestrator.model_version = self.new
+
+    def test_run_is_chunked_checkpointed_and_resumable(self):
+        run = start_run(self.new, chunk_size=2)
+        self.assertEqual(run.total, 5)
+
+        # مهلة منتهية: دفعة واحدة ثم توقف مع نقطة استئناف
+        self.assertFalse(run_chunks(run, self.orchestrator, deadline=0))
+        run = RescoreRun.objects.get(pk=run.pk)
+        self.assertEqual((run.processed, run.failed, run.remaining), (2, 0, 3))
+        self.assertIsNotNone(run.cursor_id)
+
+        self.assertTrue(run_chunks(run, self.orchestrator))
+        sizes = [len(call.args[0]) for call in self.orchestrator.run_batch_from_django_models.call_args_list]
+        self.assertEqual(sizes, [2, 2, 1])
+        self.assertTrue(all(
+            call.kwargs['save_quality'] is False for call in self.orchestrator.run_batch_from_django_models.call_args_list
+        ))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.processed, run.failed), (RescoreRun.Status.COMPLETED, 4, 1))
+        self.assertGreater(run.throughput, 0)
+
+        rescored = Diagnosis.objects.filter(model_version=self.new, result={'final_diagnosis': 'new'})
+        self.assertEqual(rescored.count(), 4)
+        broken = Diagnosis.objects.get(pk=self.broken_id)
+        self.assertEqual((broken.result, broken.model_version), ({'final_diagnosis': 'old'}, self.old))
+        self.assertEqual(Diagnosis.objects.get(pk=self.current.pk).result, {'final_diagnosis': 'v2'})
+
+    @patch('apps.diagnosis.tasks.schedule_rescore_run')
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_task_requeues_itself_until_done_and_stops_when_paused(self, mock_get_orchestrator, mock_schedule):
+        mock_get_orchestrator.return_value = self.orchestrator
+        run = start_run(self.new, chunk_size=2)
+        with self.settings(DIAGNOSIS_RESCORE={**settings.DIAGNOSIS_RESCORE, 'TASK_SECONDS': 0}):
+            rescore_model_version(run.pk)
+            mock_schedule.assert_called_once_with(run.pk)
+
+            RescoreRun.objects.filter(pk=run.pk).update(status=RescoreRun.Status.PAUSED)
+            self.assertEqual(rescore_model_version(run.pk), {'status': 'SKIPPED'})
+
+            RescoreRun.objects.filter(pk=run.pk).update(status=RescoreRun.Status.RUNNING)
+            mock_schedule.reset_mock()
+            rescore_model_version(run.pk)
+            rescore_model_version(run.pk)
+        mock_schedule.assert_called_once_with(run.pk)
+        self.assertEqual(RescoreRun.objects.get(pk=run.pk).status, RescoreRun.Status.COMPLETED)
+
+    @patch('apps.diagnosis.services.get_orchestrator')
+    def test_command_runs_inline_and_reports_progress(self, mock_get_orchestrator):
+        mock_get_orchestrator.return_value = self.orchestrator
+        out = io.StringIO()
+        call_command('rescore_diagnoses', '--inline', '--chunk-size', '3', stdout=out)
+        self.assertIn('5/5 (1 failed)', out.getvalue())
+        self.assertIn('diagnoses/s', out.getvalue())
+
+        out = io.StringIO()
+        call_command('rescore_diagnoses', '--status', stdout=out)
+        self.assertIn('[COMPLETED]', out.getvalue())
+
+    def test_command_rejects_a_target_that_workers_do_not_serve(self):
+        with self.assertRaisesRegex(CommandError, 'Workers serve'):
+            call_command('rescore_diagnoses', '--model-version', str(self.old.pk), stdout=io.StringIO())
+        self.assertFalse(RescoreRun.objects.exists())
+
+        run = start_run(self.new)
+        RescoreRun.objects.filter(pk=run.pk).update(status=RescoreRun.Status.PAUSED)
+        with self.settings(DIAGNOSIS_MODEL_RELOAD={**settings.DIAGNOSIS_MODEL_RELOAD, 'PINNED_VERSION': self.old.pk}):
+            with self.assertRaisesRegex(CommandError, 'Workers serve'):
+                call_command('rescore_diagnoses', '--resume', str(run.pk), stdout=io.StringIO())
+        self.assertEqual(RescoreRun.objects.get(pk=run.pk).status, RescoreRun.Status.PAUSED)
+
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_task_pauses_instead_of_waiting_forever_for_its_target(self, mock_get_orchestrator):
+        mock_get_orchestrator.return_value = self.orchestrator
+
+        # الهدف ليس الإصدار المخدوم: لن يُحمّل أبدًا
+        stale_target = start_run(self.old)
+        self.assertEqual(rescore_model_version(stale_target.pk), {'status': RescoreRun.Status.PAUSED})
+        self.assertEqual(RescoreRun.objects.get(pk=stale_target.pk).status, RescoreRun.Status.PAUSED)
+
+        # الهدف مخدوم لكنه لم يُحمّل في هذا العامل: انتظار محدود ثم إيقاف مؤقت
+        self.orchestrator.model_version = self.old
+        run = start_run(self.new)
+        with self.settings(
+            DIAGNOSIS_RESCORE={**settings.DIAGNOSIS_RESCORE, 'LOAD_WAIT_SECONDS': 60},
+            DIAGNOSIS_MODEL_RELOAD={**settings.DIAGNOSIS_MODEL_RELOAD, 'POLL_SECONDS': 30},
+        ):
+            with self.assertRaises(Retry):
+                rescore_model_version(run.pk)
+            rescore_model_version.apply(args=(run.pk,))
+        self.assertEqual(mock_get_orchestrator.call_count, 5)  # 2 مباشرة + 3 في apply: محاولتان ثم الإيقاف
+        self.assertEqual(RescoreRun.objects.get(pk=run.pk).status, RescoreRun.Status.PAUSED)
+        self.orchestrator.run_batch_from_django_models.assert_not_called()
@@ -0,0 +1,287 @@
+# apps/diagnosis/tests/test_scheduling.py
+import tempfile
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.diagnosis.admission import BACKLOG_REJECTION_MESSAGE, BacklogEstimate, BacklogEstimator
+from apps.diagnosis.models import Diagnosis, Patient
+from apps.diagnosis.repositories import DiagnosisRepository
+from apps.diagnosis.scheduling import fair_share_order, queue_for_priority
+from apps.diagnosis.tasks import process_diagnosis
+from apps.diagnosis.views import schedule_diagnosis_processing
+from apps.users.models import Clinic, User
+
+from .base import DoctorPatientTestCase, png_upload
+
+
+class ClaimingTests(TestCase):
+    """اختبارات آلية الحجز دون Redis (DIAGNOSIS_CLAIM_BACKEND = skip_locked)."""
+
+    def setUp(self):
+        self.patient = Patient.objects.create(full_name='Claim Patient', date_of_birth=date(1980, 5, 5), gender='FEMALE')
+        self.repo = DiagnosisRepository()
+
+    def _create(self, status=Diagnosis.Status.PENDING):
+        return Diagnosis.objects.create(
+            patient=self.patient, status=status,
+            left_fundus_image='left.png', right_fundus_image='right.png'
+        )
+
+    def test_claim_one_transitions_only_claimable_rows(self):
+        pending, retry, running = self._create(), self._create(Diagnosis.Status.RETRY), self._create(Diagnosis.Status.RUNNING)
+
+        self.assertTrue(self.repo.claim_one(pending.id, 'w1'))
+        self.assertFalse(self.repo.claim_one(pending.id, 'w2'))
+        self.assertTrue(self.repo.claim_one(retry.id, 'w1'))
+        self.assertFalse(self.repo.claim_one(running.id, 'w1'))
+        self.assertEqual(Diagnosis.objects.get(id=pending.id).worker_id, 'w1')
+
+    def test_claim_pending_returns_oldest_first_with_patient(self):
+        first, second, _third = self._create(), self._create(), self._create()
+
+        claimed = self.repo.claim_pending(2, 'w1')
+
+        self.assertEqual([d.id for d in claimed], [first.id, second.id])
+        self.assertTrue(all(d.status == Diagnosis.Status.RUNNING for d in claimed))
+        self.assertEqual(claimed[0].patient.full_name, 'Claim Patient')
+        self.assertEqual(len(self.repo.claim_pending(5, 'w2')), 1)
+
+    @override_settings(DIAGNOSIS_FAIR_SHARE_WINDOW=2)
+    def test_clinic_backlog_larger_than_window_does_not_hide_other_clinics(self):
+        busy, quiet = Clinic.objects.create(name='Busy'), Clinic.objects.create(name='Quiet')
+        self.patient.clinic = busy
+        self.patient.save()
+        backlog = [self._create() for _ in range(10)]
+        other = Diagnosis.objects.create(
+            patient=Patient.objects.create(full_name='Quiet Patient', date_of_birth=date(1990, 1, 1), gender='MALE', clinic=quiet),
+            left_fundus_image='left.png', right_fundus_image='right.png'
+        )
+
+        claimed = self.repo.claim_pending(2, 'w1')
+
+        self.assertEqual({d.id for d in claimed}, {backlog[0].id, other.id})
+
+    def test_concurrent_claimer_takes_next_candidates_in_window(self):
+        rows = [self._create() for _ in range(4)]
+        select = self.repo._select_candidates
+
+        def select_then_race(*args):
+            order = select(*args)
+            # عامل آخر يحجز أول مرشحين بين اختيار النافذة والقفل
+            for pk in order[:2]:
+                self.repo.claim_one(pk, 'w1')
+            return order
+
+        with patch.object(self.repo, '_select_candidates', side_effect=select_then_race):
+            claimed = self.repo.claim_pending(2, 'w2')
+
+        self.assertEqual([d.id for d in claimed], [rows[2].id, rows[3].id])
+
+    def test_postgresql_claim_is_one_locking_statement(self):
+        self._create()
+        # SQLite لا يعرف FOR UPDATE: تُلتقط العبارة المولّدة لـ PostgreSQL ويُتوقع فشل تنفيذها هنا
+        with patch.object(connection, 'vendor', 'postgresql'), CaptureQueriesContext(connection) as queries, \
+                self.assertRaises(DatabaseError), transaction.atomic():
+            self.repo.claim_pending(2, 'w1')
+
+        statements = [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 1)
+        sql = statements[0]
+        self.assertTrue(sql.startswith('WITH candidates AS'))
+        self.assertIn('FOR UPDATE OF d SKIP LOCKED', sql)
+        self.assertIn('UPDATE "diagnosis_diagnosis" SET status', sql)
+        self.assertIn('RETURNING "diagnosis_diagnosis".*', sql)
+
+    @override_settings(DIAGNOSIS_CLAIM_BACKEND='skip_locked')
+    @patch('apps.diagnosis.tasks.redis_client')
+    @patch('apps.diagnosis.tasks.get_orchestrator')
+    def test_process_diagnosis_without_redis(self, mock_get_orchestrator, mock_redis):
+        diagnosis = self._create()
+        mock_get_orchestrator.return_value.run_diagnosis_from_django_model.return_value = {"final_diagnosis": {}}
+        mock_get_orchestrator.return_value.model_version = None
+
+        first = process_diagnosis.apply(kwargs={'diagnosis_id': str(diagnosis.id)}).get()
+        second = process_diagnosis.apply(kwargs={'diagnosis_id': str(diagnosis.id)}).get()
+
+        self.assertEqual(first["status"], "SUCCESS")
+        self.assertEqual(second["status"], "SKIPPED")
+        self.assertEqual(Diagnosis.objects.get(id=diagnosis.id).status, Diagnosis.Status.SUCCESS)
+        mock_redis.lock.assert_not_called()
+
+    @override_settings(CELERY_BROKER_URL='redis://broker.example:6379/3')
+    @patch('apps.diagnosis.tasks.redis_client', None)
+    @patch('apps.diagnosis.tasks.Redis')
+    def test_redis_client_is_created_on_first_use(self, mock_redis):
+        from apps.diagnosis import tasks
+
+        mock_redis.from_url.assert_not_called()
+        self.assertIs(tasks.get_redis_client(), tasks.get_redis_client())
+        mock_redis.from_url.assert_called_once_with('redis://broker.example:6379/3')
+
+
+class FairShareSchedulingTests(TestCase):
+    """اختبارات ترتيب الحجز الموزون والتقاسم العادل بين العيادات."""
+
+    WEIGHTS = {"URGENT": 6, "SAME_DAY": 3, "BULK": 1}
+
+    def test_bulk_clinic_does_not_starve_other_clinic(self):
+        candidates = [{"id": f"a{i}", "priority": "BULK", "clinic_id": "A"} for i in range(5)]
+        candidates += [{"id": "b0", "priority": "BULK", "clinic_id": "B"}]
+
+        self.assertEqual(fair_share_order(candidates, self.WEIGHTS, 3), ["a0", "b0", "a1"])
+
+    def test_weights_share_slots_without_starving_bulk(self):
+        candidates = [{"id": f"u{i}", "priority": "URGENT", "clinic_id": "A"} for i in range(20)]
+        candidates += [{"id": f"b{i}", "priority": "BULK", "clinic_id": "B"} for i in range(20)]
+
+        selected = fair_share_order(candidates, self.WEIGHTS, 7)
+
+        self.assertEqual(sum(1 for pk in selected if pk.startswith("u")), 6)
+        self.assertEqual(sum(1 for pk in selected if pk.startswith("b")), 1)
+
+    def test_unused_slots_go_to_other_priorities(self):
+        candidates = [{"id": "u0", "priority": "URGENT", "clinic_id": "A"}]
+        candidates += [{"id": f"s{i}", "priority": "SAME_DAY", "clinic_id": "A"} for i in range(4)]
+
+        self.assertEqual(fair_share_order(candidates, self.WEIGHTS, 4), ["u0", "s0", "s1", "s2"])
+
+    @patch('apps.diagnosis.scheduling.current_app')
+    def test_schedule_routes_to_priority_queue(self, mock_app):
+        mock_app.conf.task_always_eager = False
+        schedule_diagnosis_processing("abc", Diagnosis.Priority.BULK)
+
+        mock_app.send_task.assert_any_call(
+            'apps.diagnosis.tasks.process_diagnosis', kwargs={'diagnosis_id': "abc"}, queue="diagnosis_bulk"
+        )
+        mock_app.send_task.assert_called_with(
+            'apps.diagnosis.tasks.generate_diagnosis_tiles', kwargs={'diagnosis_id': "abc"}, queue="diagnosis_tiles"
+        )
+        self.assertEqual(mock_app.send_task.call_count, 2)
+        self.assertEqual(queue_for_priority(Diagnosis.Priority.URGENT), "diagnosis_urgent")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AdmissionControlTests(DoctorPatientTestCase):
+    """اختبارات تقدير الطابور والتحكم في قبول طلبات التشخيص."""
+    username = 'admission-doc'
+    patient_name = 'Admission Patient'
+    date_of_birth = date(1975, 3, 3)
+
+    def _post(self, priority=Diagnosis.Priority.SAME_DAY):
+        return self.api.post('/api/diagnoses/', {
+            'patient_id': str(self.patient.id),
+            'left_fundus_image': png_upload('left.png'),
+            'right_fundus_image': png_upload('right.png'),
+            'priority': priority,
+        }, format='multipart')
+
+    def _estimate(self, wait):
+        return BacklogEstimate(queue_depth=0, pending=0, running=0, service_time_seconds=20.0, projected_wait_seconds=wait)
+
+    def test_estimator_uses_backlog_and_recent_service_time(self):
+        now = timezone.now()
+        Diagnosis.objects.create(
+            patient=self.patient, status=Diagnosis.Status.SUCCESS, left_fundus_image='l.png', right_fundus_image='r.png',
+            started_at=now - timedelta(seconds=30), finished_at=now - timedelta(seconds=20),
+        )
+        for status in [Diagnosis.Status.PENDING, Diagnosis.Status.PENDING, Diagnosis.Status.RUNNING]:
+            Diagnosis.objects.create(patient=self.patient, status=status, left_fundus_image='l.png', right_fundus_image='r.png')
+
+        redis_client = MagicMock()
+        redis_client.llen.return_value = 0
+        estimate = BacklogEstimator(redis_client=redis_client).estimate()
+
+        self.assertEqual((estimate.pending, estimate.running), (2, 1))
+        self.assertAlmostEqual(estimate.service_time_seconds, 10.0, places=3)
+        self.assertAlmostEqual(estimate.projected_wait_seconds, 30.0, places=3)
+
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_create_returns_estimated_completion_when_within_slo(self, mock_estimate):
+        mock_estimate.return_value = self._estimate(wait=10)
+        response = self._post()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn('estimated_completion_at', response.data)
+        self.assertEqual(response.data['priority'], Diagnosis.Priority.SAME_DAY)
+
+    @override_settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'reject'})
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_create_rejected_with_retry_after_when_over_slo(self, mock_estimate):
+        mock_estimate.return_value = self._estimate(wait=200)
+        response = self._post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '141')
+        self.assertFalse(Diagnosis.objects.exists())
+
+    @override_settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'reject'})
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_only_admins_bypass_admission_with_urgent(self, mock_estimate):
+        mock_estimate.return_value = self._estimate(wait=200)
+
+        # طبيب عادي لا يستطيع تجاوز 429 بطلب URGENT
+        self.assertEqual(self._post(Diagnosis.Priority.URGENT).status_code, 429)
+        self.assertFalse(Diagnosis.objects.exists())
+
+        admin = get_user_model().objects.create_user(username='admission-admin', password='x', role=User.Roles.ADMIN)
+        self.patient.doctors.add(admin)
+        self.api.force_authenticate(admin)
+        response = self._post(Diagnosis.Priority.URGENT)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Diagnosis.objects.get().priority, Diagnosis.Priority.URGENT)
+
+    @override_settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'reject'})
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_urgent_from_doctor_is_stored_as_same_day(self, mock_estimate):
+        mock_estimate.return_value = self._estimate(wait=10)
+        response = self._post(Diagnosis.Priority.URGENT)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Diagnosis.objects.get().priority, Diagnosis.Priority.SAME_DAY)
+
+    @override_settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'reject'})
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_web_form_applies_admission_control(self, mock_estimate, mock_schedule):
+        self.client.force_login(self.user)
+
+        def post():
+            return self.client.post(reverse('diagnosis-create'), {
+                'patient': str(self.patient.id),
+                'left_fundus_image': png_upload('left.png'),
+                'right_fundus_image': png_upload('right.png'),
+            })
+
+        mock_estimate.return_value = self._estimate(wait=200)
+        response = post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '141')
+        self.assertContains(response, BACKLOG_REJECTION_MESSAGE, status_code=429)
+        self.assertFalse(Diagnosis.objects.exists())
+        mock_schedule.assert_not_called()
+
+        mock_estimate.return_value = self._estimate(wait=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = post()
+        diagnosis = Diagnosis.objects.get()
+        self.assertRedirects(response, reverse('diagnosis-detail', args=[diagnosis.pk]), fetch_redirect_response=False)
+        self.assertTrue(any('Estimated completion' in str(m) for m in get_messages(response.wsgi_request)))
+        mock_schedule.assert_called_once_with(str(diagnosis.id), Diagnosis.Priority.SAME_DAY)
+
+        with self.settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'downgrade'}):
+            mock_estimate.return_value = self._estimate(wait=200)
+            self.assertEqual(post().status_code, 302)
+        self.assertEqual(Diagnosis.objects.latest('created_at').priority, Diagnosis.Priority.BULK)
+
+    @override_settings(DIAGNOSIS_ADMISSION={'ENABLED': True, 'SLO_SECONDS': 60, 'MODE': 'downgrade'})
+    @patch('apps.diagnosis.admission.BacklogEstimator.estimate')
+    def test_create_downgraded_to_bulk_when_over_slo(self, mock_estimate):
+        mock_estimate.return_value = self._estimate(wait=200)
+        response = self._post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Diagnosis.objects.get().priority, Diagnosis.Priority.BULK)
@@ -0,0 +1,280 @@
+# apps/diagnosis/tests/test_uploads.py
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from datetime import date, timedelta
+from unittest.mock import patch
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image
+
+from apps.diagnosis.content_store import cas_key
+from apps.diagnosis.models import Diagnosis, StoredImage, UploadSession
+from apps.diagnosis.resumable import purge_expired_sessions
+
+from .base import DoctorPatientTestCase, png_bytes, png_upload
+
+
+try:
+    import boto3
+    import requests
+    from moto import mock_aws
+except ImportError:  # moto من متطلبات التطوير فقط
+    mock_aws = None
+
+
+def _tus_checksum(chunk):
+    return 'sha256 ' + base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DirectUploadTests(DoctorPatientTestCase):
+    """اختبارات الرفع المباشر بروابط موقعة: presign ثم PUT ثم confirm."""
+    username = 'direct-doc'
+    patient_name = 'Direct Patient'
+    date_of_birth = date(1982, 2, 2)
+
+    def _presign(self):
+        response = self.api.post('/api/diagnoses/presign/', {}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data
+
+    def _confirm(self, token):
+        return self.api.post('/api/diagnoses/confirm/', {
+            'upload_token': token, 'patient_id': str(self.patient.id), 'priority': Diagnosis.Priority.BULK,
+        }, format='json')
+
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def test_presign_upload_confirm_creates_diagnosis(self, mock_schedule):
+        presigned = self._presign()
+        for upload in presigned['uploads'].values():
+            response = self.client.put(urlsplit(upload['url']).path, png_bytes(), content_type='image/png')
+            self.assertEqual(response.status_code, 200, response.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._confirm(presigned['upload_token'])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn('estimated_completion_at', response.data)
+
+        diagnosis = Diagnosis.objects.get(id=response.data['id'])
+        with diagnosis.left_fundus_image.open('rb') as f:
+            self.assertEqual(Image.open(f).size, (8, 8))
+        mock_schedule.assert_called_once_with(str(diagnosis.id), Diagnosis.Priority.BULK)
+
+        # لا يمكن تأكيد نفس الرفع مرتين
+        self.assertEqual(self._confirm(presigned['upload_token']).status_code, 400)
+
+    def test_confirm_rejects_missing_uploads_and_foreign_tickets(self):
+        presigned = self._presign()
+        response = self._confirm(presigned['upload_token'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('left', response.data)
+
+        other = get_user_model().objects.create_user(username='direct-other', password='x')
+        self.api.force_authenticate(other)
+        self.assertIn('upload_token', self._confirm(presigned['upload_token']).data)
+
+    def test_emulator_rejects_tampered_url_and_wrong_content_type(self):
+        url = urlsplit(self._presign()['uploads']['left']['url']).path
+        self.assertEqual(self.client.put(url[:-3] + 'xx/', png_bytes(), content_type='image/png').status_code, 403)
+        self.assertEqual(self.client.put(url, png_bytes(), content_type='image/jpeg').status_code, 403)
+
+    @unittest.skipIf(mock_aws is None, "moto is not installed")
+    @override_settings(
+        DIAGNOSIS_UPLOAD={'BACKEND': 's3', 'URL_EXPIRES_SECONDS': 900, 'MAX_BYTES': 1024 * 1024},
+        AWS_STORAGE_BUCKET_NAME='fundus-test', AWS_S3_REGION_NAME='us-east-1',
+        STORAGES={'default': {'BACKEND': 'storages.backends.s3.S3Storage'},
+                  'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}},
+    )
+    @patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'})
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def test_s3_presigned_put_round_trip(self, mock_schedule):
+        with mock_aws():
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='fundus-test')
+            presigned = self._presign()
+            for upload in presigned['uploads'].values():
+                self.assertIn('fundus-test', upload['url'])
+                response = requests.put(upload['url'], data=png_bytes(), headers=upload['headers'])
+                self.assertEqual(response.status_code, 200)
+
+            response = self._confirm(presigned['upload_token'])
+            self.assertEqual(response.status_code, 201, response.content)
+            diagnosis = Diagnosis.objects.get(id=response.data['id'])
+            with diagnosis.right_fundus_image.open('rb') as f:
+                self.assertEqual(Image.open(f).format, 'PNG')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ResumableUploadTests(DoctorPatientTestCase):
+    """اختبارات الرفع القابل للاستئناف: إنشاء الجلسة ثم أجزاء PATCH ثم إنشاء التشخيص."""
+    username = 'tus-doc'
+    patient_name = 'Tus Patient'
+    date_of_birth = date(1979, 3, 3)
+    gender = 'FEMALE'
+
+    def _create(self, length):
+        response = self.api.post(
+            '/api/resumable-uploads/', HTTP_UPLOAD_LENGTH=str(length),
+            HTTP_UPLOAD_METADATA='filetype ' + base64.b64encode(b'image/png').decode(),
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return urlsplit(response['Location']).path
+
+    def _patch(self, url, offset, chunk, checksum=None):
+        return self.api.generic(
+            'PATCH', url, chunk, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHECKSUM=checksum or _tus_checksum(chunk),
+        )
+
+    def _upload(self, data, chunk_size=40):
+        url = self._create(len(data))
+        for offset in range(0, len(data), chunk_size):
+            response = self._patch(url, offset, data[offset:offset + chunk_size])
+            self.assertEqual(response.status_code, 204, response.content)
+        return url
+
+    def test_chunked_upload_resumes_from_server_offset(self):
+        data = png_bytes()
+        url = self._create(len(data))
+        self.assertEqual(self._patch(url, 0, data[:30]).status_code, 204)
+
+        # العميل انقطع ولا يعرف أين توقف: HEAD يعيد الإزاحة المحفوظة
+        response = self.api.head(url)
+        self.assertEqual(response['Upload-Offset'], '30')
+        self.assertEqual(response['Tus-Resumable'], '1.0.0')
+
+        self.assertEqual(self._patch(url, 0, data[:30]).status_code, 409)
+        self.assertEqual(self._patch(url, 30, data[30:], checksum=_tus_checksum(b'corrupted')).status_code, 460)
+        self.assertEqual(self.api.head(url)['Upload-Offset'], '30')
+
+        response = self._patch(url, 30, data[30:])
+        self.assertEqual(response.status_code, 204, response.content)
+        session = UploadSession.objects.get()
+        self.assertEqual(session.status, UploadSession.Status.COMPLETED)
+        with default_storage.open(session.key, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertFalse(default_storage.exists(f'uploads/parts/{session.id}/{0:012d}'))
+
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def test_completed_uploads_create_diagnosis_once(self, mock_schedule):
+        left, right = self._upload(png_bytes()), self._upload(png_bytes())
+        left_id, right_id = left.rstrip('/').rsplit('/', 1)[1], right.rstrip('/').rsplit('/', 1)[1]
+        payload = {'left_upload': left_id, 'right_upload': right_id, 'patient_id': str(self.patient.id)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/diagnoses/from-uploads/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        diagnosis = Diagnosis.objects.get(id=response.data['id'])
+        with diagnosis.left_fundus_image.open('rb') as f:
+            self.assertEqual(Image.open(f).size, (8, 8))
+        mock_schedule.assert_called_once_with(str(diagnosis.id), Diagnosis.Priority.SAME_DAY)
+
+        self.assertEqual(self.api.post('/api/diagnoses/from-uploads/', payload, format='json').status_code, 400)
+
+    def test_sessions_are_private_and_expired_ones_are_purged(self):
+        data = png_bytes()
+        url = self._create(len(data))
+        self.assertEqual(self._patch(url, 0, data[:30]).status_code, 204)
+
+        other = get_user_model().objects.create_user(username='tus-other', password='x')
+        self.api.force_authenticate(other)
+        self.assertEqual(self.api.head(url).status_code, 404)
+
+        UploadSession.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(purge_expired_sessions(), 1)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(DoctorPatientTestCase):
+    """اختبارات التخزين بعنوان المحتوى: نسخة واحدة لكل صورة وعدّ المراجع من التشخيصات."""
+    username = 'cas-doc'
+    patient_name = 'CAS Patient'
+    date_of_birth = date(1968, 4, 4)
+
+    def setUp(self):
+        super().setUp()
+        self.digest = hashlib.sha256(png_bytes()).hexdigest()
+
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def _post(self, mock_schedule):
+        response = self.api.post('/api/diagnoses/', {
+            'patient_id': str(self.patient.id),
+            'left_fundus_image': png_upload('left.png'),
+            'right_fundus_image': png_upload('right.png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Diagnosis.objects.get(id=response.data['id'])
+
+    def test_repeated_images_are_stored_once_and_deleted_with_last_reference(self):
+        first, second = self._post(), self._post()
+        key = cas_key(self.digest, '.png')
+        self.assertEqual({first.left_fundus_image.name, second.right_fundus_image.name}, {key})
+        self.assertEqual(first.image_digests, (self.digest, self.digest))
+        self.assertEqual(StoredImage.objects.get().ref_count, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(StoredImage.objects.get().ref_count, 2)
+        self.assertTrue(default_storage.exists(key))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.delete()  # حذف متسلسل للتشخيص الثاني
+        self.assertFalse(StoredImage.objects.exists())
+        self.assertFalse(default_storage.exists(key))
+
+    @patch('apps.diagnosis.views.schedule_diagnosis_processing')
+    def test_confirmed_direct_upload_reuses_existing_copy(self, mock_schedule):
+        existing = self._post()
+        presigned = self.api.post('/api/diagnoses/presign/', {}, format='json').data
+        for upload in presigned['uploads'].values():
+            self.client.put(urlsplit(upload['url']).path, png_bytes(), content_type='image/png')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/diagnoses/confirm/', {
+                'upload_token': presigned['upload_token'], 'patient_id': str(self.patient.id),
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        diagnosis = Diagnosis.objects.get(id=response.data['id'])
+        self.assertEqual(diagnosis.left_fundus_image.name, existing.left_fundus_image.name)
+        self.assertEqual(StoredImage.objects.get().ref_count, 4)
+        # الملفان المرفوعان بمفاتيح presign حُذفا لأن محتواهما مخزن من قبل
+        self.assertEqual(default_storage.listdir(timezone.now().strftime('diagnoses/images/%Y/%m/%d'))[1], [])
+
+    def test_failed_confirm_rolls_back_adopted_references(self):
+        self._post()
+        presigned = self.api.post('/api/diagnoses/presign/', {}, format='json').data
+        for upload in presigned['uploads'].values():
+            self.client.put(urlsplit(upload['url']).path, png_bytes(), content_type='image/png')
+
+        with patch('apps.diagnosis.views.DiagnosisViewSet.create_from_stored_images', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.api.post('/api/diagnoses/confirm/', {
+                'upload_token': presigned['upload_token'], 'patient_id': str(self.patient.id),
+            }, format='json')
+
+        self.assertEqual(StoredImage.objects.get().ref_count, 2)
+        # الملفان المرفوعان باقيان، فيمكن إعادة التأكيد
+        self.assertEqual(len(default_storage.listdir(timezone.now().strftime('diagnoses/images/%Y/%m/%d'))[1]), 2)
+
+    def test_deduplicate_command_moves_legacy_images(self):
+        legacy = [default_storage.save(f'diagnoses/images/2024/01/0{i}/eye.png', ContentFile(png_bytes())) for i in (1, 2)]
+        diagnosis = Diagnosis.objects.create(patient=self.patient, left_fundus_image=legacy[0], right_fundus_image=legacy[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('deduplicate_images', stdout=io.StringIO(), stderr=io.StringIO())
+
+        diagnosis.refresh_from_db()
+        self.assertEqual(diagnosis.image_digests, (self.digest, self.digest))
+        self.assertEqual(StoredImage.objects.get().ref_count, 2)
+        self.assertFalse(any(default_storage.exists(name) for name in legacy))
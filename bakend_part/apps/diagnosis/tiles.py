@@ -0,0 +1,117 @@
+# apps/diagnosis/tiles.py
+"""
+هرم بلاطات Deep Zoom (DZI) لكل صورة قاع عين، ليكبّر الطبيب على الآفات دون تنزيل الأصل كاملًا:
+المستوى الأعلى بدقة الأصل، وكل مستوى أدنى بنصف الأبعاد حتى بكسل واحد، وكل مستوى مقطع إلى بلاطات
+TILE_SIZE مع تداخل OVERLAP. العارض (OpenSeadragon) يطلب فقط البلاطات الظاهرة في مستوى التكبير الحالي.
+
+المفاتيح مشتقة من بصمة الأصل (مثل النسخ المشتقة)، فالمحتوى ثابت لكل مفتاح ويمكن تخزينه مؤقتًا طويلًا.
+ملف .dzi يُكتب آخرًا، فوجوده يعني اكتمال الهرم.
+"""
+import io
+import logging
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .derivatives import is_stored, overwriting_storage, source_id
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+_DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" Overlap="{overlap}" Format="{ext}">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+def tile_extension() -> str:
+    return FORMATS[settings.DIAGNOSIS_TILES["FORMAT"]]
+
+
+def tiles_prefix(source_name: str) -> str:
+    base = source_id(source_name)
+    return f"diagnoses/tiles/{base[:2]}/{base}"
+
+
+def dzi_key(source_name: str) -> str:
+    return f"{tiles_prefix(source_name)}/image.dzi"
+
+
+def tile_key(source_name: str, level: int, col: int, row: int) -> str:
+    return f"{tiles_prefix(source_name)}/image_files/{level}/{col}_{row}.{tile_extension()}"
+
+
+def max_level(width: int, height: int) -> int:
+    """أعلى مستوى في هرم DZI: المستوى 0 بكسل واحد، وكل مستوى ضعف سابقه."""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def generate_tiles(source_name: str) -> int:
+    """
+    يبني هرم البلاطات للأصل ويعيد عدد البلاطات المكتوبة. لا يفعل شيئًا إن كان الهرم مكتملًا
+    (صورة مكررة أو مهمة مكررة). كل مستوى يُصغّر من المستوى الذي فوقه، فالأصل يُفك ترميزه مرة واحدة.
+    """
+    if tiles_ready(source_name):
+        return 0
+    config = settings.DIAGNOSIS_TILES
+    tile_size, overlap, ext = config["TILE_SIZE"], config["OVERLAP"], tile_extension()
+    save_options = {"format": config["FORMAT"].upper(), "quality": config["QUALITY"]}
+    # بقايا تشغيل سابق لم يكتمل (دون .dzi) يُكتب فوقها
+    storage = overwriting_storage()
+
+    with default_storage.open(source_name, "rb") as f:
+        image = Image.open(f)
+        image.load()
+    image = image.convert("RGB")
+    width, height = image.size
+
+    count = 0
+    level_image = image
+    for level in range(max_level(width, height), -1, -1):
+        w, h = level_image.size
+        for col in range(math.ceil(w / tile_size)):
+            for row in range(math.ceil(h / tile_size)):
+                box = (
+                    max(0, col * tile_size - overlap), max(0, row * tile_size - overlap),
+                    min(w, (col + 1) * tile_size + overlap), min(h, (row + 1) * tile_size + overlap),
+                )
+                buffer = io.BytesIO()
+                level_image.crop(box).save(buffer, **save_options)
+                storage.save(tile_key(source_name, level, col, row), ContentFile(buffer.getvalue()))
+                count += 1
+        # أبعاد المستوى L في DZI هي ceil(W / 2^(max-L))، والتنصيف المتكرر بالسقف يعطي نفس القيمة
+        level_image = level_image.resize((math.ceil(w / 2), math.ceil(h / 2)), Image.Resampling.LANCZOS)
+
+    storage.save(dzi_key(source_name), ContentFile(_DZI_TEMPLATE.format(
+        tile_size=tile_size, overlap=overlap, ext=ext, width=width, height=height,
+    ).encode()))
+    logger.info(f"Generated {count} tiles for {source_name} ({width}x{height}).")
+    return count
+
+
+def tiles_ready(source_name: str) -> bool:
+    return is_stored(dzi_key(source_name))
+
+
+def open_stored(key: str):
+    """يفتح ملفًا من الهرم، أو None إن لم يكن موجودًا (هرم لم يُولد بعد أو إحداثيات خارجه)."""
+    return default_storage.open(key, "rb") if is_stored(key) else None
+
+
+def delete_tiles(source_name: str) -> None:
+    """يحذف هرم البلاطات لأصل حُذف من التخزين."""
+    prefix = tiles_prefix(source_name)
+    default_storage.delete(dzi_key(source_name))
+    try:
+        levels, _ = default_storage.listdir(f"{prefix}/image_files")
+    except FileNotFoundError:
+        return
+    for level in levels:
+        for name in default_storage.listdir(f"{prefix}/image_files/{level}")[1]:
+            default_storage.delete(f"{prefix}/image_files/{level}/{name}")
@@ -0,0 +1,138 @@
+# apps/diagnosis/timings.py
+"""
+أزمنة مراحل معالجة التشخيص بالميلي ثانية، تُحفظ على Diagnosis.stage_timings:
+queue_wait (started_at - created_at)، claim (حجز السجل)، image_read و decode (نسخة الاستدلال، أو الأصل
+عند أول تشغيل)، derivative_write، quality، preprocessing/<استراتيجية>، model/<نموذج>، fusion، feature_pipeline،
+tabular، و db_write (حفظ تقرير الجودة والكتابة النهائية للنتيجة). المرحلة التي تتكرر (العينان، اللقطات، الخبراء بنفس الاستراتيجية) تُجمع أزمنتها.
+- collect(): يفعّل مجمّعًا للسياق الحالي (contextvars: لكل خيط أو مهمة مجمّعه)؛ stage() خارجه لا يقيس شيئًا،
+  فالاستدعاءات نفسها في parity_check و benchmark_pipeline بلا كلفة.
+- stage_percentiles(): p50/p95/p99 لكل مرحلة ضمن نافذة زمنية، محسوبة في قاعدة البيانات.
+"""
+import contextlib
+import math
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+PERCENTILES = (50, 95, 99)
+# ترتيب المراحل في التقرير كما تحدث في المعالجة؛ الأسماء التي تنتهي بـ / بادئات
+STAGE_ORDER = (
+    "queue_wait", "claim", "image_read", "decode", "derivative_write", "quality", "preprocessing/", "model/",
+    "fusion", "feature_pipeline", "tabular", "db_write",
+)
+# عدد أحدث التشخيصات التي تُقرأ منها أسماء المراحل (تختلف أسماء النماذج بين الإصدارات)
+NAME_SAMPLE_SIZE = 200
+
+_current: ContextVar[Optional["StageTimer"]] = ContextVar("diagnosis_stage_timer", default=None)
+
+
+class StageTimer:
+    """مجموع أزمنة كل مرحلة لتشخيص واحد (أو لدفعة)."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, elapsed_ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def as_dict(self, divisor: int = 1) -> Dict[str, float]:
+        """الأزمنة مقربة لحفظها؛ divisor يقسمها على عدد تشخيصات الدفعة (الحصة من زمن الدفعة)."""
+        return {name: round(elapsed_ms / divisor, 2) for name, elapsed_ms in self.stages.items()}
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[StageTimer]:
+    timer = StageTimer()
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+
+
+def record(name: str, elapsed_ms: float) -> None:
+    """يضيف زمنًا مقاسًا خارج stage() (مثل queue_wait من طوابع السجل)."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, elapsed_ms)
+
+
+def _stage_key(name: str):
+    for index, prefix in enumerate(STAGE_ORDER):
+        if name == prefix or (prefix.endswith("/") and name.startswith(prefix)):
+            return index, name
+    return len(STAGE_ORDER), name
+
+
+def stage_percentiles(since, until=None, model_version=None) -> dict:
+    """
+    p50/p95/p99 (الرتبة الأقرب) لكل مرحلة على التشخيصات الناجحة التي انتهت في [since, until).
+    - PostgreSQL: استعلام واحد بـ PERCENTILE_DISC ... WITHIN GROUP لكل مرحلة ونسبة.
+    - غير ذلك: عدّ القيم لكل مرحلة في استعلام واحد، ثم قيمة الرتبة المطلوبة بـ ORDER BY ... OFFSET.
+    القيم لا تُنقل إلى Python في الحالتين؛ الأسماء فقط تُقرأ من أحدث NAME_SAMPLE_SIZE سجل.
+    """
+    from django.db import connection
+    from django.db.models import Aggregate, Count, FloatField
+    from django.db.models.fields.json import KeyTextTransform
+    from django.db.models.functions import Cast
+
+    from .models import Diagnosis
+
+    queryset = Diagnosis.objects.filter(
+        status=Diagnosis.Status.SUCCESS, finished_at__gte=since, stage_timings__isnull=False
+    )
+    if until is not None:
+        queryset = queryset.filter(finished_at__lt=until)
+    if model_version is not None:
+        queryset = queryset.filter(model_version=model_version)
+
+    recent = queryset.order_by("-finished_at").values_list("stage_timings", flat=True)[:NAME_SAMPLE_SIZE]
+    names = sorted({name for stage_timings in recent for name in stage_timings}, key=_stage_key)
+    # أسماء المراحل فيها / ومسافات، فالأسماء المستعارة في SQL بالفهرس
+    values = [Cast(KeyTextTransform(name, "stage_timings"), FloatField()) for name in names]
+
+    aggregates = {f"n{i}": Count(value) for i, value in enumerate(values)}
+    if connection.vendor == "postgresql":
+        class PercentileDisc(Aggregate):
+            function = "PERCENTILE_DISC"
+            template = "%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+            output_field = FloatField()
+
+        for i, value in enumerate(values):
+            aggregates.update({f"p{pct}_{i}": PercentileDisc(value, fraction=pct / 100) for pct in PERCENTILES})
+    row = queryset.aggregate(diagnoses=Count("pk"), **aggregates)
+
+    stages = {}
+    for i, (name, value) in enumerate(zip(names, values)):
+        count = row[f"n{i}"]
+        if not count:
+            continue
+        entry = {"n": count}
+        for pct in PERCENTILES:
+            if f"p{pct}_{i}" in row:
+                entry[f"p{pct}"] = row[f"p{pct}_{i}"]
+            else:
+                ordered = queryset.annotate(stage_ms=value).filter(stage_ms__isnull=False).order_by("stage_ms")
+                entry[f"p{pct}"] = ordered.values_list("stage_ms", flat=True)[max(math.ceil(pct / 100 * count), 1) - 1]
+        stages[name] = entry
+
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat() if until is not None else None,
+        "model_version": model_version,
+        "diagnoses": row["diagnoses"],
+        "stages": stages,
+    }
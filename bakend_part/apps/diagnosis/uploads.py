@@ -0,0 +1,140 @@
+# apps/diagnosis/uploads.py
+"""
+الرفع المباشر لصور قاع العين إلى التخزين بروابط PUT موقّعة مسبقًا، دون المرور بعمليات الويب.
+- s3: روابط S3 حقيقية (AWS أو MinIO) تُولَّد من اتصال django-storages المستخدم كتخزين افتراضي.
+- filesystem: محاكٍ محلي؛ الرابط يشير إلى نقطة PUT في Django موقعة بـ django.core.signing
+  وتكتب الجسم تدفقيًا في default_storage. مناسب للتطوير والاختبارات والنشر دون تخزين كائنات.
+
+التدفق: presign يعيد رابطين ورمز تذكرة (ticket) موقعًا يربط المفتاحين بالمستخدم،
+ثم يرفع العميل الصورتين مباشرة، ثم confirm بالتذكرة لإنشاء Diagnosis وجدولة المعالجة.
+"""
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils import timezone
+
+UPLOAD_SALT = "diagnosis.direct-upload"
+TICKET_SALT = "diagnosis.upload-ticket"
+
+ALLOWED_CONTENT_TYPES = {"image/png": ".png", "image/jpeg": ".jpg"}
+_MAGIC_NUMBERS = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff")
+
+
+@dataclass
+class PresignedUpload:
+    key: str
+    url: str
+    method: str = "PUT"
+    headers: Dict[str, str] = field(default_factory=dict)
+    expires_at: Optional[datetime] = None
+
+
+def new_upload_key(content_type: str) -> str:
+    """مفتاح فريد تحت نفس مسار upload_to الخاص بحقول الصور."""
+    return timezone.now().strftime("diagnoses/images/%Y/%m/%d/") + uuid.uuid4().hex + ALLOWED_CONTENT_TYPES[content_type]
+
+
+class FilesystemDirectUploads:
+    """محاكٍ لروابط S3 الموقعة: الرمز الموقّع في الرابط هو وحده صلاحية الكتابة."""
+
+    def presign_put(self, key: str, content_type: str, request) -> PresignedUpload:
+        config = settings.DIAGNOSIS_UPLOAD
+        token = signing.dumps({"k": key, "ct": content_type}, salt=UPLOAD_SALT)
+        return PresignedUpload(
+            key=key,
+            url=request.build_absolute_uri(reverse("diagnosis-direct-upload", args=[token])),
+            headers={"Content-Type": content_type},
+            expires_at=timezone.now() + timedelta(seconds=config["URL_EXPIRES_SECONDS"]),
+        )
+
+
+class S3DirectUploads:
+    """روابط put_object موقعة من نفس عميل boto3 الذي يستخدمه S3Storage (django-storages)."""
+
+    def __init__(self, storage=None):
+        self.storage = storage or default_storage
+
+    def presign_put(self, key: str, content_type: str, request) -> PresignedUpload:
+        expires = settings.DIAGNOSIS_UPLOAD["URL_EXPIRES_SECONDS"]
+        client = self.storage.connection.meta.client
+        url = client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.storage.bucket_name,
+                "Key": self.storage._normalize_name(key),
+                "ContentType": content_type,
+            },
+            ExpiresIn=expires,
+        )
+        return PresignedUpload(
+            key=key, url=url, headers={"Content-Type": content_type},
+            expires_at=timezone.now() + timedelta(seconds=expires),
+        )
+
+
+def get_direct_uploads():
+    if settings.DIAGNOSIS_UPLOAD["BACKEND"] == "s3":
+        return S3DirectUploads()
+    return FilesystemDirectUploads()
+
+
+def issue_ticket(user, keys: Dict[str, str]) -> str:
+    return signing.dumps({"u": str(user.pk), "keys": keys}, salt=TICKET_SALT)
+
+
+def redeem_ticket(token: str, user) -> Dict[str, str]:
+    """يعيد المفاتيح المرتبطة بالتذكرة. يثير signing.BadSignature إن كانت مزورة أو منتهية أو لمستخدم آخر."""
+    payload = signing.loads(token, salt=TICKET_SALT, max_age=settings.DIAGNOSIS_UPLOAD["URL_EXPIRES_SECONDS"])
+    if payload["u"] != str(user.pk):
+        raise signing.BadSignature("Upload ticket was issued to a different user.")
+    return payload["keys"]
+
+
+def verify_uploaded(key: str, storage=None) -> Optional[str]:
+    """
+    يتحقق من أن الملف رُفع فعلًا وأنه صورة PNG/JPEG ضمن الحد المسموح.
+    يقرأ أول بايتات فقط (لا ينقل الصورة كاملة عبر الويب). يعيد رسالة خطأ أو None.
+    """
+    storage = storage or default_storage
+    # size بدل exists: S3Storage.exists يعيد False دائمًا عند تفعيل AWS_S3_FILE_OVERWRITE
+    try:
+        size = storage.size(key)
+    except Exception:  # FileNotFoundError على نظام الملفات، ClientError (404) على S3
+        return f"'{key}' has not been uploaded."
+    if not 0 < size <= settings.DIAGNOSIS_UPLOAD["MAX_BYTES"]:
+        return f"'{key}' has an invalid size ({size} bytes)."
+    with storage.open(key, "rb") as f:
+        header = f.read(8)
+    if not header.startswith(_MAGIC_NUMBERS):
+        return f"'{key}' is not a PNG or JPEG image."
+    return None
+
+
+def receive_direct_upload(token: str, request) -> Optional[Tuple[int, str]]:
+    """
+    ينفذ PUT للمحاكي: يتحقق من الرمز ونوع المحتوى والحجم، ثم يكتب الجسم تدفقيًا إلى default_storage.
+    يعيد (رمز HTTP، رسالة) عند الرفض، أو None عند النجاح. الرموز تحاكي استجابات S3.
+    """
+    config = settings.DIAGNOSIS_UPLOAD
+    try:
+        payload = signing.loads(token, salt=UPLOAD_SALT, max_age=config["URL_EXPIRES_SECONDS"])
+    except signing.BadSignature:
+        return 403, "Upload URL is invalid or has expired."
+    if request.content_type != payload["ct"]:
+        return 403, "Content-Type does not match the presigned upload."
+    if not 0 < int(request.META.get("CONTENT_LENGTH") or 0) <= config["MAX_BYTES"]:
+        return 413, "Content-Length is missing or exceeds the upload limit."
+
+    # دلالات PUT في S3: الكتابة تستبدل الكائن الموجود بنفس المفتاح
+    key = payload["k"]
+    if default_storage.exists(key):
+        default_storage.delete(key)
+    default_storage.save(key, File(request, name=key))
+    return None
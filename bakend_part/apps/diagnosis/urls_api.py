@@ -1,9 +1,18 @@
 # apps/diagnosis/urls_api.py
 
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from.views import DiagnosisViewSet
+from.views import DiagnosisViewSet, ResumableUploadViewSet, direct_upload_view
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'diagnoses', DiagnosisViewSet, basename='diagnosis')
+router.register(r'resumable-uploads', ResumableUploadViewSet, basename='resumable-upload')
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    # نسخ غير متزامنة لإنشاء التشخيص واسترجاعه (تعمل بكفاءة تحت ASGI/uvicorn)
+    path('async/diagnoses/', async_views.diagnosis_create, name='diagnosis-async-create'),
+    path('async/diagnoses/<uuid:pk>/', async_views.diagnosis_detail, name='diagnosis-async-detail'),
+    # محاكي روابط الرفع الموقعة عند عدم استخدام S3
+    path('uploads/<str:token>/', direct_upload_view, name='diagnosis-direct-upload'),
+]
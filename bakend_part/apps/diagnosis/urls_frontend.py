@@ -1,8 +1,15 @@
 # apps/diagnosis/urls_frontend.py
 from django.urls import path
-from .views import DiagnosisCreateView, DiagnosisDetailView
+from .views import DiagnosisCreateView, DiagnosisDetailView, DiagnosisThumbnailView, DiagnosisTileView
 
 urlpatterns = [
     path('create/', DiagnosisCreateView.as_view(), name='diagnosis-create'),
     path('<uuid:pk>/', DiagnosisDetailView.as_view(), name='diagnosis-detail'),
+    path('<uuid:pk>/thumbnail/<str:side>/', DiagnosisThumbnailView.as_view(), name='diagnosis-thumbnail'),
+    # تخطيط روابط DZI الذي يتوقعه OpenSeadragon: <name>.dzi ثم <name>_files/<level>/<col>_<row>.<ext>
+    path('<uuid:pk>/tiles/<str:side>.dzi', DiagnosisTileView.as_view(), name='diagnosis-tile-source'),
+    path(
+        '<uuid:pk>/tiles/<str:side>_files/<int:level>/<int:col>_<int:row>.<str:ext>',
+        DiagnosisTileView.as_view(), name='diagnosis-tile',
+    ),
 ]
@@ -1,20 +1,45 @@
 # # apps/diagnosis/views.py
 # apps/diagnosis/views.py
+import base64
+import math
+from datetime import timedelta
+
 from rest_framework import viewsets, mixins, status
 from rest_framework.response import Response
+from django.contrib import messages
 from django.db import transaction
-from django.views.generic import CreateView, DetailView
+from django.db.models import Q
+from django.views.generic import CreateView, DetailView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.urls import reverse_lazy
-from django.shortcuts import redirect, render
+from django.urls import reverse, reverse_lazy
+from django.shortcuts import get_object_or_404, redirect, render
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import Throttled, ValidationError
+from rest_framework.decorators import action
+from django.core import signing
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 
-from .models import Diagnosis
-from .serializers import DiagnosisCreateSerializer, DiagnosisDetailSerializer
-from .tasks import process_diagnosis
+from .admission import BACKLOG_REJECTION_MESSAGE, admit
+from .content_store import adopt
+from .derivatives import SIDES, ensure_thumbnails
+from .tiles import CONTENT_TYPES as TILE_CONTENT_TYPES, dzi_key, open_stored, tile_extension, tile_key, tiles_ready
+from .models import Diagnosis, UploadSession
+from .resumable import TUS_VERSION, UploadProtocolError, append_chunk, create_session, discard, parse_checksum
+from .serializers import (
+    DiagnosisConfirmSerializer, DiagnosisCreateSerializer, DiagnosisDetailSerializer, DiagnosisFromUploadsSerializer,
+    DiagnosisPresignSerializer,
+)
+from .uploads import get_direct_uploads, issue_ticket, new_upload_key, receive_direct_upload, redeem_ticket, verify_uploaded
+from .scheduling import schedule_diagnosis_processing
+from .timings import stage_percentiles
 from apps.users.models import Patient
-from apps.diagnosis import serializers
-from apps.users.permissions import IsOwnerOrAdmin
+from apps.users.permissions import IsAdmin, IsOwnerOrAdmin
 from .forms import DiagnosisUploadForm
 
 
@@ -35,17 +60,181 @@ class DiagnosisViewSet(mixins.CreateModelMixin,
     def get_serializer_class(self):
         if self.action == 'create':
             return DiagnosisCreateSerializer
+        if self.action == 'presign':
+            return DiagnosisPresignSerializer
+        if self.action == 'confirm':
+            return DiagnosisConfirmSerializer
+        if self.action == 'from_uploads':
+            return DiagnosisFromUploadsSerializer
         return DiagnosisDetailSerializer
 
-    def perform_create(self, serializer):
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        admission = self.admit(serializer.validated_data.get('priority', Diagnosis.Priority.SAME_DAY))
+        serializer.validated_data['priority'] = admission.priority
+        self.perform_create(serializer)
+        return self.created_response(serializer.instance, admission)
+
+    @action(detail=False, methods=['post'])
+    def presign(self, request):
         """
-        يحفظ السجل المبدئي ويطلق مهمة Celery بشكل آمن بعد إتمام المعاملة.
+        يعيد رابطي PUT موقعين لرفع الصورتين مباشرة إلى التخزين، ورمز upload_token لاستخدامه في confirm.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        uploads = get_direct_uploads()
+        presigned = {
+            side: uploads.presign_put(new_upload_key(content_type), content_type, request)
+            for side, content_type in (
+                ('left', serializer.validated_data['left_content_type']),
+                ('right', serializer.validated_data['right_content_type']),
+            )
+        }
+        return Response({
+            'upload_token': issue_ticket(request.user, {side: p.key for side, p in presigned.items()}),
+            'uploads': {
+                side: {'url': p.url, 'method': p.method, 'headers': p.headers, 'expires_at': p.expires_at}
+                for side, p in presigned.items()
+            },
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def confirm(self, request):
+        """
+        ينشئ التشخيص من صور رُفعت مباشرة إلى التخزين، بعد التحقق من وجودها ونوعها.
+        الاستجابة مطابقة لاستجابة create.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            keys = redeem_ticket(data['upload_token'], request.user)
+        except signing.BadSignature:
+            raise ValidationError({'upload_token': "Invalid or expired upload token."})
+        errors = {side: error for side, error in ((s, verify_uploaded(k)) for s, k in keys.items()) if error}
+        if errors:
+            raise ValidationError(errors)
+
+        patient = self.get_patient(data['patient_id'])
+        admission = self.admit(data['priority'])
+        # ينقل الملفين إلى التخزين بعنوان المحتوى داخل نفس المعاملة: فشل الإنشاء يلغي زيادة المراجع.
+        # الملف المرفوع يُحذف بعد COMMIT، فتأكيد نفس التذكرة مرة ثانية يفشل في verify_uploaded
+        with transaction.atomic():
+            keys = {side: adopt(key) for side, key in keys.items()}
+            diagnosis = self.create_from_stored_images(patient, admission, keys['left'], keys['right'])
+        return self.created_response(diagnosis, admission)
+
+    @action(detail=False, methods=['post'], url_path='from-uploads')
+    def from_uploads(self, request):
+        """
+        ينشئ التشخيص من جلستي رفع قابل للاستئناف مكتملتين (انظر ResumableUploadViewSet).
+        كل جلسة تُستهلك مرة واحدة فقط.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        patient = self.get_patient(data['patient_id'])
+        admission = self.admit(data['priority'])
+        with transaction.atomic():
+            upload_ids = [data['left_upload'], data['right_upload']]
+            sessions = {
+                s.id: s for s in UploadSession.objects.select_for_update().filter(
+                    id__in=upload_ids, owner=request.user, status=UploadSession.Status.COMPLETED
+                )
+            }
+            if len(sessions) != 2:
+                raise ValidationError("Both uploads must be distinct, completed and not yet used.")
+            UploadSession.objects.filter(id__in=upload_ids).update(status=UploadSession.Status.CONSUMED)
+            diagnosis = self.create_from_stored_images(
+                patient, admission, sessions[data['left_upload']].key, sessions[data['right_upload']].key
+            )
+        return self.created_response(diagnosis, admission)
+
+    @action(detail=False, methods=['get'], url_path='stage-timings', permission_classes=[IsAuthenticated, IsAdmin])
+    def stage_timings(self, request):
+        """
+        p50/p95/p99 لأزمنة كل مرحلة (Diagnosis.stage_timings) على التشخيصات الناجحة في نافذة زمنية،
+        لمقارنة ما قبل النشر بما بعده: ?hours=24 (الافتراضي)، أو ?since=...&until=... بصيغة ISO 8601،
+        و ?model_version=<id> لإصدار واحد.
+        """
+        params = request.query_params
+        until = self.parse_time(params, 'until')
+        since = self.parse_time(params, 'since')
+        if since is None:
+            try:
+                hours = float(params.get('hours', 24))
+            except ValueError:
+                hours = math.nan
+            if not (math.isfinite(hours) and hours > 0):
+                raise ValidationError({'hours': "Must be a positive number."})
+            try:
+                since = (until or timezone.now()) - timedelta(hours=hours)
+            except OverflowError:
+                raise ValidationError({'hours': "Too large."})
+        model_version = params.get('model_version') or None
+        if model_version is not None:
+            try:
+                model_version = int(model_version)
+            except ValueError:
+                raise ValidationError({'model_version': "Must be a ModelVersion id."})
+        return Response(stage_percentiles(since, until, model_version))
+
+    @staticmethod
+    def parse_time(params, name):
+        if not params.get(name):
+            return None
+        try:
+            value = parse_datetime(params[name])
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError({name: "Must be an ISO 8601 date and time."})
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+
+    def admit(self, priority):
+        """
+        يطبق التحكم في القبول (انظر apps.diagnosis.admission): رفض بـ 429 + Retry-After
+        أو خفض الأولوية إلى BULK عندما يتجاوز الانتظار المتوقع SLO، و URGENT للمسؤولين فقط.
         """
-        patient_id = serializer.validated_data.pop('patient_id')
+        admission = admit(priority, self.request.user)
+        if not admission.admitted:
+            raise Throttled(wait=admission.retry_after, detail=BACKLOG_REJECTION_MESSAGE)
+        return admission
+
+    def get_patient(self, patient_id):
         try:
-            patient = self.request.user.patients.get(id=patient_id)
+            return self.request.user.patients.get(id=patient_id)
         except Patient.DoesNotExist:
-            raise serializers.ValidationError("You do not have permission for this patient.")
+            raise ValidationError("You do not have permission for this patient.")
+
+    def create_from_stored_images(self, patient, admission, left_key, right_key):
+        """ينشئ التشخيص من ملفات موجودة في التخزين ويجدول معالجته بعد COMMIT. يُستدعى داخل معاملة."""
+        diagnosis = Diagnosis.objects.create(
+            patient=patient,
+            physician=self.request.user,
+            priority=admission.priority,
+            left_fundus_image=left_key,
+            right_fundus_image=right_key,
+        )
+        transaction.on_commit(
+            lambda: schedule_diagnosis_processing(str(diagnosis.id), diagnosis.priority)
+        )
+        return diagnosis
+
+    def created_response(self, diagnosis, admission):
+        data = dict(DiagnosisCreateSerializer(diagnosis, context=self.get_serializer_context()).data)
+        data['estimated_completion_at'] = admission.estimate.estimated_completion_at
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def perform_create(self, serializer):
+        """
+        يحفظ السجل المبدئي ويطلق مهمة Celery بشكل آمن بعد إتمام المعاملة.
+        """
+        patient = self.get_patient(serializer.validated_data.pop('patient_id'))
 
         # نضمن أن الحفظ وجدولة المهمة يحدثان بشكل ذري
         with transaction.atomic():
@@ -55,9 +244,111 @@ class DiagnosisViewSet(mixins.CreateModelMixin,
             )
             # جدولة المهمة لتنفذ فقط بعد نجاح COMMIT في قاعدة البيانات
             transaction.on_commit(
-                lambda: process_diagnosis.delay(diagnosis_id=str(diagnosis.id))
+                lambda: schedule_diagnosis_processing(str(diagnosis.id), diagnosis.priority)
             )
 
+
+class ResumableUploadViewSet(viewsets.GenericViewSet):
+    """
+    رفع قابل للاستئناف على نمط tus لصورة واحدة (انظر apps.diagnosis.resumable):
+    - POST مع Upload-Length و Upload-Metadata (filetype) لإنشاء جلسة.
+    - HEAD/GET لمعرفة Upload-Offset.
+    - PATCH بجسم application/offset+octet-stream مع Upload-Offset و Upload-Checksum.
+    - DELETE لإلغاء الجلسة.
+    عند الاكتمال تُستخدم الجلسة في POST /api/diagnoses/from-uploads/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, UploadProtocolError):
+            return self.upload_response(None, {'detail': exc.detail}, status=exc.status)
+        return super().handle_exception(exc)
+
+    def upload_response(self, session, data=None, status=status.HTTP_204_NO_CONTENT, **headers):
+        response = Response(data, status=status)
+        response['Tus-Resumable'] = TUS_VERSION
+        response['Cache-Control'] = 'no-store'
+        if session is not None:
+            response['Upload-Offset'] = str(session.offset)
+            response['Upload-Length'] = str(session.length)
+        for name, value in headers.items():
+            response[name.replace('_', '-')] = value
+        return response
+
+    def create(self, request):
+        metadata = _parse_upload_metadata(request.headers.get('Upload-Metadata', ''))
+        session = create_session(
+            request.user,
+            length=_int_header(request, 'Upload-Length'),
+            content_type=metadata.get('filetype', 'image/png'),
+        )
+        location = request.build_absolute_uri(reverse('resumable-upload-detail', args=[session.id]))
+        return self.upload_response(
+            session, {'id': session.id, 'expires_at': session.expires_at},
+            status=status.HTTP_201_CREATED, Location=location,
+        )
+
+    def retrieve(self, request, pk=None):
+        session = self.get_object()
+        return self.upload_response(session, {
+            'id': session.id, 'status': session.status, 'offset': session.offset,
+            'length': session.length, 'expires_at': session.expires_at,
+        }, status=status.HTTP_200_OK)
+
+    def partial_update(self, request, pk=None):
+        if request.content_type != 'application/offset+octet-stream':
+            raise UploadProtocolError(415, "Content-Type must be application/offset+octet-stream.")
+        # بلا معاملة حول رفع الجزء: append_chunk يحمي التزامن بتحديث شرطي على الإزاحة،
+        # وحذف الجلسة عند فشل التجميع يجب ألا يُلغى بـ rollback
+        session = append_chunk(
+            self.get_object(),
+            offset=_int_header(request, 'Upload-Offset'),
+            stream=request.stream,
+            content_length=_int_header(request, 'Content-Length'),
+            checksum=parse_checksum(request.headers.get('Upload-Checksum')),
+        )
+        return self.upload_response(session)
+
+    def destroy(self, request, pk=None):
+        discard(self.get_object())
+        return self.upload_response(None)
+
+
+def _int_header(request, name):
+    try:
+        return int(request.headers.get(name, ''))
+    except ValueError:
+        raise UploadProtocolError(400, f"{name} header is missing or not an integer.")
+
+
+def _parse_upload_metadata(header):
+    """Upload-Metadata في tus: أزواج 'key base64value' مفصولة بفواصل."""
+    metadata = {}
+    for pair in filter(None, (p.strip() for p in header.split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ''
+        except ValueError:
+            raise UploadProtocolError(400, "Upload-Metadata values must be base64 encoded.")
+    return metadata
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def direct_upload_view(request, token):
+    """
+    محاكي الرفع المباشر (DIAGNOSIS_UPLOAD['BACKEND'] = 'filesystem'): يستقبل PUT على رابط موقع من presign.
+    الرابط الموقع هو الصلاحية، لذا لا تُطلب مصادقة (مثل روابط S3).
+    """
+    rejection = receive_direct_upload(token, request)
+    if rejection:
+        code, detail = rejection
+        return JsonResponse({'detail': detail}, status=code)
+    return HttpResponse(status=200)
+
 class DiagnosisCreateView(LoginRequiredMixin, CreateView):
     """
     يعالج طلب إنشاء تشخيص جديد من نموذج ويب، مع جدولة آمنة للمهام.
@@ -70,17 +361,37 @@ class DiagnosisCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.physician = self.request.user
-        
+
+        # نفس التحكم في القبول الذي تطبقه واجهة API: رفض بـ 429 أو خفض الأولوية إلى BULK
+        admission = admit(form.instance.priority, self.request.user)
+        if not admission.admitted:
+            return self.backlog_rejected(form, admission)
+        form.instance.priority = admission.priority
+
         # استخدام transaction.atomic لضمان سلامة العملية
         with transaction.atomic():
             self.object = form.save()
             # جدولة المهمة بشكل آمن
             transaction.on_commit(
-                lambda: process_diagnosis.delay(diagnosis_id=str(self.object.id))
+                lambda: schedule_diagnosis_processing(str(self.object.id), self.object.priority)
             )
-        
+
+        estimated = timezone.localtime(admission.estimate.estimated_completion_at)
+        messages.info(self.request, f"Estimated completion: {estimated:%Y-%m-%d %H:%M}.")
         return redirect(self.get_success_url())
 
+    def backlog_rejected(self, form, admission):
+        """يعيد عرض نموذج الرفع في صفحة المريض بحالة 429 و Retry-After، مثل رفض واجهة API."""
+        form.add_error(None, BACKLOG_REJECTION_MESSAGE)
+        patient = form.cleaned_data['patient']
+        response = render(self.request, 'patients/patient_detail.html', {
+            'patient': patient,
+            'diagnoses': Diagnosis.objects.filter(patient=patient).order_by('-created_at'),
+            'upload_form': form,
+        }, status=429)
+        response['Retry-After'] = str(admission.retry_after)
+        return response
+
 class DiagnosisDetailView(LoginRequiredMixin, DetailView):
     """يعرض تفاصيل تشخيص واحد."""
     model = Diagnosis
@@ -89,6 +400,66 @@ class DiagnosisDetailView(LoginRequiredMixin, DetailView):
 
     def get_queryset(self):
         return Diagnosis.objects.filter(physician=self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # عارض التكبير لكل عين؛ قبل اكتمال هرم البلاطات تُعرض الصورة المصغرة
+        context['eye_viewers'] = []
+        for side in SIDES:
+            thumbnail = getattr(self.object, f'{side}_thumbnail')
+            context['eye_viewers'].append({
+                'label': f'{side.capitalize()} eye',
+                'tiles_ready': tiles_ready(getattr(self.object, f'{side}_fundus_image').name),
+                'tile_source': reverse('diagnosis-tile-source', args=[self.object.pk, side]),
+                'thumbnail': thumbnail.url if thumbnail else reverse('diagnosis-thumbnail', args=[self.object.pk, side]),
+            })
+        return context
+
+
+class DiagnosisImageMixin(LoginRequiredMixin):
+    """يجلب التشخيص لطبيبه أو لأطباء المريض (أو المسؤول)، ويتحقق من اسم العين في الرابط."""
+
+    def get_diagnosis(self, pk, side):
+        if side not in SIDES:
+            raise Http404("Unknown eye.")
+        user = self.request.user
+        diagnoses = Diagnosis.objects.all() if user.is_staff else Diagnosis.objects.filter(
+            Q(physician=user) | Q(patient__doctors=user)
+        ).distinct()
+        return get_object_or_404(diagnoses, pk=pk)
+
+
+class DiagnosisThumbnailView(DiagnosisImageMixin, View):
+    """
+    يحول إلى الصورة المصغرة لعين واحدة، ويولدها أولًا إن لم تكن موجودة بعد.
+    القوالب تستخدم رابط الصورة المصغرة مباشرة عندما تكون مسجلة، وهذا الرابط فقط عندما تكون ناقصة.
+    """
+    def get(self, request, pk, side):
+        diagnosis = self.get_diagnosis(pk, side)
+        ensure_thumbnails(diagnosis)
+        return redirect(getattr(diagnosis, f'{side}_thumbnail').url)
+
+
+class DiagnosisTileView(DiagnosisImageMixin, View):
+    """
+    يقدم ملف .dzi أو بلاطة من هرم Deep Zoom لعين واحدة (انظر apps.diagnosis.tiles).
+    محتوى كل رابط لا يتغير، فيُخزن في المتصفح مؤقتًا لمدة طويلة (private لأنها صور مرضى).
+    """
+    def get(self, request, pk, side, level=None, col=None, row=None, ext=None):
+        source_name = getattr(self.get_diagnosis(pk, side), f'{side}_fundus_image').name
+        if level is None:
+            key, content_type = dzi_key(source_name), 'application/xml'
+        elif ext == tile_extension():
+            key, content_type = tile_key(source_name, level, col, row), TILE_CONTENT_TYPES[ext]
+        else:
+            raise Http404("Unknown tile format.")
+
+        stored = open_stored(key)
+        if stored is None:
+            raise Http404("Tile not found.")
+        response = FileResponse(stored, content_type=content_type)
+        patch_cache_control(response, private=True, max_age=settings.DIAGNOSIS_TILES['CACHE_SECONDS'], immutable=True)
+        return response
     
 # from rest_framework import viewsets, mixins, status
 # from rest_framework.response import Response
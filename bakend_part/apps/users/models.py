@@ -65,8 +65,11 @@ class Patient(models.Model):
     @property
     def age(self):
         from datetime import date
-        today = date.today()
-        return today.year - self.date_of_birth.year - ((today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day))
+        return self.age_on(date.today())
+
+    def age_on(self, day):
+        """العمر بالسنوات الكاملة في تاريخ معين (مثل تاريخ التشخيص عند إعادة تقييمه)."""
+        return day.year - self.date_of_birth.year - ((day.month, day.day) < (self.date_of_birth.month, self.date_of_birth.day))
 
     def __str__(self):
         return self.full_name
@@ -181,6 +181,137 @@ CELERY_TASK_SOFT_TIME_LIMIT = 540 # 9 دقائق (حد ناعم، يثير اس
 # CELERY_TASK_ALWAYS_EAGER = True
 # CELERY_TASK_EAGER_PROPAGATES = True
 
+# --- وضع المعالجة بالدفعات ---
+# عند التفعيل، يطلق كل رفع مهمة process_diagnosis_batch التي تحجز حتى DIAGNOSIS_BATCH_SIZE
+# تشخيصًا معلقًا وتمررها عبر النماذج في دفعة واحدة بدلًا من مهمة لكل تشخيص.
+DIAGNOSIS_BATCH_MODE = env.bool("DIAGNOSIS_BATCH_MODE", default=False)
+DIAGNOSIS_BATCH_SIZE = env.int("DIAGNOSIS_BATCH_SIZE", default=8)
+
+# --- آلية حجز التشخيصات في process_diagnosis ---
+# "redis": قفل Redis موزع + select_for_update (السلوك الافتراضي)
+# "skip_locked": عبارة UPDATE شرطية واحدة على جدول Diagnosis دون Redis
+# قارن الأداء بالأمر: python manage.py benchmark_claims
+DIAGNOSIS_CLAIM_BACKEND = env.str("DIAGNOSIS_CLAIM_BACKEND", default="redis")
+
+# --- الأولويات والطوابير ---
+# كل أولوية تُوجَّه إلى طابور مستقل حتى لا يحجب رفع جماعي الحالات العاجلة.
+# الاستهلاك الموزون يتم بتخصيص العمال لكل طابور (انظر README)، مثلًا:
+#   celery -A eye2_project worker -Q diagnosis_urgent,diagnosis_interactive -c 3
+#   celery -A eye2_project worker -Q diagnosis_bulk,diagnosis_urgent -c 1
+DIAGNOSIS_PRIORITY_QUEUES = {
+    "URGENT": "diagnosis_urgent",
+    "SAME_DAY": "diagnosis_interactive",
+    "BULK": "diagnosis_bulk",
+}
+CELERY_TASK_DEFAULT_QUEUE = "diagnosis_interactive"
+
+# أوزان مقاعد الحجز بالدفعات لكل أولوية (Smooth Weighted Round Robin)،
+# مع تناوب عادل بين العيادات داخل كل أولوية.
+DIAGNOSIS_PRIORITY_WEIGHTS = {"URGENT": 6, "SAME_DAY": 3, "BULK": 1}
+# عدد المرشحين المفحوصين لكل أولوية = حجم الدفعة × هذه القيمة (بالتناوب بين العيادات، وحتى حجم الدفعة لكل عيادة)
+DIAGNOSIS_FAIR_SHARE_WINDOW = 4
+
+# --- التحكم في القبول (Backpressure) ---
+# يُقدَّر الانتظار = (max(عمق الطوابير, المعلق) + الجاري) × متوسط زمن الخدمة / WORKER_CONCURRENCY.
+# إذا تجاوز SLO_SECONDS: MODE="reject" يعيد 429 مع Retry-After، و MODE="downgrade" يخفض الأولوية إلى BULK.
+# الطلبات العاجلة (URGENT) لا تُرفض ولا تُخفض.
+DIAGNOSIS_ADMISSION = {
+    "ENABLED": env.bool("DIAGNOSIS_ADMISSION_ENABLED", default=True),
+    "SLO_SECONDS": env.int("DIAGNOSIS_ADMISSION_SLO_SECONDS", default=600),
+    "MODE": env.str("DIAGNOSIS_ADMISSION_MODE", default="reject"),
+    "WORKER_CONCURRENCY": env.int("DIAGNOSIS_WORKER_CONCURRENCY", default=1),
+    "DEFAULT_SERVICE_TIME_SECONDS": 20,
+    "SERVICE_TIME_WINDOW_MINUTES": 60,
+    "CACHE_SECONDS": 5,
+}
+
+# --- الرفع المباشر إلى التخزين (روابط PUT موقعة) ---
+# "filesystem": محاكٍ محلي يكتب في MEDIA_ROOT عبر /api/uploads/<token>/
+# "s3": تخزين S3 أو MinIO عبر django-storages؛ العمال يقرؤون الصور من نفس الحاوية.
+DIAGNOSIS_UPLOAD = {
+    "BACKEND": env.str("DIAGNOSIS_UPLOAD_BACKEND", default="filesystem"),
+    "URL_EXPIRES_SECONDS": env.int("DIAGNOSIS_UPLOAD_URL_EXPIRES_SECONDS", default=900),
+    "MAX_BYTES": env.int("DIAGNOSIS_UPLOAD_MAX_BYTES", default=20 * 1024 * 1024),
+}
+# الرفع القابل للاستئناف (/api/resumable-uploads/): أقصى حجم لكل جزء PATCH، ومدة صلاحية الجلسة
+DIAGNOSIS_RESUMABLE = {
+    "MAX_CHUNK_BYTES": env.int("DIAGNOSIS_RESUMABLE_MAX_CHUNK_BYTES", default=8 * 1024 * 1024),
+    "EXPIRES_HOURS": env.int("DIAGNOSIS_RESUMABLE_EXPIRES_HOURS", default=24),
+}
+
+# المهام الدورية (شغّل: celery -A eye2_project beat)
+CELERY_BEAT_SCHEDULE = {
+    "purge-expired-upload-sessions": {
+        "task": "apps.diagnosis.tasks.purge_expired_upload_sessions",
+        "schedule": timedelta(hours=1),
+        "options": {"queue": DIAGNOSIS_PRIORITY_QUEUES["BULK"]},
+    },
+}
+# النسخ المشتقة من كل صورة: نسخة مصغرة للاستدلال (أقصر ضلع بالبكسل) وصورة مصغرة WebP للواجهات.
+# CROP_ROI يقص الحواف السوداء حول قرص قاع العين قبل التصغير. معطل افتراضيًا: فعّله فقط لنماذج
+# دُربت بـ crop_roi: true في ai_part، وإلا يرى النموذج في الخادم صورًا غير التي تدرب عليها
+DIAGNOSIS_DERIVATIVES = {
+    "CROP_ROI": env.bool("DIAGNOSIS_CROP_ROI", default=False),
+    "INFERENCE_SIZE": env.int("DIAGNOSIS_INFERENCE_SIZE", default=256),
+    "THUMBNAIL_SIZE": env.int("DIAGNOSIS_THUMBNAIL_SIZE", default=160),
+    "THUMBNAIL_QUALITY": env.int("DIAGNOSIS_THUMBNAIL_QUALITY", default=75),
+}
+# فحص الجودة قبل الاستدلال (على نسخة الاستدلال): الصور خارج هذه الحدود تُرفض بحالة FAILURE
+# دون تشغيل النماذج. حد التركيز (تباين لابلاسيان) يعتمد على الكاميرا؛ راجعه بالأمر quality_report
+DIAGNOSIS_QUALITY = {
+    "ENABLED": env.bool("DIAGNOSIS_QUALITY_ENABLED", default=True),
+    "MIN_SHARPNESS": env.float("DIAGNOSIS_QUALITY_MIN_SHARPNESS", default=2.5),
+    "MIN_BRIGHTNESS": env.float("DIAGNOSIS_QUALITY_MIN_BRIGHTNESS", default=25),
+    "MAX_CLIPPED": env.float("DIAGNOSIS_QUALITY_MAX_CLIPPED", default=0.25),
+    "MIN_FIELD_OF_VIEW": env.float("DIAGNOSIS_QUALITY_MIN_FIELD_OF_VIEW", default=0.3),
+    "MAX_FIELD_OF_VIEW": env.float("DIAGNOSIS_QUALITY_MAX_FIELD_OF_VIEW", default=0.97),
+}
+# أقصى عدد لقطات لكل عين في طلب تشخيص واحد (الصورة الأساسية + لقطات إضافية)
+DIAGNOSIS_MAX_IMAGES_PER_EYE = env.int("DIAGNOSIS_MAX_IMAGES_PER_EYE", default=4)
+# تعديل تاريخ ميلاد المريض أو جنسه يعيد تقييم تشخيصاته الناجحة (المرحلة الجدولية فقط، دون الصور)
+DIAGNOSIS_RESCORE_ON_DEMOGRAPHICS_CHANGE = env.bool("DIAGNOSIS_RESCORE_ON_DEMOGRAPHICS_CHANGE", default=True)
+# إعادة استدلال التشخيصات المخزنة بعد تفعيل ModelVersion جديد (python manage.py rescore_diagnoses).
+# الطابور مستقل ولا يدخل في التحكم في القبول؛ خصص له عاملًا منفصلًا حتى لا يزاحم الطلبات التفاعلية:
+#   celery -A eye2_project worker -Q diagnosis_rescore -c 1
+# كل مهمة تعالج دفعات لمدة TASK_SECONDS ثم تعيد جدولة نفسها (أقل من حد زمن مهام Celery)
+DIAGNOSIS_RESCORE = {
+    "QUEUE": env.str("DIAGNOSIS_RESCORE_QUEUE", default="diagnosis_rescore"),
+    "CHUNK_SIZE": env.int("DIAGNOSIS_RESCORE_CHUNK_SIZE", default=32),
+    "TASK_SECONDS": env.int("DIAGNOSIS_RESCORE_TASK_SECONDS", default=240),
+    # أقصى انتظار لتحميل الإصدار الهدف في العامل قبل إيقاف التشغيل مؤقتًا
+    "LOAD_WAIT_SECONDS": env.int("DIAGNOSIS_RESCORE_LOAD_WAIT_SECONDS", default=600),
+}
+# التقييم الظلي: نسبة SAMPLE_RATE من التشخيصات الناجحة تُعاد بالإصدار المرشح VERSION (معرّف ModelVersion)
+# على طابور مستقل بعد حفظ النتيجة، وتُحفظ إحصاءات الاختلاف (python manage.py shadow_report).
+#   celery -A eye2_project worker -Q diagnosis_shadow -c 1
+DIAGNOSIS_SHADOW = {
+    "VERSION": env.int("DIAGNOSIS_SHADOW_VERSION", default=None),
+    "SAMPLE_RATE": env.float("DIAGNOSIS_SHADOW_SAMPLE_RATE", default=0.1),
+    "QUEUE": env.str("DIAGNOSIS_SHADOW_QUEUE", default="diagnosis_shadow"),
+}
+# هرم بلاطات Deep Zoom للتكبير في صفحة التشخيص. البلاطات ثابتة المحتوى لكل مفتاح،
+# فتُقدّم بترويسة Cache-Control طويلة (CACHE_SECONDS). بناؤها على طابور منخفض الأولوية مستقل
+# حتى لا يزاحم الاستدلال على طوابير الأولويات:
+#   celery -A eye2_project worker -Q diagnosis_tiles -c 1
+DIAGNOSIS_TILES = {
+    "QUEUE": env.str("DIAGNOSIS_TILES_QUEUE", default="diagnosis_tiles"),
+    "TILE_SIZE": env.int("DIAGNOSIS_TILE_SIZE", default=254),
+    "OVERLAP": env.int("DIAGNOSIS_TILE_OVERLAP", default=1),
+    "FORMAT": env.str("DIAGNOSIS_TILE_FORMAT", default="jpeg"),
+    "QUALITY": env.int("DIAGNOSIS_TILE_QUALITY", default=85),
+    "CACHE_SECONDS": env.int("DIAGNOSIS_TILE_CACHE_SECONDS", default=365 * 24 * 3600),
+}
+if DIAGNOSIS_UPLOAD["BACKEND"] == "s3":
+    # بيانات الاعتماد من AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY في البيئة
+    AWS_STORAGE_BUCKET_NAME = env.str("AWS_STORAGE_BUCKET_NAME")
+    AWS_S3_ENDPOINT_URL = env.str("AWS_S3_ENDPOINT_URL", default=None)  # مثال MinIO: http://minio:9000
+    AWS_S3_REGION_NAME = env.str("AWS_S3_REGION_NAME", default="us-east-1")
+    AWS_S3_FILE_OVERWRITE = False
+    STORAGES = {
+        "default": {"BACKEND": "storages.backends.s3.S3Storage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+
 
 
 
@@ -232,6 +363,14 @@ SPECTACULAR_SETTINGS = {
 AI_MODELS_BASE_DIR = BASE_DIR / "ai_models"
 AI_MULTI_CLASS_MODEL_PATH = AI_MODELS_BASE_DIR / "multi_class_model.keras"
 AI_TABULAR_MODEL_PATH = AI_MODELS_BASE_DIR / "tabular_model.keras"
+# تجميع تنبؤات لقطات العين الواحدة: "mean" أو "max" أو "quality" (متوسط موزون بدرجة التركيز)
+AI_EYE_AGGREGATION = env.str("AI_EYE_AGGREGATION", default="mean")
+# تحميل ملفات النماذج بالتوازي عند بدء العامل (وعند تبديل الإصدار)
+AI_MODEL_LOAD_WORKERS = env.int("AI_MODEL_LOAD_WORKERS", default=4)
+# يفك كل أرشيف .keras بجانبه بعد أول تحميل؛ التحميلات التالية تقرأ الأوزان من القرص دون نسخها عبر الذاكرة
+AI_UNPACK_MODELS = env.bool("AI_UNPACK_MODELS", default=False)
+# مشاريع التدريب (ai_part): يقرأ منها parity_check استراتيجيات المعالجة وكشف القرص، و benchmark_pipeline بناة النماذج
+AI_TRAINING_DIR = env.str("AI_TRAINING_DIR", default=str(BASE_DIR.parent / "ai_part"))
 
 # EXPERT MODELS
 AI_EXPERT_CATARACT_MODEL_PATH = AI_MODELS_BASE_DIR / "expert_glaucoma.keras"
@@ -240,3 +379,21 @@ AI_EXPERT_GLAUCOMA_MODEL_PATH = AI_MODELS_BASE_DIR / "expert_glaucoma.keras"
 AI_EXPERT_HYPERTENSION_MODEL_PATH = AI_MODELS_BASE_DIR / "expert_hypertension.keras"
 AI_EXPERT_MYOPIA_MODEL_PATH = AI_MODELS_BASE_DIR / "expert_myopia.keras"
 AI_EXPERT_AGE_MODEL_PATH = AI_MODELS_BASE_DIR / "expert_age.keras"
+
+# توزيع ملفات النماذج (python manage.py model_artifacts): مع BACKEND ("filesystem" أو "s3") يصبح
+# ModelVersion.file_path بادئة في المخزن LOCATION (مجلد مشترك أو اسم الحاوية)، ويسحب كل عامل ملفات
+# إصداره مرة واحدة إلى CACHE_DIR على العقدة مع التحقق من بصمة SHA-256. دون BACKEND: file_path مجلد محلي.
+DIAGNOSIS_MODEL_ARTIFACTS = {
+    "BACKEND": env.str("DIAGNOSIS_MODEL_ARTIFACTS_BACKEND", default=""),
+    "LOCATION": env.str("DIAGNOSIS_MODEL_ARTIFACTS_LOCATION", default=str(BASE_DIR / "model_store")),
+    "CACHE_DIR": env.str("DIAGNOSIS_MODEL_ARTIFACTS_CACHE_DIR", default=str(AI_MODELS_BASE_DIR / "cache")),
+}
+
+# إعادة التحميل الساخن: كل ModelVersion مجلد (file_path) يحوي ملفات النماذج بنفس الأسماء أعلاه.
+# العامل يقارن إصداره بآخر إصدار مفعّل كل POLL_SECONDS، ويحمّل الجديد ويسخنه في الخلفية ثم يبدّل بين المهام.
+# PINNED_VERSION يثبت العامل على إصدار معين (معرّف ModelVersion) بغض النظر عن التفعيل.
+DIAGNOSIS_MODEL_RELOAD = {
+    "ENABLED": env.bool("DIAGNOSIS_MODEL_RELOAD_ENABLED", default=True),
+    "POLL_SECONDS": env.int("DIAGNOSIS_MODEL_RELOAD_POLL_SECONDS", default=30),
+    "PINNED_VERSION": env.int("DIAGNOSIS_MODEL_VERSION", default=None),
+}
@@ -0,0 +1,47 @@
+# loadtest.py
+from .development import *
+
+# مكدس محلي لاختبار الحمل (python manage.py load_test_diagnoses): خادم التطوير وعمال Celery
+# دون Redis ودون الأوزان الحقيقية. شغّل الخادم والعمال بنفس هذا الملف:
+#   DJANGO_SETTINGS_MODULE=eye2_project.settings.loadtest python manage.py runserver --noreload
+#   DJANGO_SETTINGS_MODULE=eye2_project.settings.loadtest celery -A eye2_project worker -Q diagnosis_interactive -c 2
+
+# المجلدات لا تُنشأ عند استيراد الإعدادات: python manage.py load_test_diagnoses --prepare ينشئها مرة واحدة
+LOAD_TEST_DIR = Path(env.str("LOAD_TEST_DIR", default=str(BASE_DIR / "loadtest")))
+# الصور المرفوعة ومشتقاتها خارج media الحقيقي
+MEDIA_ROOT = LOAD_TEST_DIR / "media"
+
+# وسيط بديل عن Redis: ملفات في مجلد مشترك بين الخادم والعمال (ناقل filesystem في kombu).
+# CELERY_BROKER_URL=redis://... يعيد الوسيط الحقيقي؛ LOAD_TEST_EAGER=True ينفذ المهمة داخل الطلب نفسه
+# (بلا عمال: زمن الرفع يشمل المعالجة، ولا يقيس إلا عملية واحدة).
+CELERY_BROKER_URL = env.str("CELERY_BROKER_URL", default="filesystem://")
+if CELERY_BROKER_URL == "filesystem://":
+    _broker_dir = LOAD_TEST_DIR / "broker"
+    CELERY_BROKER_TRANSPORT_OPTIONS = {
+        "data_folder_in": str(_broker_dir),
+        "data_folder_out": str(_broker_dir),
+        "processed_folder": str(_broker_dir / "processed"),
+        "control_folder": str(_broker_dir / "control"),
+        "polling_interval": 0.1,  # الافتراضي ثانية كاملة تُضاف إلى انتظار الطابور
+    }
+CELERY_RESULT_BACKEND = None
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ALWAYS_EAGER = env.bool("LOAD_TEST_EAGER", default=False)
+
+# الحجز بعبارة UPDATE شرطية بدل قفل Redis
+DIAGNOSIS_CLAIM_BACKEND = env.str("DIAGNOSIS_CLAIM_BACKEND", default="skip_locked")
+
+# DATABASE_URL=postgres://... لقياس قريب من الإنتاج؛ SQLite تسلسل الكتابات فتنتظر بدل أن تفشل.
+# قاعدة SQLite الافتراضية في LOAD_TEST_DIR، بعيدًا عن قاعدة التطوير
+DATABASES = {"default": env.db("DATABASE_URL", default=f"sqlite:///{LOAD_TEST_DIR / 'db.sqlite3'}")}
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    DATABASES["default"]["OPTIONS"] = {"timeout": 30}
+
+# حدود DRF اليومية (1000/يوم للمستخدم) توقف اختبار الحمل قبل أن يبدأ
+REST_FRAMEWORK = {**REST_FRAMEWORK, "DEFAULT_THROTTLE_CLASSES": []}
+
+# نماذج بديلة بمعمارية التدريب وأوزان عشوائية (python manage.py benchmark_pipeline يبنيها في هذا المجلد):
+# نفس أسماء الملفات، في LOAD_TEST_MODELS
+_models_dir = Path(env.str("LOAD_TEST_MODELS", default=str(AI_MODELS_BASE_DIR / "stand_ins")))
+for _name in [name for name in globals() if name.startswith("AI_") and name.endswith("_MODEL_PATH")]:
+    globals()[_name] = _models_dir / Path(globals()[_name]).name